@@ -0,0 +1,465 @@
+"""Micro-benchmarks for hot paths, runnable against synthetic data.
+
+Each bench_* function returns a JSON-friendly dict of timings so results can be
+compared across runs (see the bench-* CLI commands).
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from . import db as dbmod
+from . import parser as parsermod
+from .paths import expand_abs
+
+
+def make_synthetic_state_db(path: str, composers: int = 20, turns: int = 200, payload_bytes: int = 2048) -> str:
+	"""Write a Cursor-like state DB with `composers` chats of `turns` bubbles each.
+
+	Bubbles carry a filler payload of roughly payload_bytes to mimic tool output.
+	"""
+	path = expand_abs(path)
+	if os.path.exists(path):
+		os.remove(path)
+	conn = sqlite3.connect(path)
+	conn.execute("CREATE TABLE cursorDiskKV(key TEXT PRIMARY KEY, value BLOB)")
+	filler = "x" * max(0, int(payload_bytes))
+	rows = []
+	for ci in range(composers):
+		cid = f"c{ci:05d}-0000-0000-0000-000000000000"
+		headers = []
+		for bi in range(turns):
+			bid = f"b{bi:06d}"
+			btype = 1 if bi % 2 == 0 else 2
+			headers.append({"bubbleId": bid, "type": btype, "serverBubbleId": bi})
+			bubble = {"text": f"message {bi} of {cid}", "type": btype, "toolResults": [{"output": filler}]}
+			rows.append((f"bubbleId:{cid}:{bid}", json.dumps(bubble).encode("utf-8")))
+		composer = {"composerId": cid, "title": f"chat {ci}", "fullConversationHeadersOnly": headers}
+		rows.append((f"composerData:{cid}", json.dumps(composer).encode("utf-8")))
+	conn.executemany("INSERT INTO cursorDiskKV(key, value) VALUES(?, ?)", rows)
+	conn.commit()
+	conn.close()
+	return path
+
+
+def _reconstruct_per_bubble(conn, composer_id: str) -> List[dict]:
+	"""Reference implementation: one kv_value lookup per header (pre bulk-loading)."""
+	composer = parsermod.load_composer(conn, composer_id)
+	if not composer:
+		return []
+	messages: List[dict] = []
+	for bubble_id, bubble_type, server_bubble_id in parsermod.iter_bubble_headers(composer):
+		bubble = parsermod.load_bubble(conn, composer_id, bubble_id)
+		if not bubble:
+			continue
+		text = bubble.get("text") or bubble.get("content") or ""
+		messages.append({
+			"composer_id": composer_id,
+			"bubble_id": bubble_id,
+			"server_bubble_id": server_bubble_id,
+			"role": parsermod.bubble_role(bubble_type),
+			"text": text,
+		})
+	return messages
+
+
+def _reconstruct_bulk_decode(conn, composer_id: str) -> List[dict]:
+	"""Reference implementation: one prefix scan, every bubble decoded in Python (pre projection)."""
+	composer = parsermod.load_composer(conn, composer_id)
+	if not composer:
+		return []
+	bubbles = parsermod.load_bubbles(conn, composer_id)
+	messages: List[dict] = []
+	for bubble_id, bubble_type, server_bubble_id in parsermod.iter_bubble_headers(composer):
+		bubble = bubbles.get(bubble_id)
+		if not bubble:
+			continue
+		text = bubble.get("text") or bubble.get("content") or ""
+		messages.append({
+			"composer_id": composer_id,
+			"bubble_id": bubble_id,
+			"server_bubble_id": server_bubble_id,
+			"role": parsermod.bubble_role(bubble_type),
+			"text": text,
+		})
+	return messages
+
+
+def bench_bubble_loading(
+	db_path: Optional[str] = None,
+	composers: int = 20,
+	turns: int = 200,
+	payload_bytes: int = 2048,
+	repeat: int = 3,
+) -> Dict[str, Any]:
+	"""Compare per-bubble lookups and a Python-decoded prefix scan against
+	reconstruct_conversation (prefix scan with fields projected in SQLite).
+
+	Uses db_path if given, otherwise builds a synthetic DB in a temp directory.
+	Reports the best of `repeat` runs for each strategy.
+	"""
+	tmpdir = None
+	if db_path is None:
+		tmpdir = tempfile.TemporaryDirectory(prefix="ae_bench_")
+		db_path = make_synthetic_state_db(os.path.join(tmpdir.name, "state.vscdb"), composers, turns, payload_bytes)
+	try:
+		conn = dbmod.connect_readonly(expand_abs(db_path))
+		ids = parsermod.list_composer_ids(conn)
+
+		def _time(fn) -> float:
+			best = float("inf")
+			for _ in range(max(1, int(repeat))):
+				t0 = time.perf_counter()
+				for cid in ids:
+					fn(conn, cid)
+				best = min(best, time.perf_counter() - t0)
+			return best
+
+		same = True
+		bubbles = 0
+		for cid in ids:
+			msgs = parsermod.reconstruct_conversation(conn, cid)
+			bubbles += len(msgs)
+			same = same and msgs == _reconstruct_per_bubble(conn, cid) == _reconstruct_bulk_decode(conn, cid)
+		per_bubble_s = _time(_reconstruct_per_bubble)
+		bulk_decode_s = _time(_reconstruct_bulk_decode)
+		bulk_s = _time(parsermod.reconstruct_conversation)
+		conn.close()
+	finally:
+		if tmpdir is not None:
+			tmpdir.cleanup()
+	return {
+		"composers": len(ids),
+		"bubbles": bubbles,
+		"per_bubble_s": round(per_bubble_s, 6),
+		"bulk_decode_s": round(bulk_decode_s, 6),
+		"bulk_s": round(bulk_s, 6),
+		"speedup": round(per_bubble_s / bulk_s, 2) if bulk_s > 0 else None,
+		"identical": same,
+	}
+
+
+class _FakeEmbedding:
+	__slots__ = ("embedding",)
+
+	def __init__(self, embedding: List[float]):
+		self.embedding = embedding
+
+
+class _FakeResponse:
+	def __init__(self, vectors: List[List[float]]):
+		self.data = [_FakeEmbedding(v) for v in vectors]
+
+
+def _upsert_per_row(c, table: str, batch_meta: List[tuple], res) -> None:
+	"""Reference implementation: SELECT then INSERT/UPDATE per item (pre batched upserts)."""
+	import array
+	from .embeddings import l2_normalize
+	for (ident, meta), data in zip(batch_meta, res.data):
+		blob = sqlite3.Binary(array.array("f", l2_normalize(list(data.embedding))).tobytes())
+		fields = (meta.get("composer_id"), meta.get("turn_index"), meta.get("user_head"), meta.get("assistant_head"), meta.get("text_hash"))
+		row = c.execute(f"SELECT vec_rowid FROM {table}_meta WHERE id=?", (ident,)).fetchone()
+		if row:
+			c.execute(f"UPDATE {table} SET embedding=? WHERE rowid=?", (blob, int(row[0])))
+			c.execute(f"UPDATE {table}_meta SET composer_id=?, turn_index=?, user_head=?, assistant_head=?, text_hash=? WHERE vec_rowid=?", fields + (int(row[0]),))
+		else:
+			c.execute(f"INSERT INTO {table}(embedding) VALUES(?)", (blob,))
+			c.execute(f"INSERT INTO {table}_meta(vec_rowid, id, composer_id, turn_index, user_head, assistant_head, text_hash) VALUES(?,?,?,?,?,?,?)", (c.lastrowid, ident) + fields)
+
+
+def bench_vec_upsert(rows: int = 20000, dim: int = 64, batch: int = 64) -> Dict[str, Any]:
+	"""Time per-row vs batched (_VecMetaUpserter) meta upserts: a fresh insert pass then an update pass.
+
+	Uses a plain table with the vec0 column layout so it runs without sqlite-vec;
+	the meta-table work being measured is the same.
+	"""
+	from . import index as indexmod
+
+	vec = [0.1] * max(1, int(dim))
+	batches = []
+	for start in range(0, rows, batch):
+		ids = [f"c{i // 50}:{i % 50}" for i in range(start, min(rows, start + batch))]
+		batches.append(([(ident, {"composer_id": ident.split(":")[0], "text_hash": "h"}) for ident in ids], _FakeResponse([vec] * len(ids))))
+
+	def _fresh_db():
+		conn = sqlite3.connect(":memory:")
+		conn.execute("CREATE TABLE v(embedding BLOB)")
+		conn.execute("CREATE TABLE v_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT, text_hash TEXT)")
+		return conn
+
+	out: Dict[str, Any] = {"rows": rows, "dim": dim, "batch": batch}
+	for name in ("per_row", "batched"):
+		conn = _fresh_db()
+		c = conn.cursor()
+		for phase in ("insert", "update"):
+			t0 = time.perf_counter()
+			if name == "per_row":
+				for meta, res in batches:
+					_upsert_per_row(c, "v", meta, res)
+			else:
+				upserter = indexmod._VecMetaUpserter(c, "v", indexmod._load_vec_meta_state(c, "v"))
+				for meta, res in batches:
+					upserter.write(meta, res)
+			conn.commit()
+			out[f"{name}_{phase}_s"] = round(time.perf_counter() - t0, 6)
+		conn.close()
+	for phase in ("insert", "update"):
+		b = out[f"batched_{phase}_s"]
+		out[f"{phase}_speedup"] = round(out[f"per_row_{phase}_s"] / b, 2) if b > 0 else None
+	return out
+
+
+def bench_sparse_search(items: int = 20000, words: int = 60, repeat: int = 3, path: Optional[str] = None) -> Dict[str, Any]:
+	"""Time index.search_index over a synthetic JSONL: streaming scan vs the inverted-index sidecar."""
+	import random
+	from . import index as indexmod
+	from . import inverted as invmod
+
+	rng = random.Random(0)
+	vocab = [f"term{i}" for i in range(5000)]
+	queries = ["term17", "term4242 term7", "term1 missingword", "term300 term301 term302"]
+	tmpdir = None
+	if path is None:
+		tmpdir = tempfile.TemporaryDirectory(prefix="ae-bench-")
+		path = os.path.join(tmpdir.name, "index.jsonl")
+	path = expand_abs(path)
+	try:
+		with open(path, "w", encoding="utf-8") as f:
+			for i in range(items):
+				user = " ".join(rng.choice(vocab) for _ in range(words // 3))
+				assistant = " ".join(rng.choice(vocab) for _ in range(words))
+				f.write(json.dumps({"composer_id": f"c{i // 50}", "turn_index": i % 50, "user": user, "assistant": assistant, "annotations": {}}) + "\n")
+		t0 = time.perf_counter()
+		invmod.build_inverted_index(path)
+		build_s = time.perf_counter() - t0
+		side = invmod.inverted_index_path(path)
+
+		def _time() -> tuple:
+			best = float("inf")
+			res = None
+			for _ in range(max(1, repeat)):
+				t = time.perf_counter()
+				res = [indexmod.search_index(path, q, k=10) for q in queries]
+				best = min(best, time.perf_counter() - t)
+			return best / len(queries), res
+
+		sidecar_s, with_side = _time()
+		os.rename(side, side + ".off")
+		try:
+			scan_s, scanned = _time()
+		finally:
+			os.rename(side + ".off", side)
+	finally:
+		if tmpdir is not None:
+			tmpdir.cleanup()
+	return {
+		"items": items,
+		"sidecar_build_s": round(build_s, 6),
+		"scan_query_s": round(scan_s, 6),
+		"sidecar_query_s": round(sidecar_s, 6),
+		"speedup": round(scan_s / sidecar_s, 2) if sidecar_s > 0 else None,
+		"identical": with_side == scanned,
+	}
+
+
+def bench_flat_vec(rows: int = 100000, dim: int = 1536, k: int = 10, repeat: int = 5, path: Optional[str] = None) -> Dict[str, Any]:
+	"""Time brute-force search over a synthetic flat (NumPy) vector store of rows x dim float32."""
+	import numpy as np
+	from . import flatvec as flatmod
+
+	rng = np.random.default_rng(0)
+	tmpdir = None
+	if path is None:
+		tmpdir = tempfile.TemporaryDirectory(prefix="ae-bench-")
+		path = os.path.join(tmpdir.name, "vec.db")
+	path = expand_abs(path)
+	try:
+		meta = [[f"c{i // 50}:{i % 50}", f"c{i // 50}", i % 50, "", "", ""] for i in range(rows)]
+
+		def _fill(mat) -> None:
+			for start in range(0, rows, 8192):
+				block = rng.standard_normal((min(8192, rows - start), dim), dtype=np.float32)
+				mat[start:start + len(block)] = block / np.linalg.norm(block, axis=1, keepdims=True)
+
+		t0 = time.perf_counter()
+		flatmod._write_store(path, "vec_index", "synthetic", dim, meta, _fill)
+		build_s = time.perf_counter() - t0
+		store = flatmod.open_flat_vectors(path, "vec_index")
+		queries = [flatmod._unit(rng.standard_normal(dim)) for _ in range(max(1, repeat))]
+		t = time.perf_counter()
+		store.search_vector(queries[0], k)
+		first_s = time.perf_counter() - t
+		times = []
+		for q in queries:
+			t = time.perf_counter()
+			res = store.search_vector(q, k)
+			times.append(time.perf_counter() - t)
+		# Exact check against a full sort
+		scores = np.asarray(store.matrix) @ queries[-1]
+		exact = [meta[i][0] for i in np.argsort(-scores, kind="stable")[:k]]
+	finally:
+		if tmpdir is not None:
+			tmpdir.cleanup()
+	return {
+		"rows": rows,
+		"dim": dim,
+		"k": k,
+		"write_s": round(build_s, 6),
+		"first_query_s": round(first_s, 6),
+		"best_query_s": round(min(times), 6),
+		"mean_query_s": round(sum(times) / len(times), 6),
+		"exact": [r["id"] for r in res] == exact,
+	}
+
+
+def _clustered_flat_store(path: str, rows: int, dim: int, seed: int = 0):
+	"""Write a synthetic flat store with topic-like structure; returns (store, draw(n) for queries)."""
+	import numpy as np
+	from . import flatvec as flatmod
+
+	rng = np.random.default_rng(seed)
+	# Rows scatter around a few hundred random directions
+	centers = rng.standard_normal((max(1, rows // 500), dim)).astype(np.float32)
+
+	def _draw(n: int):
+		pts = centers[rng.integers(0, len(centers), n)] + rng.standard_normal((n, dim), dtype=np.float32) * 0.9
+		return pts / np.linalg.norm(pts, axis=1, keepdims=True)
+
+	def _fill(mat) -> None:
+		for start in range(0, rows, 8192):
+			mat[start:start + min(8192, rows - start)] = _draw(min(8192, rows - start))
+
+	meta = [[str(i), "c", i, "", "", ""] for i in range(rows)]
+	flatmod._write_store(path, "vec_index", "synthetic", dim, meta, _fill)
+	return flatmod.open_flat_vectors(path, "vec_index"), _draw
+
+
+def bench_ann(
+	rows: int = 100000,
+	dim: int = 128,
+	nlist: Optional[int] = None,
+	nprobes: Optional[List[int]] = None,
+	k: int = 10,
+	queries: int = 50,
+	path: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""recall@k and latency of IVF search vs exact search over a synthetic clustered flat store."""
+	from . import ivf as ivfmod
+
+	tmpdir = None
+	if path is None:
+		tmpdir = tempfile.TemporaryDirectory(prefix="ae-bench-")
+		path = os.path.join(tmpdir.name, "vec.db")
+	path = expand_abs(path)
+	try:
+		store, _draw = _clustered_flat_store(path, rows, dim)
+		t0 = time.perf_counter()
+		idx = ivfmod.build_ivf(path, "vec_index", nlist=nlist)
+		build_s = time.perf_counter() - t0
+		idx.lists()
+		qs = _draw(max(1, queries))
+		t = time.perf_counter()
+		exact = [{r["id"] for r in store.search_vector(q, k)} for q in qs]
+		exact_s = (time.perf_counter() - t) / len(qs)
+		out: List[Dict[str, Any]] = []
+		for nprobe in (nprobes or [1, 2, 4, 8, 16, 32]):
+			t = time.perf_counter()
+			found = [{r["id"] for r in store.search_vector(q, k, ivf=idx, nprobe=nprobe)} for q in qs]
+			query_s = (time.perf_counter() - t) / len(qs)
+			recall = sum(len(a & b) for a, b in zip(found, exact)) / float(sum(len(b) for b in exact) or 1)
+			out.append({"nprobe": nprobe, "recall_at_k": round(recall, 4), "query_s": round(query_s, 6), "speedup": round(exact_s / query_s, 2) if query_s > 0 else None})
+	finally:
+		if tmpdir is not None:
+			tmpdir.cleanup()
+	return {"rows": rows, "dim": dim, "k": k, "nlist": idx.nlist, "build_s": round(build_s, 6), "exact_query_s": round(exact_s, 6), "ivf": out}
+
+
+def bench_quant(
+	rows: int = 100000,
+	dim: int = 1536,
+	k: int = 10,
+	reranks: Optional[List[int]] = None,
+	queries: int = 20,
+	path: Optional[str] = None,
+) -> Dict[str, Any]:
+	"""Compression ratio, recall@k and latency of int8/binary first passes with exact rerank."""
+	from . import quant as quantmod
+
+	tmpdir = None
+	if path is None:
+		tmpdir = tempfile.TemporaryDirectory(prefix="ae-bench-")
+		path = os.path.join(tmpdir.name, "vec.db")
+	path = expand_abs(path)
+	try:
+		store, _draw = _clustered_flat_store(path, rows, dim)
+		t0 = time.perf_counter()
+		per_vector = quantmod.build_quantized(path, "vec_index")
+		build_s = time.perf_counter() - t0
+		qs = _draw(max(1, queries))
+		t = time.perf_counter()
+		exact = [{r["id"] for r in store.search_vector(q, k)} for q in qs]
+		exact_s = (time.perf_counter() - t) / len(qs)
+		float_bytes = dim * 4
+		kinds: Dict[str, Any] = {}
+		for kind in quantmod.KINDS:
+			codes = quantmod.open_quantized(path, "vec_index", store, kind)
+			out: List[Dict[str, Any]] = []
+			for rerank in (reranks or [1, 4, 16]):
+				t = time.perf_counter()
+				found = [{r["id"] for r in store.search_vector(q, k, quant=codes, rerank=rerank)} for q in qs]
+				query_s = (time.perf_counter() - t) / len(qs)
+				recall = sum(len(a & b) for a, b in zip(found, exact)) / float(sum(len(b) for b in exact) or 1)
+				out.append({"rerank": rerank, "recall_at_k": round(recall, 4), "recall_loss": round(1.0 - recall, 4), "query_s": round(query_s, 6)})
+			kinds[kind] = {"bytes_per_vector": per_vector[kind], "compression": round(float_bytes / per_vector[kind], 2), "runs": out}
+	finally:
+		if tmpdir is not None:
+			tmpdir.cleanup()
+	return {"rows": rows, "dim": dim, "k": k, "float32_bytes_per_vector": float_bytes, "quantize_s": round(build_s, 6), "exact_query_s": round(exact_s, 6), "kinds": kinds}
+
+
+def bench_topk(rows: int = 5000, dim: int = 256, queries: int = 32, k: int = 10) -> Dict[str, Any]:
+	"""Per-query latency of vector.topk: the old per-pair loop vs NumPy, one query and batched."""
+	import numpy as np
+	from . import vector as vectmod
+
+	rng = np.random.default_rng(0)
+	corpus = rng.standard_normal((rows, dim)).astype(np.float32)
+	qs = rng.standard_normal((max(1, queries), dim)).astype(np.float32)
+	corpus_list, q_list = corpus.tolist(), qs.tolist()
+
+	def _loop(q):
+		# Previous implementation: cosine_similarity per row, then a full sort
+		scored = [(i, vectmod.cosine_similarity(q, v)) for i, v in enumerate(corpus_list)]
+		scored.sort(key=lambda x: x[1], reverse=True)
+		return scored[:k]
+
+	t = time.perf_counter()
+	loop = _loop(q_list[0])
+	loop_s = time.perf_counter() - t
+	t = time.perf_counter()
+	pure = vectmod._topk_pure(q_list[:1], corpus_list, k, False)[0]
+	pure_s = time.perf_counter() - t
+	t = time.perf_counter()
+	single = [vectmod.topk(q, corpus_list, k) for q in q_list]
+	single_s = (time.perf_counter() - t) / len(q_list)
+	normed = vectmod.normalize_rows(corpus)
+	t = time.perf_counter()
+	batched = vectmod.topk_batch(vectmod.normalize_rows(qs), normed, k, normalized=True)
+	batch_s = (time.perf_counter() - t) / len(q_list)
+	same = [i for i, _ in loop] == [i for i, _ in pure] == [i for i, _ in single[0]] == [i for i, _ in batched[0]]
+	return {
+		"rows": rows,
+		"dim": dim,
+		"queries": len(q_list),
+		"k": k,
+		"loop_query_s": round(loop_s, 6),
+		"pure_query_s": round(pure_s, 6),
+		"numpy_list_query_s": round(single_s, 6),
+		"numpy_batched_query_s": round(batch_s, 6),
+		"speedup": round(loop_s / batch_s, 1) if batch_s > 0 else None,
+		"same_top_k": same,
+	}
@@ -3,7 +3,7 @@ import json
 import os
 import sys
 import re
-from typing import Optional, Dict, List
+from typing import Any, Optional, Dict, List
 
 from .paths import default_db_path, expand_abs
 from . import db as dbmod
@@ -21,12 +21,15 @@ from . import fuzz as fuzzmod
 from . import vector as vectmod
 from . import rag as ragmod
 from . import index as indexmod
+from . import filters as filtersmod
+from . import offsets as offsetsmod
 from . import toolchat as toolchatmod
 from . import qa as qamod
 from . import streams as streammod
 from . import cluster as clustermod
 from . import multiscale as multiscalemod
 from . import memory as memmod
+from . import bench as benchmod
 import llm_cache
 
 # Load .env if present (optional dependency). This runs for all CLI commands.
@@ -63,6 +66,18 @@ def _get_db_path(args: argparse.Namespace) -> str:
 	return expand_abs(args.db or default_db_path(agent_type=agent_type))
 
 
+def _filter_spec(spec: str) -> str:
+	"""argparse type for --filter: validates one spec (see filters.parse_filter_args)."""
+	try:
+		filtersmod.parse_filter_args([spec])
+	except ValueError as e:
+		raise argparse.ArgumentTypeError(str(e))
+	return spec
+
+
+_FILTER_HELP = "Metadata filter (repeatable, all must match): repo=NAME, kind=doc|chat, tag=T, flag=F or a bare flag such as contains_design"
+
+
 def cmd_info(args: argparse.Namespace) -> int:
 	db_path = _get_db_path(args)
 	table_name = _get_table_name(args)
@@ -140,11 +155,8 @@ def cmd_chats(args: argparse.Namespace) -> int:
 	db_path = _get_db_path(args)
 	table_name = _get_table_name(args)
 	conn = dbmod.connect_readonly(db_path)
-	keys = dbmod.composer_data_keys(conn, limit=args.limit, table=table_name)
+	keys = dbmod.iter_composer_data_keys(conn, limit=args.limit, table=table_name)
 	printed = False
-	if not keys:
-		print("composerData:00000000-0000-0000-0000-000000000000\t(placeholder)")
-		return 0
 	for k in keys:
 		val = dbmod.kv_value(conn, k, table=table_name)
 		if val is None:
@@ -428,12 +440,19 @@ def cmd_vec_db_search(args: argparse.Namespace) -> int:
 	if not re.fullmatch(r"[A-Za-z0-9_]+", args.table or ""):
 		print(json.dumps({"error": "invalid table name"}))
 		return 2
-	result = indexmod.vec_search(args.db, args.table, args.query, args.k)
+	result = indexmod.vec_search(
+		args.db, args.table, args.query, args.k,
+		backend=getattr(args, "backend", None),
+		nprobe=getattr(args, "nprobe", None),
+		quant=getattr(args, "quant", None),
+		rerank=getattr(args, "rerank", None),
+		filters=filtersmod.parse_filter_args(getattr(args, "filter", None)),
+	)
 	print(json.dumps(result, ensure_ascii=False, indent=2))
 	return 0
 
 def cmd_index(args: argparse.Namespace) -> int:
-	count = indexmod.build_index(args.out, db_path=args.db, limit_composers=args.limit_composers, max_turns_per=args.max_turns)
+	count = indexmod.build_index(args.out, db_path=args.db, limit_composers=args.limit_composers, max_turns_per=args.max_turns, workers=getattr(args, "workers", None), incremental=getattr(args, "incremental", False))
 	result: Dict[str, object] = {"wrote": count, "path": args.out}
 	# Optionally run Toponymy naming on the full index
 	if getattr(args, "topics_out", None):
@@ -457,7 +476,11 @@ def cmd_index(args: argparse.Namespace) -> int:
 
 
 def cmd_sample(args: argparse.Namespace) -> int:
-	items = indexmod.sample_index(args.path, args.n)
+	try:
+		items = indexmod.sample_index(args.path, args.n, seed=args.seed, stratify=args.stratify)
+	except ValueError as e:
+		print(json.dumps({"error": str(e)}))
+		return 2
 	print(json.dumps(items, ensure_ascii=False, indent=2))
 	return 0
 
@@ -477,7 +500,7 @@ def cmd_ingest(args: argparse.Namespace) -> int:
 	"""
 	src = (args.source or "").lower()
 	if src == "cursor":
-		count = indexmod.build_index(args.out, db_path=args.db, limit_composers=args.limit_composers, max_turns_per=args.max_turns)
+		count = indexmod.build_index(args.out, db_path=args.db, limit_composers=args.limit_composers, max_turns_per=args.max_turns, workers=getattr(args, "workers", None))
 		print(json.dumps({"wrote": count, "path": expand_abs(args.out)}))
 		return 0
 	elif src in {"markdown", "md"}:
@@ -492,6 +515,36 @@ def cmd_ingest(args: argparse.Namespace) -> int:
 		return 2
 
 
+class _LazyItems:
+	"""A composer's index items, decoded on first access through the index sidecar."""
+
+	def __init__(self, offs, ordinals: List[int]):
+		self._offs = offs
+		self._ordinals = ordinals
+		self._cache: Dict[int, Optional[Dict]] = {}
+
+	def _get(self, i: int) -> Optional[Dict]:
+		if i not in self._cache:
+			self._cache[i] = self._offs.item_at(i)
+		return self._cache[i]
+
+	def __iter__(self):
+		for i in self._ordinals:
+			it = self._get(i)
+			if it is not None:
+				yield it
+
+	def first_turns(self, n: int) -> List[Dict]:
+		# Ids carry the turn index, so sorting needs no decoding
+		def turn(i: int) -> int:
+			try:
+				return int(self._offs.ident(i).rsplit(":", 1)[1])
+			except ValueError:
+				return 0
+		picked = sorted(self._ordinals, key=turn)[:n]
+		return [it for it in (self._get(i) for i in picked) if it is not None]
+
+
 def cmd_auto_titles(args: argparse.Namespace) -> int:
 	# Derive simple titles from per-composer conversations using LLM summaries (fast model by default)
 	try:
@@ -499,23 +552,34 @@ def cmd_auto_titles(args: argparse.Namespace) -> int:
 	except Exception:
 		client = None
 	index_path = expand_abs(args.index_jsonl)
-	by_cid: Dict[str, List[Dict]] = {}
-	with open(index_path, "r", encoding="utf-8") as f:
-		for line in f:
-			try:
-				it = json.loads(line)
-			except Exception:
-				continue
-			cid = it.get("composer_id")
-			if cid is None:
-				continue
-			by_cid.setdefault(cid, []).append(it)
+	by_cid: Dict[str, Any] = {}
+	offs = offsetsmod.open_offsets_index(index_path)
+	if offs is not None:
+		# Items are decoded lazily by seeking, so each chat only reads what it uses
+		for cid in offs.composer_ids():
+			if cid != "None":
+				by_cid[cid] = _LazyItems(offs, offs.composer_ordinals(cid))
+	else:
+		with open(index_path, "r", encoding="utf-8") as f:
+			for line in f:
+				try:
+					it = json.loads(line)
+				except Exception:
+					continue
+				cid = it.get("composer_id")
+				if cid is None:
+					continue
+				by_cid.setdefault(cid, []).append(it)
 	# Build titles
 	results: Dict[str, Dict] = {}
 	model = args.model or os.getenv("OPENAI_SMALL_MODEL", "gpt-5-nano")
 	for cid, items in by_cid.items():
 		pairs = []
-		for it in sorted(items, key=lambda x: int(x.get("turn_index") or 0))[: args.max_turns]:
+		if isinstance(items, _LazyItems):
+			first_turns = items.first_turns(args.max_turns)
+		else:
+			first_turns = sorted(items, key=lambda x: int(x.get("turn_index") or 0))[: args.max_turns]
+		for it in first_turns:
 			pairs.append({
 				"turn_index": it.get("turn_index"),
 				"user": it.get("user", ""),
@@ -660,6 +724,8 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("out", help="Output JSONL path")
 	sp.add_argument("--limit-composers", type=int)
 	sp.add_argument("--max-turns", type=int)
+	sp.add_argument("--workers", type=int, help="Build composers in N worker processes (output identical to serial)")
+	sp.add_argument("--incremental", action="store_true", help="Rebuild only composers whose content changed since the last build (uses the .manifest.json sidecar)")
 	# Optional: also run Toponymy naming over the built index
 	sp.add_argument("--topics-out", help="Also write Toponymy topics JSON (optional dependency)")
 	sp.add_argument("--topics-embed-model", help="Embedding model for initial vectors (env: OPENAI_EMBED_MODEL > EMBEDDING_MODEL)")
@@ -669,9 +735,11 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("--topics-verbose", action="store_true")
 	sp.set_defaults(func=cmd_index)
 
-	sp = sub.add_parser("sample", parents=[parent], help="Reservoir sample N items from a JSONL index")
+	sp = sub.add_parser("sample", parents=[parent], help="Randomly sample N items from a JSONL index")
 	sp.add_argument("path", help="Index JSONL path")
 	sp.add_argument("n", type=int)
+	sp.add_argument("--seed", type=int, help="Seed for a reproducible sample")
+	sp.add_argument("--stratify", choices=["composer", "tag"], help="Spread picks evenly across chats or annotation tags")
 	sp.set_defaults(func=cmd_sample)
 
 	# Markdown/Docs indexing
@@ -689,6 +757,7 @@ def build_parser() -> argparse.ArgumentParser:
 	# cursor options
 	sp.add_argument("--limit-composers", type=int)
 	sp.add_argument("--max-turns", type=int)
+	sp.add_argument("--workers", type=int, help="Build composers in N worker processes (cursor source)")
 	# markdown options
 	sp.add_argument("--root", help="Root directory for markdown source")
 	sp.add_argument("--ext", action="append", help="Markdown extensions to include; repeatable")
@@ -703,46 +772,89 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("--max-turns", type=int, default=30)
 	sp.set_defaults(func=cmd_auto_titles)
 
+	def _cmd_vec_index(a: argparse.Namespace) -> int:
+		stats: Dict[str, int] = {}
+		wrote = indexmod.build_embeddings_sqlite(a.out_db, a.index_jsonl, a.table, changed_only=a.changed_only, stats=stats, backend=a.backend)
+		print(json.dumps({
+			"wrote": wrote,
+			"db": a.out_db,
+			"table": a.table,
+			"backend": indexmod.vec_backend(a.backend, a.out_db, a.table),
+			"stats": stats,
+		}, ensure_ascii=False))
+		return 0
+
 	sp = sub.add_parser("vec-index", parents=[parent], help="Build sqlite-vec DB from a JSONL index (requires sqlite-vec)")
 	sp.add_argument("out_db", help="Output SQLite DB path (will load sqlite-vec)")
 	sp.add_argument("index_jsonl", help="Source JSONL index path")
 	sp.add_argument("--table", default="vec_index")
-	sp.set_defaults(func=lambda a: print(json.dumps({
-		"wrote": indexmod.build_embeddings_sqlite(a.out_db, a.index_jsonl, a.table),
-		"db": a.out_db,
-		"table": a.table,
-	}, ensure_ascii=False)))
+	sp.add_argument("--changed-only", action="store_true", help="Skip items whose embedded text is unchanged (no API call)")
+	sp.add_argument("--backend", choices=list(indexmod.VEC_BACKENDS), default=None, help="Vector store (default: env AGENT_VEC_BACKEND or sqlite-vec); numpy writes <out_db>.<table>.npy")
+	sp.set_defaults(func=_cmd_vec_index)
 
 	# Back-compat alias: vec-db-index
 	sp = sub.add_parser("vec-db-index", parents=[parent], help="Build sqlite-vec DB from a JSONL index (requires sqlite-vec)")
 	sp.add_argument("out_db", help="Output SQLite DB path (will load sqlite-vec)")
 	sp.add_argument("index_jsonl", help="Source JSONL index path")
 	sp.add_argument("--table", default="vec_index")
-	sp.set_defaults(func=lambda a: print(json.dumps({
-		"wrote": indexmod.build_embeddings_sqlite(a.out_db, a.index_jsonl, a.table),
-		"db": a.out_db,
-		"table": a.table,
-	}, ensure_ascii=False)))
+	sp.add_argument("--changed-only", action="store_true", help="Skip items whose embedded text is unchanged (no API call)")
+	sp.add_argument("--backend", choices=list(indexmod.VEC_BACKENDS), default=None, help="Vector store (default: env AGENT_VEC_BACKEND or sqlite-vec); numpy writes <out_db>.<table>.npy")
+	sp.set_defaults(func=_cmd_vec_index)
 
 	sp = sub.add_parser("vec-search", parents=[parent], help="Vector search the sqlite-vec DB for a query")
 	sp.add_argument("db", help="SQLite DB path with sqlite-vec index")
 	sp.add_argument("--table", default="vec_index")
 	sp.add_argument("--query", required=True)
 	sp.add_argument("--k", type=int, default=8)
+	sp.add_argument("--backend", choices=list(indexmod.VEC_BACKENDS), default=None, help="Vector store (default: env AGENT_VEC_BACKEND, or numpy when only a flat store exists)")
+	sp.add_argument("--nprobe", type=int, default=None, help="numpy backend: IVF lists to scan (default: env AGENT_VEC_NPROBE or 8; 0 = exact)")
+	sp.add_argument("--quant", choices=["int8", "binary", "none"], default=None, help="numpy backend: quantized first pass (default: env AGENT_VEC_QUANT or none)")
+	sp.add_argument("--rerank", type=int, default=None, help="numpy backend: shortlist size as a multiple of k for the exact rerank (default: env AGENT_VEC_RERANK or 8)")
+	sp.add_argument("--filter", action="append", type=_filter_spec, help=_FILTER_HELP)
 	sp.set_defaults(func=cmd_vec_db_search)
 
+	def _cmd_vec_ivf_build(a: argparse.Namespace) -> int:
+		from . import ivf as ivfmod
+		idx = ivfmod.build_ivf(a.db, a.table, nlist=a.nlist, iters=a.iters)
+		print(json.dumps({"path": ivfmod.ivf_path(a.db, a.table), "rows": len(idx), "nlist": idx.nlist}, ensure_ascii=False))
+		return 0
+
+	sp = sub.add_parser("vec-ivf-build", parents=[parent], help="Train an IVF (k-means) ANN index over a numpy flat vector store")
+	sp.add_argument("db", help="Vector DB path the flat store was built with")
+	sp.add_argument("--table", default="vec_index")
+	sp.add_argument("--nlist", type=int, default=None, help="Number of lists (default: 4 * sqrt(rows))")
+	sp.add_argument("--iters", type=int, default=10, help="k-means iterations")
+	sp.set_defaults(func=_cmd_vec_ivf_build)
+
+	def _cmd_vec_quantize(a: argparse.Namespace) -> int:
+		from . import quant as quantmod
+		per_vector = quantmod.build_quantized(a.db, a.table, a.kind or list(quantmod.KINDS))
+		print(json.dumps({"bytes_per_vector": per_vector, "paths": {k: quantmod.quant_paths(a.db, a.table)[k] for k in per_vector}}, ensure_ascii=False))
+		return 0
+
+	sp = sub.add_parser("vec-quantize", parents=[parent], help="Write int8/binary codes for a numpy flat vector store (quantized first pass + exact rerank)")
+	sp.add_argument("db", help="Vector DB path the flat store was built with")
+	sp.add_argument("--table", default="vec_index")
+	sp.add_argument("--kind", choices=["int8", "binary"], action="append", help="Code kind (repeatable; default: both)")
+	sp.set_defaults(func=_cmd_vec_quantize)
+
 	# Back-compat alias: vec-db-search
 	sp = sub.add_parser("vec-db-search", parents=[parent], help="Vector search the sqlite-vec DB for a query")
 	sp.add_argument("db", help="SQLite DB path with sqlite-vec index")
 	sp.add_argument("--table", default="vec_index")
 	sp.add_argument("--query", required=True)
 	sp.add_argument("--k", type=int, default=8)
+	sp.add_argument("--backend", choices=list(indexmod.VEC_BACKENDS), default=None, help="Vector store (default: env AGENT_VEC_BACKEND, or numpy when only a flat store exists)")
+	sp.add_argument("--nprobe", type=int, default=None, help="numpy backend: IVF lists to scan (default: env AGENT_VEC_NPROBE or 8; 0 = exact)")
+	sp.add_argument("--quant", choices=["int8", "binary", "none"], default=None, help="numpy backend: quantized first pass (default: env AGENT_VEC_QUANT or none)")
+	sp.add_argument("--rerank", type=int, default=None, help="numpy backend: shortlist size as a multiple of k for the exact rerank (default: env AGENT_VEC_RERANK or 8)")
+	sp.add_argument("--filter", action="append", type=_filter_spec, help=_FILTER_HELP)
 	sp.set_defaults(func=cmd_vec_db_search)
 
 	# SQLite sparse search over items table
 	def _cmd_sqlite_search(a: argparse.Namespace) -> int:
 		try:
-			rows = indexmod.items_search(a.db, a.table, a.query, a.k)
+			rows = indexmod.items_search(a.db, a.table, a.query, a.k, highlight=a.highlight, filters=filtersmod.parse_filter_args(a.filter))
 			print(json.dumps({"items": rows}, ensure_ascii=False, indent=2))
 			return 0
 		except ValueError as e:
@@ -754,6 +866,8 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("--table", default="items")
 	sp.add_argument("--query", required=True)
 	sp.add_argument("--k", type=int, default=8)
+	sp.add_argument("--highlight", action="store_true", help="Return full user/assistant text with matches wrapped in [brackets]")
+	sp.add_argument("--filter", action="append", type=_filter_spec, help=_FILTER_HELP)
 	sp.set_defaults(func=_cmd_sqlite_search)
 
 	# SQLite per-turn items index (idempotent upsert)
@@ -762,8 +876,9 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("--table", default="items")
 	sp.add_argument("--limit-composers", type=int)
 	sp.add_argument("--max-turns", type=int)
+	sp.add_argument("--workers", type=int, help="Build composers in N worker processes (output identical to serial)")
 	sp.set_defaults(func=lambda a: print(json.dumps({
-		"wrote": indexmod.build_index_sqlite(a.out_db, a.db, a.table, a.limit_composers, a.max_turns)
+		"wrote": indexmod.build_index_sqlite(a.out_db, a.db, a.table, a.limit_composers, a.max_turns, workers=a.workers)
 	})))
 
 	# Build/refresh sqlite-vec from items table
@@ -771,13 +886,28 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("db", help="SQLite DB path (contains items table; will hold vec tables)")
 	sp.add_argument("--items-table", default="items")
 	sp.add_argument("--vec-table", default="vec_index")
+	sp.add_argument("--changed-only", action="store_true", help="Skip items whose embedded text is unchanged (no API call)")
+	sp.add_argument("--concurrency", type=int, help="Embedding requests in flight (env: EMBED_CONCURRENCY, default 4)")
+	sp.add_argument("--rpm", type=float, help="Max embedding requests per minute (env: EMBED_RPM)")
+	sp.add_argument("--tpm", type=float, help="Max embedding tokens per minute, estimated (env: EMBED_TPM)")
 	def _cmd_vec_from_items(a: argparse.Namespace) -> int:
-		wrote = indexmod.build_embeddings_sqlite_from_items(a.db, a.items_table, a.vec_table)
+		stats: Dict[str, int] = {}
+		wrote = indexmod.build_embeddings_sqlite_from_items(
+			a.db,
+			a.items_table,
+			a.vec_table,
+			changed_only=a.changed_only,
+			stats=stats,
+			concurrency=a.concurrency,
+			rpm=a.rpm,
+			tpm=a.tpm,
+		)
 		print(json.dumps({
 			"wrote": wrote,
 			"db": a.db,
 			"items_table": a.items_table,
 			"vec_table": a.vec_table,
+			"stats": stats,
 		}, ensure_ascii=False))
 		return 0
 	sp.set_defaults(func=_cmd_vec_from_items)
@@ -821,7 +951,9 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("index_jsonl", help="Index JSONL path")
 	sp.add_argument("--n", type=int, default=40)
 	sp.add_argument("--model", help="Override LLM model")
-	sp.set_defaults(func=lambda a: print(json.dumps(qamod.llm_find_issues(a.index_jsonl, n=a.n, model=a.model), ensure_ascii=False, indent=2)))
+	sp.add_argument("--seed", type=int, help="Seed for a reproducible sample")
+	sp.add_argument("--stratify", choices=["composer", "tag"], help="Spread the sample evenly across chats or annotation tags")
+	sp.set_defaults(func=lambda a: print(json.dumps(qamod.llm_find_issues(a.index_jsonl, n=a.n, model=a.model, seed=a.seed, stratify=a.stratify), ensure_ascii=False, indent=2)))
 
 	sp = sub.add_parser("qa-llm-aggregate", parents=[parent], help="Aggregate LLM findings with stats into prioritized issues")
 	sp.add_argument("findings_json", help="Path to findings JSON from qa-llm-sample")
@@ -1220,6 +1352,7 @@ def build_parser() -> argparse.ArgumentParser:
 	sp.add_argument("--k", type=int, default=10, help="Number of results to return (default: 10)")
 	sp.add_argument("--no-auto-index", action="store_true", help="Don't auto-create indexes if missing")
 	sp.add_argument("--no-cache", action="store_true", help="Don't use cache (force fresh search)")
+	sp.add_argument("--filter", action="append", type=_filter_spec, help=_FILTER_HELP)
 	sp.set_defaults(func=lambda a: print(json.dumps(memmod.find_solution(
 		a.query,
 		index_jsonl=a.index_jsonl,
@@ -1228,6 +1361,7 @@ def build_parser() -> argparse.ArgumentParser:
 		k=a.k,
 		auto_index=not a.no_auto_index,
 		use_cache=not a.no_cache,
+		filters=filtersmod.parse_filter_args(a.filter),
 	), ensure_ascii=False, indent=2)))
 
 	sp = sub.add_parser("remember", parents=[parent], help="Help recall forgotten things from chat history (cached)")
@@ -1280,6 +1414,8 @@ def build_parser() -> argparse.ArgumentParser:
 	sp = sub.add_parser("cache-stats", parents=[parent], help="Show cache statistics")
 	sp.set_defaults(func=lambda a: print(json.dumps({
 		"cache_count": llm_cache.count(),
+		"embedding_count": llm_cache.count_vectors(),
+		"embeddings_by_scope": llm_cache.vector_stats(),
 		"cache_path": os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite"),
 	}, ensure_ascii=False, indent=2)))
 
@@ -1290,6 +1426,76 @@ def build_parser() -> argparse.ArgumentParser:
 		return 0
 	sp.set_defaults(func=_cmd_cache_clear)
 
+	sp = sub.add_parser("cache", parents=[parent], help="LLM cache maintenance: stats, evict, vacuum or clear")
+	sp.add_argument("action", choices=["stats", "evict", "vacuum", "clear"], help="stats: entries, bytes, hit rates, evictions per namespace; evict: apply TTLs and LLM_CACHE_MAX_BYTES/LLM_CACHE_MAX_ENTRIES now; vacuum: compact the file")
+	def _cmd_cache(a: argparse.Namespace) -> int:
+		if a.action == "stats":
+			out = llm_cache.stats()
+		elif a.action == "evict":
+			out = llm_cache.evict()
+		elif a.action == "vacuum":
+			out = llm_cache.vacuum()
+		else:
+			llm_cache.clear()
+			out = {"cleared": True}
+		print(json.dumps(out, ensure_ascii=False, indent=2))
+		return 0
+	sp.set_defaults(func=_cmd_cache)
+
+	sp = sub.add_parser("bench-bubbles", parents=[parent], help="Benchmark per-bubble lookups vs bulk prefix scan (synthetic DB unless --db)")
+	sp.add_argument("--composers", type=int, default=20)
+	sp.add_argument("--turns", type=int, default=200)
+	sp.add_argument("--payload-bytes", type=int, default=2048)
+	sp.add_argument("--repeat", type=int, default=3)
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_bubble_loading(a.db, a.composers, a.turns, a.payload_bytes, a.repeat), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-vec-upsert", parents=[parent], help="Benchmark per-row vs batched vec meta upserts (in-memory DB)")
+	sp.add_argument("--rows", type=int, default=20000)
+	sp.add_argument("--dim", type=int, default=64)
+	sp.add_argument("--batch", type=int, default=64)
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_vec_upsert(a.rows, a.dim, a.batch), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-sparse-search", parents=[parent], help="Benchmark JSONL search: streaming scan vs inverted-index sidecar")
+	sp.add_argument("--items", type=int, default=20000)
+	sp.add_argument("--words", type=int, default=60, help="Assistant words per item (user gets a third)")
+	sp.add_argument("--repeat", type=int, default=3)
+	sp.add_argument("--path", default=None, help="Where to write the synthetic JSONL (default: temp dir)")
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_sparse_search(a.items, a.words, a.repeat, a.path), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-flat-vec", parents=[parent], help="Benchmark brute-force search over a synthetic NumPy flat vector store")
+	sp.add_argument("--rows", type=int, default=100000)
+	sp.add_argument("--dim", type=int, default=1536)
+	sp.add_argument("--k", type=int, default=10)
+	sp.add_argument("--repeat", type=int, default=5)
+	sp.add_argument("--path", default=None, help="Store name prefix (default: temp dir)")
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_flat_vec(a.rows, a.dim, a.k, a.repeat, a.path), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-topk", parents=[parent], help="Benchmark vector.topk: per-pair loop vs NumPy (single and batched queries)")
+	sp.add_argument("--rows", type=int, default=5000)
+	sp.add_argument("--dim", type=int, default=256)
+	sp.add_argument("--queries", type=int, default=32)
+	sp.add_argument("--k", type=int, default=10)
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_topk(a.rows, a.dim, a.queries, a.k), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-ann", parents=[parent], help="Benchmark IVF recall@k and latency against exact flat search")
+	sp.add_argument("--rows", type=int, default=100000)
+	sp.add_argument("--dim", type=int, default=128)
+	sp.add_argument("--nlist", type=int, default=None)
+	sp.add_argument("--nprobe", type=int, action="append", help="nprobe values to try (repeatable; default 1,2,4,8,16,32)")
+	sp.add_argument("--k", type=int, default=10)
+	sp.add_argument("--queries", type=int, default=50)
+	sp.add_argument("--path", default=None, help="Store name prefix (default: temp dir)")
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_ann(a.rows, a.dim, a.nlist, a.nprobe, a.k, a.queries, a.path), ensure_ascii=False, indent=2)))
+
+	sp = sub.add_parser("bench-quant", parents=[parent], help="Benchmark int8/binary quantized search: compression ratio and recall loss vs exact")
+	sp.add_argument("--rows", type=int, default=100000)
+	sp.add_argument("--dim", type=int, default=1536)
+	sp.add_argument("--k", type=int, default=10)
+	sp.add_argument("--rerank", type=int, action="append", help="Shortlist multiples of k to try (repeatable; default 1,4,16)")
+	sp.add_argument("--queries", type=int, default=20)
+	sp.add_argument("--path", default=None, help="Store name prefix (default: temp dir)")
+	sp.set_defaults(func=lambda a: print(json.dumps(benchmod.bench_quant(a.rows, a.dim, a.k, a.rerank, a.queries, a.path), ensure_ascii=False, indent=2)))
+
 	return p
 
 
@@ -7,6 +7,8 @@ from typing import Dict, List, Tuple, Any
 import llm_utils as llmmod
 from .paths import expand_abs
 from .embeddings import l2_normalize
+from . import embedders as embedmod
+from . import index as indexmod
 # pyd_models removed - using dicts directly
 
 
@@ -104,50 +106,19 @@ def build_cluster_tree(index_jsonl: str, out_json: str, depth: int = 3, min_size
 			ident = f"{obj.get('composer_id')}:{obj.get('turn_index')}"
 			ids.append(ident)
 			texts.append(_build_text_from_item(obj))
-	# Embeddings backend selection: default to fast offline hashing.
-	# Override via CLUSTER_EMBED_BACKEND=hash|st|openai
+	# Embeddings backend selection: default to fast offline hashing TF-IDF.
+	# Override via CLUSTER_EMBED_BACKEND=hash|st|openai (see embedders)
 	backend = (os.getenv("CLUSTER_EMBED_BACKEND", "hash") or "hash").lower()
 	vecs: List[List[float]] = []
-	if backend == "hash":
-		import hashlib
-		def hv(t: str) -> List[float]:
-			h = hashlib.sha256((t or "").encode("utf-8")).digest()
-			arr = [float(int.from_bytes(h[i:i+2], "big")) for i in range(0, 32, 2)]
-			s = sum(x*x for x in arr) ** 0.5 or 1.0
-			return [x / s for x in arr]
-		vecs = [hv(t) for t in texts]
-	elif backend == "st":
+	if backend != "hash":
 		try:
-			from sentence_transformers import SentenceTransformer  # type: ignore
-			st_name = os.getenv("SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2")
-			st = SentenceTransformer(st_name)
-			emb = st.encode(texts, show_progress_bar=False)
-			vecs = [l2_normalize(list(map(float, v))) for v in emb]
+			vecs = embedmod.get_embedder(backend, embed_model if backend == "openai" else None).embed(texts)
 		except Exception:
-			# fallback to hash if ST unavailable
+			# fallback to hash if the backend is unavailable
 			backend = "hash"
-			import hashlib
-			def hv2(t: str) -> List[float]:
-				h = hashlib.sha256((t or "").encode("utf-8")).digest()
-				arr = [float(int.from_bytes(h[i:i+2], "big")) for i in range(0, 32, 2)]
-				s = sum(x*x for x in arr) ** 0.5 or 1.0
-				return [x / s for x in arr]
-			vecs = [hv2(t) for t in texts]
-	elif backend == "openai":
-		try:
-			client = llmmod.require_client()
-			model = embed_model or os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
-			res = client.embeddings.create(model=model, input=texts)
-			vecs = [l2_normalize(list(d.embedding)) for d in res.data]
-		except Exception:
-			# fallback to hash
-			import hashlib
-			def hv3(t: str) -> List[float]:
-				h = hashlib.sha256((t or "").encode("utf-8")).digest()
-				arr = [float(int.from_bytes(h[i:i+2], "big")) for i in range(0, 32, 2)]
-				s = sum(x*x for x in arr) ** 0.5 or 1.0
-				return [x / s for x in arr]
-			vecs = [hv3(t) for t in texts]
+	if backend == "hash":
+		# idf fitted on the items being clustered
+		vecs = embedmod.get_embedder("hash").fit(texts).embed(texts)
 	# cluster
 	root = _bisect_recursive(vecs, list(range(len(ids))), depth, min_size)
 	# write
@@ -284,15 +255,6 @@ def summarize_clusters(tree_json: str, index_jsonl: str, out_json: str, max_samp
 	# Load tree and items
 	with open(expand_abs(tree_json), "r", encoding="utf-8") as f:
 		tree = json.load(f)
-	items: Dict[str, Dict] = {}
-	with open(expand_abs(index_jsonl), "r", encoding="utf-8") as f:
-		for line in f:
-			try:
-				obj = json.loads(line)
-			except Exception:
-				continue
-			ident = f"{obj.get('composer_id')}:{obj.get('turn_index')}"
-			items[ident] = obj
 	client = llmmod.require_client()
 	model = model or os.getenv("OPENAI_MODEL", "gpt-5")
 
@@ -332,6 +294,15 @@ def summarize_clusters(tree_json: str, index_jsonl: str, out_json: str, max_samp
 		if "right" in node:
 			summarize_node(node["right"])
 
+	def sampled_ids(node: Dict) -> List[str]:
+		acc = collect_ids(node)[:max_samples_per_node]
+		for side in ("left", "right"):
+			if side in node:
+				acc.extend(sampled_ids(node[side]))
+		return acc
+
+	# Only sampled items are read (seeking via the index sidecar when available)
+	items = indexmod.get_index_items(index_jsonl, sampled_ids(tree["tree"]))
 	summarize_node(tree["tree"])
 	with open(expand_abs(out_json), "w", encoding="utf-8") as f:
 		json.dump(tree, f, ensure_ascii=False, indent=2)
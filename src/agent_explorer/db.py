@@ -4,8 +4,9 @@ Provides read-only access to SQLite databases used by AI agents
 to store conversation state and key-value data.
 """
 
+import json
 import sqlite3
-from typing import Optional, List, Tuple, Iterable
+from typing import Optional, List, Tuple, Iterable, Iterator
 
 
 def connect_readonly(db_path: str) -> sqlite3.Connection:
@@ -98,8 +99,13 @@ def kv_keys(
 	conditions = []
 
 	if prefix:
-		conditions.append("key LIKE ?")
-		params.append(f"{prefix}%")
+		# Half-open key range instead of LIKE so SQLite can use the primary-key index
+		conditions.append("key >= ?")
+		params.append(prefix)
+		upper = _prefix_upper_bound(prefix)
+		if upper is not None:
+			conditions.append("key < ?")
+			params.append(upper)
 	if like:
 		conditions.append("key LIKE ?")
 		params.append(like)
@@ -118,6 +124,60 @@ def kv_keys(
 	return [row[0] for row in c.fetchall()]
 
 
+def iter_kv_keys(
+	conn: sqlite3.Connection,
+	prefix: Optional[str] = None,
+	limit: Optional[int] = None,
+	table: str = "cursorDiskKV",
+	page_size: int = 1000,
+) -> Iterator[str]:
+	"""Stream keys in key order using range scans and keyset pagination.
+
+	Each page is a bounded `key > last_key` range query, so memory stays flat and
+	no read statement is held open between pages.
+
+	Args:
+		conn: Database connection
+		prefix: Optional key prefix filter (e.g., "composerData:")
+		limit: Optional maximum number of keys to yield (None, 0 or less: no limit)
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+		page_size: Keys fetched per query
+
+	Returns:
+		Iterator of keys
+	"""
+	page_size = max(1, int(page_size))
+	upper = _prefix_upper_bound(prefix) if prefix else None
+	c = conn.cursor()
+	last: Optional[str] = None
+	remaining = limit if limit and limit > 0 else None
+	while remaining is None or remaining > 0:
+		conditions = []
+		params: List[object] = []
+		if last is not None:
+			conditions.append("key > ?")
+			params.append(last)
+		elif prefix:
+			conditions.append("key >= ?")
+			params.append(prefix)
+		if upper is not None:
+			conditions.append("key < ?")
+			params.append(upper)
+		query = f"SELECT key FROM {table}"
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+		n = page_size if remaining is None else min(page_size, remaining)
+		query += f" ORDER BY key LIMIT {n}"
+		rows = c.execute(query, params).fetchall()
+		for row in rows:
+			yield row[0]
+		if remaining is not None:
+			remaining -= len(rows)
+		if len(rows) < n:
+			return
+		last = rows[-1][0]
+
+
 def kv_value(conn: sqlite3.Connection, key: str, table: str = "cursorDiskKV") -> Optional[bytes]:
 	"""Get value for a key from key-value table.
 	
@@ -135,6 +195,189 @@ def kv_value(conn: sqlite3.Connection, key: str, table: str = "cursorDiskKV") ->
 	return row[0] if row else None
 
 
+def kv_value_length(conn: sqlite3.Connection, key: str, table: str = "cursorDiskKV") -> Optional[int]:
+	"""Length of a key's value, computed inside SQLite, or None if the key is missing.
+
+	Args:
+		conn: Database connection
+		key: Key to look up
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		length(value), or None if not found
+	"""
+	row = conn.execute(f"SELECT length(value) FROM {table} WHERE key=?", (key,)).fetchone()
+	return int(row[0]) if row and row[0] is not None else None
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+	"""Return the smallest string greater than every string starting with prefix.
+
+	Used to turn a prefix filter into an index-friendly half-open key range
+	(key >= prefix AND key < upper). Returns None if no finite bound exists.
+	"""
+	chars = list(prefix)
+	while chars:
+		last = ord(chars[-1])
+		if last < 0x10FFFF:
+			chars[-1] = chr(last + 1)
+			return "".join(chars)
+		chars.pop()
+	return None
+
+
+def kv_prefix_items(conn: sqlite3.Connection, prefix: str, table: str = "cursorDiskKV") -> Iterator[Tuple[str, bytes]]:
+	"""Stream (key, value) rows whose key starts with prefix via one key-range scan.
+
+	Args:
+		conn: Database connection
+		prefix: Key prefix (e.g., "bubbleId:<composer_id>:")
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		Iterator of (key, value) tuples in key order
+	"""
+	c = conn.cursor()
+	upper = _prefix_upper_bound(prefix)
+	if upper is None:
+		c.execute(f"SELECT key, value FROM {table} WHERE key >= ? ORDER BY key", (prefix,))
+	else:
+		c.execute(f"SELECT key, value FROM {table} WHERE key >= ? AND key < ? ORDER BY key", (prefix, upper))
+	for row in c:
+		yield row[0], row[1]
+
+
+def kv_prefix_stats(conn: sqlite3.Connection, prefix: str, table: str = "cursorDiskKV") -> Tuple[int, int]:
+	"""(row count, total value length) for keys starting with prefix, aggregated inside SQLite.
+
+	Args:
+		conn: Database connection
+		prefix: Key prefix (e.g., "bubbleId:<composer_id>:")
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		Tuple of (count, sum of length(value))
+	"""
+	upper = _prefix_upper_bound(prefix)
+	where = "key >= ?" if upper is None else "key >= ? AND key < ?"
+	params = (prefix,) if upper is None else (prefix, upper)
+	row = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(length(value)), 0) FROM {table} WHERE {where}", params).fetchone()
+	return int(row[0]), int(row[1])
+
+
+# Malformed or empty-object values are treated as missing, matching a Python
+# json.loads() + truthiness check. json_valid guards json_extract, which raises on
+# malformed input; each extra JSON1 call re-parses the whole value, so keep it at two.
+_JSON_OBJECT_WHERE = "CASE WHEN json_valid(v) THEN v <> '{}' ELSE 0 END"
+
+
+def _json_fields_expr(n_paths: int) -> str:
+	# json_extract with 2+ paths returns a JSON array; wrap a single path the same way
+	if n_paths == 1:
+		return "json_array(json_extract(v, ?))"
+	return "json_extract(v, " + ", ".join("?" * n_paths) + ")"
+
+
+def kv_json_fields(
+	conn: sqlite3.Connection,
+	key: str,
+	paths: List[str],
+	table: str = "cursorDiskKV",
+) -> Optional[list]:
+	"""Project JSON fields out of one value inside SQLite (JSON1).
+
+	Only the requested fields cross into Python; the rest of the document is never
+	decoded there.
+
+	Args:
+		conn: Database connection
+		key: Key to look up
+		paths: JSON paths to extract (e.g., ["$.text", "$.type"])
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		List of values (None for absent fields) in path order, or None if the key is
+		missing, malformed or an empty object.
+		Raises sqlite3.OperationalError when JSON1 is unavailable.
+	"""
+	c = conn.cursor()
+	c.execute(
+		f"SELECT {_json_fields_expr(len(paths))} FROM "
+		f"(SELECT CAST(value AS TEXT) AS v FROM {table} WHERE key = ?) "
+		f"WHERE {_JSON_OBJECT_WHERE}",
+		(*paths, key),
+	)
+	row = c.fetchone()
+	return json.loads(row[0]) if row else None
+
+
+def iter_kv_json_fields(
+	conn: sqlite3.Connection,
+	prefix: str,
+	paths: List[str],
+	table: str = "cursorDiskKV",
+) -> Iterator[Tuple[str, list]]:
+	"""Project JSON fields out of every value under a key prefix in one range scan.
+
+	Args:
+		conn: Database connection
+		prefix: Key prefix (e.g., "bubbleId:<composer_id>:")
+		paths: JSON paths to extract (e.g., ["$.text", "$.content"])
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		Iterator of (key, values) in key order; malformed or empty-object
+		values are skipped. Raises sqlite3.OperationalError when JSON1 is unavailable.
+	"""
+	c = conn.cursor()
+	upper = _prefix_upper_bound(prefix)
+	where, params = ("key >= ?", [prefix]) if upper is None else ("key >= ? AND key < ?", [prefix, upper])
+	c.execute(
+		f"SELECT key, {_json_fields_expr(len(paths))} FROM "
+		f"(SELECT key, CAST(value AS TEXT) AS v FROM {table} WHERE {where}) "
+		f"WHERE {_JSON_OBJECT_WHERE} ORDER BY key",
+		(*paths, *params),
+	)
+	for row in c:
+		yield row[0], json.loads(row[1])
+
+
+def kv_json_string_fields(
+	conn: sqlite3.Connection,
+	key: str,
+	name_contains: Iterable[str],
+	table: str = "cursorDiskKV",
+) -> List[Tuple[str, str]]:
+	"""Find non-empty string fields anywhere in one JSON value by field name, inside SQLite.
+
+	Walks the document with json_tree, so nested objects are searched without
+	decoding the value in Python.
+
+	Args:
+		conn: Database connection
+		key: Key to look up
+		name_contains: Substrings matched case-insensitively against field names
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+
+	Returns:
+		List of (field_name, value) in document order. Raises sqlite3.OperationalError
+		when JSON1 is unavailable.
+	"""
+	pats = [f"%{p}%" for p in name_contains]
+	if not pats:
+		return []
+	c = conn.cursor()
+	name_where = " OR ".join("j.key LIKE ?" for _ in pats)
+	c.execute(
+		f"SELECT j.key, j.value FROM "
+		f"(SELECT CASE WHEN json_valid(v) THEN v ELSE 'null' END AS v FROM "
+		f"(SELECT CAST(value AS TEXT) AS v FROM {table} WHERE key = ?)) AS s, json_tree(s.v) AS j "
+		f"WHERE j.type = 'text' AND j.value <> '' AND ({name_where}) ORDER BY j.id",
+		(key, *pats),
+	)
+	return [(row[0], row[1]) for row in c.fetchall()]
+
+
 def search_kv(
 	conn: sqlite3.Connection,
 	key_like: Optional[str] = None,
@@ -180,16 +423,30 @@ def search_kv(
 	return [(row[0], row[1]) for row in c.fetchall()]
 
 
-def composer_data_keys(conn: sqlite3.Connection, limit: Optional[int] = None, table: str = "cursorDiskKV") -> Iterable[str]:
+def composer_data_keys(conn: sqlite3.Connection, limit: Optional[int] = None, table: str = "cursorDiskKV") -> List[str]:
 	"""Get all composerData:* keys.
 	
 	Args:
 		conn: Database connection
-		limit: Optional maximum number of keys
+		limit: Optional maximum number of keys (None, 0 or less: no limit)
+		table: Table name (defaults to cursorDiskKV for backward compatibility)
+	
+	Returns:
+		List of keys matching composerData:*, in key order
+	"""
+	return list(iter_composer_data_keys(conn, limit=limit, table=table))
+
+
+def iter_composer_data_keys(conn: sqlite3.Connection, limit: Optional[int] = None, table: str = "cursorDiskKV") -> Iterator[str]:
+	"""Stream composerData:* keys in key order; see iter_kv_keys.
+	
+	Args:
+		conn: Database connection
+		limit: Optional maximum number of keys (None, 0 or less: no limit)
 		table: Table name (defaults to cursorDiskKV for backward compatibility)
 	
 	Returns:
-		Iterable of keys matching composerData:*
+		Iterator of keys matching composerData:*
 	"""
-	return kv_keys(conn, prefix="composerData:", limit=limit, table=table)
+	return iter_kv_keys(conn, prefix="composerData:", limit=limit, table=table)
 
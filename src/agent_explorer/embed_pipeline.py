@@ -0,0 +1,185 @@
+"""Pipelined embedding ingestion: reader -> N concurrent requests -> single writer.
+
+The caller's thread reads batches and writes results (SQLite connections are
+bound to the thread that opened them); embedding requests run concurrently in a
+thread pool behind a shared request/token rate limiter. Results are written in
+submission order, so output does not depend on which request finishes first.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, List, Optional, Tuple
+
+
+def _env_float(name: str) -> Optional[float]:
+	try:
+		val = float(os.getenv(name, "") or 0)
+	except ValueError:
+		return None
+	return val if val > 0 else None
+
+
+def default_concurrency() -> int:
+	try:
+		return max(1, int(os.getenv("EMBED_CONCURRENCY", "4")))
+	except ValueError:
+		return 4
+
+
+def estimate_tokens(texts: Iterable[str]) -> int:
+	"""Rough token count (~4 chars per token) used for TPM budgeting."""
+	return sum(len(t) // 4 + 1 for t in texts)
+
+
+class RateLimiter:
+	"""Token-bucket limiter for requests per minute and tokens per minute.
+
+	Either limit may be None (unlimited). pause() blocks every caller until a
+	deadline, used when the server answers with Retry-After.
+	"""
+
+	def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+		self.rpm = float(rpm) if rpm else None
+		self.tpm = float(tpm) if tpm else None
+		self._lock = threading.Lock()
+		self._req = self.rpm or 0.0
+		self._tok = self.tpm or 0.0
+		self._last = time.monotonic()
+		self._paused_until = 0.0
+
+	@classmethod
+	def from_env(cls, rpm: Optional[float] = None, tpm: Optional[float] = None) -> "RateLimiter":
+		"""Explicit limits win; otherwise EMBED_RPM / EMBED_TPM."""
+		return cls(rpm or _env_float("EMBED_RPM"), tpm or _env_float("EMBED_TPM"))
+
+	def _refill(self, now: float) -> None:
+		dt = now - self._last
+		self._last = now
+		if self.rpm:
+			self._req = min(self.rpm, self._req + dt * self.rpm / 60.0)
+		if self.tpm:
+			self._tok = min(self.tpm, self._tok + dt * self.tpm / 60.0)
+
+	def acquire(self, tokens: int = 0) -> None:
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self._refill(now)
+				wait = self._paused_until - now
+				if wait <= 0:
+					# A request larger than the whole TPM budget waits for a full bucket
+					need_tok = min(float(tokens), self.tpm) if self.tpm else 0.0
+					wait_req = (1.0 - self._req) * 60.0 / self.rpm if self.rpm and self._req < 1.0 else 0.0
+					wait_tok = (need_tok - self._tok) * 60.0 / self.tpm if self.tpm and self._tok < need_tok else 0.0
+					wait = max(wait_req, wait_tok)
+					if wait <= 0:
+						if self.rpm:
+							self._req -= 1.0
+						if self.tpm:
+							self._tok -= need_tok
+						return
+			time.sleep(min(wait, 5.0))
+
+	def pause(self, seconds: float) -> None:
+		with self._lock:
+			self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+	"""Server-requested backoff from an API error (retry-after-ms / retry-after headers)."""
+	resp = getattr(exc, "response", None)
+	headers = getattr(resp, "headers", None)
+	if not headers or not hasattr(headers, "get"):
+		return None
+	ms = headers.get("retry-after-ms")
+	if ms:
+		try:
+			return max(0.0, float(ms) / 1000.0)
+		except ValueError:
+			pass
+	val = headers.get("retry-after")
+	if not val:
+		return None
+	try:
+		return max(0.0, float(val))
+	except ValueError:
+		pass
+	try:
+		from email.utils import parsedate_to_datetime
+		return max(0.0, parsedate_to_datetime(val).timestamp() - time.time())
+	except Exception:
+		return None
+
+
+def embed_with_retry(client, model: str, inputs: List[str], limiter: Optional[RateLimiter] = None, retries: int = 4):
+	"""client.embeddings.create with rate limiting and backoff (Retry-After when given)."""
+	delay = 1.0
+	for attempt in range(retries + 1):
+		if limiter is not None:
+			limiter.acquire(estimate_tokens(inputs))
+		try:
+			return client.embeddings.create(model=model, input=inputs)
+		except Exception as e:
+			if attempt >= retries:
+				raise
+			wait = retry_after_seconds(e)
+			if wait is not None:
+				# Rate limited: hold back every in-flight worker, not just this one
+				if limiter is not None:
+					limiter.pause(wait)
+			else:
+				wait = delay
+				delay *= 1.6
+			if os.getenv("EMBED_VERBOSE"):
+				print(f"embed batch failed: {e}; retry in {wait:.1f}s", file=sys.stderr)
+			time.sleep(wait)
+
+
+def run_pipeline(
+	batches: Iterable[Tuple[List[str], Any]],
+	embed: Callable[[List[str]], Any],
+	write: Callable[[Any, Any], int],
+	concurrency: int = 4,
+	max_in_flight: Optional[int] = None,
+	commit: Optional[Callable[[], None]] = None,
+	commit_every: int = 0,
+) -> None:
+	"""Drive (texts, payload) batches through embed() concurrently and write() in order.
+
+	write(payload, result) returns the number of rows it wrote; commit() is called
+	whenever commit_every rows have accumulated (0 disables; the caller commits at
+	the end). At most max_in_flight requests (default 2 x concurrency) are queued.
+	"""
+	concurrency = max(1, int(concurrency))
+	max_in_flight = max(1, int(max_in_flight or concurrency * 2))
+	pending: Deque[Tuple[Any, Any]] = deque()
+	since_commit = 0
+
+	def _write_head() -> None:
+		nonlocal since_commit
+		payload, fut = pending.popleft()
+		since_commit += int(write(payload, fut.result()) or 0)
+		if commit is not None and commit_every and since_commit >= commit_every:
+			commit()
+			since_commit = 0
+
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as ex:
+		try:
+			for texts, payload in batches:
+				pending.append((payload, ex.submit(embed, texts)))
+				# Write whatever is already done, keeping SQLite busy while requests are in flight
+				while pending and pending[0][1].done():
+					_write_head()
+				while len(pending) >= max_in_flight:
+					_write_head()
+			while pending:
+				_write_head()
+		except BaseException:
+			for _, fut in pending:
+				fut.cancel()
+			raise
@@ -0,0 +1,377 @@
+"""Pluggable text embedders shared by indexing, search, clustering and streams.
+
+Backends (AGENT_EMBED_BACKEND or an explicit backend argument):
+
+- openai: the embeddings API (model from OPENAI_EMBED_MODEL / EMBEDDING_MODEL),
+  persistently cached through llm_utils.embed_texts.
+- st: a local sentence-transformers model (SENTENCE_TRANSFORMER_MODEL, default
+  all-MiniLM-L6-v2), loaded once per process.
+- hash: offline feature-hashing TF-IDF over word uni/bigrams (AGENT_HASH_DIM
+  buckets, default 512); no model, no network. Indexes fit the idf on their own
+  texts (see index_embedder) and save it with the vectors.
+
+Instances are per-process singletons keyed by (backend, model). Each embedder's
+model string names its backend ("hash:512", "hash:512+idf:<digest>" when fitted,
+"st:<name>", or the OpenAI model), so stored vectors can be matched to the
+embedder that made them (see embedder_for_model; fitted models also need the
+state() saved alongside). Local embedders also expose an OpenAI-shaped client (see
+Embedder.client) so the embedding pipeline can drive any backend.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import llm_utils as llmmod
+
+
+def default_openai_model() -> str:
+	return os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
+
+
+def _unit(vec: List[float]) -> List[float]:
+	s = math.sqrt(sum(x * x for x in vec))
+	return [x / s for x in vec] if s > 0.0 else vec
+
+
+class _Datum:
+	__slots__ = ("embedding", "index")
+
+	def __init__(self, embedding: List[float], index: int) -> None:
+		self.embedding = embedding
+		self.index = index
+
+
+class _Response:
+	"""Just enough of an OpenAI embeddings response for the pipeline and probes."""
+
+	usage = None
+
+	def __init__(self, vecs: List[List[float]]) -> None:
+		self.data = [_Datum(v, i) for i, v in enumerate(vecs)]
+
+
+class _LocalClient:
+	"""client.embeddings.create(model=..., input=[...]) backed by a local embedder."""
+
+	def __init__(self, embedder: "Embedder") -> None:
+		self.embeddings = self
+		self._embedder = embedder
+
+	def create(self, model: str, input: Sequence[str]) -> _Response:
+		return _Response(self._embedder.embed(list(input)))
+
+
+class Embedder(ABC):
+	"""Base class: embed() batches uncached texts through _embed_batch.
+
+	Subclasses set name, model and remote, and implement _embed_batch. Local
+	embedders memoize vectors in-process by text (memo_size entries). Embedders
+	that learn corpus statistics set fits and override fit/state.
+	"""
+
+	name = ""
+	remote = False
+	fits = False
+	batch_size = 64
+	memo_size = 4096
+
+	def __init__(self, model: str) -> None:
+		self.model = model
+		self._memo: "OrderedDict[str, List[float]]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	@abstractmethod
+	def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+		"""Unit-length vectors for texts (already deduplicated), in order."""
+
+	def fit(self, texts: Iterable[str]) -> "Embedder":
+		"""An embedder adapted to texts (a copy with its own model string); self when nothing is learned."""
+		return self
+
+	def state(self) -> Optional[Dict[str, Any]]:
+		"""JSON-serializable data that embedder_for_model needs besides the model string, if any."""
+		return None
+
+	def embed(self, texts: Sequence[str]) -> List[List[float]]:
+		"""Unit-length vectors for texts, in order."""
+		out: List[Optional[List[float]]] = [None] * len(texts)
+		missing: Dict[str, List[int]] = {}
+		with self._lock:
+			for i, t in enumerate(texts):
+				key = hashlib.sha1((t or "").encode("utf-8")).hexdigest()
+				vec = self._memo.get(key)
+				if vec is not None:
+					self._memo.move_to_end(key)
+					out[i] = vec
+				else:
+					missing.setdefault(key, []).append(i)
+		keys = list(missing)
+		for start in range(0, len(keys), self.batch_size):
+			chunk = keys[start:start + self.batch_size]
+			vecs = self._embed_batch([texts[missing[k][0]] or "" for k in chunk])
+			with self._lock:
+				for key, vec in zip(chunk, vecs):
+					for i in missing[key]:
+						out[i] = vec
+					if self.memo_size > 0:
+						self._memo[key] = vec
+						while len(self._memo) > self.memo_size:
+							self._memo.popitem(last=False)
+		return [list(v) for v in out]
+
+	def client(self):
+		"""OpenAI-shaped client for embed_pipeline and dimension probes."""
+		return _LocalClient(self)
+
+
+class OpenAIEmbedder(Embedder):
+	"""OpenAI embeddings; the client is created lazily (require_client) on first use."""
+
+	name = "openai"
+	remote = True
+	memo_size = 0
+
+	def __init__(self, model: Optional[str] = None) -> None:
+		super().__init__(model or default_openai_model())
+
+	def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+		# embed_texts batches (EMBED_BATCH) and caches in llm_cache
+		vecs = llmmod.embed_texts(llmmod.require_client(), texts, model=self.model, scope="embedder")
+		return [_unit(list(v)) for v in vecs]
+
+	def client(self):
+		return llmmod.require_client()
+
+
+# Loaded sentence-transformers models by name (one per process)
+_ST_MODELS: Dict[str, object] = {}
+_ST_LOCK = threading.Lock()
+
+
+def _load_sentence_transformer(name: str):
+	with _ST_LOCK:
+		model = _ST_MODELS.get(name)
+		if model is None:
+			try:
+				from sentence_transformers import SentenceTransformer  # type: ignore
+			except ImportError as e:
+				raise RuntimeError("sentence-transformers is required for the st backend: pip install sentence-transformers") from e
+			model = _ST_MODELS[name] = SentenceTransformer(name)
+		return model
+
+
+class SentenceTransformerEmbedder(Embedder):
+	"""Local sentence-transformers model; encode calls are serialized per process."""
+
+	name = "st"
+
+	def __init__(self, model: Optional[str] = None) -> None:
+		name = (model or os.getenv("SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2"))
+		name = name[3:] if name.startswith("st:") else name
+		super().__init__(f"st:{name}")
+		self.st_name = name
+		try:
+			self.batch_size = max(1, int(os.getenv("ST_BATCH", "64")))
+		except Exception:
+			pass
+
+	def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+		model = _load_sentence_transformer(self.st_name)
+		with _ST_LOCK:
+			emb = model.encode(texts, batch_size=self.batch_size, show_progress_bar=False)
+		return [_unit([float(x) for x in v]) for v in emb]
+
+
+_TOKEN = re.compile(r"\w+")
+_HASH_MODEL = re.compile(r"hash:(\d+)(?:\+idf(?::(\w+))?)?")
+
+
+class HashingEmbedder(Embedder):
+	"""Feature-hashing TF-IDF: signed crc32 buckets of word uni/bigrams, sublinear tf.
+
+	Without fit() every bucket has idf 1 (term frequency only); fit(texts) returns
+	a copy weighted by the corpus's smoothed idf, whose model string carries a
+	digest of the idf ("hash:<dim>+idf:<digest>") and whose state() holds it.
+	"""
+
+	name = "hash"
+	fits = True
+	memo_size = 0
+	batch_size = 1024
+
+	def __init__(self, model: Optional[str] = None, ngram_max: int = 2, idf: Optional[Sequence[float]] = None) -> None:
+		if model:
+			m = _HASH_MODEL.fullmatch(model)
+			if not m:
+				raise ValueError(f"invalid hash embedder model: {model} (expected hash:<dim>)")
+			dim = m.group(1)
+		else:
+			dim = os.getenv("AGENT_HASH_DIM", "512")
+		try:
+			self.dim = max(8, int(dim))
+		except ValueError:
+			raise ValueError(f"invalid AGENT_HASH_DIM: {dim}")
+		self.ngram_max = max(1, int(ngram_max))
+		self.idf = [float(x) for x in idf] if idf is not None else None
+		if self.idf is not None and len(self.idf) != self.dim:
+			raise ValueError(f"idf has {len(self.idf)} buckets, expected {self.dim}")
+		super().__init__(f"hash:{self.dim}" + (f"+idf:{_idf_digest(self.idf)}" if self.idf is not None else ""))
+
+	def _features(self, text: str) -> Counter:
+		toks = _TOKEN.findall((text or "").lower())
+		feats = Counter(toks)
+		for n in range(2, self.ngram_max + 1):
+			feats.update(" ".join(toks[i:i + n]) for i in range(len(toks) - n + 1))
+		return feats
+
+	def _bucket(self, feat: str):
+		h = zlib.crc32(feat.encode("utf-8"))
+		return h % self.dim, (-1.0 if h & 0x80000000 else 1.0)
+
+	def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+		out: List[List[float]] = []
+		for t in texts:
+			vec = [0.0] * self.dim
+			for feat, n in self._features(t).items():
+				b, sign = self._bucket(feat)
+				w = 1.0 + math.log(n)
+				vec[b] += sign * w * (self.idf[b] if self.idf is not None else 1.0)
+			out.append(_unit(vec))
+		return out
+
+	def fit(self, texts: Iterable[str]) -> "HashingEmbedder":
+		"""A copy weighted by smoothed idf (log((1 + n) / (1 + df)) + 1) over texts' buckets."""
+		df = [0] * self.dim
+		n = 0
+		for t in texts:
+			n += 1
+			for b in {self._bucket(f)[0] for f in self._features(t)}:
+				df[b] += 1
+		idf = [math.log((1.0 + n) / (1.0 + d)) + 1.0 for d in df]
+		return HashingEmbedder(f"hash:{self.dim}", self.ngram_max, idf)
+
+	def state(self) -> Optional[Dict[str, Any]]:
+		return {"idf": self.idf} if self.idf is not None else None
+
+	def client(self):
+		return _LocalClient(self)
+
+
+def _idf_digest(idf: Sequence[float]) -> str:
+	# Over float32 so the digest survives a JSON round trip of the state
+	return hashlib.sha1(array("f", idf).tobytes()).hexdigest()[:12]
+
+
+_REGISTRY: Dict[str, Callable[[Optional[str]], Embedder]] = {
+	"openai": OpenAIEmbedder,
+	"st": SentenceTransformerEmbedder,
+	"hash": HashingEmbedder,
+}
+_ALIASES = {"sentence-transformers": "st", "sentence_transformers": "st", "tfidf": "hash", "hashing": "hash"}
+_INSTANCES: Dict[tuple, Embedder] = {}
+_INSTANCES_LOCK = threading.Lock()
+
+
+def register_embedder(name: str, factory: Callable[[Optional[str]], Embedder]) -> None:
+	"""Add or replace a backend; factory(model) builds an Embedder."""
+	_REGISTRY[name.strip().lower()] = factory
+	with _INSTANCES_LOCK:
+		for key in [k for k in _INSTANCES if k[0] == name]:
+			_INSTANCES.pop(key, None)
+
+
+def backend_names() -> List[str]:
+	return sorted(_REGISTRY)
+
+
+def resolve_backend(backend: Optional[str] = None) -> str:
+	name = (backend or os.getenv("AGENT_EMBED_BACKEND") or "openai").strip().lower()
+	name = _ALIASES.get(name, name)
+	if name not in _REGISTRY:
+		raise ValueError(f"unknown embedding backend: {name} (expected one of {', '.join(backend_names())})")
+	return name
+
+
+def get_embedder(backend: Optional[str] = None, model: Optional[str] = None) -> Embedder:
+	"""The process-wide embedder for backend (default env AGENT_EMBED_BACKEND or openai) and model."""
+	name = resolve_backend(backend)
+	if name == "openai" and not model:
+		model = default_openai_model()
+	key = (name, model or "")
+	with _INSTANCES_LOCK:
+		inst = _INSTANCES.get(key)
+		if inst is None:
+			inst = _INSTANCES[key] = _REGISTRY[name](model)
+		return inst
+
+
+def embedder_for_model(model: Optional[str], state: Optional[Dict[str, Any]] = None) -> Embedder:
+	"""The embedder that produced vectors recorded under model (see module docstring).
+
+	Fitted models ("hash:<dim>+idf:<digest>") are rebuilt from the state() saved with
+	their vectors; ValueError if it is missing or does not match the model.
+	"""
+	if not model:
+		return get_embedder()
+	if model.startswith("hash:"):
+		if "+" not in model:
+			return get_embedder("hash", model)
+		with _INSTANCES_LOCK:
+			inst = _INSTANCES.get(("hash", model))
+		if inst is not None:
+			return inst
+		idf = (state or {}).get("idf")
+		if not idf:
+			raise ValueError(f"{model} vectors need the idf saved with their index")
+		dim = _HASH_MODEL.fullmatch(model)
+		inst = HashingEmbedder(f"hash:{dim.group(1)}" if dim else model, idf=idf)
+		if inst.model != model:
+			raise ValueError(f"saved idf does not match {model}")
+		with _INSTANCES_LOCK:
+			return _INSTANCES.setdefault(("hash", model), inst)
+	if model.startswith("st:"):
+		return get_embedder("st", model)
+	return get_embedder("openai", model)
+
+
+def index_embedder(
+	embedder: Embedder,
+	texts: Callable[[], Iterable[str]],
+	model: Optional[str] = None,
+	state: Optional[Dict[str, Any]] = None,
+) -> Embedder:
+	"""The embedder to build an index with, given the model and state the index recorded.
+
+	Embedders that fit (hash) are fitted once on texts() (the index's texts), then
+	reuse the saved state on later builds while the base model is unchanged, so
+	unchanged items keep their vectors. Others are returned as is.
+	"""
+	if not embedder.fits:
+		return embedder
+	if model and state and model.startswith(embedder.model + "+"):
+		try:
+			return embedder_for_model(model, state)
+		except ValueError:
+			pass
+	return embedder.fit(texts())
+
+
+def embed_query(text: str, model: Optional[str] = None, state: Optional[Dict[str, Any]] = None) -> List[float]:
+	"""Query vector from the embedder for model and its saved state (default: get_embedder()).
+
+	Remote embedders go through llm_utils.embed_query and its query caches; local
+	ones embed the normalized text directly.
+	"""
+	embedder = embedder_for_model(model, state) if model else get_embedder()
+	if embedder.remote:
+		return llmmod.embed_query(text, model=embedder.model)
+	return embedder.embed([llmmod.normalize_query_text(text)])[0]
@@ -0,0 +1,150 @@
+"""Metadata filters pushed down into vector and sparse search.
+
+A filter dict may hold any of:
+
+- repo: exact repo hint (the index item's "repo", from parser.extract_repo_hint)
+- kind: annotations.kind, "chat" when unset (docs indexed by docs.py are "doc")
+- flags: annotation booleans that must all be set (e.g. contains_design)
+- tags: annotation tags that must all be present (case-insensitive)
+
+Stored alongside items as repo/kind/ann_flags/tags columns (space-separated flag
+and tag strings) in the items table, <table>_meta and the flat vector store.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_KIND = "chat"
+_FLAG_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _as_list(val: Any) -> List[str]:
+	if val is None:
+		return []
+	if isinstance(val, str):
+		val = val.replace(",", " ").split()
+	return [str(v).strip() for v in val if str(v).strip()]
+
+
+def normalize_filters(filters: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+	"""Canonical form (flags and tags as sorted tuples, tags lowercased), or None when empty.
+
+	Raises ValueError for unknown keys or malformed flag names.
+	"""
+	if not filters:
+		return None
+	unknown = set(filters) - {"repo", "kind", "flags", "tags"}
+	if unknown:
+		raise ValueError(f"unknown filter key(s): {', '.join(sorted(unknown))}")
+	out: Dict[str, Any] = {}
+	if filters.get("repo"):
+		out["repo"] = str(filters["repo"]).strip()
+	if filters.get("kind"):
+		out["kind"] = str(filters["kind"]).strip()
+	flags = _as_list(filters.get("flags"))
+	for f in flags:
+		if not _FLAG_RE.fullmatch(f):
+			raise ValueError(f"invalid flag name: {f}")
+	if flags:
+		out["flags"] = tuple(sorted(set(flags)))
+	tags = _as_list(filters.get("tags"))
+	if tags:
+		out["tags"] = tuple(sorted({t.lower() for t in tags}))
+	return out or None
+
+
+def parse_filter_args(specs: Optional[Iterable[str]]) -> Optional[Dict[str, Any]]:
+	"""Build a filter from CLI strings: repo=X, kind=doc, tag=rust (or tag:rust), flag=F or a bare flag name."""
+	raw: Dict[str, Any] = {}
+	for spec in specs or []:
+		spec = (spec or "").strip()
+		if not spec:
+			continue
+		key, sep, val = spec.partition("=")
+		if not sep and spec.startswith("tag:"):
+			key, val = "tag", spec[4:]
+		elif not sep:
+			key, val = "flag", spec
+		key = key.strip().lower()
+		if key in ("tag", "tags"):
+			raw.setdefault("tags", []).extend(_as_list(val))
+		elif key in ("flag", "flags"):
+			raw.setdefault("flags", []).extend(_as_list(val))
+		elif key in ("repo", "kind"):
+			raw[key] = val
+		else:
+			raise ValueError(f"unknown filter: {spec}")
+	return normalize_filters(raw)
+
+
+def item_fields(obj: Dict[str, Any]) -> Dict[str, str]:
+	"""repo/kind/ann_flags/tags column values for a JSONL index item."""
+	from .index import _ann_flags_and_tags
+
+	ann = obj.get("annotations") if isinstance(obj.get("annotations"), dict) else {}
+	flags, tags = _ann_flags_and_tags(ann)
+	return {
+		"repo": obj.get("repo") or "",
+		"kind": str(ann.get("kind") or DEFAULT_KIND),
+		"ann_flags": flags,
+		"tags": tags,
+	}
+
+
+def fields_match(repo: Optional[str], kind: Optional[str], ann_flags: Optional[str], tags: Optional[str], filters: Optional[Dict[str, Any]]) -> bool:
+	"""Whether stored column values satisfy a normalized filter."""
+	if not filters:
+		return True
+	if "repo" in filters and (repo or "") != filters["repo"]:
+		return False
+	if "kind" in filters and (kind or DEFAULT_KIND) != filters["kind"]:
+		return False
+	if "flags" in filters and not set(filters["flags"]) <= set((ann_flags or "").split()):
+		return False
+	if "tags" in filters and not set(filters["tags"]) <= set((tags or "").lower().split()):
+		return False
+	return True
+
+
+def item_matches(obj: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+	if not filters:
+		return True
+	f = item_fields(obj)
+	return fields_match(f["repo"], f["kind"], f["ann_flags"], f["tags"], filters)
+
+
+def _like_word(word: str) -> str:
+	escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+	return f"% {escaped} %"
+
+
+def sql_where(filters: Optional[Dict[str, Any]], alias: str, columns: Optional[Sequence[str]] = None) -> Tuple[str, list]:
+	"""SQL condition (no leading WHERE/AND; "1" when unfiltered) and params for alias's columns.
+
+	columns lists the columns the table actually has; a filter on a missing one
+	(tables built before filtering existed) matches nothing.
+	"""
+	if not filters:
+		return "1", []
+	have = set(columns) if columns is not None else {"repo", "kind", "ann_flags", "tags"}
+	needed = {"repo": "repo", "kind": "kind", "flags": "ann_flags", "tags": "tags"}
+	if any(needed[key] not in have for key in filters):
+		return "0", []
+
+	conds: List[str] = []
+	params: list = []
+	if "repo" in filters:
+		conds.append(f"{alias}.repo = ?")
+		params.append(filters["repo"])
+	if "kind" in filters:
+		conds.append(f"COALESCE({alias}.kind, '{DEFAULT_KIND}') = ?")
+		params.append(filters["kind"])
+	for flag in filters.get("flags", ()):
+		conds.append(f"(' ' || COALESCE({alias}.ann_flags, '') || ' ') LIKE ? ESCAPE '\\'")
+		params.append(_like_word(flag))
+	for tag in filters.get("tags", ()):
+		conds.append(f"(' ' || lower(COALESCE({alias}.tags, '')) || ' ') LIKE ? ESCAPE '\\'")
+		params.append(_like_word(tag))
+	return " AND ".join(conds), params
@@ -0,0 +1,425 @@
+"""Pure NumPy flat vector store: an alternative to sqlite-vec for vec_search.
+
+Vectors live in <db>.<table>.npy, a float32 (n, dim) matrix of L2-normalized rows
+that is memory-mapped for search; <db>.<table>.meta.json holds the model, dim,
+the stat of the matrix it was written with and one (id, composer_id, turn_index,
+user_head, assistant_head, text_hash, repo, kind, ann_flags, tags) row per matrix
+row; the last four back metadata filters. A query
+is one matrix-vector product plus argpartition. Distances are L2 between unit
+vectors (sqrt(2 - 2 cos)), the same scale sqlite-vec reports.
+
+Selected with AGENT_VEC_BACKEND=numpy or --backend numpy; see index.vec_backend.
+An optional IVF index (see ivf) makes searches approximate and sublinear, and
+optional int8/binary codes (see quant) give a cheaper first pass before an exact
+rerank.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+from . import embed_pipeline as pipemod
+from . import embedders as embedmod
+from . import filters as filtersmod
+from . import ivf as ivfmod
+from . import quant as quantmod
+from .paths import expand_abs
+
+
+_FORMAT = 2
+_META_FIELDS = ("id", "composer_id", "turn_index", "user_head", "assistant_head", "text_hash", "repo", "kind", "ann_flags", "tags")
+
+
+def flat_paths(db_path: str, table: str = "vec_index") -> Tuple[str, str]:
+	"""(matrix .npy path, meta .json path) for a store named like a sqlite-vec DB + table."""
+	base = f"{expand_abs(db_path)}.{table}"
+	return base + ".npy", base + ".meta.json"
+
+
+def _unit(vec):
+	"""float32 copy of vec scaled to unit length (zero vectors unchanged)."""
+	import numpy as np
+
+	v = np.asarray(vec, dtype=np.float32)
+	n = float(np.linalg.norm(v))
+	return v / n if n > 0 else v
+
+
+def flat_exists(db_path: str, table: str = "vec_index") -> bool:
+	return all(os.path.exists(p) for p in flat_paths(db_path, table))
+
+
+class FlatVectors:
+	"""Read-only view of a flat store: mmap'd matrix plus meta rows; see open_flat_vectors."""
+
+	def __init__(self, matrix, meta: dict, key: tuple) -> None:
+		self.matrix = matrix
+		self.model = meta.get("model")
+		# What embedders.embedder_for_model needs besides the model (e.g. a fitted idf)
+		self.embedder_state: Optional[Dict] = meta.get("embedder_state")
+		self.dim = int(meta.get("dim") or 0)
+		self.rows: List[list] = meta.get("rows") or []
+		self.key = key
+		self._allowed: Dict[tuple, object] = {}
+
+	def __len__(self) -> int:
+		return len(self.rows)
+
+	def allowed(self, filters: Dict):
+		"""Sorted row ids passing a normalized filter; rows written before filters existed never pass."""
+		import numpy as np
+
+		fkey = tuple(sorted(filters.items()))
+		ids = self._allowed.get(fkey)
+		if ids is None:
+			if len(self._allowed) >= 32:
+				self._allowed.clear()
+			ids = np.fromiter(
+				(i for i, r in enumerate(self.rows) if len(r) >= 10 and filtersmod.fields_match(r[6], r[7], r[8], r[9], filters)),
+				dtype=np.int64,
+			)
+			self._allowed[fkey] = ids
+		return ids
+
+	def search_vector(self, vec, top_k: int = 10, ivf=None, nprobe: Optional[int] = None, quant=None, rerank: int = 8, allowed=None) -> List[Dict]:
+		"""Nearest rows to a unit vector, ascending by distance.
+
+		With an ivf index (see ivf.open_ivf) only its nprobe best lists are scanned.
+		With quantized codes (see quant.open_quantized) those rows are first cut to a
+		rerank * top_k shortlist, which is then scored exactly. allowed (sorted row
+		ids, see allowed()) restricts every stage; when the probed lists hold fewer
+		than top_k allowed rows, all allowed rows are scanned instead.
+		"""
+		import numpy as np
+
+		n = len(self.rows) if allowed is None else len(allowed)
+		k = min(max(0, int(top_k)), n)
+		if k == 0:
+			return []
+		q = np.asarray(vec, dtype=np.float32)
+		if q.shape != (self.dim,):
+			raise ValueError(f"query has dim {q.size}, store has {self.dim}")
+		cand = None
+		if ivf is not None and nprobe:
+			cand = ivf.candidates(q, nprobe)
+			if allowed is not None:
+				cand = np.intersect1d(cand, allowed, assume_unique=True)
+				if len(cand) < k:
+					cand = allowed
+		elif allowed is not None:
+			cand = allowed
+		if quant is not None:
+			cand = quant.shortlist(q, max(1, int(rerank)) * k, cand)
+		if cand is None:
+			scores = self.matrix @ q
+		else:
+			scores = self.matrix[cand] @ q
+		m = len(scores)
+		k = min(k, m)
+		top = np.argpartition(scores, m - k)[m - k:] if k < m else np.arange(m)
+		top = top[np.argsort(-scores[top], kind="stable")]
+		scores = scores[top]
+		if cand is not None:
+			top = cand[top]
+		out: List[Dict] = []
+		for i, score in zip(top.tolist(), scores.tolist()):
+			ident, cid, tix, uh, ah = self.rows[i][:5]
+			dist = float(np.sqrt(max(0.0, 2.0 - 2.0 * score)))
+			out.append({"id": ident, "composer_id": cid, "turn_index": tix, "user_head": uh, "assistant_head": ah, "distance": dist})
+		return out
+
+
+# Open stores by (matrix path); reused while neither file changes
+_OPEN: Dict[str, FlatVectors] = {}
+
+
+def open_flat_vectors(db_path: str, table: str = "vec_index") -> Optional[FlatVectors]:
+	"""The store for (db_path, table), or None if either file is missing or they disagree.
+
+	The meta records the (inode, size, mtime) of the matrix it was written with, so
+	a matrix swapped in without its meta (an interrupted _commit_store) is not opened.
+	"""
+	import numpy as np
+
+	npy, meta_path = flat_paths(db_path, table)
+	try:
+		st = os.stat(npy)
+		mst = os.stat(meta_path)
+	except OSError:
+		return None
+	key = (st.st_size, st.st_mtime_ns, mst.st_size, mst.st_mtime_ns)
+	cached = _OPEN.get(npy)
+	if cached is not None and cached.key == key:
+		return cached
+	_OPEN.pop(npy, None)
+	try:
+		with open(meta_path, "r", encoding="utf-8") as f:
+			meta = json.load(f)
+		if meta.get("format") != _FORMAT or meta.get("matrix") != _matrix_stamp(st):
+			return None
+		matrix = np.load(npy, mmap_mode="r")
+	except Exception:
+		return None
+	rows = meta.get("rows") or []
+	if matrix.dtype != np.float32 or matrix.ndim != 2 or matrix.shape[0] != len(rows) or (rows and matrix.shape[1] != int(meta.get("dim") or 0)):
+		return None
+	store = FlatVectors(matrix, meta, key)
+	_OPEN[npy] = store
+	return store
+
+
+def _matrix_stamp(st: os.stat_result) -> List[int]:
+	return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _new_matrix(db_path: str, table: str, n_rows: int, dim: int):
+	"""Writable float32 memmap for the next matrix of a store; a temp file until _commit_store."""
+	import numpy as np
+
+	tmp = flat_paths(db_path, table)[0] + ".tmp.npy"
+	return np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(n_rows, dim))
+
+
+def _discard_matrix(db_path: str, table: str) -> None:
+	try:
+		os.remove(flat_paths(db_path, table)[0] + ".tmp.npy")
+	except OSError:
+		pass
+
+
+def _commit_store(db_path: str, table: str, mat, model: str, rows: List[list], embedder_state: Optional[Dict] = None) -> None:
+	"""Flush mat (from _new_matrix) and swap it in with its meta; the meta is replaced last."""
+	npy, meta_path = flat_paths(db_path, table)
+	tmp = npy + ".tmp.npy"
+	dim = int(mat.shape[1])
+	mat.flush()
+	meta_tmp = meta_path + ".tmp"
+	with open(meta_tmp, "w", encoding="utf-8") as f:
+		# rename keeps the inode and mtime, so this is the stat of the matrix once swapped in
+		meta = {"format": _FORMAT, "model": model, "dim": dim, "matrix": _matrix_stamp(os.stat(tmp)), "fields": list(_META_FIELDS), "rows": rows}
+		if embedder_state:
+			meta["embedder_state"] = embedder_state
+		json.dump(meta, f, ensure_ascii=False)
+	_OPEN.pop(npy, None)
+	os.replace(tmp, npy)
+	os.replace(meta_tmp, meta_path)
+
+
+def _write_store(
+	db_path: str,
+	table: str,
+	model: str,
+	dim: int,
+	rows: List[list],
+	fill: Callable[[object], None],
+	embedder_state: Optional[Dict] = None,
+) -> None:
+	"""Write matrix then meta; fill(matrix) sets the rows of a writable memmap."""
+	mat = _new_matrix(db_path, table, len(rows), dim)
+	fill(mat)
+	_commit_store(db_path, table, mat, model, rows, embedder_state)
+
+
+def build_flat_embeddings(
+	db_path: str,
+	index_path: str,
+	table: str = "vec_index",
+	changed_only: bool = False,
+	stats: Optional[Dict[str, int]] = None,
+	concurrency: Optional[int] = None,
+	rpm: Optional[float] = None,
+	tpm: Optional[float] = None,
+) -> int:
+	"""Embed the JSONL index into a flat store; mirrors index.build_embeddings_sqlite.
+
+	With changed_only, rows whose text hash is unchanged keep their vectors without an
+	API call. Items no longer in the index are dropped. Returns inserted + updated.
+	"""
+	import re
+	import numpy as np
+	from . import index as indexmod
+
+	if not re.fullmatch(r"[A-Za-z0-9_]+", table or ""):
+		raise ValueError("invalid table name")
+
+	prev = open_flat_vectors(db_path, table)
+	# Fitting embedders (hash) learn their idf from this index once and keep it in the meta
+	embedder = embedmod.index_embedder(
+		embedmod.get_embedder(),
+		lambda: indexmod._index_embed_texts(index_path),
+		prev.model if prev is not None else None,
+		prev.embedder_state if prev is not None else None,
+	)
+	client = embedder.client()
+	model = embedder.model
+	prev_rows = {r[0]: i for i, r in enumerate(prev.rows)} if prev is not None else {}
+
+	counts = {"inserted": 0, "updated": 0, "skipped": 0, "skipped_empty": 0}
+	BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH", "16")))
+	limiter = pipemod.RateLimiter.from_env(rpm, tpm)
+
+	def _items():
+		"""(line number, ident, text to embed, item) for each item in the index."""
+		with open(expand_abs(index_path), "r", encoding="utf-8") as f:
+			for lineno, line in enumerate(f):
+				try:
+					obj = json.loads(line)
+				except Exception:
+					continue
+				if not isinstance(obj, dict):
+					continue
+				yield lineno, f"{obj.get('composer_id')}:{obj.get('turn_index')}", indexmod._item_embed_text(obj), obj
+
+	# First pass: one row per id in index order, a repeated id takes over its slot
+	# (last wins); each slot then either reuses a prev row or is embedded.
+	rows: List[list] = []
+	slots: Dict[str, int] = {}
+	last: List[int] = []
+	for lineno, ident, text, obj in _items():
+		if not text:
+			counts["skipped_empty"] += 1
+			continue
+		fields = filtersmod.item_fields(obj)
+		row = [ident, obj.get("composer_id"), obj.get("turn_index"), obj.get("user_head"), obj.get("assistant_head"), indexmod._embed_text_hash(model, text)]
+		row += [fields[col] for col in _META_FIELDS[6:]]
+		slot = slots.get(ident)
+		if slot is None:
+			slots[ident] = len(rows)
+			rows.append(row)
+			last.append(lineno)
+		else:
+			rows[slot] = row
+			last[slot] = lineno
+	reuse: Dict[int, int] = {}
+	if changed_only:
+		for slot, row in enumerate(rows):
+			p = prev_rows.get(row[0])
+			if p is not None and prev.rows[p][5] == row[5]:
+				reuse[slot] = p
+	counts["skipped"] = len(reuse)
+
+	def _batches():
+		b_texts: List[str] = []
+		b_slots: List[int] = []
+		for lineno, ident, text, _ in _items():
+			slot = slots.get(ident) if text else None
+			if slot is None or last[slot] != lineno or slot in reuse:
+				continue
+			b_texts.append(text)
+			b_slots.append(slot)
+			if len(b_texts) >= BATCH_SIZE:
+				yield b_texts, b_slots
+				b_texts, b_slots = [], []
+		if b_texts:
+			yield b_texts, b_slots
+
+	# Second pass: each batch goes straight into the new matrix, which is created
+	# once the first result gives the dimension
+	fresh: List[int] = []
+	out: List[object] = []
+
+	def _write(batch_slots, res) -> int:
+		for slot, data in zip(batch_slots, res.data):
+			vec = _unit(data.embedding)
+			if not out:
+				if reuse and prev.dim != vec.shape[0]:
+					raise ValueError(f"embedding dim changed from {prev.dim} to {vec.shape[0]}; rebuild without changed_only")
+				out.append(_new_matrix(db_path, table, len(rows), int(vec.shape[0])))
+			out[0][slot] = vec
+			fresh.append(slot)
+		return len(batch_slots)
+
+	try:
+		pipemod.run_pipeline(
+			_batches(),
+			lambda texts: pipemod.embed_with_retry(client, model, texts, limiter),
+			_write,
+			concurrency=concurrency or pipemod.default_concurrency(),
+		)
+		if not out:
+			out.append(_new_matrix(db_path, table, len(rows), int(prev.dim) if prev is not None else 0))
+		mat = out[0]
+		# Copy kept rows in chunks so a large store is never fully resident
+		dst = np.fromiter(reuse.keys(), dtype=np.int64, count=len(reuse))
+		src = np.fromiter(reuse.values(), dtype=np.int64, count=len(reuse))
+		for i in range(0, len(dst), 8192):
+			mat[dst[i:i + 8192]] = prev.matrix[src[i:i + 8192]]
+	except BaseException:
+		out.clear()
+		_discard_matrix(db_path, table)
+		raise
+	for slot in fresh:
+		counts["updated" if rows[slot][0] in prev_rows else "inserted"] += 1
+	counts["deleted"] = sum(1 for ident in prev_rows if ident not in slots)
+
+	prev_ivf = ivfmod.open_ivf(db_path, table, prev)
+	_commit_store(db_path, table, mat, model, rows, embedder.state())
+	_carry_ivf(db_path, table, prev_ivf, reuse, fresh)
+	kinds = quantmod.quantized_kinds(db_path, table)
+	if kinds and len(rows):
+		quantmod.build_quantized(db_path, table, kinds)
+	if stats is not None:
+		stats.update(counts)
+	if os.getenv("EMBED_VERBOSE"):
+		print(json.dumps(counts), file=sys.stderr)
+	return counts["inserted"] + counts["updated"]
+
+
+def _carry_ivf(db_path: str, table: str, prev_ivf, reuse: Dict[int, int], fresh: List[int]) -> None:
+	"""Keep an IVF index current after a rebuild: kept rows keep their lists, new rows are assigned."""
+	import numpy as np
+
+	path = ivfmod.ivf_path(db_path, table)
+	store = open_flat_vectors(db_path, table)
+	if prev_ivf is None or store is None or prev_ivf.centroids.shape[1] != store.dim:
+		if os.path.exists(path):
+			os.remove(path)
+		return
+	assign = np.zeros(len(store), dtype=np.int32)
+	for slot, p in reuse.items():
+		assign[slot] = prev_ivf.assign[p]
+	slots = np.asarray(sorted(fresh), dtype=np.int64)
+	for i in range(0, len(slots), 8192):
+		chunk = slots[i:i + 8192]
+		assign[chunk] = ivfmod.nearest_centroid(store.matrix[chunk], prev_ivf.centroids)
+	ivfmod.IVFIndex(prev_ivf.centroids, assign).save(path, store.key)
+
+
+def flat_search(
+	db_path: str,
+	table: str,
+	query: str,
+	top_k: int = 10,
+	nprobe: Optional[int] = None,
+	quant: Optional[str] = None,
+	rerank: Optional[int] = None,
+	filters: Optional[Dict] = None,
+) -> List[Dict]:
+	"""vec_search over a flat store; the query is embedded by the store's model (embedders.embed_query).
+
+	Uses the IVF index when one is current, scanning nprobe lists (default env
+	AGENT_VEC_NPROBE or 8); nprobe=0 forces an exact scan. quant ("int8" or
+	"binary", default env AGENT_VEC_QUANT) adds a quantized first pass whose
+	rerank * top_k shortlist (default env AGENT_VEC_RERANK or 8) is scored exactly;
+	"none" or codes that are missing or stale skip it. filters (see
+	filters.normalize_filters) restrict the candidates before any scoring.
+	"""
+	store = open_flat_vectors(db_path, table)
+	if store is None:
+		raise FileNotFoundError(f"no flat vector store at {flat_paths(db_path, table)[0]}")
+	if len(store) == 0:
+		return []
+	f_norm = filtersmod.normalize_filters(filters)
+	allowed = store.allowed(f_norm) if f_norm else None
+	if allowed is not None and len(allowed) == 0:
+		return []
+	if nprobe is None:
+		nprobe = ivfmod.default_nprobe()
+	ivf = ivfmod.open_ivf(db_path, table, store) if nprobe else None
+	kind = quantmod.default_kind() if quant is None else quant
+	codes = quantmod.open_quantized(db_path, table, store, kind) if kind else None
+	vec = embedmod.embed_query(query, model=store.model, state=store.embedder_state)
+	return store.search_vector(_unit(vec), top_k, ivf=ivf, nprobe=nprobe, quant=codes, rerank=rerank or quantmod.default_rerank(), allowed=allowed)
@@ -1,17 +1,25 @@
 from __future__ import annotations
 
+import hashlib
+import itertools
 import json
 import os
 import random
+import re
 import sys
-from typing import Dict, Iterable, List, Optional
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from . import db as dbmod
 from . import parser as parsermod
 from . import rag as ragmod
 from .paths import expand_abs, default_db_path
 from .embeddings import l2_normalize
-import llm_utils as llmmod
+from . import embed_pipeline as pipemod
+from . import embedders as embedmod
+from . import filters as filtersmod
+from . import inverted as invmod
+from . import offsets as offsetsmod
 
 
 def _load_sqlite_vec(conn) -> None:
@@ -54,7 +62,7 @@ def _load_sqlite_vec(conn) -> None:
 
 
 def _composer_ids(conn) -> Iterable[str]:
-	for k in dbmod.composer_data_keys(conn, limit=1000000):
+	for k in dbmod.iter_composer_data_keys(conn):
 		# keys like composerData:<uuid>
 		try:
 			cid = k.split(":", 1)[1]
@@ -64,45 +72,273 @@ def _composer_ids(conn) -> Iterable[str]:
 			continue
 
 
-def build_index(out_path: str, db_path: Optional[str] = None, limit_composers: Optional[int] = None, max_turns_per: Optional[int] = None) -> int:
+def _composer_items(conn, cid: str, max_turns_per: Optional[int] = None) -> List[Dict]:
+	"""Per-turn items for one composer, tagged with its repo hint."""
+	msgs = parsermod.reconstruct_conversation(conn, cid)
+	# Best-effort repo/workspace hint extraction
+	try:
+		repo_hint = parsermod.load_repo_hint(conn, cid)
+	except Exception:
+		repo_hint = None
+	items = ragmod.build_turn_items(msgs)
+	if max_turns_per is not None:
+		items = items[:max_turns_per]
+	if repo_hint:
+		for it in items:
+			it["repo"] = repo_hint
+	return items
+
+
+# Per-process source connection for build workers (set by _init_index_worker)
+_worker_conn = None
+
+
+def _init_index_worker(db_path: str) -> None:
+	global _worker_conn
+	_worker_conn = dbmod.connect_readonly(db_path)
+
+
+def _worker_composer_items(args) -> List[Dict]:
+	cid, max_turns_per = args
+	return _composer_items(_worker_conn, cid, max_turns_per)
+
+
+def _limited_composer_ids(conn, limit_composers: Optional[int] = None) -> Iterable[str]:
+	ids = _composer_ids(conn)
+	if limit_composers is not None:
+		ids = itertools.islice(ids, max(0, int(limit_composers)))
+	return ids
+
+
+def _iter_composer_items(
+	conn,
+	db_path: str,
+	ids: Iterable[str],
+	max_turns_per: Optional[int] = None,
+	workers: Optional[int] = None,
+) -> Iterable[List[Dict]]:
+	"""Yield the items of each composer in ids, in order.
+
+	With workers > 1, composers are split across a process pool; each worker opens
+	its own read-only connection to db_path and results are yielded in submission
+	order, so the output is identical to the serial path over conn.
+	"""
+	if not workers or workers <= 1:
+		for cid in ids:
+			yield _composer_items(conn, cid, max_turns_per)
+		return
+	ids = list(ids)
+	if not ids:
+		return
+	from concurrent.futures import ProcessPoolExecutor
+
+	workers = min(int(workers), len(ids))
+	chunksize = max(1, len(ids) // (workers * 4))
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_index_worker, initargs=(db_path,)) as ex:
+		for items in ex.map(_worker_composer_items, [(cid, max_turns_per) for cid in ids], chunksize=chunksize):
+			yield items
+
+
+# Bump when the per-turn item format changes so manifests from older builds are ignored
+_INDEX_FORMAT = 2
+
+
+def index_manifest_path(index_path: str) -> str:
+	"""Sidecar recording, per composer, a content hash, turn count and byte range in the JSONL."""
+	return expand_abs(index_path) + ".manifest.json"
+
+
+def _composer_stats(conn, cid: str) -> str:
+	"""Cheap change marker for a composer, aggregated inside SQLite: its value's length
+	and its bubbles' count and total length. Catches appended, removed and resized
+	bubbles without reading any value; same-length edits need _composer_hash.
+	"""
+	n, size = dbmod.kv_prefix_stats(conn, f"bubbleId:{cid}:")
+	return f"{dbmod.kv_value_length(conn, f'composerData:{cid}')}:{n}:{size}"
+
+
+def _composer_hash(conn, cid: str) -> str:
+	"""Content hash of a composer's value and its bubble rows (one key-range scan)."""
+	h = hashlib.sha256()
+	h.update(dbmod.kv_value(conn, f"composerData:{cid}") or b"")
+	for key, val in dbmod.kv_prefix_items(conn, f"bubbleId:{cid}:"):
+		h.update(b"\0" + key.encode("utf-8") + b"\0")
+		h.update(val if isinstance(val, bytes) else str(val).encode("utf-8"))
+	return h.hexdigest()
+
+
+def _load_index_manifest(out_path: str, max_turns_per: Optional[int]) -> Optional[Dict]:
+	"""Manifest for out_path if it still describes that file and the same build options."""
+	try:
+		with open(index_manifest_path(out_path), "r", encoding="utf-8") as f:
+			manifest = json.load(f)
+		st = os.stat(out_path)
+	except Exception:
+		return None
+	if (
+		not isinstance(manifest, dict)
+		or manifest.get("format") != _INDEX_FORMAT
+		or manifest.get("max_turns_per") != max_turns_per
+		or manifest.get("index_size") != st.st_size
+		or manifest.get("index_mtime_ns") != st.st_mtime_ns
+		or not isinstance(manifest.get("composers"), dict)
+	):
+		return None
+	return manifest
+
+
+def _write_index_manifest(out_path: str, max_turns_per: Optional[int], composers: Dict[str, Dict]) -> None:
+	st = os.stat(out_path)
+	manifest = {
+		"format": _INDEX_FORMAT,
+		"max_turns_per": max_turns_per,
+		"index_size": st.st_size,
+		"index_mtime_ns": st.st_mtime_ns,
+		"composers": composers,
+	}
+	path = index_manifest_path(out_path)
+	tmp = path + ".tmp"
+	with open(tmp, "w", encoding="utf-8") as f:
+		json.dump(manifest, f)
+	os.replace(tmp, path)
+
+
+def build_index(
+	out_path: str,
+	db_path: Optional[str] = None,
+	limit_composers: Optional[int] = None,
+	max_turns_per: Optional[int] = None,
+	workers: Optional[int] = None,
+	incremental: bool = False,
+) -> int:
 	"""Write a JSONL index of per-turn items for RAG over all chats.
 
 	Each line: {composer_id, turn_index, user_head, assistant_head, annotations, user, assistant}
+	workers > 1 builds composers in a process pool; the file is byte-identical to a serial build.
+
+	A manifest sidecar (index_manifest_path) records each composer's content hash,
+	a cheap SQL aggregate of its row lengths, its turn count and its byte range. With
+	incremental=True, a composer whose aggregate changed is rebuilt without hashing;
+	otherwise its rows are hashed and compared. Only new or changed composers are
+	rebuilt; unchanged segments are copied from the previous file, so the result
+	is byte-identical to a full rebuild. If nothing changed the JSONL is left untouched.
+
+	An inverted-index sidecar (inverted.inverted_index_path) is written alongside for
+	search_index and lookups by id or composer (offsets.open_offsets_index);
+	incremental builds only process new or changed composers.
 	"""
-	conn = dbmod.connect_readonly(expand_abs(db_path or default_db_path()))
+	src_path = expand_abs(db_path or default_db_path())
+	conn = dbmod.connect_readonly(src_path)
 	out_path = expand_abs(out_path)
 	os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-	count = 0
-	with open(out_path, "w", encoding="utf-8") as f:
-		for i, cid in enumerate(_composer_ids(conn)):
-			if limit_composers is not None and i >= limit_composers:
-				break
-			msgs = parsermod.reconstruct_conversation(conn, cid)
-			# Best-effort repo/workspace hint extraction
-			try:
-				composer_obj = parsermod.load_composer(conn, cid)
-				repo_hint = parsermod.extract_repo_hint(composer_obj)
-			except Exception:
-				repo_hint = None
-			items = ragmod.build_turn_items(msgs)
-			if max_turns_per is not None:
-				items = items[:max_turns_per]
-			for it in items:
-				if repo_hint:
-					it["repo"] = repo_hint
-				f.write(json.dumps(it, ensure_ascii=False) + "\n")
-				count += 1
-	# Close DB connection
 	try:
-		conn.close()
-	except Exception:
-		pass
+		ids = list(_limited_composer_ids(conn, limit_composers))
+		manifest = _load_index_manifest(out_path, max_turns_per) if incremental else None
+		# Full builds skip fingerprinting; their manifest entries never match, so the next
+		# incremental build rebuilds everything once
+		stats = {cid: _composer_stats(conn, cid) if incremental else None for cid in ids}
+		hashes: Dict[str, Optional[str]] = {}
+		old = manifest["composers"] if manifest else {}
+		changed = []
+		for cid in ids:
+			e = old.get(cid) or {}
+			if manifest is None or e.get("stats") != stats[cid]:
+				changed.append(cid)
+				continue
+			hashes[cid] = _composer_hash(conn, cid)
+			if e.get("hash") != hashes[cid]:
+				changed.append(cid)
+		if manifest is not None and not changed and list(old) == ids:
+			# Up to date: refresh the manifest so callers can tell the index was verified
+			if invmod.open_inverted_index(out_path) is None:
+				invmod.build_inverted_index(out_path)
+			_write_index_manifest(out_path, max_turns_per, old)
+			return sum(int(e.get("turns") or 0) for e in old.values())
+		if incremental:
+			# Hashed before reading, so an edit racing the build is picked up next time
+			for cid in changed:
+				if cid not in hashes:
+					hashes[cid] = _composer_hash(conn, cid)
+		if os.getenv("CURSOR_VERBOSE"):
+			print(f"Index: rebuilding {len(changed)} of {len(ids)} composers", file=sys.stderr)
+		fresh = iter(_iter_composer_items(conn, src_path, changed, max_turns_per, workers))
+		# Unchanged composers reuse their entries from the previous sidecar when it is current
+		prev_inv = invmod.open_inverted_index(out_path) if manifest else None
+		inv = invmod.InvertedIndexBuilder()
+		changed_set = set(changed)
+		entries: Dict[str, Dict] = {}
+		count = 0
+		offset = 0
+		tmp = out_path + ".tmp"
+		with open(tmp, "wb") as f, open(out_path if manifest else os.devnull, "rb") as prev:
+			for cid in ids:
+				if cid in changed_set:
+					items = next(fresh)
+					turns = len(items)
+					lines = []
+					pos = offset
+					for it in items:
+						line = (json.dumps(it, ensure_ascii=False) + "\n").encode("utf-8")
+						inv.add_item(it, pos, len(line) - 1)
+						lines.append(line)
+						pos += len(line)
+					data = b"".join(lines)
+				else:
+					e = old[cid]
+					turns = int(e["turns"])
+					prev.seek(int(e["offset"]))
+					data = prev.read(int(e["length"]))
+					if prev_inv is None:
+						inv.add_lines(data, offset)
+					else:
+						inv.copy_from(prev_inv, int(e["offset"]), len(data), offset)
+				f.write(data)
+				entries[cid] = {"hash": hashes.get(cid), "stats": stats[cid], "turns": turns, "offset": offset, "length": len(data)}
+				offset += len(data)
+				count += turns
+		os.replace(tmp, out_path)
+		inv.write(out_path)
+		_write_index_manifest(out_path, max_turns_per, entries)
+	finally:
+		# Close DB connection
+		try:
+			conn.close()
+		except Exception:
+			pass
 	return count
 
 
-def sample_index(index_path: str, n: int) -> List[Dict]:
-	"""Reservoir sample n items from a JSONL index without loading it all."""
+# Strata for sample_index(stratify=...)
+_SAMPLE_STRATA = ("composer", "tag")
+
+
+def sample_index(index_path: str, n: int, seed: Optional[int] = None, stratify: Optional[str] = None) -> List[Dict]:
+	"""Sample n distinct items from a JSONL index, decoding only the chosen records.
+
+	With a current index sidecar items are picked uniformly by ordinal. Otherwise
+	random byte offsets are re-synced to the enclosing line; a line of length L is
+	kept with probability shortest/L, which keeps the sample close to uniform
+	instead of favouring long turns. Small indexes (or too many misses) fall back
+	to a reservoir sample over the whole file.
+
+	seed makes the sample reproducible. stratify="composer" or "tag" spreads picks
+	round-robin over chats or annotation tags (untagged items, and items without
+	user/assistant text, form one stratum), drawing at random within each.
+	"""
 	index_path = expand_abs(index_path)
+	n = max(0, int(n))
+	rng = random.Random(seed)
+	if stratify:
+		if stratify not in _SAMPLE_STRATA:
+			raise ValueError(f"stratify must be one of {', '.join(_SAMPLE_STRATA)}")
+		return _sample_stratified(index_path, n, rng, stratify)
+	offs = offsetsmod.open_offsets_index(index_path)
+	if offs is not None:
+		picks = rng.sample(range(len(offs)), min(n, len(offs)))
+		return [obj for obj in (offs.item_at(i) for i in picks) if obj is not None]
+	sampled = _sample_by_offset(index_path, n, rng)
+	if sampled is not None:
+		return sampled
 	reservoir: List[Dict] = []
 	with open(index_path, "r", encoding="utf-8") as f:
 		for t, line in enumerate(f, start=1):
@@ -113,14 +349,165 @@ def sample_index(index_path: str, n: int) -> List[Dict]:
 			if len(reservoir) < n:
 				reservoir.append(obj)
 			else:
-				j = random.randint(1, t)
+				j = rng.randint(1, t)
 				if j <= n:
 					reservoir[j - 1] = obj
 	return reservoir
 
 
-def search_index(index_path: str, query: str, k: int = 10) -> List[Dict]:
+def _sample_by_offset(index_path: str, n: int, rng: random.Random, probes: int = 64) -> Optional[List[Dict]]:
+	"""Rejection-sample lines at random byte offsets; None when a full scan is the better deal."""
+	import mmap
+
+	size = os.path.getsize(index_path)
+	if n == 0 or size == 0:
+		return []
+	with open(index_path, "rb") as f:
+		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def _line_at(pos: int) -> tuple:
+		start = mm.rfind(b"\n", 0, pos) + 1
+		end = mm.find(b"\n", pos)
+		return start, (size if end == -1 else end)
+
+	try:
+		# Pilot probes: a random offset hits a line with probability L/size, so the
+		# mean of 1/L estimates items per byte
+		lengths = [e - s for s, e in (_line_at(rng.randrange(size)) for _ in range(probes))]
+		lengths = [L for L in lengths if L > 0]
+		if not lengths or size * sum(1.0 / L for L in lengths) / len(lengths) < 4 * n:
+			return None
+		shortest = min(lengths)
+		picked: Dict[int, Dict] = {}
+		for _ in range(400 * n + 400):
+			if len(picked) >= n:
+				break
+			start, end = _line_at(rng.randrange(size))
+			length = end - start
+			if length <= 0 or start in picked:
+				continue
+			if length < shortest:
+				# Earlier picks were accepted against a looser bound; redraw them
+				shortest = length
+				picked.clear()
+			if rng.random() * length > shortest:
+				continue
+			try:
+				obj = json.loads(mm[start:end])
+			except Exception:
+				continue
+			if isinstance(obj, dict):
+				picked[start] = obj
+		return list(picked.values()) if len(picked) >= n else None
+	finally:
+		mm.close()
+
+
+def _pick_stratified(strata: Dict[str, List[int]], n: int, rng: random.Random) -> List[int]:
+	"""Round-robin over strata in random order, drawing without replacement within each."""
+	pools = {k: list(strata[k]) for k in sorted(strata)}
+	keys = list(pools)
+	rng.shuffle(keys)
+	picked: List[int] = []
+	seen = set()
+	while len(picked) < n and keys:
+		for key in list(keys):
+			pool = pools[key]
+			choice = None
+			while pool and choice is None:
+				j = rng.randrange(len(pool))
+				pool[j], pool[-1] = pool[-1], pool[j]
+				x = pool.pop()
+				if x not in seen:
+					choice = x
+			if choice is None:
+				keys.remove(key)
+				continue
+			seen.add(choice)
+			picked.append(choice)
+			if len(picked) >= n:
+				break
+	return picked
+
+
+def _sample_stratified(index_path: str, n: int, rng: random.Random, stratify: str) -> List[Dict]:
+	if stratify == "composer":
+		offs = offsetsmod.open_offsets_index(index_path)
+		if offs is not None:
+			strata = {cid: offs.composer_ordinals(cid) for cid in offs.composer_ids()}
+			return [obj for obj in (offs.item_at(i) for i in _pick_stratified(strata, n, rng)) if obj is not None]
+	else:
+		inv = invmod.open_inverted_index(index_path)
+		if inv is not None:
+			strata = inv.tag_postings()
+			tagged = set().union(*strata.values()) if strata else set()
+			untagged = [i for i in range(inv.n_items) if i not in tagged]
+			if untagged:
+				strata[""] = untagged
+			return [obj for obj in (inv.item(i) for i in _pick_stratified(strata, n, rng)) if obj is not None]
+	# No sidecar: one pass to learn each line's stratum, then decode only the picks
+	locs: List[tuple] = []
+	strata = {}
+	with open(index_path, "rb") as f:
+		pos = 0
+		for line in f:
+			try:
+				obj = json.loads(line)
+			except Exception:
+				obj = None
+			if isinstance(obj, dict):
+				if stratify == "composer":
+					keys = [str(obj.get("composer_id"))]
+				else:
+					keys = sorted(set(invmod.item_tags(obj))) or [""]
+				for key in keys:
+					strata.setdefault(key, []).append(len(locs))
+				locs.append((pos, len(line)))
+			pos += len(line)
+		out: List[Dict] = []
+		for i in _pick_stratified(strata, n, rng):
+			f.seek(locs[i][0])
+			out.append(json.loads(f.read(locs[i][1])))
+	return out
+
+
+def get_index_items(index_path: str, ids: Iterable[str]) -> Dict[str, Dict]:
+	"""Items for the given "<composer_id>:<turn_index>" ids, keyed by id.
+
+	Seeks through the index sidecar when it is current; otherwise scans the JSONL
+	once (later duplicates win). Unknown ids are omitted.
+	"""
 	index_path = expand_abs(index_path)
+	wanted = set(ids)
+	offs = offsetsmod.open_offsets_index(index_path)
+	if offs is not None:
+		return offs.get_many(wanted)
+	out: Dict[str, Dict] = {}
+	with open(index_path, "r", encoding="utf-8") as f:
+		for line in f:
+			try:
+				obj = json.loads(line)
+			except Exception:
+				continue
+			ident = offsetsmod.item_id(obj)
+			if ident in wanted:
+				out[ident] = obj
+	return out
+
+
+def search_index(index_path: str, query: str, k: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+	"""Top-k items by token-overlap score; seeks via the inverted-index sidecar when current.
+
+	filters (see filters.normalize_filters) restricts results by repo, kind, flags and tags.
+	"""
+	index_path = expand_abs(index_path)
+	f_norm = filtersmod.normalize_filters(filters)
+	accept = (lambda obj: filtersmod.item_matches(obj, f_norm)) if f_norm else None
+	inv = invmod.open_inverted_index(index_path)
+	if inv is not None:
+		hits = inv.search(query, k, accept=accept)
+		if hits is not None:
+			return [{"score": s, **obj} for s, obj in hits]
 	from .rag import _score  # reuse simple scorer
 	buf: List[Dict] = []
 	with open(index_path, "r", encoding="utf-8") as f:
@@ -129,22 +516,10 @@ def search_index(index_path: str, query: str, k: int = 10) -> List[Dict]:
 				obj = json.loads(line)
 			except Exception:
 				continue
+			if accept is not None and not accept(obj):
+				continue
 			base_text = (obj.get("user", "") + "\n" + obj.get("assistant", "")).strip()
-			ann = obj.get("annotations") or {}
-			meta_bits = []
-			for meta_key in [
-				"contains_design",
-				"contains_preference",
-				"contains_learning",
-				"unfinished_thread",
-				"has_useful_output",
-			]:
-				if ann.get(meta_key):
-					meta_bits.append(meta_key)
-			for t in (ann.get("tags") or []):
-				if isinstance(t, str) and t:
-					meta_bits.append(f"tag:{t}")
-			meta_text = (" ".join(meta_bits)).strip()
+			meta_text = _annotation_meta_text(obj.get("annotations") or {})
 			text = (base_text + ("\n" + meta_text if meta_text else "")).strip()
 			s = _score(query, text)
 			if s > 0:
@@ -153,201 +528,651 @@ def search_index(index_path: str, query: str, k: int = 10) -> List[Dict]:
 	return buf[:k]
 
 
-def build_embeddings_sqlite(db_path: str, index_path: str, table: str = "vec_index", changed_only: bool = False) -> int:
+# Annotation booleans folded into searchable/embedded text as bare tokens
+_ANN_META_KEYS = (
+	"contains_design",
+	"contains_preference",
+	"contains_learning",
+	"unfinished_thread",
+	"has_useful_output",
+)
+
+
+def _annotation_meta_text(ann) -> str:
+	"""Annotation flags and `tag:<t>` tokens as one space-separated string."""
+	if not isinstance(ann, dict):
+		return ""
+	meta_bits = [k for k in _ANN_META_KEYS if ann.get(k)]
+	for t in (ann.get("tags") or []):
+		if isinstance(t, str) and t:
+			meta_bits.append(f"tag:{t}")
+	return (" ".join(meta_bits)).strip()
+
+
+def _item_embed_text(obj: Dict) -> str:
+	"""Text embedded for a JSONL index item: heads (or full turns) plus annotation meta."""
+	uh = obj.get("user_head") or obj.get("user") or ""
+	ah = obj.get("assistant_head") or obj.get("assistant") or ""
+	meta_text = _annotation_meta_text(obj.get("annotations") or {})
+	return (uh + "\n" + ah + ("\n" + meta_text if meta_text else "")).strip()[:1200]
+
+
+def _index_embed_texts(index_path: str) -> Iterator[str]:
+	"""Non-empty embed texts of a JSONL index, in file order (for fitting embedders)."""
+	with open(expand_abs(index_path), "r", encoding="utf-8") as f:
+		for line in f:
+			try:
+				obj = json.loads(line)
+			except Exception:
+				continue
+			text = _item_embed_text(obj) if isinstance(obj, dict) else ""
+			if text:
+				yield text
+
+
+def _embed_text_hash(model: str, text: str) -> str:
+	"""Hash stored in <table>_meta.text_hash; a changed model or text forces a re-embed."""
+	return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+# Filterable columns (see filters) kept alongside items and vector meta rows
+_FILTER_COLUMNS = ("repo", "kind", "ann_flags", "tags")
+
+
+def _ensure_vec_meta_columns(c, table: str) -> None:
+	# Meta tables created before text hashing or metadata filters lack the columns
+	cols = [r[1] for r in c.execute(f"PRAGMA table_info({table}_meta)").fetchall()]
+	for col in ("text_hash",) + _FILTER_COLUMNS:
+		if col not in cols:
+			c.execute(f"ALTER TABLE {table}_meta ADD COLUMN {col} TEXT")
+
+
+def _refresh_vec_meta_filters(c, table: str, rows: List[tuple]) -> None:
+	"""Rewrite filter columns for skipped (unchanged-text) rows; rows are (repo, kind, ann_flags, tags, vec_rowid)."""
+	if rows:
+		c.executemany(
+			f"UPDATE {table}_meta SET repo=?1, kind=?2, ann_flags=?3, tags=?4 WHERE vec_rowid=?5 "
+			f"AND (repo IS NOT ?1 OR kind IS NOT ?2 OR ann_flags IS NOT ?3 OR tags IS NOT ?4)",
+			rows,
+		)
+
+
+def _load_vec_meta_state(c, table: str) -> Dict[str, tuple]:
+	"""Map id -> (vec_rowid, text_hash) for every row in <table>_meta, in one query."""
+	return {r[0]: (int(r[1]), r[2]) for r in c.execute(f"SELECT id, vec_rowid, text_hash FROM {table}_meta")}
+
+
+def _delete_vec_rows(c, table: str, rowids: List[int]) -> int:
+	if not rowids:
+		return 0
+	c.executemany(f"DELETE FROM {table} WHERE rowid=?", [(r,) for r in rowids])
+	c.executemany(f"DELETE FROM {table}_meta WHERE vec_rowid=?", [(r,) for r in rowids])
+	return len(rowids)
+
+
+class _VecMetaUpserter:
+	"""Batched upserts into a sqlite-vec table and its <table>_meta sidecar.
+
+	The id -> vec_rowid map is loaded once up front (see _load_vec_meta_state) and
+	kept current, so a batch needs no lookups: new rows get explicit rowids and
+	each batch is two executemany calls per table inside the caller's transaction.
+	"""
+
+	def __init__(self, c, table: str, existing: Dict[str, tuple]):
+		self.c = c
+		self.table = table
+		_ensure_vec_meta_columns(c, table)
+		self.rowids: Dict[str, int] = {ident: rowid for ident, (rowid, _) in existing.items()}
+		row = c.execute(f"SELECT COALESCE(MAX(vec_rowid), 0) FROM {table}_meta").fetchone()
+		self.next_rowid = int(row[0]) + 1
+
+	def write(self, batch_meta: List[tuple], res) -> tuple:
+		"""Upsert one embedding response; batch_meta holds (id, meta) pairs aligned with res.data.
+
+		Returns (inserted, updated).
+		"""
+		import sqlite3
+		import array
+
+		ins_vec: List[tuple] = []
+		ins_meta: List[tuple] = []
+		upd_vec: List[tuple] = []
+		upd_meta: List[tuple] = []
+		for (ident, meta), data in zip(batch_meta, res.data):
+			vec = l2_normalize(list(data.embedding))
+			blob = sqlite3.Binary(array.array('f', vec).tobytes())
+			fields = (meta.get("composer_id"), meta.get("turn_index"), meta.get("user_head"), meta.get("assistant_head"), meta.get("text_hash")) + tuple(meta.get(col) for col in _FILTER_COLUMNS)
+			rowid = self.rowids.get(ident)
+			if rowid is None:
+				rowid = self.next_rowid
+				self.next_rowid += 1
+				self.rowids[ident] = rowid
+				ins_vec.append((rowid, blob))
+				ins_meta.append((rowid, ident) + fields)
+			else:
+				upd_vec.append((blob, rowid))
+				upd_meta.append(fields + (rowid,))
+		t = self.table
+		if ins_vec:
+			self.c.executemany(f"INSERT INTO {t}(rowid, embedding) VALUES(?, ?)", ins_vec)
+			self.c.executemany(
+				f"INSERT INTO {t}_meta(vec_rowid, id, composer_id, turn_index, user_head, assistant_head, text_hash, repo, kind, ann_flags, tags) VALUES(?,?,?,?,?,?,?,?,?,?,?)",
+				ins_meta,
+			)
+		if upd_vec:
+			self.c.executemany(f"UPDATE {t} SET embedding=? WHERE rowid=?", upd_vec)
+			self.c.executemany(
+				f"UPDATE {t}_meta SET composer_id=?, turn_index=?, user_head=?, assistant_head=?, text_hash=?, repo=?, kind=?, ann_flags=?, tags=? WHERE vec_rowid=?",
+				upd_meta,
+			)
+		return len(ins_meta), len(upd_meta)
+
+
+VEC_BACKENDS = ("sqlite-vec", "numpy")
+
+
+def vec_backend(backend: Optional[str] = None, db_path: Optional[str] = None, table: str = "vec_index") -> str:
+	"""Resolve the vector store: explicit backend, else env AGENT_VEC_BACKEND, else auto.
+
+	Auto picks the NumPy flat store (see flatvec) when one exists for (db_path, table)
+	and no SQLite DB does, and sqlite-vec otherwise.
+	"""
+	name = (backend or os.getenv("AGENT_VEC_BACKEND") or "auto").strip().lower()
+	if name in ("numpy", "flat"):
+		return "numpy"
+	if name in ("sqlite-vec", "sqlite_vec", "sqlite"):
+		return "sqlite-vec"
+	if name != "auto":
+		raise ValueError(f"unknown vector backend: {name} (expected one of {', '.join(VEC_BACKENDS)})")
+	if db_path and not os.path.exists(expand_abs(db_path)):
+		from . import flatvec as flatmod
+		if flatmod.flat_exists(db_path, table):
+			return "numpy"
+	return "sqlite-vec"
+
+
+def vec_store_file(db_path: str, table: str = "vec_index", backend: Optional[str] = None) -> str:
+	"""File whose existence and mtime stand for the vector store (SQLite DB or flat .npy)."""
+	if vec_backend(backend, db_path, table) == "numpy":
+		from . import flatvec as flatmod
+		return flatmod.flat_paths(db_path, table)[0]
+	return expand_abs(db_path)
+
+
+def _vec_table_embedder(c, table: str, texts: Callable[[], Iterable[str]]) -> Tuple[embedmod.Embedder, int]:
+	"""(embedder, dim) for building a sqlite-vec table, recorded in <table>_dims.
+
+	Fitting embedders (hash) learn their idf from texts() once and keep it in the
+	state column; a changed model or state is written back so vec_search embeds
+	queries the way the rows were embedded. The dimension is probed on first build.
+	"""
+	# Use a table name unlikely to conflict with sqlite-vec internals
+	c.execute(f"CREATE TABLE IF NOT EXISTS {table}_dims(model TEXT, dim INTEGER)")
+	if "state" not in {r[1] for r in c.execute(f"PRAGMA table_info({table}_dims)")}:
+		c.execute(f"ALTER TABLE {table}_dims ADD COLUMN state TEXT")
+	info = None
+	try:
+		info = c.execute(f"SELECT model, dim, state FROM {table}_dims LIMIT 1").fetchone()
+	except Exception:
+		info = None
+	prev_model, prev_state = _vec_dims_model(info)
+	embedder = embedmod.index_embedder(embedmod.get_embedder(), texts, prev_model, prev_state)
+	model = embedder.model
+	state = embedder.state()
+	if info and info[1]:
+		dim = int(info[1])
+		if (prev_model, prev_state) != (model, state):
+			c.execute(f"UPDATE {table}_dims SET model = ?, state = ?", (model, json.dumps(state) if state else None))
+		return embedder, dim
+	probe = embedder.client().embeddings.create(model=model, input=["dimension_probe"])
+	dim = len(probe.data[0].embedding)
+	try:
+		c.execute(f"DELETE FROM {table}_dims")
+		c.execute(f"INSERT INTO {table}_dims(model, dim, state) VALUES(?,?,?)", (model, dim, json.dumps(state) if state else None))
+	except Exception:
+		# As a last resort, create the vec table without caching the dimension
+		pass
+	return embedder, dim
+
+
+def build_embeddings_sqlite(
+	db_path: str,
+	index_path: str,
+	table: str = "vec_index",
+	changed_only: bool = False,
+	stats: Optional[Dict[str, int]] = None,
+	concurrency: Optional[int] = None,
+	rpm: Optional[float] = None,
+	tpm: Optional[float] = None,
+	commit_every: int = 2000,
+	backend: Optional[str] = None,
+) -> int:
 	"""Create a SQLite+sqlite-vec DB and populate embeddings for items in the JSONL index.
 
 	This expects the sqlite-vec extension to be available; if not, it will raise at runtime.
+	With changed_only, items whose embedded text hash matches <table>_meta.text_hash are
+	skipped without an API call. Rows whose ids are no longer in the index are deleted.
+	If given, stats is filled with inserted/updated/skipped/skipped_empty/deleted counts.
+
+	Embedding requests run `concurrency` at a time (env EMBED_CONCURRENCY, default 4)
+	under optional rpm/tpm limits (env EMBED_RPM / EMBED_TPM) while this thread
+	writes finished batches, committing every commit_every rows (see embed_pipeline).
+
+	backend (or env AGENT_VEC_BACKEND) "numpy" writes a flat .npy store instead; see
+	vec_backend and flatvec.build_flat_embeddings.
 	"""
 	import sqlite3
-	import array
 	import re
-	import time
 
 	# Validate table name to avoid SQL injection in DDL/DML
 	if not re.fullmatch(r"[A-Za-z0-9_]+", table or ""):
 		raise ValueError("invalid table name")
+	if vec_backend(backend, db_path, table) == "numpy":
+		from . import flatvec as flatmod
+		return flatmod.build_flat_embeddings(db_path, index_path, table, changed_only=changed_only, stats=stats, concurrency=concurrency, rpm=rpm, tpm=tpm)
 
 	conn = sqlite3.connect(expand_abs(db_path))
 	conn.enable_load_extension(True)
 	_load_sqlite_vec(conn)
 
 	c = conn.cursor()
-	# Determine embedding dimension dynamically from the selected model, cached in a side table
-	client = llmmod.require_client()
-	model = os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
-	# Use a table name unlikely to conflict with sqlite-vec internals
-	c.execute(f"CREATE TABLE IF NOT EXISTS {table}_dims(model TEXT, dim INTEGER)")
-	info = None
-	try:
-		info = c.execute(f"SELECT model, dim FROM {table}_dims LIMIT 1").fetchone()
-	except Exception:
-		info = None
-	if info and info[1]:
-		dim = int(info[1])
-	else:
-		try:
-			probe = client.embeddings.create(model=model, input=["dimension_probe"])
-			dim = len(probe.data[0].embedding)
-			c.execute(f"DELETE FROM {table}_dims")
-			c.execute(f"INSERT INTO {table}_dims(model, dim) VALUES(?,?)", (model, dim))
-		except Exception:
-			# As a last resort, fall back to creating the vec table without caching
-			probe = client.embeddings.create(model=model, input=["dimension_probe"])
-			dim = len(probe.data[0].embedding)
+	embedder, dim = _vec_table_embedder(c, table, lambda: _index_embed_texts(index_path))
+	client = embedder.client()
+	model = embedder.model
 	c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING vec0(embedding float[{dim}])")
-	c.execute(f"CREATE TABLE IF NOT EXISTS {table}_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT)")
+	c.execute(
+		f"CREATE TABLE IF NOT EXISTS {table}_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, "
+		f"user_head TEXT, assistant_head TEXT, text_hash TEXT, repo TEXT, kind TEXT, ann_flags TEXT, tags TEXT)"
+	)
+	_ensure_vec_meta_columns(c, table)
+	existing = _load_vec_meta_state(c, table)
+	seen: set = set()
+	refresh: List[tuple] = []
 
-	# Embed items
-	inserted = 0
-	updated = 0
-	skipped_empty = 0
-	with open(expand_abs(index_path), "r", encoding="utf-8") as f:
-		BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH", "16")))
-		batch_ids: List[str] = []
-		batch_texts: List[str] = []
-		batch_meta: List[Dict] = []
-
-		def _embed_with_retry(inputs: List[str]):
-			retries = 4
-			delay = 1.0
-			for attempt in range(retries + 1):
+	# Embed items: reader (this generator) -> concurrent requests -> writer (this thread)
+	counts = {"inserted": 0, "updated": 0, "skipped": 0, "skipped_empty": 0}
+	BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH", "16")))
+	limiter = pipemod.RateLimiter.from_env(rpm, tpm)
+
+	def _batches():
+		b_texts: List[str] = []
+		b_meta: List[tuple] = []
+		with open(expand_abs(index_path), "r", encoding="utf-8") as f:
+			for line in f:
 				try:
-					return client.embeddings.create(model=model, input=inputs)
-				except Exception as e:
-					if attempt >= retries:
-						raise
-					if os.getenv("EMBED_VERBOSE"):
-						print(f"embed batch failed: {e}; retry in {delay:.1f}s", file=sys.stderr)
-					time.sleep(delay)
-					delay *= 1.6
+					obj = json.loads(line)
+				except Exception:
+					continue
+				ident = f"{obj.get('composer_id')}:{obj.get('turn_index')}"
+				text = _item_embed_text(obj)
+				if not text:
+					counts["skipped_empty"] += 1
+					continue
+				seen.add(ident)
+				text_hash = _embed_text_hash(model, text)
+				fields = filtersmod.item_fields(obj)
+				if changed_only and ident in existing and existing[ident][1] == text_hash:
+					counts["skipped"] += 1
+					refresh.append(tuple(fields[col] for col in _FILTER_COLUMNS) + (existing[ident][0],))
+					continue
+				b_texts.append(text)
+				b_meta.append((ident, {**obj, **fields, "text_hash": text_hash}))
+				if len(b_texts) >= BATCH_SIZE:
+					yield b_texts, b_meta
+					b_texts, b_meta = [], []
+		if b_texts:
+			yield b_texts, b_meta
 
-		for line in f:
-			try:
-				obj = json.loads(line)
-			except Exception:
-				continue
-			ident = f"{obj.get('composer_id')}:{obj.get('turn_index')}"
-			uh = obj.get("user_head") or obj.get("user") or ""
-			ah = obj.get("assistant_head") or obj.get("assistant") or ""
-			ann = obj.get("annotations") or {}
-			meta_bits = []
-			for meta_key in [
-				"contains_design",
-				"contains_preference",
-				"contains_learning",
-				"unfinished_thread",
-				"has_useful_output",
-			]:
-				if ann.get(meta_key):
-					meta_bits.append(meta_key)
-			for t in (ann.get("tags") or []):
-				if isinstance(t, str) and t:
-					meta_bits.append(f"tag:{t}")
-			meta_text = (" ".join(meta_bits)).strip()
-			text = (uh + "\n" + ah + ("\n" + meta_text if meta_text else "")).strip()[:1200]
-			if not text:
-				skipped_empty += 1
-				continue
-			batch_ids.append(ident)
-			batch_texts.append(text)
-			batch_meta.append(obj)
-			if len(batch_texts) >= BATCH_SIZE:
-				# call embedding API
-				res = _embed_with_retry(batch_texts)
-				for ident2, meta2, data in zip(batch_ids, batch_meta, res.data):
-					vec = l2_normalize(list(data.embedding))
-					blob = sqlite3.Binary(array.array('f', vec).tobytes())
-					# Upsert: check existing meta row for id
-					row = c.execute(f"SELECT vec_rowid FROM {table}_meta WHERE id= ?", (ident2,)).fetchone()
-					if row:
-						vec_rowid = int(row[0])
-						c.execute(f"UPDATE {table} SET embedding=? WHERE rowid=?", (blob, vec_rowid))
-						c.execute(f"UPDATE {table}_meta SET composer_id=?, turn_index=?, user_head=?, assistant_head=? WHERE vec_rowid= ?",
-							(meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head"), vec_rowid))
-						updated += 1
-					else:
-						c.execute(f"INSERT INTO {table}(embedding) VALUES(?)", (blob,))
-						vec_rowid = c.lastrowid
-						c.execute(f"INSERT INTO {table}_meta(vec_rowid, id, composer_id, turn_index, user_head, assistant_head) VALUES(?,?,?,?,?,?)",
-							(vec_rowid, ident2, meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head")))
-						inserted += 1
-				batch_ids, batch_texts, batch_meta = [], [], []
-
-	if batch_texts:
-		res = _embed_with_retry(batch_texts)
-		for ident2, meta2, data in zip(batch_ids, batch_meta, res.data):
-			vec = l2_normalize(list(data.embedding))
-			blob = sqlite3.Binary(array.array('f', vec).tobytes())
-			row = c.execute(f"SELECT vec_rowid FROM {table}_meta WHERE id= ?", (ident2,)).fetchone()
-			if row:
-				vec_rowid = int(row[0])
-				c.execute(f"UPDATE {table} SET embedding=? WHERE rowid=?", (blob, vec_rowid))
-				c.execute(f"UPDATE {table}_meta SET composer_id=?, turn_index=?, user_head=?, assistant_head=? WHERE vec_rowid= ?",
-					(meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head"), vec_rowid))
-				updated += 1
-			else:
-				c.execute(f"INSERT INTO {table}(embedding) VALUES(?)", (blob,))
-				vec_rowid = c.lastrowid
-				c.execute(f"INSERT INTO {table}_meta(vec_rowid, id, composer_id, turn_index, user_head, assistant_head) VALUES(?,?,?,?,?,?)",
-					(vec_rowid, ident2, meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head")))
-				inserted += 1
+	upserter = _VecMetaUpserter(c, table, existing)
 
+	def _write(batch_meta, res) -> int:
+		ins, upd = upserter.write(batch_meta, res)
+		counts["inserted"] += ins
+		counts["updated"] += upd
+		return ins + upd
+
+	pipemod.run_pipeline(
+		_batches(),
+		lambda texts: pipemod.embed_with_retry(client, model, texts, limiter),
+		_write,
+		concurrency=concurrency or pipemod.default_concurrency(),
+		commit=conn.commit,
+		commit_every=commit_every,
+	)
+	inserted, updated = counts["inserted"], counts["updated"]
+	# Unchanged text can still carry a new repo hint or kind
+	_refresh_vec_meta_filters(c, table, refresh)
+
+	# Drop vectors for items that left the index (or now have no text)
+	counts["deleted"] = _delete_vec_rows(c, table, [rowid for ident, (rowid, _) in existing.items() if ident not in seen])
+	if stats is not None:
+		stats.update(counts)
 	if os.getenv("EMBED_VERBOSE"):
-		print(json.dumps({"inserted": inserted, "updated": updated, "skipped_empty": skipped_empty}), file=sys.stderr)
+		print(json.dumps(counts), file=sys.stderr)
 	conn.commit()
 	conn.close()
 	return inserted + updated
 
 
-def vec_search(db_path: str, index_table: str, query: str, top_k: int = 10) -> List[Dict]:
-	"""Search sqlite-vec DB and return matches joined with meta rows."""
+# Read connections with sqlite-vec loaded, reused across vec_search calls. Per thread,
+# since sqlite3 connections may only be used on their own thread; a thread's
+# connections are closed when it exits. Keyed by (path, table); values are (conn,
+# file ident, (embedding model, embedder state) recorded in <table>_dims).
+_VEC_LOCAL = threading.local()
+
+
+def _vec_conns() -> Dict[tuple, tuple]:
+	conns = getattr(_VEC_LOCAL, "conns", None)
+	if conns is None:
+		conns = _VEC_LOCAL.conns = {}
+	return conns
+
+
+def _vec_dims_model(row) -> Tuple[Optional[str], Optional[Dict]]:
+	"""(model, embedder state) from a <table>_dims (model, dim[, state]) row."""
+	if not row or not row[0]:
+		return None, None
+	try:
+		state = json.loads(row[2]) if len(row) > 2 and row[2] else None
+	except Exception:
+		state = None
+	return row[0], state
+
+
+def _vec_table_model(conn, table: str) -> Tuple[Optional[str], Optional[Dict]]:
+	try:
+		return _vec_dims_model(conn.execute(f"SELECT * FROM {table}_dims LIMIT 1").fetchone())
+	except Exception:
+		return None, None
+
+
+def _vec_connection(db_path: str, table: str):
+	"""Cached (connection, (model, state)) for db_path with sqlite-vec loaded; reopened if the file is replaced or rewritten."""
+	import sqlite3
+
+	path = expand_abs(db_path)
+	key = (path, table)
+	conns = _vec_conns()
+	try:
+		st = os.stat(path)
+		ident = (st.st_dev, st.st_ino, st.st_mtime_ns)
+	except OSError:
+		ident = None
+	cached = conns.get(key)
+	if cached is not None:
+		if cached[1] == ident:
+			return cached[0], cached[2]
+		conns.pop(key, None)
+		try:
+			cached[0].close()
+		except Exception:
+			pass
+	conn = sqlite3.connect(path)
+	try:
+		conn.enable_load_extension(True)
+		_load_sqlite_vec(conn)
+	except Exception:
+		conn.close()
+		raise
+	model = _vec_table_model(conn, table)
+	conns[key] = (conn, ident, model)
+	return conn, model
+
+
+def close_vec_connections() -> None:
+	"""Close this thread's cached vec_search connections (e.g. before deleting the DB)."""
+	conns = _vec_conns()
+	while conns:
+		conn = conns.popitem()[1][0]
+		try:
+			conn.close()
+		except Exception:
+			pass
+
+
+def vec_search(
+	db_path: str,
+	index_table: str,
+	query: str,
+	top_k: int = 10,
+	backend: Optional[str] = None,
+	nprobe: Optional[int] = None,
+	quant: Optional[str] = None,
+	rerank: Optional[int] = None,
+	filters: Optional[Dict] = None,
+) -> List[Dict]:
+	"""Search sqlite-vec DB and return matches joined with meta rows.
+
+	KNN and meta lookup run as one query; the connection is cached per (path, table)
+	and thread for the life of the thread (see close_vec_connections). top_k is
+	capped at the sqlite-vec KNN limit (_VEC_KNN_MAX). The query embedding goes
+	through embedders.embed_query with the embedder that built the table (the model in
+	<table>_dims), so remote repeats skip the API. With the "numpy" backend
+	(see vec_backend) the flat store is searched instead, returning the same fields;
+	nprobe tunes its IVF index and quant/rerank its quantized first pass when those
+	were built (see flatvec.flat_search).
+
+	filters (see filters.normalize_filters) are applied inside the search against the
+	<table>_meta columns: see _vec_search_filtered.
+	"""
 	import sqlite3
 	import array
 	import re
 
 	if not re.fullmatch(r"[A-Za-z0-9_]+", index_table or ""):
 		raise ValueError("invalid table name")
+	if vec_backend(backend, db_path, index_table) == "numpy":
+		from . import flatvec as flatmod
+		return flatmod.flat_search(db_path, index_table, query, top_k, nprobe=nprobe, quant=quant, rerank=rerank, filters=filters)
 
-	conn = sqlite3.connect(expand_abs(db_path))
-	conn.enable_load_extension(True)
-	_load_sqlite_vec(conn)
+	f_norm = filtersmod.normalize_filters(filters)
+	conn, (model, state) = _vec_connection(db_path, index_table)
 
-	client = llmmod.require_client()
-	model = os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
-	res = client.embeddings.create(model=model, input=[query])
-	vec = l2_normalize(list(res.data[0].embedding))
+	# Repeated queries (agent loops, design-plan sweeps) are served from the query cache
+	vec = l2_normalize(embedmod.embed_query(query, model=model, state=state))
 	blob = sqlite3.Binary(array.array('f', vec).tobytes())
-	c = conn.cursor()
-	rows = c.execute(f"SELECT rowid, distance FROM {index_table} WHERE embedding MATCH ? ORDER BY distance LIMIT ?", (blob, top_k)).fetchall()
-	out: List[Dict] = []
-	for rowid, distance in rows:
-		meta = c.execute(f"SELECT id, composer_id, turn_index, user_head, assistant_head FROM {index_table}_meta WHERE vec_rowid = ?", (rowid,)).fetchone()
-		if meta:
-			idv, cid, tix, uh, ah = meta
-			out.append({"id": idv, "composer_id": cid, "turn_index": tix, "user_head": uh, "assistant_head": ah, "distance": float(distance)})
-	conn.close()
-	return out
+	if f_norm:
+		rows = _vec_search_filtered(conn, index_table, blob, top_k, f_norm)
+	elif top_k <= 0:
+		rows = []
+	else:
+		rows = conn.execute(
+			f"WITH knn AS (SELECT rowid, distance FROM {index_table} WHERE embedding MATCH ? ORDER BY distance LIMIT ?) "
+			f"SELECT m.id, m.composer_id, m.turn_index, m.user_head, m.assistant_head, knn.distance "
+			f"FROM knn JOIN {index_table}_meta AS m ON m.vec_rowid = knn.rowid ORDER BY knn.distance",
+			(blob, min(int(top_k), _VEC_KNN_MAX)),
+		).fetchall()
+	return [
+		{"id": idv, "composer_id": cid, "turn_index": tix, "user_head": uh, "assistant_head": ah, "distance": float(distance)}
+		for idv, cid, tix, uh, ah, distance in rows
+	]
+
+
+# sqlite-vec caps the k of a KNN query
+_VEC_KNN_MAX = 4096
+
+
+def _vec_prefilter_max() -> int:
+	try:
+		return max(0, int(os.getenv("AGENT_VEC_PREFILTER_MAX", "2000")))
+	except Exception:
+		return 2000
+
+
+def _vec_search_filtered(conn, table: str, blob, top_k: int, filters: Dict) -> List[tuple]:
+	"""Filtered KNN rows (id, composer_id, turn_index, user_head, assistant_head, distance).
+
+	When at most AGENT_VEC_PREFILTER_MAX (default 2000) meta rows pass the filter,
+	those rows are scored exactly (pre-filter). Otherwise the KNN over-fetches by the
+	filter's inverse selectivity and filters the joined rows, growing the fetch 4x
+	until top_k pass or the KNN limit is reached, then falls back to pre-filtering.
+	"""
+	cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table}_meta)").fetchall()]
+	where, params = filtersmod.sql_where(filters, "m", cols)
+	top_k = max(0, int(top_k))
+	matching, total = conn.execute(
+		f"SELECT COALESCE(SUM({where}), 0), COUNT(*) FROM {table}_meta AS m", params
+	).fetchone()
+	if not matching or top_k == 0:
+		return []
+	select = "SELECT m.id, m.composer_id, m.turn_index, m.user_head, m.assistant_head"
+	if matching > _vec_prefilter_max():
+		fetch = min(_VEC_KNN_MAX, max(top_k * 4, -(-top_k * total // matching) * 2))
+		while True:
+			rows = conn.execute(
+				f"WITH knn AS (SELECT rowid, distance FROM {table} WHERE embedding MATCH ? ORDER BY distance LIMIT ?) "
+				f"{select}, knn.distance FROM knn JOIN {table}_meta AS m ON m.vec_rowid = knn.rowid "
+				f"WHERE {where} ORDER BY knn.distance LIMIT ?",
+				[blob, fetch] + params + [top_k],
+			).fetchall()
+			if len(rows) >= top_k or fetch >= total:
+				return rows
+			if fetch >= _VEC_KNN_MAX:
+				break
+			fetch = min(_VEC_KNN_MAX, fetch * 4)
+	return conn.execute(
+		f"{select}, vec_distance_l2(v.embedding, ?) AS distance FROM {table}_meta AS m "
+		f"JOIN {table} AS v ON v.rowid = m.vec_rowid WHERE {where} ORDER BY distance LIMIT ?",
+		[blob] + params + [top_k],
+	).fetchall()
 
 
+def _ann_flags_and_tags(ann) -> tuple:
+	"""Flatten annotations into (flags, tags) strings for the items FTS columns."""
+	if not isinstance(ann, dict):
+		return "", ""
+	flags = " ".join(k for k in _ANN_META_KEYS if ann.get(k))
+	tags = " ".join(t for t in (ann.get("tags") or []) if isinstance(t, str) and t)
+	return flags, tags
 
 
-def items_search(db_path: str, table: str = "items", query: str = "", k: int = 10) -> List[Dict]:
-	"""Sparse search over the SQLite items table using simple token-overlap scoring.
+def _ensure_items_columns(c, table: str) -> None:
+	# Tables created before FTS support or metadata filters lack these columns
+	cols = [r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+	for col in _FILTER_COLUMNS:
+		if col not in cols:
+			c.execute(f"ALTER TABLE {table} ADD COLUMN {col} TEXT")
 
-	Returns top-k items with fields: composer_id, turn_index, user_head, assistant_head, score.
+
+def _ensure_items_fts(c, table: str) -> bool:
+	"""Create <table>_fts (FTS5, external content on <table>) and its sync triggers.
+
+	A newly created index is filled from existing rows. Returns False when FTS5 is
+	unavailable, in which case items_search falls back to scanning.
+	"""
+	fts = f"{table}_fts"
+	exists = c.execute("SELECT 1 FROM sqlite_master WHERE name=?", (fts,)).fetchone()
+	if exists:
+		return True
+	try:
+		c.execute(
+			f"CREATE VIRTUAL TABLE {fts} USING fts5("
+			f"user, assistant, ann_flags, tags, content='{table}', content_rowid='rowid', tokenize='unicode61')"
+		)
+	except Exception:
+		return False
+	cols = "user, assistant, ann_flags, tags"
+	new_vals = "new.rowid, new.user, new.assistant, new.ann_flags, new.tags"
+	old_vals = "'delete', old.rowid, old.user, old.assistant, old.ann_flags, old.tags"
+	c.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN INSERT INTO {fts}(rowid, {cols}) VALUES({new_vals}); END")
+	c.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN INSERT INTO {fts}({fts}, rowid, {cols}) VALUES({old_vals}); END")
+	c.execute(
+		f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN "
+		f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES({old_vals}); "
+		f"INSERT INTO {fts}(rowid, {cols}) VALUES({new_vals}); END"
+	)
+	c.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+	return True
+
+
+def _fts_query(query: str) -> str:
+	"""Free text -> FTS5 query: each word as a quoted prefix term, OR-ed (BM25 ranks overlap)."""
+	terms = re.findall(r"\w+", (query or "").lower())
+	return " OR ".join(f'"{t}"*' for t in dict.fromkeys(terms))
+
+
+def items_search(
+	db_path: str,
+	table: str = "items",
+	query: str = "",
+	k: int = 10,
+	highlight: bool = False,
+	filters: Optional[Dict] = None,
+) -> List[Dict]:
+	"""Sparse search over the SQLite items table.
+
+	Uses the <table>_fts index (BM25 over user, assistant, annotation flags and tags)
+	when present; otherwise falls back to token-overlap scoring over every row.
+	Returns top-k items with fields: composer_id, turn_index, user_head, assistant_head,
+	score (higher is better) and, with FTS, a [bracketed] snippet. highlight=True adds
+	user_highlight/assistant_highlight with every match bracketed. filters (see
+	filters.normalize_filters) are applied in the query, before the top-k cut.
 	"""
 	import sqlite3
-	import re
 
 	if not re.fullmatch(r"[A-Za-z0-9_]+", table or ""):
 		raise ValueError("invalid table name")
-	from .rag import _score  # reuse simple scorer
 
+	f_norm = filtersmod.normalize_filters(filters)
 	conn = sqlite3.connect(expand_abs(db_path))
+	try:
+		cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+		where, params = filtersmod.sql_where(f_norm, "i", cols)
+		fts = f"{table}_fts"
+		has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name=?", (fts,)).fetchone()
+		match = _fts_query(query)
+		if has_fts:
+			if not match:
+				return []
+			extra = (
+				f", highlight({fts}, 0, '[', ']'), highlight({fts}, 1, '[', ']')" if highlight else ""
+			)
+			try:
+				rows = conn.execute(
+					f"SELECT i.composer_id, i.turn_index, i.user, i.assistant, i.user_head, i.assistant_head, "
+					f"bm25({fts}, 1.0, 1.0, 0.5, 2.0) AS rank, snippet({fts}, -1, '[', ']', '...', 16){extra} "
+					f"FROM {fts} JOIN {table} AS i ON i.rowid = {fts}.rowid "
+					f"WHERE {fts} MATCH ? AND {where} ORDER BY rank LIMIT ?",
+					[match] + params + [max(0, int(k))],
+				).fetchall()
+			except sqlite3.OperationalError:
+				rows = None
+			if rows is not None:
+				out: List[Dict] = []
+				for r in rows:
+					cid, tix, user, assistant, uh, ah, rank, snip = r[:8]
+					item = {
+						"composer_id": cid,
+						"turn_index": int(tix),
+						"user_head": _item_head(uh, user, 160),
+						"assistant_head": _item_head(ah, assistant, 200),
+						# bm25() is lower-is-better; flip so callers can rank descending
+						"score": round(-float(rank), 4),
+						"snippet": snip,
+					}
+					if highlight:
+						item["user_highlight"], item["assistant_highlight"] = r[8], r[9]
+					out.append(item)
+				return out
+		return _items_search_scan(conn, table, query, k, where, params)
+	finally:
+		conn.close()
+
+
+def _item_head(head, full, n: int) -> str:
+	return (head or (full or "").splitlines()[0][:n]) if isinstance(head, str) else (full or "")[:n]
+
+
+def _items_search_scan(conn, table: str, query: str, k: int, where: str = "1", params: Optional[list] = None) -> List[Dict]:
+	"""Token-overlap scoring over every row passing where (used when there is no FTS index)."""
+	from .rag import _score  # reuse simple scorer
+
 	c = conn.cursor()
 	buf: List[Dict] = []
 	for row in c.execute(
-		f"SELECT composer_id, turn_index, user, assistant, user_head, assistant_head, annotations FROM {table} ORDER BY composer_id, turn_index"
+		f"SELECT composer_id, turn_index, user, assistant, user_head, assistant_head, annotations FROM {table} AS i "
+		f"WHERE {where} ORDER BY composer_id, turn_index",
+		params or [],
 	):
 		cid, tix, user, assistant, uh, ah, ann_text = row
 		base_text = ((user or "") + "\n" + (assistant or "")).strip()
@@ -356,32 +1181,18 @@ def items_search(db_path: str, table: str = "items", query: str = "", k: int = 1
 			ann = json.loads(ann_text) if ann_text else {}
 		except Exception:
 			ann = {}
-		meta_bits: List[str] = []
-		for meta_key in [
-			"contains_design",
-			"contains_preference",
-			"contains_learning",
-			"unfinished_thread",
-			"has_useful_output",
-		]:
-			if isinstance(ann, dict) and ann.get(meta_key):
-				meta_bits.append(meta_key)
-		for t in (ann.get("tags") or []) if isinstance(ann, dict) else []:
-			if isinstance(t, str) and t:
-				meta_bits.append(f"tag:{t}")
-		meta_text = (" ".join(meta_bits)).strip()
+		meta_text = _annotation_meta_text(ann)
 		text = (base_text + ("\n" + meta_text if meta_text else "")).strip()
 		s = _score(query, text)
 		if s > 0:
 			buf.append({
 				"composer_id": cid,
 				"turn_index": int(tix),
-				"user_head": (uh or (user or "").splitlines()[0][:160]) if isinstance(uh, str) else (user or "")[:160],
-				"assistant_head": (ah or (assistant or "").splitlines()[0][:200]) if isinstance(ah, str) else (assistant or "")[:200],
+				"user_head": _item_head(uh, user, 160),
+				"assistant_head": _item_head(ah, assistant, 200),
 				"score": int(s),
 			})
 	buf.sort(key=lambda o: o["score"], reverse=True)
-	conn.close()
 	return buf[:k]
 
 def build_index_sqlite(
@@ -390,6 +1201,7 @@ def build_index_sqlite(
 	table: str = "items",
 	limit_composers: Optional[int] = None,
 	max_turns_per: Optional[int] = None,
+	workers: Optional[int] = None,
 ) -> int:
 	"""Write a SQLite index (table of per-turn items) over all chats.
 
@@ -401,7 +1213,17 @@ def build_index_sqlite(
 	  - user_head TEXT
 	  - assistant_head TEXT
 	  - annotations TEXT (JSON)
+	  - ann_flags TEXT (set annotation booleans, space-separated)
+	  - tags TEXT (annotation tags, space-separated)
+	  - repo TEXT (repo hint, see parser.load_repo_hint)
+	  - kind TEXT (annotations.kind, "chat" when unset)
 	PRIMARY KEY (composer_id, turn_index)
+
+	An FTS5 table <table>_fts (external content, synced by triggers) indexes user,
+	assistant, ann_flags and tags for items_search.
+
+	workers > 1 builds composers in a process pool; rows are written in the same
+	order as a serial build.
 	"""
 	import sqlite3
 	import re
@@ -409,7 +1231,8 @@ def build_index_sqlite(
 	if not re.fullmatch(r"[A-Za-z0-9_]+", table or ""):
 		raise ValueError("invalid table name")
 
-	src = dbmod.connect_readonly(expand_abs(db_path or default_db_path()))
+	src_path = expand_abs(db_path or default_db_path())
+	src = dbmod.connect_readonly(src_path)
 	out_db = expand_abs(out_db_path)
 	os.makedirs(os.path.dirname(out_db) or ".", exist_ok=True)
 	conn = sqlite3.connect(out_db)
@@ -430,36 +1253,35 @@ def build_index_sqlite(
 		f"  user_head TEXT,\n"
 		f"  assistant_head TEXT,\n"
 		f"  annotations TEXT,\n"
+		f"  ann_flags TEXT,\n"
+		f"  tags TEXT,\n"
+		f"  repo TEXT,\n"
+		f"  kind TEXT,\n"
 		f"  PRIMARY KEY (composer_id, turn_index)\n"
 		f")"
 	)
+	_ensure_items_columns(c, table)
+	# Full-text index kept in sync by triggers; optional if FTS5 is missing
+	_ensure_items_fts(c, table)
 
 	count = 0
-	for i, cid in enumerate(_composer_ids(src)):
-		if limit_composers is not None and i >= limit_composers:
-			break
-		msgs = parsermod.reconstruct_conversation(src, cid)
-		# Best-effort repo/workspace hint extraction
-		try:
-			composer_obj = parsermod.load_composer(src, cid)
-			repo_hint = parsermod.extract_repo_hint(composer_obj)
-		except Exception:
-			repo_hint = None
-		items = ragmod.build_turn_items(msgs)
-		if max_turns_per is not None:
-			items = items[:max_turns_per]
-		for it in items:
-			if repo_hint:
-				it["repo"] = repo_hint
-			c.execute(
-				f"INSERT INTO {table} (composer_id, turn_index, user, assistant, user_head, assistant_head, annotations)\n"
-				f"VALUES (?, ?, ?, ?, ?, ?, ?)\n"
-				f"ON CONFLICT(composer_id, turn_index) DO UPDATE SET\n"
-				f"  user=excluded.user,\n"
-				f"  assistant=excluded.assistant,\n"
-				f"  user_head=excluded.user_head,\n"
-				f"  assistant_head=excluded.assistant_head,\n"
-				f"  annotations=excluded.annotations",
+	for items in _iter_composer_items(src, src_path, _limited_composer_ids(src, limit_composers), max_turns_per, workers):
+		if not items:
+			continue
+		c.executemany(
+			f"INSERT INTO {table} (composer_id, turn_index, user, assistant, user_head, assistant_head, annotations, ann_flags, tags, repo, kind)\n"
+			f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)\n"
+			f"ON CONFLICT(composer_id, turn_index) DO UPDATE SET\n"
+			f"  user=excluded.user,\n"
+			f"  assistant=excluded.assistant,\n"
+			f"  user_head=excluded.user_head,\n"
+			f"  assistant_head=excluded.assistant_head,\n"
+			f"  annotations=excluded.annotations,\n"
+			f"  ann_flags=excluded.ann_flags,\n"
+			f"  tags=excluded.tags,\n"
+			f"  repo=excluded.repo,\n"
+			f"  kind=excluded.kind",
+			[
 				(
 					it.get("composer_id"),
 					it.get("turn_index"),
@@ -468,9 +1290,12 @@ def build_index_sqlite(
 					it.get("user_head", ""),
 					it.get("assistant_head", ""),
 					json.dumps(it.get("annotations") or {}, ensure_ascii=False),
-				),
-			)
-			count += 1
+					*(filtersmod.item_fields(it)[col] for col in ("ann_flags", "tags", "repo", "kind")),
+				)
+				for it in items
+			],
+		)
+		count += len(items)
 
 	# Close source DB connection
 	try:
@@ -482,22 +1307,46 @@ def build_index_sqlite(
 	return count
 
 
+def _items_row_annotations(ann_text) -> Dict:
+	try:
+		ann = json.loads(ann_text) if ann_text else {}
+	except Exception:
+		ann = {}
+	return ann if isinstance(ann, dict) else {}
+
+
+def _items_row_embed_text(uh, ah, user, assistant, ann: Dict) -> str:
+	"""Embedded text of an items-table row (heads, else full text, plus annotation meta)."""
+	meta_text = _annotation_meta_text(ann)
+	return ((uh or user or "") + "\n" + (ah or assistant or "") + ("\n" + meta_text if meta_text else "")).strip()[:1200]
+
+
 def build_embeddings_sqlite_from_items(
 	db_path: str,
 	items_table: str = "items",
 	vec_table: str = "vec_index",
 	changed_only: bool = False,
+	stats: Optional[Dict[str, int]] = None,
+	concurrency: Optional[int] = None,
+	rpm: Optional[float] = None,
+	tpm: Optional[float] = None,
+	commit_every: int = 2000,
 ) -> int:
 	"""Populate sqlite-vec embeddings using texts from a SQLite items table.
 
 	- db_path: SQLite DB that contains the items table and will hold vec tables
 	- items_table: source per-turn items (schema from build_index_sqlite)
 	- vec_table: target sqlite-vec table name
+	- changed_only: skip items whose embedded text hash is unchanged (no API call)
+	- stats: if given, filled with inserted/updated/skipped/skipped_empty/deleted counts
+	- concurrency / rpm / tpm: in-flight embedding requests and rate limits
+	  (env EMBED_CONCURRENCY / EMBED_RPM / EMBED_TPM); see embed_pipeline
+	- commit_every: rows per write transaction
+
+	Vectors whose ids are no longer in the items table are deleted.
 	"""
 	import sqlite3
-	import array
 	import re
-	import time
 
 	if not re.fullmatch(r"[A-Za-z0-9_]+", items_table or ""):
 		raise ValueError("invalid items table name")
@@ -517,25 +1366,23 @@ def build_embeddings_sqlite_from_items(
 		conn.close()
 		raise ValueError(f"items table not found: {items_table}")
 
+	# Items tables built before metadata filters have no repo column
+	has_repo = "repo" in [r[1] for r in c.execute(f"PRAGMA table_info({items_table})").fetchall()]
+	select = (
+		f"SELECT composer_id, turn_index, user_head, assistant_head, user, assistant, annotations, {'repo' if has_repo else 'NULL'} "
+		f"FROM {items_table} ORDER BY composer_id, turn_index"
+	)
+
+	def _fit_texts() -> Iterator[str]:
+		for row in conn.cursor().execute(select):
+			text = _items_row_embed_text(row[2], row[3], row[4], row[5], _items_row_annotations(row[6]))
+			if text:
+				yield text
+
 	# Create vec tables (detect embedding dim dynamically with caching); avoid conflicting table names
-	client = llmmod.require_client()
-	model = os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
-	c.execute(f"CREATE TABLE IF NOT EXISTS {vec_table}_dims(model TEXT, dim INTEGER)")
-	info = None
-	try:
-		info = c.execute(f"SELECT model, dim FROM {vec_table}_dims LIMIT 1").fetchone()
-	except Exception:
-		info = None
-	if info and info[1]:
-		dim = int(info[1])
-	else:
-		probe = client.embeddings.create(model=model, input=["dimension_probe"])
-		dim = len(probe.data[0].embedding)
-		try:
-			c.execute(f"DELETE FROM {vec_table}_dims")
-			c.execute(f"INSERT INTO {vec_table}_dims(model, dim) VALUES(?,?)", (model, dim))
-		except Exception:
-			pass
+	embedder, dim = _vec_table_embedder(c, vec_table, _fit_texts)
+	client = embedder.client()
+	model = embedder.model
 	c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {vec_table} USING vec0(embedding float[{dim}])")
 	c.execute(
 		f"CREATE TABLE IF NOT EXISTS {vec_table}_meta(\n"
@@ -544,108 +1391,89 @@ def build_embeddings_sqlite_from_items(
 		f"  composer_id TEXT,\n"
 		f"  turn_index INTEGER,\n"
 		f"  user_head TEXT,\n"
-		f"  assistant_head TEXT\n"
+		f"  assistant_head TEXT,\n"
+		f"  text_hash TEXT,\n"
+		f"  repo TEXT,\n"
+		f"  kind TEXT,\n"
+		f"  ann_flags TEXT,\n"
+		f"  tags TEXT\n"
 		f")"
 	)
+	_ensure_vec_meta_columns(c, vec_table)
+	existing = _load_vec_meta_state(c, vec_table)
+	seen: set = set()
+	refresh: List[tuple] = []
 
-	# Read items and embed in batches
+	# Read items and embed: reader (this generator) -> concurrent requests -> writer (this thread)
+	counts = {"inserted": 0, "updated": 0, "skipped": 0, "skipped_empty": 0}
 	BATCH_SIZE = max(1, int(os.getenv("EMBED_BATCH", "16")))
-	inserted = 0
-	updated = 0
-	skipped_empty = 0
-	b_ids: List[str] = []
-	b_texts: List[str] = []
-	b_meta: List[Dict] = []
-
-	def _embed_with_retry(inputs: List[str]):
-		retries = 4
-		delay = 1.0
-		for attempt in range(retries + 1):
-			try:
-				return client.embeddings.create(model=model, input=inputs)
-			except Exception as e:
-				if attempt >= retries:
-					raise
-				if os.getenv("EMBED_VERBOSE"):
-					print(f"embed batch failed: {e}; retry in {delay:.1f}s", file=sys.stderr)
-				time.sleep(delay)
-				delay *= 1.6
-
-	def _flush_batch() -> None:
-		nonlocal inserted, updated, skipped_empty, b_ids, b_texts, b_meta
-		if not b_texts:
-			return
-		res = _embed_with_retry(b_texts)
-		for ident2, meta2, data in zip(b_ids, b_meta, res.data):
-			vec = l2_normalize(list(data.embedding))
-			blob = sqlite3.Binary(array.array('f', vec).tobytes())
-			row2 = c.execute(f"SELECT vec_rowid FROM {vec_table}_meta WHERE id= ?", (ident2,)).fetchone()
-			if row2:
-				vec_rowid = int(row2[0])
-				c.execute(f"UPDATE {vec_table} SET embedding=? WHERE rowid=?", (blob, vec_rowid))
-				c.execute(
-					f"UPDATE {vec_table}_meta SET composer_id=?, turn_index=?, user_head=?, assistant_head=? WHERE vec_rowid=?",
-					(meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head"), vec_rowid),
-				)
-				updated += 1
-			else:
-				c.execute(f"INSERT INTO {vec_table}(embedding) VALUES(?)", (blob,))
-				vec_rowid = c.lastrowid
-				c.execute(
-					f"INSERT INTO {vec_table}_meta(vec_rowid, id, composer_id, turn_index, user_head, assistant_head) VALUES(?,?,?,?,?,?)",
-					(vec_rowid, ident2, meta2.get("composer_id"), meta2.get("turn_index"), meta2.get("user_head"), meta2.get("assistant_head")),
-				)
-				inserted += 1
-		b_ids, b_texts, b_meta = [], [], []
+	limiter = pipemod.RateLimiter.from_env(rpm, tpm)
 
-	# Stream rows from a separate cursor
-	c_read = conn.cursor()
-	for row in c_read.execute(
-		f"SELECT composer_id, turn_index, user_head, assistant_head, user, assistant, annotations FROM {items_table} ORDER BY composer_id, turn_index"
-	):
-		cid, tidx, uh, ah, user, assistant, ann_text = row
-		try:
-			ann = json.loads(ann_text) if ann_text else {}
-		except Exception:
-			ann = {}
-		meta_bits: List[str] = []
-		for meta_key in [
-			"contains_design",
-			"contains_preference",
-			"contains_learning",
-			"unfinished_thread",
-			"has_useful_output",
-		]:
-			if isinstance(ann, dict) and ann.get(meta_key):
-				meta_bits.append(meta_key)
-		for t in (ann.get("tags") or []) if isinstance(ann, dict) else []:
-			if isinstance(t, str) and t:
-				meta_bits.append(f"tag:{t}")
-		meta_text = (" ".join(meta_bits)).strip()
-		text = ((uh or user or "") + "\n" + (ah or assistant or "") + ("\n" + meta_text if meta_text else "")).strip()[:1200]
-		if not text:
-			skipped_empty += 1
-			continue
-		ident = f"{cid}:{tidx}"
-		b_ids.append(ident)
-		b_texts.append(text)
-		# safe heads
-		user_text = (user or "").strip()
-		assist_text = (assistant or "").strip()
-		user_head = (uh or (user_text.splitlines()[0] if user_text else ""))[:160]
-		assistant_head = (ah or (assist_text.splitlines()[0] if assist_text else ""))[:200]
-		b_meta.append({
-			"composer_id": cid,
-			"turn_index": tidx,
-			"user_head": user_head,
-			"assistant_head": assistant_head,
-		})
-		if len(b_texts) >= BATCH_SIZE:
-			_flush_batch()
-
-	_flush_batch()
+	def _batches():
+		b_texts: List[str] = []
+		b_meta: List[tuple] = []
+		# Stream rows from a separate cursor
+		c_read = conn.cursor()
+		for row in c_read.execute(select):
+			cid, tidx, uh, ah, user, assistant, ann_text, repo = row
+			ann = _items_row_annotations(ann_text)
+			fields = filtersmod.item_fields({"repo": repo, "annotations": ann})
+			text = _items_row_embed_text(uh, ah, user, assistant, ann)
+			if not text:
+				counts["skipped_empty"] += 1
+				continue
+			ident = f"{cid}:{tidx}"
+			seen.add(ident)
+			text_hash = _embed_text_hash(model, text)
+			if changed_only and ident in existing and existing[ident][1] == text_hash:
+				counts["skipped"] += 1
+				refresh.append(tuple(fields[col] for col in _FILTER_COLUMNS) + (existing[ident][0],))
+				continue
+			b_texts.append(text)
+			# safe heads
+			user_text = (user or "").strip()
+			assist_text = (assistant or "").strip()
+			user_head = (uh or (user_text.splitlines()[0] if user_text else ""))[:160]
+			assistant_head = (ah or (assist_text.splitlines()[0] if assist_text else ""))[:200]
+			b_meta.append((ident, {
+				"composer_id": cid,
+				"turn_index": tidx,
+				"user_head": user_head,
+				"assistant_head": assistant_head,
+				"text_hash": text_hash,
+				**fields,
+			}))
+			if len(b_texts) >= BATCH_SIZE:
+				yield b_texts, b_meta
+				b_texts, b_meta = [], []
+		if b_texts:
+			yield b_texts, b_meta
+
+	upserter = _VecMetaUpserter(c, vec_table, existing)
+
+	def _write(batch_meta, res) -> int:
+		ins, upd = upserter.write(batch_meta, res)
+		counts["inserted"] += ins
+		counts["updated"] += upd
+		return ins + upd
+
+	pipemod.run_pipeline(
+		_batches(),
+		lambda texts: pipemod.embed_with_retry(client, model, texts, limiter),
+		_write,
+		concurrency=concurrency or pipemod.default_concurrency(),
+		commit=conn.commit,
+		commit_every=commit_every,
+	)
+	inserted, updated = counts["inserted"], counts["updated"]
+	_refresh_vec_meta_filters(c, vec_table, refresh)
+
+	# Drop vectors for items that left the table (or now have no text)
+	counts["deleted"] = _delete_vec_rows(c, vec_table, [rowid for ident, (rowid, _) in existing.items() if ident not in seen])
+	if stats is not None:
+		stats.update(counts)
 	if os.getenv("EMBED_VERBOSE"):
-		print(json.dumps({"inserted": inserted, "updated": updated, "skipped_empty": skipped_empty}), file=sys.stderr)
+		print(json.dumps(counts), file=sys.stderr)
 	conn.commit()
 	conn.close()
 	return inserted + updated
@@ -0,0 +1,345 @@
+"""On-disk inverted index sidecar for the JSONL turn index (<index>.inv).
+
+The sidecar maps every lowercased word of an item to postings (item ordinal,
+term frequency) and records each item's byte range in the JSONL. Sparse queries
+read only the postings they need and seek straight to the matching lines through
+mmap, instead of decoding the whole JSONL per query.
+
+Scores are identical to the streaming scan (rag._score: a query token counts when
+it is a substring of the lowercased text). A word-only token is a substring of the
+text exactly when it is a substring of one of its words, so those scores come from
+postings alone, found by searching the vocabulary for words containing the token.
+Tokens with punctuation use their word parts as a candidate filter and are checked
+against the decoded item; tokens with no word characters need a full scan.
+
+Vocabulary terms come in three kinds: plain words of user/assistant text, "@word"
+for words of the annotation flags/tags text, and "#tag" for whole annotation tags
+(used by memory.find_solution's tag boost, which ignores items without text).
+
+The same file carries the id and composer tables of offsets.py, so one sidecar
+serves both sparse search and lookups by id (InvertedIndex is an IndexOffsets).
+"""
+from __future__ import annotations
+
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import offsets as offsetsmod
+from . import sidecar as sidecarmod
+from .paths import expand_abs
+
+
+_WORD = re.compile(r"\w+")
+
+
+def inverted_index_path(index_path: str) -> str:
+	return expand_abs(index_path) + ".inv"
+
+
+def _item_texts(obj: dict) -> Tuple[str, str]:
+	"""(user/assistant text, annotation meta text) exactly as the scan scorers build them."""
+	from .index import _annotation_meta_text
+
+	base = ((obj.get("user") or "") + "\n" + (obj.get("assistant") or "")).strip()
+	return base, _annotation_meta_text(obj.get("annotations") or {})
+
+
+def _tag_term(tag: str) -> str:
+	# Separators of the on-disk vocabulary/doc lists cannot appear inside a term
+	return "#" + re.sub(r"[\t\n\x1f]", " ", tag.lower())
+
+
+def item_tags(obj: dict, base: Optional[str] = None) -> List[str]:
+	"""The item's "#tag" terms without the "#": lowercased annotation tags, only for items with text.
+
+	Tag strata in index.sample_index use the same rule with or without a sidecar.
+	"""
+	if base is None:
+		base = _item_texts(obj)[0]
+	ann = obj.get("annotations") or {}
+	if not base or not isinstance(ann, dict):
+		return []
+	return [_tag_term(t)[1:] for t in ann.get("tags") or [] if isinstance(t, str) and t]
+
+
+def _doc_terms(obj: dict) -> Dict[str, int]:
+	base, meta = _item_texts(obj)
+	terms: Dict[str, int] = Counter(_WORD.findall(base.lower()))
+	for w in _WORD.findall(meta.lower()):
+		terms["@" + w] += 1
+	for t in item_tags(obj, base):
+		terms["#" + t] += 1
+	return terms
+
+
+class InvertedIndexBuilder:
+	"""Accumulates items in JSONL order; write() emits the sidecar."""
+
+	def __init__(self) -> None:
+		# term -> [ordinal, tf, ordinal, tf, ...]; plain lists append fastest
+		self._postings: Dict[str, List[int]] = {}
+		self._offsets = array("Q")
+		self._lengths = array("I")
+		self._docs: List[str] = []
+		self._ids = offsetsmod.OffsetsBuilder()
+
+	@property
+	def n_items(self) -> int:
+		return len(self._docs)
+
+	def add_doc(self, offset: int, length: int, terms: Dict[str, int], ident: str, composer_id: Optional[str]) -> None:
+		ordinal = len(self._docs)
+		postings = self._postings
+		for term, n in terms.items():
+			p = postings.get(term)
+			if p is None:
+				postings[term] = [ordinal, n]
+			else:
+				p.append(ordinal)
+				p.append(n)
+		self._offsets.append(offset)
+		self._lengths.append(length)
+		self._docs.append("\t".join([f"{t}\x1f{n}" for t, n in terms.items()]))
+		self._ids.add(ident, composer_id)
+
+	def add_item(self, obj: dict, offset: int, length: int) -> None:
+		self.add_doc(offset, length, _doc_terms(obj), offsetsmod.item_id(obj), obj.get("composer_id"))
+
+	def add_lines(self, data: bytes, offset: int) -> None:
+		"""Index the JSONL lines in data, which starts at byte offset in the file."""
+		for obj, off, length in sidecarmod.jsonl_items(data, offset):
+			self.add_item(obj, off, length)
+
+	def copy_from(self, prev: "InvertedIndex", start: int, length: int, offset: int) -> None:
+		"""Reuse prev's items in bytes [start, start+length) of its JSONL, now at offset."""
+		offsets = prev.offsets
+		lo = bisect_left(offsets, start)
+		hi = bisect_left(offsets, start + length)
+		lengths = prev.lengths
+		for i in range(lo, hi):
+			ident = prev.ident(i)
+			self.add_doc(offsets[i] - start + offset, lengths[i], prev.doc_terms(i), ident, ident.rsplit(":", 1)[0])
+
+	def write(self, index_path: str, st: Optional[os.stat_result] = None) -> str:
+		"""Write the sidecar for index_path atomically; st is the JSONL's stat (default: now)."""
+		index_path = expand_abs(index_path)
+		st = st or os.stat(index_path)
+		vocab = bytearray()
+		vocab_ptr = array("Q", [0])
+		term_ptr = array("Q", [0])
+		postings = array("I")
+		tfs = array("H")
+		for term in sorted(self._postings):
+			vocab += term.encode("utf-8") + b"\n"
+			vocab_ptr.append(len(vocab))
+			p = self._postings[term]
+			postings.extend(p[0::2])
+			freqs = p[1::2]
+			tfs.extend(freqs if max(freqs) <= 0xFFFF else [min(n, 0xFFFF) for n in freqs])
+			term_ptr.append(len(postings))
+		docs = bytearray()
+		doc_ptr = array("Q", [0])
+		for d in self._docs:
+			docs += d.encode("utf-8") + b"\n"
+			doc_ptr.append(len(docs))
+		blobs = {
+			"vocab": bytes(vocab),
+			"vocab_ptr": sidecarmod.to_le(vocab_ptr),
+			"term_ptr": sidecarmod.to_le(term_ptr),
+			"postings": sidecarmod.to_le(postings),
+			"tfs": sidecarmod.to_le(tfs),
+			"offsets": sidecarmod.to_le(self._offsets),
+			"lengths": sidecarmod.to_le(self._lengths),
+			"docs": bytes(docs),
+			"doc_ptr": sidecarmod.to_le(doc_ptr),
+			**self._ids.blobs(),
+		}
+		header = {
+			"format": InvertedIndex.FORMAT,
+			"n_items": self.n_items,
+			"n_terms": len(vocab_ptr) - 1,
+			"n_composers": self._ids.n_composers,
+		}
+		path = inverted_index_path(index_path)
+		_OPEN.pop(index_path, None)
+		sidecarmod.write_sidecar(path, InvertedIndex.MAGIC, InvertedIndex.SECTIONS, blobs, header, st)
+		return path
+
+
+def build_inverted_index(index_path: str) -> int:
+	"""Build the sidecar for an existing JSONL index from scratch; returns the item count."""
+	index_path = expand_abs(index_path)
+	st = os.stat(index_path)
+	builder = InvertedIndexBuilder()
+	with open(index_path, "rb") as f:
+		offset = 0
+		for line in f:
+			builder.add_lines(line.rstrip(b"\n"), offset)
+			offset += len(line)
+	builder.write(index_path, st)
+	return builder.n_items
+
+
+class InvertedIndex(offsetsmod.IndexOffsets):
+	"""Read-only view of a sidecar, memory-mapped; see open_inverted_index."""
+
+	MAGIC = b"AEINV\x00\x00\x01"
+	# 2: adds the id and composer sections of offsets.py
+	FORMAT = 2
+	SECTIONS = (
+		("vocab", None),
+		("vocab_ptr", "Q"),
+		("term_ptr", "Q"),
+		("postings", "I"),
+		("tfs", "H"),
+		("offsets", "Q"),
+		("lengths", "I"),
+		("docs", None),
+		("doc_ptr", "Q"),
+	) + offsetsmod.SECTIONS
+
+	def __init__(self, *args, **kwargs) -> None:
+		super().__init__(*args, **kwargs)
+		self._items: Dict[int, Optional[dict]] = {}
+
+	def term(self, ti: int) -> str:
+		return self._string("vocab", "vocab_ptr", ti).decode("utf-8")
+
+	def postings(self, ti: int) -> Tuple[array, array]:
+		"""(ordinals, term frequencies) for term index ti."""
+		ptr = self._array("term_ptr")
+		lo, hi = ptr[ti], ptr[ti + 1]
+		return self._slice("postings", lo, hi), self._slice("tfs", lo, hi)
+
+	def doc_terms(self, ordinal: int) -> Dict[str, int]:
+		line = self._string("docs", "doc_ptr", ordinal).decode("utf-8")
+		out: Dict[str, int] = {}
+		for entry in line.split("\t") if line else ():
+			term, _, n = entry.rpartition("\x1f")
+			out[term] = int(n)
+		return out
+
+	def item(self, ordinal: int) -> Optional[dict]:
+		"""Decode one JSONL item by seeking to its byte range."""
+		if ordinal in self._items:
+			return self._items[ordinal]
+		obj = self.item_at(ordinal)
+		if len(self._items) >= 4096:
+			# Bounded: the reader is cached for the life of the process
+			self._items.clear()
+		self._items[ordinal] = obj
+		return obj
+
+	def _tag_terms(self) -> Iterable[int]:
+		vs = self._sections["vocab"][0]
+		ptr = self._array("vocab_ptr")
+		ti = 0
+		# "#" sorts before every word character, so tag terms come first
+		while ti < len(ptr) - 1 and self._mm[vs + ptr[ti]:vs + ptr[ti] + 1] == b"#":
+			yield ti
+			ti += 1
+
+	def tag_postings(self) -> Dict[str, List[int]]:
+		"""Lowercased annotation tag -> ordinals of items carrying it (items with text only)."""
+		return {self.term(ti)[1:]: list(self.postings(ti)[0]) for ti in self._tag_terms()}
+
+	def _terms_containing(self, word: str) -> Iterable[int]:
+		vs, vl = self._sections["vocab"]
+		end = vs + vl
+		ptr = self._array("vocab_ptr")
+		needle = word.encode("utf-8")
+		pos = self._mm.find(needle, vs, end)
+		while pos != -1:
+			ti = bisect_right(ptr, pos - vs) - 1
+			yield ti
+			# One hit per term is enough; resume at the next vocabulary entry
+			pos = self._mm.find(needle, vs + ptr[ti + 1], end)
+
+	def _containing(self, word: str, meta: bool) -> set:
+		"""Ordinals whose text has a word containing `word` (a run of word characters)."""
+		vs = self._sections["vocab"][0]
+		ptr = self._array("vocab_ptr")
+		out: set = set()
+		for ti in self._terms_containing(word):
+			kind = self._mm[vs + ptr[ti]:vs + ptr[ti] + 1]
+			if kind == b"#" or (kind == b"@" and not meta):
+				continue
+			out.update(self.postings(ti)[0])
+		return out
+
+	def _text(self, ordinal: int, meta: bool) -> str:
+		obj = self.item(ordinal)
+		if not isinstance(obj, dict):
+			return ""
+		base, meta_text = _item_texts(obj)
+		text = (base + ("\n" + meta_text if meta_text else "")).strip() if meta else base
+		return text.lower()
+
+	def search(
+		self,
+		query: str,
+		k: int = 10,
+		meta: bool = True,
+		tag_boost: int = 0,
+		accept: Optional[Callable[[dict], bool]] = None,
+	) -> Optional[List[Tuple[int, dict]]]:
+		"""Top-k (score, item) pairs, best first and ties in file order.
+
+		meta=True scores user/assistant plus annotation meta text (index.search_index);
+		meta=False scores user/assistant only. tag_boost adds that much per annotation
+		tag contained in the query. accept (e.g. a metadata filter) is applied in rank
+		order, so only candidates up to the k-th accepted item are decoded. Returns
+		None when the query needs a full scan.
+		"""
+		q_low = (query or "").lower()
+		tokens = q_low.split()
+		matches: Dict[str, set] = {}
+		for tok in dict.fromkeys(tokens):
+			if _WORD.fullmatch(tok):
+				matches[tok] = self._containing(tok, meta)
+				continue
+			parts = list(dict.fromkeys(_WORD.findall(tok)))
+			if not parts:
+				return None
+			cand: Optional[set] = None
+			for part in parts:
+				found = self._containing(part, meta)
+				cand = found if cand is None else cand & found
+				if not cand:
+					break
+			matches[tok] = {i for i in cand or () if tok in self._text(i, meta)}
+		scores: Counter = Counter()
+		for tok in tokens:
+			scores.update(matches[tok])
+		if tag_boost:
+			for ti in self._tag_terms():
+				tag = self.term(ti)[1:]
+				if tag and tag in q_low:
+					ords, tfs = self.postings(ti)
+					for o, n in zip(ords, tfs):
+						scores[o] += tag_boost * n
+		best = sorted((-s, i) for i, s in scores.items() if s > 0)
+		k = max(0, int(k))
+		if accept is None:
+			best = best[:k]
+		out: List[Tuple[int, dict]] = []
+		for neg, i in best:
+			if len(out) >= k:
+				break
+			obj = self.item(i)
+			if isinstance(obj, dict) and (accept is None or accept(obj)):
+				out.append((-neg, obj))
+		return out
+
+
+# Open sidecars by JSONL path; reused while neither file changes
+_OPEN: Dict[str, InvertedIndex] = {}
+
+
+def open_inverted_index(index_path: str) -> Optional[InvertedIndex]:
+	"""The sidecar for index_path if it exists and matches the JSONL's size and mtime."""
+	return sidecarmod.open_sidecar(InvertedIndex, _OPEN, index_path, inverted_index_path(index_path))
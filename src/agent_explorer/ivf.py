@@ -0,0 +1,177 @@
+"""Inverted-file (IVF) ANN index over a flat vector store (<db>.<table>.ivf.npz).
+
+Spherical k-means centroids split the rows into nlist lists. A query scores the
+centroids, scans the rows of the nprobe closest lists exactly and keeps the top-k,
+so nprobe trades recall for latency (nprobe >= nlist is exhaustive). Rows added
+later are assigned to their nearest centroid without retraining; rebuild with
+build_ivf once the corpus has drifted. The file records the stat of the flat store
+it was built for and is ignored (exact search is used) when they disagree.
+"""
+from __future__ import annotations
+
+import os
+from typing import Optional, Tuple
+
+from .paths import expand_abs
+
+
+_FORMAT = 1
+# Rows scored per matrix product when assigning or training
+_CHUNK = 16384
+
+
+def ivf_path(db_path: str, table: str = "vec_index") -> str:
+	return f"{expand_abs(db_path)}.{table}.ivf.npz"
+
+
+def default_nlist(n_rows: int) -> int:
+	return max(1, min(n_rows, int(4 * n_rows ** 0.5)))
+
+
+def default_nprobe() -> int:
+	try:
+		return max(0, int(os.getenv("AGENT_VEC_NPROBE", "8")))
+	except Exception:
+		return 8
+
+
+def nearest_centroid(vectors, centroids):
+	"""Index of the highest-scoring centroid for each row (int32)."""
+	import numpy as np
+
+	out = np.empty(len(vectors), dtype=np.int32)
+	for i in range(0, len(vectors), _CHUNK):
+		block = np.asarray(vectors[i:i + _CHUNK], dtype=np.float32)
+		out[i:i + len(block)] = np.argmax(block @ centroids.T, axis=1)
+	return out
+
+
+def train_centroids(matrix, nlist: int, iters: int = 10, sample: Optional[int] = None, seed: int = 0):
+	"""Spherical k-means on a row sample; returns unit-length (nlist, dim) float32 centroids."""
+	import numpy as np
+
+	rng = np.random.default_rng(seed)
+	n = len(matrix)
+	nlist = max(1, min(int(nlist), n))
+	size = min(n, sample or max(nlist * 64, 10000))
+	picks = np.sort(rng.choice(n, size=size, replace=False)) if size < n else np.arange(n)
+	data = np.asarray(matrix[picks], dtype=np.float32)
+	centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+	for _ in range(max(1, iters)):
+		labels = nearest_centroid(data, centroids)
+		order = np.argsort(labels, kind="stable")
+		counts = np.bincount(labels, minlength=nlist)
+		filled = np.flatnonzero(counts)
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+		sums = np.add.reduceat(data[order], starts, axis=0)
+		centroids[filled] = sums
+		empty = np.flatnonzero(counts == 0)
+		if len(empty):
+			# Reseed empty lists from random sample rows
+			centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+		norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+		centroids /= np.where(norms > 0, norms, 1.0)
+	return centroids
+
+
+class IVFIndex:
+	"""Centroids plus a list assignment per flat-store row."""
+
+	def __init__(self, centroids, assign, store_key: tuple = ()) -> None:
+		import numpy as np
+
+		self.centroids = np.asarray(centroids, dtype=np.float32)
+		self.assign = np.asarray(assign, dtype=np.int32)
+		self.store_key = tuple(store_key)
+		self._lists: Optional[Tuple] = None
+
+	@property
+	def nlist(self) -> int:
+		return len(self.centroids)
+
+	def __len__(self) -> int:
+		return len(self.assign)
+
+	def lists(self):
+		"""(row ids grouped by list, list start pointers of length nlist + 1)."""
+		import numpy as np
+
+		if self._lists is None:
+			order = np.argsort(self.assign, kind="stable").astype(np.int64)
+			ptr = np.zeros(self.nlist + 1, dtype=np.int64)
+			np.cumsum(np.bincount(self.assign, minlength=self.nlist), out=ptr[1:])
+			self._lists = (order, ptr)
+		return self._lists
+
+	def add(self, vectors) -> None:
+		"""Append rows (in flat-store order) to their nearest lists."""
+		import numpy as np
+
+		self.assign = np.concatenate([self.assign, nearest_centroid(vectors, self.centroids)])
+		self._lists = None
+
+	def candidates(self, q, nprobe: int):
+		"""Sorted row ids in the nprobe lists whose centroids score highest for q."""
+		import numpy as np
+
+		p = max(1, min(int(nprobe), self.nlist))
+		scores = self.centroids @ q
+		probe = np.argpartition(scores, self.nlist - p)[self.nlist - p:] if p < self.nlist else np.arange(self.nlist)
+		order, ptr = self.lists()
+		cand = np.concatenate([order[ptr[c]:ptr[c + 1]] for c in probe])
+		cand.sort()
+		return cand
+
+	def search(self, matrix, q, k: int, nprobe: int):
+		"""(row ids, scores) of the best k candidate rows, descending by score."""
+		import numpy as np
+
+		cand = self.candidates(q, nprobe)
+		if len(cand) == 0 or k <= 0:
+			return cand[:0], np.empty(0, dtype=np.float32)
+		scores = matrix[cand] @ q
+		k = min(k, len(cand))
+		top = np.argpartition(scores, len(cand) - k)[len(cand) - k:]
+		top = top[np.argsort(-scores[top], kind="stable")]
+		return cand[top], scores[top]
+
+	def save(self, path: str, store_key: tuple) -> None:
+		import numpy as np
+
+		self.store_key = tuple(store_key)
+		tmp = path + ".tmp"
+		with open(tmp, "wb") as f:
+			np.savez(f, format=np.int64(_FORMAT), centroids=self.centroids, assign=self.assign, store_key=np.asarray(self.store_key, dtype=np.int64))
+		os.replace(tmp, path)
+
+
+def open_ivf(db_path: str, table: str, store) -> Optional[IVFIndex]:
+	"""The IVF index for a flat store (see flatvec.open_flat_vectors), if built for this version of it."""
+	import numpy as np
+
+	path = ivf_path(db_path, table)
+	if store is None or not os.path.exists(path):
+		return None
+	try:
+		with np.load(path) as z:
+			if int(z["format"]) != _FORMAT:
+				return None
+			idx = IVFIndex(z["centroids"], z["assign"], tuple(int(x) for x in z["store_key"]))
+	except Exception:
+		return None
+	if idx.store_key != tuple(store.key) or len(idx) != len(store) or idx.centroids.shape[1:] != (store.dim,):
+		return None
+	return idx
+
+
+def build_ivf(db_path: str, table: str = "vec_index", nlist: Optional[int] = None, iters: int = 10, seed: int = 0) -> IVFIndex:
+	"""Train centroids on the flat store for (db_path, table), assign every row and save."""
+	from . import flatvec as flatmod
+
+	store = flatmod.open_flat_vectors(db_path, table)
+	if store is None or len(store) == 0:
+		raise FileNotFoundError(f"no flat vector store at {flatmod.flat_paths(db_path, table)[0]}")
+	centroids = train_centroids(store.matrix, nlist or default_nlist(len(store)), iters=iters, seed=seed)
+	idx = IVFIndex(centroids, nearest_centroid(store.matrix, centroids))
+	idx.save(ivf_path(db_path, table), store.key)
+	return idx
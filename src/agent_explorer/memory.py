@@ -9,7 +9,9 @@ import hashlib
 from typing import Dict, List, Optional, Any, Tuple
 
 from .paths import expand_abs
+from . import filters as filtersmod
 from . import index as indexmod
+from . import inverted as invmod
 import llm_utils as llmmod
 import llm_cache
 
@@ -54,7 +56,8 @@ def _get_index_mtime(index_path: str) -> Optional[float]:
 def _is_index_stale(index_path: str, db_path: Optional[str] = None) -> bool:
 	"""Check if index is stale compared to source DB.
 	
-	Returns True if index doesn't exist or is older than source DB.
+	Returns True if index doesn't exist or is older than source DB. The index counts
+	as fresh as of its last build or incremental check (manifest mtime).
 	Handles file system errors gracefully.
 	"""
 	if not os.path.exists(index_path):
@@ -65,6 +68,11 @@ def _is_index_stale(index_path: str, db_path: Optional[str] = None) -> bool:
 	except OSError:
 		# File may have been deleted or is inaccessible
 		return True
+	# An incremental build that found nothing changed only refreshes the manifest
+	try:
+		index_mtime = max(index_mtime, os.path.getmtime(indexmod.index_manifest_path(index_path)))
+	except OSError:
+		pass
 
 	# Check if source DB is newer
 	if db_path and os.path.exists(db_path):
@@ -104,20 +112,30 @@ def ensure_indexed(
 	if not index_exists or index_stale or force:
 		if os.getenv("CURSOR_VERBOSE"):
 			print(f"Building index: {index_path} (stale={index_stale}, force={force})", file=sys.stderr)
+		# Incremental unless forced: only new/changed composers are rebuilt (see index manifest)
 		count = indexmod.build_index(
 			index_path,
 			db_path=db_path,
 			limit_composers=None,
 			max_turns_per=None,
+			incremental=not force,
 		)
 		index_exists = count > 0
+	else:
+		# Indexes built before the sidecars existed: add them without a rebuild
+		try:
+			if invmod.open_inverted_index(index_path) is None:
+				invmod.build_inverted_index(index_path)
+		except Exception:
+			pass
 
 	# Check if vec DB exists and is up-to-date with index
-	vec_exists = os.path.exists(vec_path) and os.path.getsize(vec_path) > 0
+	vec_file = indexmod.vec_store_file(vec_path)
+	vec_exists = os.path.exists(vec_file) and os.path.getsize(vec_file) > 0
 	vec_stale = False
 	if vec_exists and index_exists:
 		# Check if vec DB is older than index
-		vec_mtime = os.path.getmtime(vec_path)
+		vec_mtime = os.path.getmtime(vec_file)
 		index_mtime = _get_index_mtime(index_path)
 		if index_mtime and index_mtime > vec_mtime:
 			vec_stale = True
@@ -158,6 +176,7 @@ def find_solution(
 	k: int = 10,
 	auto_index: bool = True,
 	use_cache: bool = True,
+	filters: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
 	"""Find past solutions to a problem (cached and idempotent).
 	
@@ -165,6 +184,9 @@ def find_solution(
 	1. Ensures indexes exist (if auto_index, idempotent)
 	2. Searches for relevant conversations (cached)
 	3. Returns structured results with conversation context
+
+	filters (repo, kind, flags, tags; see filters.normalize_filters) are pushed down
+	into each search method rather than applied to the fused results.
 	"""
 	# Ensure indexes exist (idempotent)
 	if auto_index:
@@ -176,14 +198,16 @@ def find_solution(
 		return {"error": "Index not found. Run 'index' command first or set auto_index=True."}
 
 	query_normalized = query.strip()[:1000]
+	f_norm = filtersmod.normalize_filters(filters)
+	filter_key = (json.dumps(f_norm, sort_keys=True),) if f_norm else ()
 
 	# Check cache for search results (cache key includes query, k, and index mtime)
 	cache_key = None
 	cache_hit = False
 	if use_cache:
 		index_mtime = _get_index_mtime(index_jsonl)
-		cache_key = _cache_key("find-solution", query_normalized, k, index_jsonl, index_mtime or 0)
-		cached = llm_cache.get(cache_key)
+		cache_key = _cache_key("find-solution", query_normalized, k, index_jsonl, index_mtime or 0, *filter_key)
+		cached = llm_cache.get(cache_key, ns="search")
 		if cached:
 			try:
 				result = json.loads(cached)
@@ -199,9 +223,9 @@ def find_solution(
 	jsonl_results: List[Dict] = []
 	
 	# Vector search (if available)
-	if vec_db and os.path.exists(vec_db):
+	if vec_db and os.path.exists(indexmod.vec_store_file(vec_db)):
 		try:
-			vector_results = indexmod.vec_search(vec_db, "vec_index", query, top_k=k * 2)
+			vector_results = indexmod.vec_search(vec_db, "vec_index", query, top_k=k * 2, filters=f_norm)
 		except Exception:
 			pass
 
@@ -210,9 +234,9 @@ def find_solution(
 	items_db = envmod.get_items_db_path()
 	if os.path.exists(items_db):
 		try:
-			sparse_results = indexmod.items_search(items_db, "items", query_normalized, k=k * 2)  # Get more for fusion
-			except Exception:
-				pass
+			sparse_results = indexmod.items_search(items_db, "items", query_normalized, k=k * 2, filters=f_norm)  # Get more for fusion
+		except Exception:
+			pass
 
 	# JSONL search (always available as fallback, but also used for fusion)
 	if not vector_results and not sparse_results:
@@ -221,51 +245,62 @@ def find_solution(
 			from . import rag as ragmod
 			_score = ragmod._score
 
-			# Use streaming approach for large files - process line by line
-			# Keep only top candidates in memory to avoid memory issues
-			best_results: List[Tuple[float, Dict]] = []  # (score, item)
-
-			with open(index_jsonl, "r", encoding="utf-8") as f:
-				malformed_count = 0
-				for line_num, line in enumerate(f, 1):
-					line = line.strip()
-					if not line:  # Skip empty lines
-						continue
-					try:
-						obj = json.loads(line)
-						# Build searchable text
-						user = obj.get("user", "") or ""
-						assistant = obj.get("assistant", "") or ""
-						text = (user + "\n" + assistant).strip()
-						if not text:
+			# Seek through the inverted-index sidecar when current; same scores as the scan below
+			hits = None
+			inv = invmod.open_inverted_index(index_jsonl)
+			if inv is not None:
+				accept = (lambda obj: filtersmod.item_matches(obj, f_norm)) if f_norm else None
+				hits = inv.search(query_normalized, k * 2, meta=False, tag_boost=2, accept=accept)
+			if hits is not None:
+				jsonl_results = [item for score, item in hits]
+			else:
+				# Use streaming approach for large files - process line by line
+				# Keep only top candidates in memory to avoid memory issues
+				best_results: List[Tuple[float, Dict]] = []  # (score, item)
+
+				with open(index_jsonl, "r", encoding="utf-8") as f:
+					malformed_count = 0
+					for line_num, line in enumerate(f, 1):
+						line = line.strip()
+						if not line:  # Skip empty lines
+							continue
+						try:
+							obj = json.loads(line)
+							if f_norm and not filtersmod.item_matches(obj, f_norm):
+								continue
+							# Build searchable text
+							user = obj.get("user", "") or ""
+							assistant = obj.get("assistant", "") or ""
+							text = (user + "\n" + assistant).strip()
+							if not text:
+								continue
+
+							# Quick score check - only keep top candidates
+							score = _score(query_normalized, text)
+							# Light boost for tags (same as search_items)
+							ann = obj.get("annotations") or {}
+							tags = ann.get("tags") or []
+							for t in tags:
+								if t and t.lower() in query_normalized.lower():
+									score += 2
+
+							if score > 0:
+								best_results.append((score, obj))
+								# Keep only top k*2 candidates during scan to limit memory
+								if len(best_results) > k * 2:
+									best_results.sort(key=lambda x: x[0], reverse=True)
+									best_results = best_results[:k * 2]
+						except json.JSONDecodeError:
+							malformed_count += 1
+							continue
+						except (AttributeError, KeyError, TypeError):
 							continue
 
-						# Quick score check - only keep top candidates
-						score = _score(query_normalized, text)
-						# Light boost for tags (same as search_items)
-						ann = obj.get("annotations") or {}
-						tags = ann.get("tags") or []
-						for t in tags:
-							if t and t.lower() in query_normalized.lower():
-								score += 2
-
-						if score > 0:
-							best_results.append((score, obj))
-							# Keep only top k*2 candidates during scan to limit memory
-							if len(best_results) > k * 2:
-								best_results.sort(key=lambda x: x[0], reverse=True)
-								best_results = best_results[:k * 2]
-					except json.JSONDecodeError:
-						malformed_count += 1
-						continue
-					except (AttributeError, KeyError, TypeError):
-						continue
-
-			# Sort and return top k*2 for potential fusion
-			best_results.sort(key=lambda x: x[0], reverse=True)
-			jsonl_results = [item for score, item in best_results[:k * 2]]
-			except Exception:
-				pass
+				# Sort and return top k*2 for potential fusion
+				best_results.sort(key=lambda x: x[0], reverse=True)
+				jsonl_results = [item for score, item in best_results[:k * 2]]
+		except Exception:
+			pass
 
 	# Fuse results using rank-fusion if multiple sources available
 	results: List[Dict] = []
@@ -416,10 +451,12 @@ def find_solution(
 		"match_type": overall_match_type,  # Overall match type (vector/sparse/fusion)
 		"search_method": search_method,  # Which search method was used (vector/sparse/jsonl/fusion)
 	}
+	if f_norm:
+		result["filters"] = f_norm
 
 	# Cache the result
 	if use_cache and cache_key and not cache_hit:
-		llm_cache.set(cache_key, json.dumps(result, ensure_ascii=False))
+		llm_cache.set(cache_key, json.dumps(result, ensure_ascii=False), ns="search")
 
 	return result
 
@@ -464,7 +501,7 @@ def remember(
 		cache_key = _cache_key("remember", query_normalized, model or "default", *result_ids)
 
 		# Try cache first
-		cached = llm_cache.get(cache_key)
+		cached = llm_cache.get(cache_key, ns="recall")
 		if cached:
 			try:
 				memory_summary = json.loads(cached)
@@ -522,6 +559,7 @@ Provide a concise summary of what was discussed, key points, and any decisions m
 						prompt_tokens=usage.prompt_tokens if usage else None,
 						completion_tokens=usage.completion_tokens if usage else None,
 						total_tokens=usage.total_tokens if usage else None,
+						ns="recall",
 					)
 				elif hasattr(client, "messages") and hasattr(client.messages, "create"):
 					# Anthropic style
@@ -541,6 +579,7 @@ Provide a concise summary of what was discussed, key points, and any decisions m
 						prompt_tokens=usage.input_tokens if usage else None,
 						completion_tokens=usage.output_tokens if usage else None,
 						total_tokens=(usage.input_tokens + usage.output_tokens) if usage else None,
+						ns="recall",
 					)
 				else:
 					# Fallback for other client types
@@ -636,7 +675,7 @@ def find_design_plans(
 		cache_key = _cache_key("design-coherence", model or "default", *topics_normalized, *conv_ids)
 
 		# Try cache first
-		cached = llm_cache.get(cache_key)
+		cached = llm_cache.get(cache_key, ns="recall")
 		if cached:
 			try:
 				coherence_summary = json.loads(cached)
@@ -699,6 +738,7 @@ Format as JSON with keys: themes (array), plans (array of {{topic, description,
 						prompt_tokens=usage.prompt_tokens if usage else None,
 						completion_tokens=usage.completion_tokens if usage else None,
 						total_tokens=usage.total_tokens if usage else None,
+						ns="recall",
 					)
 				else:
 					text = "{}"
@@ -0,0 +1,176 @@
+"""Lookups by item id or composer into the JSONL turn index.
+
+Each item id ("<composer_id>:<turn_index>") and composer is mapped to item
+ordinals, whose byte ranges in the JSONL come from the inverted-index sidecar
+(<index>.inv, see inverted.py): OffsetsBuilder contributes the id and composer
+sections to that file and IndexOffsets reads them back, so callers can fetch
+specific records by seeking through mmap instead of decoding the whole file.
+When ids repeat, lookups return the last occurrence (like loading into a dict).
+"""
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import sidecar as sidecarmod
+
+
+# (name, array typecode) of the sections this module adds; byte sections use None
+SECTIONS = (
+	("ids", None),
+	("id_ptr", "Q"),
+	("id_order", "I"),
+	("composers", None),
+	("composer_ptr", "Q"),
+	("members", "I"),
+	("member_ptr", "Q"),
+	("composer_order", "I"),
+)
+_STRING_PTRS = {"ids": "id_ptr", "composers": "composer_ptr"}
+
+
+def item_id(obj: dict) -> str:
+	return f"{obj.get('composer_id')}:{obj.get('turn_index')}"
+
+
+class OffsetsBuilder:
+	"""Accumulates item ids in JSONL order; blobs() returns the id and composer sections."""
+
+	def __init__(self) -> None:
+		self._ids: List[str] = []
+		self._composers: Dict[str, List[int]] = {}
+
+	@property
+	def n_composers(self) -> int:
+		return len(self._composers)
+
+	def add(self, ident: str, composer_id: Optional[str]) -> None:
+		self._composers.setdefault(str(composer_id), []).append(len(self._ids))
+		self._ids.append(ident)
+
+	def add_item(self, obj: dict) -> None:
+		self.add(item_id(obj), obj.get("composer_id"))
+
+	def blobs(self) -> Dict[str, bytes]:
+		ids_blob, id_ptr = sidecarmod.strings_blob(self._ids)
+		cids = list(self._composers)
+		cids_blob, composer_ptr = sidecarmod.strings_blob(cids)
+		members = array("I")
+		member_ptr = array("Q", [0])
+		for cid in cids:
+			members.extend(self._composers[cid])
+			member_ptr.append(len(members))
+		# Sorted by (bytes, position) so a binary search finds every duplicate together
+		id_order = array("I", sorted(range(len(self._ids)), key=lambda i: (self._ids[i].encode("utf-8"), i)))
+		composer_order = array("I", sorted(range(len(cids)), key=lambda i: cids[i].encode("utf-8")))
+		return {
+			"ids": ids_blob,
+			"id_ptr": sidecarmod.to_le(id_ptr),
+			"id_order": sidecarmod.to_le(id_order),
+			"composers": cids_blob,
+			"composer_ptr": sidecarmod.to_le(composer_ptr),
+			"members": sidecarmod.to_le(members),
+			"member_ptr": sidecarmod.to_le(member_ptr),
+			"composer_order": sidecarmod.to_le(composer_order),
+		}
+
+
+class IndexOffsets(sidecarmod.Sidecar):
+	"""Id and composer lookups over a sidecar carrying SECTIONS; see open_offsets_index."""
+
+	@property
+	def n_composers(self) -> int:
+		return int(self.header["n_composers"])
+
+	def _entry(self, section: str, i: int) -> bytes:
+		return self._string(section, _STRING_PTRS[section], i)
+
+	def _find(self, section: str, order_name: str, target: bytes) -> int:
+		"""Leftmost position in order_name whose string is >= target (binary search)."""
+		order = self._array(order_name)
+		lo, hi = 0, len(order)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._entry(section, order[mid]) < target:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	def ident(self, ordinal: int) -> str:
+		return self._entry("ids", ordinal).decode("utf-8")
+
+	def ordinal(self, ident: str) -> Optional[int]:
+		target = ident.encode("utf-8")
+		order = self._array("id_order")
+		pos = self._find("ids", "id_order", target)
+		found = None
+		while pos < len(order) and self._entry("ids", order[pos]) == target:
+			found = order[pos]
+			pos += 1
+		return found
+
+	def locate(self, ident: str) -> Optional[Tuple[int, int]]:
+		"""(byte offset, length) of the item's line in the JSONL, or None."""
+		i = self.ordinal(ident)
+		return None if i is None else (self.offsets[i], self.lengths[i])
+
+	def get(self, ident: str) -> Optional[dict]:
+		i = self.ordinal(ident)
+		return None if i is None else self.item_at(i)
+
+	def get_many(self, idents: Iterable[str]) -> Dict[str, dict]:
+		"""Items for the ids that exist, keyed by id."""
+		out: Dict[str, dict] = {}
+		for ident in idents:
+			if ident not in out:
+				obj = self.get(ident)
+				if obj is not None:
+					out[ident] = obj
+		return out
+
+	def composer_ids(self) -> List[str]:
+		"""Composer ids in order of first appearance in the JSONL."""
+		return [self._entry("composers", i).decode("utf-8") for i in range(self.n_composers)]
+
+	def composer_ordinals(self, composer_id: str) -> List[int]:
+		"""Ordinals of a composer's items, in file order (empty if unknown)."""
+		target = str(composer_id).encode("utf-8")
+		order = self._array("composer_order")
+		pos = self._find("composers", "composer_order", target)
+		if pos >= len(order) or self._entry("composers", order[pos]) != target:
+			return []
+		ptr = self._array("member_ptr")
+		members = self._array("members")
+		ci = order[pos]
+		return list(members[ptr[ci]:ptr[ci + 1]])
+
+	def composer_range(self, composer_id: str) -> Optional[Tuple[int, int]]:
+		"""(byte offset, length) spanning a composer's lines, or None if unknown."""
+		ords = self.composer_ordinals(composer_id)
+		if not ords:
+			return None
+		first, last = ords[0], ords[-1]
+		return self.offsets[first], self.offsets[last] + self.lengths[last] - self.offsets[first]
+
+	def composer_items(self, composer_id: str) -> List[dict]:
+		out: List[dict] = []
+		for i in self.composer_ordinals(composer_id):
+			obj = self.item_at(i)
+			if obj is not None:
+				out.append(obj)
+		return out
+
+
+def open_offsets_index(index_path: str) -> Optional[IndexOffsets]:
+	"""Id/composer lookups for index_path: its inverted-index sidecar, if current."""
+	from . import inverted as invmod
+
+	return invmod.open_inverted_index(index_path)
+
+
+def build_offsets_index(index_path: str) -> int:
+	"""Build the sidecar that open_offsets_index reads; returns the item count."""
+	from . import inverted as invmod
+
+	return invmod.build_inverted_index(index_path)
@@ -1,5 +1,6 @@
 import json
-from typing import Iterable, List, Optional, Tuple
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from . import db as dbmod
 from .formatting import to_text
@@ -14,7 +15,7 @@ def parse_json(value: object) -> Optional[dict]:
 
 
 def list_composer_ids(conn) -> List[str]:
-	keys = dbmod.composer_data_keys(conn, limit=10_000)
+	keys = dbmod.composer_data_keys(conn)
 	ids: List[str] = []
 	for k in keys:
 		# Expect format composerData:<uuid>
@@ -48,18 +49,83 @@ def load_bubble(conn, composer_id: str, bubble_id: str) -> Optional[dict]:
 	return parse_json(val)
 
 
+def load_bubbles(conn, composer_id: str) -> Dict[str, dict]:
+	"""Load every bubble of a composer in one key-range scan, keyed by bubble id.
+
+	Callers restore header order themselves. Raises sqlite3.Error if the scan
+	fails, in which case load_bubble per header is the fallback.
+	"""
+	prefix = f"bubbleId:{composer_id}:"
+	bubbles: Dict[str, dict] = {}
+	for key, val in dbmod.kv_prefix_items(conn, prefix):
+		obj = parse_json(val)
+		if obj:
+			bubbles[key[len(prefix):]] = obj
+	return bubbles
+
+
+# Only these fields of a bubble are needed to rebuild a conversation
+_BUBBLE_FIELDS = ("text", "content")
+
+
+def load_bubble_fields(conn, composer_id: str) -> Dict[str, dict]:
+	"""Like load_bubbles, but returns only text/content for each bubble.
+
+	Fields are projected with json_extract inside SQLite so large tool outputs and
+	attachments are never decoded in Python. Falls back to load_bubbles when JSON1
+	is unavailable.
+	"""
+	prefix = f"bubbleId:{composer_id}:"
+	try:
+		return {
+			key[len(prefix):]: dict(zip(_BUBBLE_FIELDS, vals))
+			for key, vals in dbmod.iter_kv_json_fields(conn, prefix, [f"$.{f}" for f in _BUBBLE_FIELDS])
+		}
+	except sqlite3.OperationalError:
+		pass
+	bubbles: Dict[str, dict] = {}
+	for bid, obj in load_bubbles(conn, composer_id).items():
+		if isinstance(obj, dict):
+			bubbles[bid] = {f: obj.get(f) for f in _BUBBLE_FIELDS}
+	return bubbles
+
+
+def load_bubble_headers(conn, composer_id: str) -> Optional[List[Tuple[str, Optional[int], Optional[str]]]]:
+	"""Read a composer's bubble headers without materializing the composer object.
+
+	Returns the same tuples as iter_bubble_headers, or None if the composer is
+	missing. Falls back to load_composer when JSON1 is unavailable.
+	"""
+	try:
+		fields = dbmod.kv_json_fields(conn, f"composerData:{composer_id}", ["$.fullConversationHeadersOnly"])
+	except sqlite3.OperationalError:
+		composer = load_composer(conn, composer_id)
+		return list(iter_bubble_headers(composer)) if composer else None
+	if fields is None:
+		return None
+	return list(iter_bubble_headers({"fullConversationHeadersOnly": fields[0]}))
+
+
 def bubble_role(bubble_type: Optional[int]) -> str:
 	# Empirically: 1=user, 2=assistant
 	return "user" if bubble_type == 1 else "assistant"
 
 
-def reconstruct_conversation(conn, composer_id: str) -> List[dict]:
-	composer = load_composer(conn, composer_id)
-	if not composer:
+def reconstruct_conversation(conn, composer_id: str, composer: Optional[dict] = None) -> List[dict]:
+	if composer is not None:
+		headers = list(iter_bubble_headers(composer)) if composer else None
+	else:
+		headers = load_bubble_headers(conn, composer_id)
+	if not headers:
 		return []
+	try:
+		bubbles: Optional[Dict[str, dict]] = load_bubble_fields(conn, composer_id)
+	except sqlite3.Error:
+		# Bulk scan unavailable (e.g. unexpected schema); load bubbles one by one
+		bubbles = None
 	messages: List[dict] = []
-	for bubble_id, bubble_type, server_bubble_id in iter_bubble_headers(composer):
-		bubble = load_bubble(conn, composer_id, bubble_id)
+	for bubble_id, bubble_type, server_bubble_id in headers:
+		bubble = bubbles.get(bubble_id) if bubbles is not None else load_bubble(conn, composer_id, bubble_id)
 		if not bubble:
 			continue
 		text = bubble.get("text") if isinstance(bubble, dict) else None
@@ -88,6 +154,9 @@ def _walk_dict(d):
 				yield _
 
 
+_REPO_KEY_PATTERNS = ("repo", "repository", "git", "workspace", "root", "cwd", "path", "url")
+
+
 def extract_repo_hint(composer_obj: Optional[dict]) -> Optional[str]:
 	"""Best-effort extraction of repository/workspace hint from a composer object.
 
@@ -98,15 +167,30 @@ def extract_repo_hint(composer_obj: Optional[dict]) -> Optional[str]:
 	"""
 	if not composer_obj:
 		return None
-	key_pat = ("repo", "repository", "git", "workspace", "root", "cwd", "path", "url")
 	candidates: list[str] = []
 	for k, v in _walk_dict(composer_obj):
 		try:
 			kl = str(k).lower() if k is not None else ""
-			if any(p in kl for p in key_pat) and isinstance(v, str) and v:
+			if any(p in kl for p in _REPO_KEY_PATTERNS) and isinstance(v, str) and v:
 				candidates.append(v)
 		except Exception:
 			continue
+	return _pick_repo_hint(candidates)
+
+
+def load_repo_hint(conn, composer_id: str) -> Optional[str]:
+	"""extract_repo_hint for a stored composer, matching candidate fields inside SQLite.
+
+	Falls back to decoding the composer in Python when JSON1 is unavailable.
+	"""
+	try:
+		found = dbmod.kv_json_string_fields(conn, f"composerData:{composer_id}", _REPO_KEY_PATTERNS)
+	except sqlite3.OperationalError:
+		return extract_repo_hint(load_composer(conn, composer_id))
+	return _pick_repo_hint([v for _, v in found])
+
+
+def _pick_repo_hint(candidates: List[str]) -> Optional[str]:
 	# Rank candidates: git remotes > paths with separators > other strings
 	def score(s: str) -> tuple[int, int]:
 		is_git = ("github.com" in s.lower()) or s.lower().endswith(".git")
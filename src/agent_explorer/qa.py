@@ -4,6 +4,7 @@ import json
 from typing import Dict, List, Optional
 import os
 import re
+import sqlite3
 from . import db as dbmod
 from . import parser as parsermod
 from .paths import default_db_path
@@ -120,16 +121,19 @@ def analyze_db(db_path: Optional[str] = None, limit_composers: Optional[int] = N
 	anomalies: List[Dict] = []
 
 	for cid in composer_ids:
-		composer = parsermod.load_composer(conn, cid)
-		if not composer:
+		headers = parsermod.load_bubble_headers(conn, cid)
+		if headers is None:
 			continue
-		headers = list(parsermod.iter_bubble_headers(composer))
 		metrics["chats"] += 1
 		metrics["headers_total"] += len(headers)
 		loaded_count = 0
 		messages: List[dict] = []
+		try:
+			bubbles: Optional[Dict[str, dict]] = parsermod.load_bubble_fields(conn, cid)
+		except sqlite3.Error:
+			bubbles = None
 		for bubble_id, bubble_type, server_bubble_id in headers:
-			bubble = parsermod.load_bubble(conn, cid, bubble_id)
+			bubble = bubbles.get(bubble_id) if bubbles is not None else parsermod.load_bubble(conn, cid, bubble_id)
 			if bubble:
 				loaded_count += 1
 				text = (bubble.get("text") or bubble.get("content") or "") if isinstance(bubble, dict) else ""
@@ -197,13 +201,21 @@ def _build_item_snippet(obj: Dict) -> str:
 	)
 
 
-def llm_find_issues(index_jsonl: str, n: int = 40, model: Optional[str] = None, seed: Optional[int] = None) -> Dict:
+def llm_find_issues(
+	index_jsonl: str,
+	n: int = 40,
+	model: Optional[str] = None,
+	seed: Optional[int] = None,
+	stratify: Optional[str] = None,
+) -> Dict:
 	"""Randomly sample items and ask an LLM to find problems and fixes per item.
 
+	seed and stratify ("composer" or "tag") are passed to index.sample_index.
+
 	Returns: { items: [{id, issues:[..], severity, suggestions:[..]}], prompt_tokens, completion_tokens }
 	"""
 	index_jsonl = expand_abs(index_jsonl)
-	items = indexmod.sample_index(index_jsonl, max(1, int(n)))
+	items = indexmod.sample_index(index_jsonl, max(1, int(n)), seed=seed, stratify=stratify)
 	if not items:
 		return {"items": [], "sample_count": 0}
 	client = llmmod.require_client()
@@ -0,0 +1,204 @@
+"""Quantized copies of a flat vector store for a cheap first search pass.
+
+Two codes are supported, each a memory-mapped <db>.<table>.<kind>.npy next to the
+float32 matrix:
+
+- int8: per-dimension symmetric scalar quantization (x / scale * 127), 4x smaller;
+  scores are dot products against the scaled query.
+- binary: one sign bit per dimension packed into bytes, 32x smaller; scores are
+  Hamming distances.
+
+A search shortlists rerank * k rows from the codes and reranks them exactly
+against the float32 rows, so only the shortlist touches the full matrix.
+<db>.<table>.quant.json records the scales and the stat of the store the codes
+were built for; stale codes are ignored.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, Iterable, Optional
+
+from .paths import expand_abs
+
+
+_FORMAT = 1
+KINDS = ("int8", "binary")
+_CHUNK = 65536
+
+
+def quant_paths(db_path: str, table: str = "vec_index") -> Dict[str, str]:
+	base = f"{expand_abs(db_path)}.{table}"
+	out = {kind: f"{base}.{kind}.npy" for kind in KINDS}
+	out["header"] = f"{base}.quant.json"
+	return out
+
+
+def default_kind() -> Optional[str]:
+	kind = (os.getenv("AGENT_VEC_QUANT") or "").strip().lower()
+	return kind if kind in KINDS else None
+
+
+def default_rerank() -> int:
+	try:
+		return max(1, int(os.getenv("AGENT_VEC_RERANK", "8")))
+	except Exception:
+		return 8
+
+
+def _popcount(x):
+	import numpy as np
+
+	if hasattr(np, "bitwise_count"):
+		return np.bitwise_count(x)
+	table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+	return table[x]
+
+
+class QuantizedVectors:
+	"""One code matrix (int8 or packed bits) aligned with the flat store's rows."""
+
+	def __init__(self, kind: str, codes, scale=None) -> None:
+		self.kind = kind
+		self.codes = codes
+		self.scale = scale
+
+	def __len__(self) -> int:
+		return len(self.codes)
+
+	@property
+	def nbytes_per_vector(self) -> int:
+		return int(self.codes.shape[1]) * self.codes.dtype.itemsize
+
+	def _scores(self, codes, q):
+		"""Higher is closer: int8 dot products or negated Hamming distances."""
+		import numpy as np
+
+		if self.kind == "int8":
+			return codes.astype(np.float32) @ (q * self.scale / 127.0).astype(np.float32)
+		bits = np.packbits(q > 0)
+		return -_popcount(np.bitwise_xor(codes, bits)).sum(axis=1, dtype=np.int32)
+
+	def shortlist(self, q, m: int, candidates=None):
+		"""Up to m row ids (sorted) with the best approximate scores, among candidates if given."""
+		import numpy as np
+
+		if candidates is None:
+			n = len(self.codes)
+			# int8 rows are widened to float32 per chunk; small chunks stay in cache
+			step = 2048 if self.kind == "int8" else _CHUNK
+			scores = np.concatenate([self._scores(self.codes[i:i + step], q) for i in range(0, n, step)]) if n else np.empty(0)
+			ids = None
+		else:
+			ids = np.asarray(candidates, dtype=np.int64)
+			n = len(ids)
+			scores = self._scores(self.codes[ids], q) if n else np.empty(0)
+		if m < n:
+			top = np.argpartition(scores, n - m)[n - m:]
+		else:
+			top = np.arange(n)
+		top = np.sort(top) if ids is None else np.sort(ids[top])
+		return top
+
+
+def quantize_int8(matrix):
+	"""Per-dimension int8 scales: max |x| over the rows (1.0 for all-zero dimensions)."""
+	import numpy as np
+
+	scale = np.zeros(matrix.shape[1], dtype=np.float32)
+	for i in range(0, len(matrix), _CHUNK):
+		np.maximum(scale, np.abs(matrix[i:i + _CHUNK]).max(axis=0), out=scale)
+	scale[scale == 0] = 1.0
+	return scale
+
+
+def build_quantized(db_path: str, table: str = "vec_index", kinds: Iterable[str] = KINDS) -> Dict[str, int]:
+	"""Write the requested code matrices for the flat store; returns bytes per vector by kind."""
+	import numpy as np
+	from . import flatvec as flatmod
+
+	kinds = [k for k in kinds if k in KINDS]
+	store = flatmod.open_flat_vectors(db_path, table)
+	if store is None:
+		raise FileNotFoundError(f"no flat vector store at {flatmod.flat_paths(db_path, table)[0]}")
+	paths = quant_paths(db_path, table)
+	n, dim = store.matrix.shape
+	header: Dict = {"format": _FORMAT, "store_key": list(store.key), "kinds": {}}
+	try:
+		with open(paths["header"], "r", encoding="utf-8") as f:
+			prev = json.load(f)
+		# Codes of other kinds stay listed while they match this store
+		if prev.get("format") == _FORMAT and prev.get("store_key") == header["store_key"]:
+			header["kinds"].update({k: v for k, v in (prev.get("kinds") or {}).items() if k in KINDS and k not in kinds})
+	except Exception:
+		pass
+	out: Dict[str, int] = {}
+	for kind in kinds:
+		tmp = paths[kind] + ".tmp.npy"
+		if kind == "int8":
+			scale = quantize_int8(store.matrix)
+			codes = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.int8, shape=(n, dim))
+			for i in range(0, n, _CHUNK):
+				codes[i:i + _CHUNK] = np.clip(np.rint(store.matrix[i:i + _CHUNK] / scale * 127.0), -127, 127)
+			header["kinds"][kind] = {"scale": scale.tolist()}
+		else:
+			codes = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=(n, (dim + 7) // 8))
+			for i in range(0, n, _CHUNK):
+				codes[i:i + _CHUNK] = np.packbits(store.matrix[i:i + _CHUNK] > 0, axis=1)
+			header["kinds"][kind] = {}
+		out[kind] = int(codes.shape[1]) * codes.dtype.itemsize
+		codes.flush()
+		del codes
+		os.replace(tmp, paths[kind])
+	tmp = paths["header"] + ".tmp"
+	with open(tmp, "w", encoding="utf-8") as f:
+		json.dump(header, f)
+	os.replace(tmp, paths["header"])
+	return out
+
+
+def quantized_kinds(db_path: str, table: str = "vec_index") -> list:
+	"""Kinds listed in the header, current or not (so rebuilds can refresh them)."""
+	try:
+		with open(quant_paths(db_path, table)["header"], "r", encoding="utf-8") as f:
+			return [k for k in json.load(f).get("kinds", {}) if k in KINDS]
+	except Exception:
+		return []
+
+
+# Open code matrices by path, with the (store, file) stat key they were opened for
+_OPEN: Dict[str, tuple] = {}
+
+
+def open_quantized(db_path: str, table: str, store, kind: str) -> Optional[QuantizedVectors]:
+	"""The kind's codes for a flat store if they were built for this version of it."""
+	import numpy as np
+
+	if store is None or kind not in KINDS:
+		return None
+	paths = quant_paths(db_path, table)
+	try:
+		st = os.stat(paths[kind])
+		hst = os.stat(paths["header"])
+	except OSError:
+		return None
+	key = (tuple(store.key), st.st_size, st.st_mtime_ns, hst.st_size, hst.st_mtime_ns)
+	cached = _OPEN.get(paths[kind])
+	if cached is not None and cached[0] == key:
+		return cached[1]
+	_OPEN.pop(paths[kind], None)
+	try:
+		with open(paths["header"], "r", encoding="utf-8") as f:
+			header = json.load(f)
+		if header.get("format") != _FORMAT or tuple(header.get("store_key") or ()) != tuple(store.key):
+			return None
+		info = header["kinds"][kind]
+		codes = np.load(paths[kind], mmap_mode="r")
+	except Exception:
+		return None
+	if len(codes) != len(store):
+		return None
+	scale = np.asarray(info["scale"], dtype=np.float32) if kind == "int8" else None
+	qv = QuantizedVectors(kind, codes, scale)
+	_OPEN[paths[kind]] = (key, qv)
+	return qv
@@ -0,0 +1,196 @@
+"""Binary container shared by the JSONL index sidecars (see inverted.py, offsets.py).
+
+A sidecar is a magic string, a little-endian u32 header length, a JSON header
+(format, the JSONL's size and mtime it was built from, section byte ranges) and
+then the sections back to back. Array sections are little-endian; string
+sections are newline-terminated UTF-8 entries addressed by a pointer array.
+Readers memory-map the file and decode sections on first use.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar
+
+from .paths import expand_abs
+
+
+def to_le(arr: array) -> bytes:
+	if sys.byteorder != "little":
+		arr = array(arr.typecode, arr)
+		arr.byteswap()
+	return arr.tobytes()
+
+
+def strings_blob(strings: Sequence[str]) -> Tuple[bytes, array]:
+	"""(newline-terminated UTF-8 entries, pointer array with a leading 0)."""
+	blob = bytearray()
+	ptr = array("Q", [0])
+	for s in strings:
+		blob += s.encode("utf-8") + b"\n"
+		ptr.append(len(blob))
+	return bytes(blob), ptr
+
+
+def jsonl_items(data: bytes, offset: int) -> Iterator[Tuple[dict, int, int]]:
+	"""(item, byte offset, length) for each JSON object line of data, which starts at offset."""
+	pos = 0
+	for line in data.split(b"\n"):
+		if line.strip():
+			try:
+				obj = json.loads(line)
+			except Exception:
+				obj = None
+			if isinstance(obj, dict):
+				yield obj, offset + pos, len(line)
+		pos += len(line) + 1
+
+
+def write_sidecar(
+	path: str,
+	magic: bytes,
+	sections: Sequence[Tuple[str, Optional[str]]],
+	blobs: Dict[str, bytes],
+	header: Dict,
+	st: os.stat_result,
+) -> None:
+	"""Write blobs in sections order behind magic and header, atomically."""
+	ranges: Dict[str, List[int]] = {}
+	pos = 0
+	for name, _ in sections:
+		ranges[name] = [pos, len(blobs[name])]
+		pos += len(blobs[name])
+	head = json.dumps({
+		**header,
+		"index_size": st.st_size,
+		"index_mtime_ns": st.st_mtime_ns,
+		"sections": ranges,
+	}).encode("utf-8")
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(magic)
+		f.write(struct.pack("<I", len(head)))
+		f.write(head)
+		for name, _ in sections:
+			f.write(blobs[name])
+	os.replace(tmp, path)
+
+
+S = TypeVar("S", bound="Sidecar")
+
+
+class Sidecar:
+	"""Read-only, memory-mapped sidecar plus lazy access to its JSONL.
+
+	Subclasses set MAGIC, FORMAT and SECTIONS ((name, array typecode), byte
+	sections use None) and include "offsets" (Q) and "lengths" (I) sections
+	giving each item's line in the JSONL.
+	"""
+
+	MAGIC = b""
+	FORMAT = 0
+	SECTIONS: Tuple[Tuple[str, Optional[str]], ...] = ()
+
+	def __init__(self, index_path: str, mm: mmap.mmap, header: dict, base: int, key: tuple) -> None:
+		self.index_path = index_path
+		self.header = header
+		self.n_items = int(header["n_items"])
+		self.key = key
+		self._mm = mm
+		self._sections = {k: (base + int(v[0]), int(v[1])) for k, v in header["sections"].items()}
+		self._arrays: Dict[str, array] = {}
+		self._jsonl: Optional[mmap.mmap] = None
+
+	@classmethod
+	def load(cls: Type[S], index_path: str, sidecar_path: str, key: tuple = ()) -> S:
+		with open(sidecar_path, "rb") as f:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if mm[:len(cls.MAGIC)] != cls.MAGIC:
+			raise ValueError(f"not a {cls.__name__} sidecar")
+		(hlen,) = struct.unpack_from("<I", mm, len(cls.MAGIC))
+		start = len(cls.MAGIC) + 4
+		header = json.loads(mm[start:start + hlen])
+		if header.get("format") != cls.FORMAT:
+			raise ValueError(f"unsupported {cls.__name__} format")
+		return cls(index_path, mm, header, start + hlen, key)
+
+	def __len__(self) -> int:
+		return self.n_items
+
+	def _array(self, name: str) -> array:
+		arr = self._arrays.get(name)
+		if arr is None:
+			start, length = self._sections[name]
+			arr = array(dict(self.SECTIONS)[name])
+			arr.frombytes(self._mm[start:start + length])
+			if sys.byteorder != "little":
+				arr.byteswap()
+			self._arrays[name] = arr
+		return arr
+
+	def _slice(self, name: str, lo: int, hi: int) -> array:
+		"""Elements [lo, hi) of an array section, without decoding the rest."""
+		code = dict(self.SECTIONS)[name]
+		size = array(code).itemsize
+		start = self._sections[name][0]
+		arr = array(code)
+		arr.frombytes(self._mm[start + lo * size:start + hi * size])
+		if sys.byteorder != "little":
+			arr.byteswap()
+		return arr
+
+	def _string(self, section: str, ptr_name: str, i: int) -> bytes:
+		"""Entry i of a string section (without its newline)."""
+		ptr = self._array(ptr_name)
+		start = self._sections[section][0]
+		return self._mm[start + ptr[i]:start + ptr[i + 1] - 1]
+
+	@property
+	def offsets(self) -> array:
+		return self._array("offsets")
+
+	@property
+	def lengths(self) -> array:
+		return self._array("lengths")
+
+	def item_at(self, ordinal: int) -> Optional[dict]:
+		"""Decode the item at ordinal by seeking into the JSONL."""
+		if self._jsonl is None:
+			with open(self.index_path, "rb") as f:
+				self._jsonl = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		off = self.offsets[ordinal]
+		try:
+			obj = json.loads(self._jsonl[off:off + self.lengths[ordinal]])
+		except Exception:
+			return None
+		return obj if isinstance(obj, dict) else None
+
+
+def open_sidecar(cls: Type[S], cache: Dict[str, S], index_path: str, sidecar_path: str) -> Optional[S]:
+	"""cls's sidecar for index_path if it exists and matches the JSONL's size and mtime.
+
+	cache maps JSONL paths to open sidecars, reused while neither file changes.
+	"""
+	index_path = expand_abs(index_path)
+	try:
+		st = os.stat(index_path)
+		sst = os.stat(sidecar_path)
+	except OSError:
+		return None
+	key = (st.st_size, st.st_mtime_ns, sst.st_size, sst.st_mtime_ns)
+	cached = cache.get(index_path)
+	if cached is not None and cached.key == key:
+		return cached
+	cache.pop(index_path, None)
+	try:
+		side = cls.load(index_path, sidecar_path, key)
+	except Exception:
+		return None
+	if side.header.get("index_size") != st.st_size or side.header.get("index_mtime_ns") != st.st_mtime_ns:
+		return None
+	cache[index_path] = side
+	return side
@@ -6,6 +6,7 @@ import re
 from typing import Dict, List, Optional, Tuple
 
 from .paths import expand_abs
+from . import embedders as embedmod
 import llm_utils as llmmod
 
 
@@ -89,15 +90,16 @@ def analyze_user_transitions(
 	# Optional embeddings
 	vecs: Dict[str, List[float]] = {}
 	if use_embeddings:
+		# Local sentence-transformers; STREAMS_EMBED_BACKEND opts into another backend
+		# (e.g. hash, or openai, which sends the turns to the API). Disabled if unavailable.
+		texts = [u for lst in by_cid.values() for (_, _, u) in lst]
 		try:
-			from sentence_transformers import SentenceTransformer  # type: ignore
-			st = SentenceTransformer(os.getenv("SENTENCE_TRANSFORMER_MODEL", "all-MiniLM-L6-v2"))
-			texts = [u for lst in by_cid.values() for (_, _, u) in lst]
-			emb = st.encode(texts, show_progress_bar=False)
+			embedder = embedmod.get_embedder(os.getenv("STREAMS_EMBED_BACKEND") or "st")
+			emb = embedder.fit(texts).embed(texts)
 			idx = 0
 			for lst in by_cid.values():
 				for _, uid, _ in lst:
-					vecs[uid] = list(map(float, emb[idx]))
+					vecs[uid] = emb[idx]
 					idx += 1
 		except Exception:
 			use_embeddings = False
@@ -1,11 +1,10 @@
 from __future__ import annotations
 
 import json
-import os
 from typing import Dict, List, Tuple
 
-import llm_utils as llmmod
 from .paths import expand_abs
+from . import embedders as embedmod
 from .embeddings import l2_normalize
 
 
@@ -65,10 +64,8 @@ def build_tag_clusters(index_jsonl: str, out_json: str, embed_model: str | None
             json.dump(mapping, f, ensure_ascii=False, indent=2)
         return mapping
 
-    client = llmmod.require_client()
-    model = embed_model or os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
-    res = client.embeddings.create(model=model, input=tags)
-    vecs = [l2_normalize(list(d.embedding)) for d in res.data]
+    # embed_model picks the backend by prefix ("hash:512", "st:<name>"); default AGENT_EMBED_BACKEND
+    vecs = [l2_normalize(v) for v in embedmod.embedder_for_model(embed_model).embed(tags)]
     _, _, assign = _kmeans_2(vecs)
     mapping = {t: ("clusterA" if a == 0 else "clusterB") for t, a in zip(tags, assign)}
     with open(out_json, "w", encoding="utf-8") as f:
@@ -7,6 +7,7 @@ import tempfile
 
 import llm_utils as llmmod
 from . import index as indexmod
+from . import offsets as offsetsmod
 from . import db as dbmod
 from . import parser as parsermod
 from . import adversary as adversarymod
@@ -29,6 +30,23 @@ def _default_vec_db_path() -> str:
 	return envmod.get_vec_db_path()
 
 
+# Metadata filter accepted by the search tools (see filters.normalize_filters)
+_FILTERS_SCHEMA: Dict[str, Any] = {
+	"type": "object",
+	"description": "Restrict results; every given field must match",
+	"properties": {
+		"repo": {"type": "string", "description": "Repo hint of the conversation"},
+		"kind": {"type": "string", "description": "Item kind: chat (default) or doc"},
+		"flags": {
+			"type": "array",
+			"items": {"type": "string", "enum": list(indexmod._ANN_META_KEYS)},
+			"description": "Annotation flags that must all be set",
+		},
+		"tags": {"type": "array", "items": {"type": "string"}, "description": "Annotation tags that must all be present"},
+	},
+}
+
+
 def get_tools_schema() -> List[Dict[str, Any]]:
 	"""Return tool definitions (JSON schema) for LLM tool calling."""
 	return [
@@ -50,6 +68,7 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 						"index_jsonl": {"type": "string", "description": "Path to JSONL index (for sparse mode)"},
 						"vec_db": {"type": "string", "description": "Path to sqlite-vec DB (for vector mode)"},
 						"table": {"type": "string", "default": "vec_index"},
+						"filters": _FILTERS_SCHEMA,
 					},
 					"required": ["mode", "query"],
 				},
@@ -78,6 +97,7 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 					"type": "object",
 					"properties": {
 						"db": {"type": "string"},
+						"index": {"type": "string", "description": "Optional JSONL index; pairs are read from it by offset when current"},
 						"composer_id": {"type": "string"},
 						"mode": {"type": "string", "enum": ["pairs", "messages"], "default": "pairs"},
 						"offset": {"type": "integer", "default": 0},
@@ -129,7 +149,8 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 					"properties": {
 						"index_jsonl": {"type": "string"},
 						"query": {"type": "string"},
-						"k": {"type": "integer", "default": 8}
+						"k": {"type": "integer", "default": 8},
+						"filters": _FILTERS_SCHEMA,
 					},
 					"required": ["query"],
 				},
@@ -146,7 +167,8 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 						"db": {"type": "string"},
 						"table": {"type": "string", "default": "items"},
 						"query": {"type": "string"},
-						"k": {"type": "integer", "default": 8}
+						"k": {"type": "integer", "default": 8},
+						"filters": _FILTERS_SCHEMA,
 					},
 					"required": ["query"],
 				},
@@ -164,6 +186,7 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 						"table": {"type": "string", "default": "vec_index"},
 						"query": {"type": "string"},
 						"k": {"type": "integer", "default": 8},
+						"filters": _FILTERS_SCHEMA,
 					},
 					"required": ["query"],
 				},
@@ -181,7 +204,8 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 						"db": {"type": "string"},
 						"table": {"type": "string", "default": "vec_index"},
 						"query": {"type": "string"},
-						"k": {"type": "integer", "default": 8}
+						"k": {"type": "integer", "default": 8},
+						"filters": _FILTERS_SCHEMA,
 					},
 					"required": ["query"],
 				},
@@ -259,6 +283,11 @@ def get_tools_schema() -> List[Dict[str, Any]]:
 	]
 
 
+def _filter_kwargs(args: Dict[str, Any]) -> Dict[str, Any]:
+	"""filters= for the search calls, only when the tool call set one."""
+	return {"filters": args["filters"]} if args.get("filters") else {}
+
+
 def _tool_annotations_search(args: Dict[str, Any]) -> Dict[str, Any]:
 	mode = args.get("mode", "vector")
 	query = args.get("query", "")
@@ -266,11 +295,11 @@ def _tool_annotations_search(args: Dict[str, Any]) -> Dict[str, Any]:
 	if mode == "vector":
 		db = expand_abs(args.get("vec_db") or _default_vec_db_path())
 		table = args.get("table") or "vec_index"
-		rows = indexmod.vec_search(db, table, query, top_k=k)
+		rows = indexmod.vec_search(db, table, query, top_k=k, **_filter_kwargs(args))
 		return {"mode": "vector", "items": rows}
 	else:
 		idx = expand_abs(args.get("index_jsonl") or _default_index_path())
-		rows = indexmod.search_index(idx, query, k=k)
+		rows = indexmod.search_index(idx, query, k=k, **_filter_kwargs(args))
 		# keep only essential fields in items
 		simple = [{
 			"id": f"{r.get('composer_id')}:{r.get('turn_index')}",
@@ -313,11 +342,20 @@ def _tool_list_chats(args: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def _tool_cat_chat(args: Dict[str, Any]) -> Dict[str, Any]:
-	conn = dbmod.connect_readonly(expand_abs(args.get("db") or default_db_path()))
 	cid = args.get("composer_id")
 	mode = (args.get("mode") or "pairs").lower()
 	offset = max(0, int(args.get("offset", 0)))
 	limit = max(1, min(50, int(args.get("limit", 5))))
+	offs = offsetsmod.open_offsets_index(args["index"]) if args.get("index") and mode != "messages" else None
+	if offs is not None and offs.composer_ordinals(cid):
+		# Pairs straight from the JSONL index: seek to the requested turns only
+		picked = [offs.item_at(i) for i in offs.composer_ordinals(cid)[offset: offset + limit]]
+		return {"mode": "pairs", "items": [{
+			"turn_index": it.get("turn_index"),
+			"user_head": ((it.get("user") or "").splitlines() or [""])[0][:200],
+			"assistant_head": ((it.get("assistant") or "").splitlines() or [""])[0][:200],
+		} for it in picked if it is not None]}
+	conn = dbmod.connect_readonly(expand_abs(args.get("db") or default_db_path()))
 	msgs = parsermod.reconstruct_conversation(conn, cid)
 	if mode == "messages":
 		slice_msgs = msgs[offset: offset + limit]
@@ -353,18 +391,18 @@ def _tool_vec_db_index(args: Dict[str, Any]) -> Dict[str, Any]:
 
 def _tool_sparse_search(args: Dict[str, Any]) -> Dict[str, Any]:
 	idx = expand_abs(args.get("index_jsonl") or _default_index_path())
-	rows = indexmod.search_index(idx, args.get("query", ""), k=int(args.get("k", 8)))
+	rows = indexmod.search_index(idx, args.get("query", ""), k=int(args.get("k", 8)), **_filter_kwargs(args))
 	return {"items": rows}
 
 
 def _tool_items_search(args: Dict[str, Any]) -> Dict[str, Any]:
 	db = expand_abs(args.get("db") or _default_vec_db_path())
 	table = args.get("table") or "items"
-	rows = indexmod.items_search(db, table, args.get("query", ""), k=int(args.get("k", 8)))
+	rows = indexmod.items_search(db, table, args.get("query", ""), k=int(args.get("k", 8)), **_filter_kwargs(args))
 	return {"items": rows}
 
 def _tool_vec_db_search(args: Dict[str, Any]) -> Dict[str, Any]:
-	rows = indexmod.vec_search(expand_abs(args.get("db") or _default_vec_db_path()), args.get("table") or "vec_index", args.get("query", ""), top_k=int(args.get("k", 8)))
+	rows = indexmod.vec_search(expand_abs(args.get("db") or _default_vec_db_path()), args.get("table") or "vec_index", args.get("query", ""), top_k=int(args.get("k", 8)), **_filter_kwargs(args))
 	return {"items": rows}
 
 
@@ -375,12 +413,13 @@ def _tool_hybrid_search(args: Dict[str, Any]) -> Dict[str, Any]:
 	db = expand_abs(args.get("db") or _default_vec_db_path())
 	table = args.get("table") or "vec_index"
 	k = int(args.get("k", 8))
+	fkw = _filter_kwargs(args)
 	
 	# Get results from both sources
-	sp = indexmod.search_index(idx, query, k=k * 2)  # Get more for fusion
+	sp = indexmod.search_index(idx, query, k=k * 2, **fkw)  # Get more for fusion
 	vec = []
 	try:
-		vec = indexmod.vec_search(db, table, query, top_k=k * 2)  # Get more for fusion
+		vec = indexmod.vec_search(db, table, query, top_k=k * 2, **fkw)  # Get more for fusion
 	except Exception:
 		pass
 	
@@ -10,10 +10,19 @@ _run_counters: Dict[str, int] = {
 	"events": 0,
 	"cache_hits": 0,
 	"cache_stores": 0,
+	"query_embed_memory_hits": 0,
+	"query_embed_disk_hits": 0,
+	"query_embed_misses": 0,
+	"memory_cache_hits": 0,
+	"memory_cache_negative_hits": 0,
+	"memory_cache_misses": 0,
+	"memory_cache_bytes": 0,
 	"prompt_tokens": 0,
 	"completion_tokens": 0,
 	"total_tokens": 0,
 }
+# Embedding cache outcomes per scope tag (see llm_utils.embed_texts): hits, misses, migrated
+_embed_scopes: Dict[str, Dict[str, int]] = {}
 
 
 def set_context(meta: Dict[str, str]) -> None:
@@ -126,13 +135,53 @@ def note_cache_store() -> None:
 	_run_counters["cache_stores"] += 1
 
 
+def note_query_embedding(outcome: str) -> None:
+	"""Count a query-embedding lookup: 'memory' or 'disk' hit, or 'miss'."""
+	name = {"memory": "query_embed_memory_hits", "disk": "query_embed_disk_hits"}.get(outcome, "query_embed_misses")
+	_run_counters[name] += 1
+
+
+def note_embedding(scope: Optional[str], outcome: str) -> None:
+	"""Count an embedding cache 'hit', 'miss' or 'migrated' (legacy key re-keyed) for scope."""
+	counts = _embed_scopes.setdefault(scope or "generic", {"hits": 0, "misses": 0, "migrated": 0})
+	name = {"hit": "hits", "miss": "misses", "migrated": "migrated"}.get(outcome, "misses")
+	counts[name] += 1
+
+
+def note_memory_cache(hits: int, misses: int, negative_hits: int, nbytes: int) -> None:
+	"""Count llm_cache memory-tier lookups (misses went on to SQLite) and record the tier's current size."""
+	_run_counters["memory_cache_hits"] += hits
+	_run_counters["memory_cache_misses"] += misses
+	_run_counters["memory_cache_negative_hits"] += negative_hits
+	_run_counters["memory_cache_bytes"] = nbytes
+
+
 def get_run_summary() -> Dict:
+	tier_hits = _run_counters["memory_cache_hits"] + _run_counters["memory_cache_negative_hits"]
+	tier_lookups = tier_hits + _run_counters["memory_cache_misses"]
+	mem = _run_counters["query_embed_memory_hits"]
+	disk = _run_counters["query_embed_disk_hits"]
+	lookups = mem + disk + _run_counters["query_embed_misses"]
 	return {
 		"events": _run_counters["events"],
 		"cache": {
 			"hits": _run_counters["cache_hits"],
 			"stores": _run_counters["cache_stores"],
 		},
+		"memory_cache": {
+			"hits": _run_counters["memory_cache_hits"],
+			"negative_hits": _run_counters["memory_cache_negative_hits"],
+			"misses": _run_counters["memory_cache_misses"],
+			"bytes": _run_counters["memory_cache_bytes"],
+			"hit_rate": round(tier_hits / tier_lookups, 4) if tier_lookups else 0.0,
+		},
+		"query_embeddings": {
+			"memory_hits": mem,
+			"disk_hits": disk,
+			"misses": _run_counters["query_embed_misses"],
+			"hit_rate": round((mem + disk) / lookups, 4) if lookups else 0.0,
+		},
+		"embeddings": {scope: dict(c) for scope, c in sorted(_embed_scopes.items())},
 		"tokens": {
 			"prompt": _run_counters["prompt_tokens"],
 			"completion": _run_counters["completion_tokens"],
@@ -1,6 +1,17 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+import heapq
+from typing import List, Sequence, Tuple
+
+try:
+	import numpy as np
+	_HAS_NUMPY = True
+except ImportError:
+	_HAS_NUMPY = False
+
+
+# Score blocks are capped at about this many floats when batching queries
+_BLOCK = 1 << 22
 
 
 def _dot(a: List[float], b: List[float]) -> float:
@@ -21,13 +32,92 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
 	return _dot(a, b) / (n1 * n2)
 
 
-def topk(query_vec: List[float], corpus_vecs: List[List[float]], k: int) -> List[Tuple[int, float]]:
-	"""Return top-k (index, score) by cosine similarity, descending."""
-	scores: List[Tuple[int, float]] = []
-	for idx, v in enumerate(corpus_vecs):
-		s = cosine_similarity(query_vec, v)
-		scores.append((idx, s))
-	scores.sort(key=lambda x: x[1], reverse=True)
-	return scores[: max(0, k)]
+def _as_matrix(vecs, copy: bool = False):
+	"""(n, dim) float32 view (or copy) of vectors; a single 1-d vector is one row."""
+	m = np.array(vecs, dtype=np.float32, copy=True) if copy else np.asarray(vecs, dtype=np.float32)
+	if m.ndim == 1:
+		m = m.reshape(1, -1) if m.size else m.reshape(0, 0)
+	return m
+
+
+def normalize_rows(vecs):
+	"""Unit-length float32 copy of a (n, dim) matrix or list of vectors; zero rows stay zero.
+
+	Normalize a corpus once and pass normalized=True to topk/topk_batch to skip the work
+	per call. Without NumPy, returns lists of floats.
+	"""
+	if not _HAS_NUMPY:
+		out = []
+		for v in vecs:
+			n = _norm(v)
+			out.append([x / n for x in v] if n > 0.0 else [float(x) for x in v])
+		return out
+	m = _as_matrix(vecs, copy=True)
+	norms = np.linalg.norm(m, axis=1, keepdims=True)
+	m /= np.where(norms > 0, norms, 1.0)
+	return m
+
+
+def _topk_pure(queries: Sequence[Sequence[float]], corpus_vecs: Sequence[Sequence[float]], k: int, normalized: bool) -> List[List[Tuple[int, float]]]:
+	"""Pure-Python topk_batch: corpus norms computed once, heap selection instead of a full sort."""
+	norms = [1.0 if normalized else _norm(v) for v in corpus_vecs]
+	out: List[List[Tuple[int, float]]] = []
+	for q in queries:
+		qn = 1.0 if normalized else _norm(q)
+		scores = (
+			(idx, _dot(q, v) / (qn * n) if qn != 0.0 and n != 0.0 else 0.0)
+			for idx, (v, n) in enumerate(zip(corpus_vecs, norms))
+		)
+		# nlargest is stable like sorted(..., reverse=True)[:k]: ties keep corpus order
+		out.append(heapq.nlargest(k, scores, key=lambda x: x[1]))
+	return out
+
+
+def topk_batch(queries, corpus_vecs, k: int, normalized: bool = False) -> List[List[Tuple[int, float]]]:
+	"""Top-k (index, score) by cosine similarity for each query, descending.
+
+	queries and corpus_vecs are lists of vectors or NumPy matrices. normalized=True
+	means both already have unit (or zero) rows, e.g. from normalize_rows, so a
+	float32 corpus matrix is used as-is. All queries are scored with one matrix
+	product per block and each row's top-k is picked with argpartition, then sorted
+	with ties in corpus order; rows tied with the k-th score are all considered, so
+	the lowest indices win at the boundary too. Falls back to pure Python without NumPy.
+	"""
+	k = max(0, int(k))
+	if not _HAS_NUMPY:
+		return _topk_pure(queries, corpus_vecs, k, normalized)
+	corpus = _as_matrix(corpus_vecs) if normalized else normalize_rows(corpus_vecs)
+	q = _as_matrix(queries) if normalized else normalize_rows(queries)
+	n = len(corpus)
+	k = min(k, n)
+	if k == 0 or len(q) == 0:
+		return [[] for _ in range(len(q))]
+	out: List[List[Tuple[int, float]]] = []
+	step = max(1, _BLOCK // max(1, n))
+	for start in range(0, len(q), step):
+		scores = q[start:start + step] @ corpus.T
+		wide = ()
+		if k < n:
+			part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+			# argpartition keeps an arbitrary subset of the rows tied with the k-th score
+			kth = np.take_along_axis(scores, part, axis=1).min(axis=1)
+			wide = np.flatnonzero((scores >= kth[:, None]).sum(axis=1) > k)
+		else:
+			part = np.broadcast_to(np.arange(n), scores.shape)
+		top = np.take_along_axis(scores, part, axis=1)
+		# Sort each row by (-score, index) so ties keep corpus order
+		order = np.lexsort((part, -top), axis=1)
+		part = np.take_along_axis(part, order, axis=1)
+		top = np.take_along_axis(top, order, axis=1)
+		rows = [list(zip(p.tolist(), t.tolist())) for p, t in zip(part, top)]
+		for r in wide:
+			cand = np.flatnonzero(scores[r] >= kth[r])
+			cand = cand[np.argsort(-scores[r, cand], kind="stable")[:k]]
+			rows[r] = list(zip(cand.tolist(), scores[r, cand].tolist()))
+		out.extend(rows)
+	return out
 
 
+def topk(query_vec, corpus_vecs, k: int, normalized: bool = False) -> List[Tuple[int, float]]:
+	"""Return top-k (index, score) by cosine similarity, descending; see topk_batch."""
+	return topk_batch([query_vec], corpus_vecs, k, normalized=normalized)[0]
@@ -1,17 +1,243 @@
+"""SQLite key-value cache for LLM responses and embeddings (LLM_CACHE_PATH).
+
+One connection per cache file is opened per process (WAL mode) and shared by all
+threads under a lock. Every write call commits before it returns, so an idle
+process never holds the file's write lock; get_many/set_many/set_vectors batch
+lookups and inserts into one statement (and one transaction) per call. Access
+times and hit/miss counters from reads are recorded in groups: after
+LLM_CACHE_COMMIT_EVERY of them (default 256), once LLM_CACHE_COMMIT_SECS
+(default 2) have passed, with the next write, on flush()/close(), and at
+interpreter exit.
+
+Embeddings live in their own table as native-endian float32 BLOBs with model and
+dim columns (set_vectors/get_vectors) plus a scope tag for stats, about a quarter
+the size of JSON text and decoded without parsing; get_vectors can hand back
+NumPy arrays or memoryviews over the stored bytes without copying. JSON-list
+embeddings written to the cache table by older versions are moved there when
+their (legacy) keys are looked up (see migrate_embeddings).
+
+Entries belong to a namespace: "llm" (annotations, summaries, judgments; the
+default), "search" (memory.find_solution results), "recall" (memory's LLM
+summaries over search results) and "embed" (the embeddings table). A namespace
+may expire entries after LLM_CACHE_TTL_<NAMESPACE> seconds (defaults: search one
+day, recall one week, others never; 0 disables), fixed when an entry is written.
+LLM_CACHE_MAX_BYTES (suffixes K/M/G) and LLM_CACHE_MAX_ENTRIES bound the file:
+the least recently accessed entries are evicted down to 90% of a bound after a
+commit, at most every LLM_CACHE_MAINT_SECS (default 60), or on demand with
+evict(). Files created by this version return freed pages as they go
+(incremental auto-vacuum); vacuum() compacts any file. Hits, misses, evictions
+and expirations per namespace accumulate in the cache_stats table (see stats()).
+
+Key-value and embedding reads go through a byte-bounded in-process LRU first
+(per cache file, LLM_CACHE_MEMORY_BYTES, default 32M; 0 disables), so agent
+loops that repeat lookups or queries stop paying for SQLite. Writes go to both
+tiers. With
+LLM_CACHE_NEGATIVE_SECS > 0, misses are remembered for that long too; a set()
+in this process replaces them at once, but entries written by other processes
+are not seen until the negative entry expires. Memory-tier hits, misses and
+bytes are counted in trace.get_run_summary()["memory_cache"].
+"""
 from __future__ import annotations
 
+import array
+import atexit
+import json
 import os
+import re
 import sqlite3
-from typing import Optional, Dict
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from agent_explorer import trace as tracemod
+
+
+# IN-list chunk size for get_many; stays under SQLite's default variable limit (999)
+_CHUNK = 500
+# Connections kept open at once (tests and tools may point LLM_CACHE_PATH at many files)
+_MAX_CONNS = 8
+DEFAULT_NAMESPACE = "llm"
+EMBED_NAMESPACE = "embed"
+_DEFAULT_TTLS = {"search": 24 * 3600, "recall": 7 * 24 * 3600}
+# Eviction stops at this fraction of a bound so the next commit does not evict again
+_EVICT_TARGET = 0.9
+# Rough per-row overhead (rowid, index entries, cell headers) for byte estimates
+_ROW_OVERHEAD = 64
+_COUNTERS = ("hits", "misses", "evictions", "expired")
+# Rough per-entry overhead of the memory tier (OrderedDict node, tuple, floats)
+_MEM_OVERHEAD = 160
+# Memory-tier keys of embeddings rows start with this, so they never collide with cache keys
+_VEC_PREFIX = "\x00vec:"
 
 
 def _db_path() -> str:
 	return os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
 
 
-def _connect() -> sqlite3.Connection:
-	path = _db_path()
-	conn = sqlite3.connect(path)
+def _env_number(name: str, default: float) -> float:
+	try:
+		return float(os.getenv(name, str(default)))
+	except ValueError:
+		return default
+
+
+def _parse_bytes(text: Optional[str]) -> int:
+	m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*", (text or "").lower())
+	if not m:
+		return 0
+	return int(float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " "))
+
+
+def max_bytes() -> int:
+	"""LLM_CACHE_MAX_BYTES in bytes; 0 when unbounded."""
+	return _parse_bytes(os.getenv("LLM_CACHE_MAX_BYTES"))
+
+
+def max_entries() -> int:
+	"""LLM_CACHE_MAX_ENTRIES (cache and embeddings rows together); 0 when unbounded."""
+	return max(0, int(_env_number("LLM_CACHE_MAX_ENTRIES", 0)))
+
+
+def memory_bytes() -> int:
+	"""LLM_CACHE_MEMORY_BYTES in bytes (default 32M); 0 disables the in-process tier."""
+	return _parse_bytes(os.getenv("LLM_CACHE_MEMORY_BYTES", "32M"))
+
+
+def ttl_seconds(ns: str) -> Optional[float]:
+	"""TTL for a namespace from LLM_CACHE_TTL_<NS>, else the default; None means entries never expire."""
+	default = float(_DEFAULT_TTLS.get(ns, 0))
+	ttl = _env_number(f"LLM_CACHE_TTL_{ns.upper()}", default)
+	return ttl if ttl > 0 else None
+
+
+def _expires_at(ns: str, now: float) -> Optional[float]:
+	ttl = ttl_seconds(ns)
+	return now + ttl if ttl is not None else None
+
+
+class _MemoryTier:
+	"""Byte-bounded LRU of rows: key -> (value, meta, expires_at, size).
+
+	Cache rows hold (value, token meta); embeddings rows, under _VEC_PREFIX + key,
+	hold (float32 bytes, model). A value of None is a negative entry: the key was
+	missing from SQLite.
+	"""
+
+	__slots__ = ("entries", "bytes")
+
+	def __init__(self) -> None:
+		self.entries: "OrderedDict[str, Tuple[Any, Any, Optional[float], int]]" = OrderedDict()
+		self.bytes = 0
+
+	def lookup(self, key: str, now: float):
+		"""The live entry for key (most recently used from now on), or None."""
+		entry = self.entries.get(key)
+		if entry is None:
+			return None
+		if entry[2] is not None and entry[2] <= now:
+			self.discard(key)
+			return None
+		self.entries.move_to_end(key)
+		return entry
+
+	def put(self, key: str, value: Any, meta: Any, expires_at: Optional[float]) -> None:
+		self.discard(key)
+		limit = memory_bytes()
+		size = sys.getsizeof(key) + (sys.getsizeof(value) if value is not None else 0) + _MEM_OVERHEAD
+		if size > limit:
+			return
+		self.entries[key] = (value, meta, expires_at, size)
+		self.bytes += size
+		while self.bytes > limit:
+			self.bytes -= self.entries.popitem(last=False)[1][3]
+
+	def discard(self, key: str) -> None:
+		entry = self.entries.pop(key, None)
+		if entry is not None:
+			self.bytes -= entry[3]
+
+	def clear(self) -> None:
+		self.entries.clear()
+		self.bytes = 0
+
+
+class _Handle:
+	__slots__ = ("conn", "pending", "last_commit", "last_maint", "writes", "touched", "counts", "memory")
+
+	def __init__(self, conn: sqlite3.Connection) -> None:
+		self.conn = conn
+		self.pending = 0
+		self.last_commit = time.monotonic()
+		self.last_maint = 0.0
+		# Writes since the last maintenance pass
+		self.writes = 0
+		# Access times to record at the next commit, per table
+		self.touched: Dict[str, Dict[str, float]] = {"cache": {}, "embeddings": {}}
+		# Counters not yet added to cache_stats: {namespace: {counter: n}}
+		self.counts: Dict[str, Dict[str, int]] = {}
+		self.memory = _MemoryTier()
+
+	def count(self, ns: str, counter: str, n: int = 1) -> None:
+		if n:
+			self.counts.setdefault(ns, dict.fromkeys(_COUNTERS, 0))[counter] += n
+
+	def touch(self, table: str, keys: Iterable[str], lookups: int) -> None:
+		"""Record access times for the keys found by lookups reads; commits once enough reads are pending."""
+		t = self.touched[table]
+		now = time.time()
+		for k in keys:
+			t[k] = now
+		self.pending += lookups
+		self._maybe_commit()
+
+	def _write_side_state(self) -> None:
+		for table, t in self.touched.items():
+			if t:
+				self.conn.executemany(f"UPDATE {table} SET accessed_at = ? WHERE key = ?", [(v, k) for k, v in t.items()])
+				t.clear()
+		if self.counts:
+			self.conn.executemany(
+				"INSERT INTO cache_stats(namespace, hits, misses, evictions, expired) VALUES(?, ?, ?, ?, ?) "
+				"ON CONFLICT(namespace) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses, "
+				"evictions = evictions + excluded.evictions, expired = expired + excluded.expired",
+				[(ns, *(c[k] for k in _COUNTERS)) for ns, c in self.counts.items()],
+			)
+			self.counts.clear()
+
+	def commit(self, maintain: bool = True) -> None:
+		self._write_side_state()
+		self.conn.commit()
+		self.pending = 0
+		self.last_commit = time.monotonic()
+		if maintain and self.writes and time.monotonic() - self.last_maint >= _env_number("LLM_CACHE_MAINT_SECS", 60.0):
+			_maintain(self)
+
+	def _maybe_commit(self) -> None:
+		if self.pending >= _env_number("LLM_CACHE_COMMIT_EVERY", 256) or time.monotonic() - self.last_commit >= _env_number("LLM_CACHE_COMMIT_SECS", 2.0):
+			self.commit()
+
+	def wrote(self, n: int) -> None:
+		# Commit now: a deferred commit would keep other processes' writers waiting
+		self.pending += n
+		self.writes += n
+		self.commit()
+
+
+_HANDLES: "OrderedDict[str, _Handle]" = OrderedDict()
+_LOCK = threading.RLock()
+
+
+def _open(path: str) -> sqlite3.Connection:
+	conn = sqlite3.connect(path, check_same_thread=False)
+	try:
+		# Only takes effect on a new file; lets evictions hand pages back without a full VACUUM
+		conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute("PRAGMA synchronous=NORMAL")
+	except sqlite3.DatabaseError:
+		pass
 	conn.execute(
 		"""
 		CREATE TABLE IF NOT EXISTS cache (
@@ -32,70 +258,642 @@ def _connect() -> sqlite3.Connection:
 		)
 		"""
 	)
+	conn.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS embeddings (
+			key TEXT PRIMARY KEY,
+			model TEXT,
+			dim INTEGER NOT NULL,
+			vec BLOB NOT NULL,
+			created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+		)
+		"""
+	)
+	conn.execute(
+		"""
+		CREATE TABLE IF NOT EXISTS cache_stats (
+			namespace TEXT PRIMARY KEY,
+			hits INTEGER NOT NULL DEFAULT 0,
+			misses INTEGER NOT NULL DEFAULT 0,
+			evictions INTEGER NOT NULL DEFAULT 0,
+			expired INTEGER NOT NULL DEFAULT 0
+		)
+		"""
+	)
+	# Columns added over time (new files get them the same way). Rows written before
+	# have NULLs: no namespace, never expire, and oldest for eviction.
+	added = (
+		("cache", ("namespace TEXT", "accessed_at REAL", "expires_at REAL")),
+		("embeddings", ("scope TEXT", "accessed_at REAL", "expires_at REAL")),
+	)
+	for table, cols in added:
+		have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+		for col in cols:
+			if col.split()[0] not in have:
+				conn.execute(f"ALTER TABLE {table} ADD COLUMN {col}")
+		conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed_at)")
+		conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table}(expires_at) WHERE expires_at IS NOT NULL")
+	conn.commit()
 	return conn
 
 
-def get(key: str) -> Optional[str]:
+def _pack(vec: Any) -> bytes:
+	if hasattr(vec, "astype") and hasattr(vec, "tobytes"):
+		return vec.astype("float32", copy=False).tobytes()
+	return array.array("f", vec).tobytes()
+
+
+def _migrate_json_embeddings(conn: sqlite3.Connection, keys: List[str]) -> List[str]:
+	"""Move the cache rows under keys whose value is a JSON list of numbers into the embeddings table.
+
+	Only callers know which keys name embeddings; other values of the same shape
+	(e.g. an LLM result that is a list of numbers) stay where they are.
+	"""
+	out: List[str] = []
+	for start in range(0, len(keys), _CHUNK):
+		chunk = keys[start:start + _CHUNK]
+		marks = ",".join("?" * len(chunk))
+		page = conn.execute(f"SELECT key, value FROM cache WHERE key IN ({marks}) AND value LIKE '[%'", chunk).fetchall()
+		moved: List[Tuple[str, Optional[str], int, bytes]] = []
+		for key, value in page:
+			try:
+				vec = json.loads(value)
+				if not isinstance(vec, list) or not vec or not all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in vec):
+					continue
+				moved.append((key, None, len(vec), _pack(vec)))
+			except Exception:
+				continue
+		if moved:
+			done = [m[0] for m in moved]
+			marks = ",".join("?" * len(done))
+			conn.executemany("INSERT OR IGNORE INTO embeddings(key, model, dim, vec) VALUES(?, ?, ?, ?)", moved)
+			conn.execute(f"DELETE FROM cache WHERE key IN ({marks})", done)
+			conn.execute(f"DELETE FROM cache_meta WHERE key IN ({marks})", done)
+			conn.commit()
+			out += done
+	return out
+
+
+def _handle() -> _Handle:
+	"""Pooled handle for the current LLM_CACHE_PATH; call with _LOCK held."""
+	path = os.path.abspath(_db_path())
+	h = _HANDLES.get(path)
+	if h is not None:
+		_HANDLES.move_to_end(path)
+		return h
+	h = _HANDLES[path] = _Handle(_open(path))
+	while len(_HANDLES) > _MAX_CONNS:
+		_close(_HANDLES.popitem(last=False)[1])
+	return h
+
+
+def _close(h: _Handle) -> None:
+	try:
+		h.commit(maintain=False)
+	except Exception:
+		pass
+	try:
+		h.conn.close()
+	except Exception:
+		pass
+
+
+def flush() -> None:
+	"""Commit pending writes, access times and stats on every pooled connection."""
+	with _LOCK:
+		for h in _HANDLES.values():
+			try:
+				h.commit()
+			except Exception:
+				pass
+
+
+def drop_memory() -> None:
+	"""Empty this process's memory tiers; the cache files are left alone."""
+	with _LOCK:
+		for h in _HANDLES.values():
+			h.memory.clear()
+
+
+def close() -> None:
+	"""Commit and close every pooled connection (e.g. before deleting the cache file)."""
+	with _LOCK:
+		while _HANDLES:
+			_close(_HANDLES.popitem()[1])
+
+
+atexit.register(close)
+
+
+# ------------------- expiry, eviction and stats -------------------
+
+def _used_bytes(conn: sqlite3.Connection) -> int:
+	page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+	pages = conn.execute("PRAGMA page_count").fetchone()[0]
+	free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+	return (pages - free) * page_size
+
+
+def _purge_expired(h: _Handle, now: float) -> int:
+	conn = h.conn
+	removed = 0
+	for ns, n in conn.execute("SELECT COALESCE(namespace, ''), COUNT(*) FROM cache WHERE expires_at <= ? GROUP BY 1", (now,)).fetchall():
+		h.count(ns, "expired", n)
+		removed += n
+	if removed:
+		conn.execute("DELETE FROM cache_meta WHERE key IN (SELECT key FROM cache WHERE expires_at <= ?)", (now,))
+		conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+	n = conn.execute("SELECT COUNT(*) FROM embeddings WHERE expires_at <= ?", (now,)).fetchone()[0]
+	if n:
+		h.count(EMBED_NAMESPACE, "expired", n)
+		conn.execute("DELETE FROM embeddings WHERE expires_at <= ?", (now,))
+	return removed + n
+
+
+def _evict_oldest(h: _Handle, rows: int = 0, nbytes: int = 0) -> int:
+	"""Delete the least recently accessed entries of both tables until rows and (estimated) nbytes are freed."""
+	conn = h.conn
+	evicted = freed = 0
+	while evicted < rows or freed < nbytes:
+		# Oldest candidates from each table, merged by access time (never accessed first)
+		cands = [
+			(a if a is not None else float("-inf"), "cache", k, ns or "", size)
+			for k, ns, size, a in conn.execute(
+				"SELECT key, namespace, length(key) + length(value), accessed_at FROM cache ORDER BY accessed_at LIMIT ?", (_CHUNK,)
+			)
+		]
+		cands += [
+			(a if a is not None else float("-inf"), "embeddings", k, EMBED_NAMESPACE, size)
+			for k, size, a in conn.execute(
+				"SELECT key, length(key) + length(vec), accessed_at FROM embeddings ORDER BY accessed_at LIMIT ?", (_CHUNK,)
+			)
+		]
+		if not cands:
+			break
+		cands.sort(key=lambda c: c[0])
+		doomed: Dict[str, List[str]] = {"cache": [], "embeddings": []}
+		for _, table, key, ns, size in cands[:_CHUNK]:
+			if evicted >= rows and freed >= nbytes:
+				break
+			doomed[table].append(key)
+			h.count(ns, "evictions")
+			evicted += 1
+			freed += (size or 0) + _ROW_OVERHEAD
+		for table, keys in doomed.items():
+			if not keys:
+				continue
+			marks = ",".join("?" * len(keys))
+			conn.execute(f"DELETE FROM {table} WHERE key IN ({marks})", keys)
+			if table == "cache":
+				conn.execute(f"DELETE FROM cache_meta WHERE key IN ({marks})", keys)
+			for k in keys:
+				h.touched[table].pop(k, None)
+				h.memory.discard(k if table == "cache" else _VEC_PREFIX + k)
+	return evicted
+
+
+def _maintain(h: _Handle) -> Dict[str, int]:
+	"""Purge expired entries, evict down to the configured bounds and release free pages; commits."""
+	conn = h.conn
+	h.writes = 0
+	h.last_maint = time.monotonic()
+	out = {"expired": _purge_expired(h, time.time()), "evicted": 0}
+	limit = max_entries()
+	if limit:
+		total = conn.execute("SELECT (SELECT COUNT(*) FROM cache) + (SELECT COUNT(*) FROM embeddings)").fetchone()[0]
+		if total > limit:
+			out["evicted"] += _evict_oldest(h, rows=total - int(limit * _EVICT_TARGET))
+	limit = max_bytes()
+	if limit:
+		used = _used_bytes(conn)
+		if used > limit:
+			out["evicted"] += _evict_oldest(h, nbytes=used - int(limit * _EVICT_TARGET))
+	h.commit(maintain=False)
+	if out["expired"] or out["evicted"]:
+		try:
+			if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+				conn.execute("PRAGMA incremental_vacuum")
+				conn.commit()
+		except sqlite3.DatabaseError:
+			pass
+	return out
+
+
+def evict() -> Dict[str, int]:
+	"""Drop expired entries and evict down to LLM_CACHE_MAX_BYTES / LLM_CACHE_MAX_ENTRIES now."""
+	with _LOCK:
+		h = _handle()
+		h.commit(maintain=False)
+		return _maintain(h)
+
+
+def vacuum() -> Dict[str, int]:
+	"""Rebuild the cache file (also switching it to incremental auto-vacuum); returns its size before and after."""
+	with _LOCK:
+		h = _handle()
+		h.commit(maintain=False)
+		path = os.path.abspath(_db_path())
+		before = os.path.getsize(path)
+		h.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+		h.conn.execute("VACUUM")
+		return {"bytes_before": before, "bytes_after": os.path.getsize(path)}
+
+
+def stats() -> Dict[str, Any]:
+	"""Per-namespace entries, bytes, hits/misses/hit rate, evictions, expirations and TTL; file size and bounds."""
+	with _LOCK:
+		h = _handle()
+		h.commit(maintain=False)
+		conn = h.conn
+		per: Dict[str, Dict[str, Any]] = {}
+
+		def slot(ns: str) -> Dict[str, Any]:
+			return per.setdefault(ns, {"entries": 0, "bytes": 0, **dict.fromkeys(_COUNTERS, 0)})
+
+		for ns, n, size in conn.execute(
+			"SELECT COALESCE(namespace, ''), COUNT(*), COALESCE(SUM(length(key) + length(value)), 0) FROM cache GROUP BY 1"
+		):
+			slot(ns).update(entries=int(n), bytes=int(size))
+		n, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(length(key) + length(vec)), 0) FROM embeddings").fetchone()
+		if n:
+			slot(EMBED_NAMESPACE).update(entries=int(n), bytes=int(size))
+		for row in conn.execute("SELECT namespace, hits, misses, evictions, expired FROM cache_stats"):
+			slot(row[0]).update(zip(_COUNTERS, (int(x) for x in row[1:])))
+		for ns, s in per.items():
+			lookups = s["hits"] + s["misses"]
+			s["hit_rate"] = round(s["hits"] / lookups, 4) if lookups else 0.0
+			s["ttl_seconds"] = ttl_seconds(ns) if ns else None
+		path = os.path.abspath(_db_path())
+		return {
+			"path": path,
+			# The main file plus its write-ahead log
+			"file_bytes": sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)),
+			"used_bytes": _used_bytes(conn),
+			"max_bytes": max_bytes() or None,
+			"max_entries": max_entries() or None,
+			"namespaces": {ns: per[ns] for ns in sorted(per)},
+			# This process's in-memory tier for the file
+			"memory": {"entries": len(h.memory.entries), "bytes": h.memory.bytes, "max_bytes": memory_bytes() or None},
+		}
+
+
+# ------------------- key-value entries -------------------
+
+def _lookup(h: _Handle, keys: List[str], ns: str) -> Dict[str, Tuple[str, Optional[Dict[str, int]]]]:
+	"""Live (value, token meta) for unique keys: the memory tier first, then SQLite in chunks.
+
+	Counts hits/misses for ns, records access times and fills the memory tier
+	(and negative entries, when enabled) from what SQLite returned.
+	"""
+	now = time.time()
+	mem = h.memory
+	enabled = memory_bytes() > 0
+	out: Dict[str, Tuple[str, Optional[Dict[str, int]]]] = {}
+	rest: List[str] = []
+	negative_hits = 0
+	for k in keys:
+		entry = mem.lookup(k, now) if enabled else None
+		if entry is None:
+			rest.append(k)
+		elif entry[0] is None:
+			negative_hits += 1
+		else:
+			out[k] = (entry[0], entry[1])
+	memory_hits = len(out)
+	for start in range(0, len(rest), _CHUNK):
+		chunk = rest[start:start + _CHUNK]
+		marks = ",".join("?" * len(chunk))
+		for key, value, expires, mkey, pt, ct, tt in h.conn.execute(
+			"SELECT c.key, c.value, c.expires_at, m.key, m.prompt_tokens, m.completion_tokens, m.total_tokens "
+			f"FROM cache c LEFT JOIN cache_meta m ON m.key = c.key WHERE c.key IN ({marks}) AND (c.expires_at IS NULL OR c.expires_at > ?)",
+			(*chunk, now),
+		):
+			meta = _meta_dict((pt, ct, tt)) if mkey is not None else None
+			out[key] = (value, meta)
+			if enabled:
+				mem.put(key, value, meta, expires)
+	negative_secs = _env_number("LLM_CACHE_NEGATIVE_SECS", 0.0)
+	if enabled and negative_secs > 0:
+		for k in rest:
+			if k not in out:
+				mem.put(k, None, None, now + negative_secs)
+	h.count(ns, "hits", len(out))
+	h.count(ns, "misses", len(keys) - len(out))
+	h.touch("cache", out, len(keys))
+	if enabled:
+		tracemod.note_memory_cache(memory_hits, len(rest), negative_hits, mem.bytes)
+	return out
+
+
+def get(key: str, ns: str = DEFAULT_NAMESPACE) -> Optional[str]:
 	try:
-		conn = _connect()
-		row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
-		conn.close()
-		return row[0] if row else None
+		with _LOCK:
+			hit = _lookup(_handle(), [key], ns).get(key)
+		return hit[0] if hit else None
 	except Exception:
 		return None
 
 
+def get_many(keys: Iterable[str], ns: str = DEFAULT_NAMESPACE) -> Dict[str, str]:
+	"""Values for the keys that are cached; missing keys are absent from the result."""
+	uniq = list(dict.fromkeys(keys))
+	try:
+		with _LOCK:
+			found = _lookup(_handle(), uniq, ns)
+		return {k: v[0] for k, v in found.items()}
+	except Exception:
+		return {}
+
+
+def _meta_dict(row) -> Dict[str, int]:
+	return {
+		"prompt_tokens": int(row[0]) if row[0] is not None else 0,
+		"completion_tokens": int(row[1]) if row[1] is not None else 0,
+		"total_tokens": int(row[2]) if row[2] is not None else 0,
+	}
+
+
 def get_meta(key: str) -> Optional[Dict[str, int]]:
 	try:
-		conn = _connect()
-		row = conn.execute(
-			"SELECT prompt_tokens, completion_tokens, total_tokens FROM cache_meta WHERE key = ?",
-			(key,),
-		).fetchone()
-		conn.close()
-		if not row:
-			return None
-		return {
-			"prompt_tokens": int(row[0]) if row[0] is not None else 0,
-			"completion_tokens": int(row[1]) if row[1] is not None else 0,
-			"total_tokens": int(row[2]) if row[2] is not None else 0,
-		}
+		with _LOCK:
+			row = _handle().conn.execute(
+				"SELECT prompt_tokens, completion_tokens, total_tokens FROM cache_meta WHERE key = ?",
+				(key,),
+			).fetchone()
+		return _meta_dict(row) if row else None
 	except Exception:
 		return None
 
 
-def set(key: str, value: str, prompt_tokens: int | None = None, completion_tokens: int | None = None, total_tokens: int | None = None) -> None:
+def get_with_meta(key: str, ns: str = DEFAULT_NAMESPACE) -> Optional[Tuple[str, Optional[Dict[str, int]]]]:
+	"""(value, token meta or None) in one lookup, or None when key is not cached."""
 	try:
-		conn = _connect()
-		conn.execute("INSERT OR REPLACE INTO cache(key, value) VALUES(?, ?)", (key, value))
-		conn.execute(
-			"INSERT OR REPLACE INTO cache_meta(key, prompt_tokens, completion_tokens, total_tokens) VALUES(?, ?, ?, ?)",
-			(key, prompt_tokens, completion_tokens, total_tokens),
-		)
-		conn.commit()
-		conn.close()
+		with _LOCK:
+			return _lookup(_handle(), [key], ns).get(key)
+	except Exception:
+		return None
+
+
+def _remember(h: _Handle, key: str, value: Any, meta: Any, expires_at: Optional[float]) -> None:
+	"""Write-through to the memory tier (replacing any negative entry)."""
+	if memory_bytes() > 0:
+		h.memory.put(key, value, meta, expires_at)
+	else:
+		h.memory.discard(key)
+
+
+def set(key: str, value: str, prompt_tokens: int | None = None, completion_tokens: int | None = None, total_tokens: int | None = None, ns: str = DEFAULT_NAMESPACE) -> None:
+	"""Store value under key; ns sets the namespace and so the TTL (see ttl_seconds)."""
+	try:
+		with _LOCK:
+			h = _handle()
+			now = time.time()
+			expires = _expires_at(ns, now)
+			h.conn.execute(
+				"INSERT OR REPLACE INTO cache(key, value, namespace, accessed_at, expires_at) VALUES(?, ?, ?, ?, ?)",
+				(key, value, ns, now, expires),
+			)
+			h.conn.execute(
+				"INSERT OR REPLACE INTO cache_meta(key, prompt_tokens, completion_tokens, total_tokens) VALUES(?, ?, ?, ?)",
+				(key, prompt_tokens, completion_tokens, total_tokens),
+			)
+			_remember(h, key, value, _meta_dict((prompt_tokens, completion_tokens, total_tokens)), expires)
+			h.wrote(1)
+	except Exception:
+		return
+
+
+def set_many(entries: Iterable[Tuple[str, str]], ns: str = DEFAULT_NAMESPACE) -> None:
+	"""Store (key, value) pairs with executemany; token meta is left empty, as set() does by default."""
+	rows: List[Tuple[str, str]] = list(entries)
+	if not rows:
+		return
+	try:
+		with _LOCK:
+			h = _handle()
+			now = time.time()
+			expires = _expires_at(ns, now)
+			h.conn.executemany(
+				"INSERT OR REPLACE INTO cache(key, value, namespace, accessed_at, expires_at) VALUES(?, ?, ?, ?, ?)",
+				[(k, v, ns, now, expires) for k, v in rows],
+			)
+			h.conn.executemany(
+				"INSERT OR REPLACE INTO cache_meta(key, prompt_tokens, completion_tokens, total_tokens) VALUES(?, NULL, NULL, NULL)",
+				[(k,) for k, _ in rows],
+			)
+			for k, v in rows:
+				_remember(h, k, v, _meta_dict((None, None, None)), expires)
+			h.wrote(len(rows))
 	except Exception:
 		return
 
 
+# ------------------- embeddings -------------------
+
+def migrate_embeddings(keys: Iterable[str]) -> int:
+	"""Move JSON-list embeddings an older version cached under keys (embedding keys) to the embeddings table."""
+	uniq = list(dict.fromkeys(keys))
+	if not uniq:
+		return 0
+	try:
+		with _LOCK:
+			h = _handle()
+			moved = _migrate_json_embeddings(h.conn, uniq)
+			# Moved rows may be remembered as cache values or as missing vectors
+			for k in moved:
+				h.memory.discard(k)
+				h.memory.discard(_VEC_PREFIX + k)
+				h.touched["cache"].pop(k, None)
+			return len(moved)
+	except Exception:
+		return 0
+
+
+def _decode(blob: bytes, fmt: str):
+	if fmt == "list":
+		return memoryview(blob).cast("f").tolist()
+	if fmt == "view":
+		return memoryview(blob).cast("f")
+	if fmt == "array":
+		out = array.array("f")
+		out.frombytes(blob)
+		return out
+	if fmt == "numpy":
+		import numpy as np
+		return np.frombuffer(blob, dtype=np.float32)
+	raise ValueError(f"unknown vector format: {fmt}")
+
+
+def get_vectors(
+	keys: Iterable[str],
+	fmt: str = "list",
+	model: Optional[str] = None,
+	track: bool = True,
+	sources: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+	"""Cached embeddings for the keys that have one: the memory tier first, then SQLite.
+
+	fmt: "list" (floats), "view" (zero-copy float32 memoryview of the stored bytes),
+	"numpy" (zero-copy read-only float32 array) or "array" (array('f') copy). With
+	model, entries recorded under a different model are treated as missing
+	(migrated entries have no model and always match). track=False keeps the
+	lookup out of the hit/miss stats (e.g. probing legacy keys). sources, if
+	given, receives "memory" or "disk" for each key found.
+	"""
+	if fmt not in ("list", "view", "array", "numpy"):
+		raise ValueError(f"unknown vector format: {fmt}")
+	uniq = list(dict.fromkeys(keys))
+	out: Dict[str, Any] = {}
+	try:
+		with _LOCK:
+			h = _handle()
+			now = time.time()
+			mem = h.memory
+			enabled = memory_bytes() > 0
+			blobs: Dict[str, bytes] = {}
+			rest: List[str] = []
+			negative_hits = 0
+			for k in uniq:
+				entry = mem.lookup(_VEC_PREFIX + k, now) if enabled else None
+				if entry is None:
+					rest.append(k)
+				elif entry[0] is None:
+					negative_hits += 1
+				elif model is None or entry[1] is None or entry[1] == model:
+					blobs[k] = entry[0]
+			if sources is not None:
+				sources.update(dict.fromkeys(blobs, "memory"))
+			memory_hits = len(blobs)
+			for start in range(0, len(rest), _CHUNK):
+				chunk = rest[start:start + _CHUNK]
+				marks = ",".join("?" * len(chunk))
+				for key, vmodel, dim, blob, expires in h.conn.execute(
+					f"SELECT key, model, dim, vec, expires_at FROM embeddings WHERE key IN ({marks}) AND (expires_at IS NULL OR expires_at > ?)",
+					(*chunk, now),
+				):
+					if len(blob) != 4 * dim:
+						continue
+					if enabled:
+						mem.put(_VEC_PREFIX + key, blob, vmodel, expires)
+					if model is not None and vmodel is not None and vmodel != model:
+						continue
+					blobs[key] = blob
+					if sources is not None:
+						sources[key] = "disk"
+			negative_secs = _env_number("LLM_CACHE_NEGATIVE_SECS", 0.0)
+			if enabled and negative_secs > 0:
+				for k in rest:
+					if k not in blobs and _VEC_PREFIX + k not in mem.entries:
+						mem.put(_VEC_PREFIX + k, None, None, now + negative_secs)
+			if track:
+				h.count(EMBED_NAMESPACE, "hits", len(blobs))
+				h.count(EMBED_NAMESPACE, "misses", len(uniq) - len(blobs))
+			h.touch("embeddings", blobs, len(uniq))
+			if enabled:
+				tracemod.note_memory_cache(memory_hits, len(rest), negative_hits, mem.bytes)
+		out = {k: _decode(b, fmt) for k, b in blobs.items()}
+	except ValueError:
+		raise
+	except Exception:
+		pass
+	return out
+
+
+def get_vector(key: str, fmt: str = "list", model: Optional[str] = None) -> Any:
+	return get_vectors([key], fmt, model).get(key)
+
+
+def set_vectors(entries: Iterable[Tuple[str, Optional[str], Sequence[float]]], scope: Optional[str] = None) -> None:
+	"""Store (key, model, vector) triples as float32 BLOBs; vectors may be lists or NumPy arrays.
+
+	scope tags the rows for vector_stats (the last writer's scope wins); it is not part of the key.
+	"""
+	now = time.time()
+	expires = _expires_at(EMBED_NAMESPACE, now)
+	rows = []
+	for key, model, vec in entries:
+		blob = _pack(vec)
+		rows.append((key, model, len(blob) // 4, blob, scope, now, expires))
+	if not rows:
+		return
+	try:
+		with _LOCK:
+			h = _handle()
+			h.conn.executemany(
+				"INSERT OR REPLACE INTO embeddings(key, model, dim, vec, scope, accessed_at, expires_at) VALUES(?, ?, ?, ?, ?, ?, ?)",
+				rows,
+			)
+			for key, vmodel, _, blob, _, _, _ in rows:
+				_remember(h, _VEC_PREFIX + key, blob, vmodel, expires)
+			h.wrote(len(rows))
+	except Exception:
+		return
+
+
+def set_vector(key: str, model: Optional[str], vec: Sequence[float], scope: Optional[str] = None) -> None:
+	set_vectors([(key, model, vec)], scope=scope)
+
+
+def delete_vectors(keys: Iterable[str]) -> None:
+	uniq = list(dict.fromkeys(keys))
+	try:
+		with _LOCK:
+			h = _handle()
+			for start in range(0, len(uniq), _CHUNK):
+				chunk = uniq[start:start + _CHUNK]
+				marks = ",".join("?" * len(chunk))
+				h.conn.execute(f"DELETE FROM embeddings WHERE key IN ({marks})", chunk)
+			for k in uniq:
+				h.touched["embeddings"].pop(k, None)
+				h.memory.discard(_VEC_PREFIX + k)
+			h.wrote(len(uniq))
+	except Exception:
+		return
+
+
+def vector_stats() -> List[Dict[str, Any]]:
+	"""Stored embeddings grouped by (scope, model): count and bytes."""
+	try:
+		with _LOCK:
+			rows = _handle().conn.execute(
+				"SELECT COALESCE(scope, ''), COALESCE(model, ''), COUNT(*), COALESCE(SUM(length(vec)), 0) "
+				"FROM embeddings GROUP BY 1, 2 ORDER BY 3 DESC"
+			).fetchall()
+		return [{"scope": r[0], "model": r[1], "count": int(r[2]), "bytes": int(r[3])} for r in rows]
+	except Exception:
+		return []
+
+
 def clear() -> None:
 	try:
-		conn = _connect()
-		conn.execute("DELETE FROM cache")
-		conn.execute("DELETE FROM cache_meta")
-		conn.commit()
-		conn.close()
+		with _LOCK:
+			h = _handle()
+			for t in h.touched.values():
+				t.clear()
+			h.counts.clear()
+			h.memory.clear()
+			h.conn.execute("DELETE FROM cache")
+			h.conn.execute("DELETE FROM cache_meta")
+			h.conn.execute("DELETE FROM embeddings")
+			h.conn.execute("DELETE FROM cache_stats")
+			h.commit(maintain=False)
 	except Exception:
 		return
 
 
 def count() -> int:
 	try:
-		conn = _connect()
-		row = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
-		conn.close()
+		with _LOCK:
+			row = _handle().conn.execute("SELECT COUNT(*) FROM cache").fetchone()
 		return int(row[0]) if row else 0
 	except Exception:
 		return 0
 
 
+def count_vectors() -> int:
+	try:
+		with _LOCK:
+			row = _handle().conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+		return int(row[0]) if row else 0
+	except Exception:
+		return 0
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
+import array
 import json
 import os
 import hashlib
+import re
 from typing import Dict, List, Optional, Any
 from agent_explorer import trace as tracemod
 
@@ -68,9 +70,9 @@ def annotate_pair_llm(
 	)
 	prompt = f"User:\n{user}\n\nAssistant:\n{assistant}"
 	cache_key = _hash_key(["annotate_pair_llm", model, instructions, user, assistant])
-	cached = llm_cache.get(cache_key)
-	if cached is not None:
-		meta = llm_cache.get_meta(cache_key) or {}
+	hit = llm_cache.get_with_meta(cache_key)
+	if hit is not None:
+		cached, meta = hit
 		if meta:
 			tracemod.log_event("cache_hit_meta", {"key": cache_key, **meta})
 		tracemod.note_cache_hit()
@@ -142,9 +144,9 @@ def summarize_conversation_llm(
 		"macro (one-sentence theme). Keep it concise."
 	)
 	cache_key = _hash_key(["summarize_conversation_llm", model, instructions, body])
-	cached = llm_cache.get(cache_key)
-	if cached is not None:
-		meta = llm_cache.get_meta(cache_key) or {}
+	hit = llm_cache.get_with_meta(cache_key)
+	if hit is not None:
+		cached, meta = hit
 		if meta:
 			tracemod.log_event("cache_hit_meta", {"key": cache_key, **meta})
 		tracemod.note_cache_hit()
@@ -286,40 +288,80 @@ def judge_annotations_llm(
 
 # ------------------- embedding helpers -------------------
 
-def _embedding_cache_key(model: str, scope: str, ident: str, text: str) -> str:
-	# Use sha256 of text to keep keys small
+def embedding_key(model: str, text: str, dimensions: Optional[int] = None) -> str:
+	"""Content-addressed cache key: (model, dimensions, hash of whitespace-normalized text).
+
+	Independent of scope and batch position, so the same text embedded by any
+	command (index, vsearch, clusters, queries) shares one entry.
+	"""
+	h = hashlib.sha256(normalize_query_text(text).encode("utf-8")).hexdigest()
+	return _hash_key(["embed", model, str(dimensions or ""), h])
+
+
+def _legacy_embedding_cache_key(model: str, scope: str, ident: str, text: str) -> str:
+	# Keys before content addressing: scope and batch position were part of the key
 	h = hashlib.sha256(text.encode("utf-8")).hexdigest()
 	return _hash_key(["embed", model, scope, ident, h])
 
 
-def embed_texts(client: Any, texts: List[str], model: Optional[str] = None, scope: str = "generic", id_prefix: str = "") -> List[List[float]]:
+def _adopt_legacy_vectors(legacy: Dict[str, str], model: str, scope: str) -> Dict[str, List[float]]:
+	"""Re-key vectors found under legacy keys ({legacy key: new key}); returns {new key: vector}.
+
+	Legacy keys may still hold JSON lists in the cache table; those are moved first.
+	"""
+	llm_cache.migrate_embeddings(list(legacy))
+	found = llm_cache.get_vectors(list(legacy), model=model, track=False)
+	if not found:
+		return {}
+	adopted = {legacy[k]: v for k, v in found.items()}
+	llm_cache.set_vectors([(k, model, v) for k, v in adopted.items()], scope=scope)
+	llm_cache.delete_vectors(list(found))
+	for _ in adopted:
+		tracemod.note_embedding(scope, "migrated")
+	return adopted
+
+
+def embed_texts(client: Any, texts: List[str], model: Optional[str] = None, scope: str = "generic", id_prefix: str = "", dimensions: Optional[int] = None) -> List[List[float]]:
 	"""Embed a list of texts with caching and tracing.
 
 	- client: OpenAI client from require_client()
 	- texts: list of strings
 	- model: embedding model name; defaults to env EMBEDDING_MODEL or OpenAI default
-	- scope/id_prefix: optional tags for cache keys
+	- scope: tag recorded with stored vectors and counted per scope in
+	  trace.get_run_summary()["embeddings"]; not part of the cache key (see embedding_key)
+	- id_prefix: only used to find entries cached under the old position-based keys,
+	  which are moved to content keys when hit
+	- dimensions: requested output size for models that support it; part of the key
+
+	Texts with the same normalized content are embedded once per call, and the
+	normalized text (what embedding_key hashes) is what gets sent: a text with
+	newlines or runs of whitespace is embedded with them collapsed to single
+	spaces, so its vector differs slightly from one of the raw text.
 	"""
 	if model is None:
 		model = os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
+	keys = [embedding_key(model, t, dimensions) for t in texts]
+	# First pass: one batched lookup of the float32 vectors
+	found: Dict[str, List[float]] = llm_cache.get_vectors(keys, model=model)
+	if dimensions is None and len(found) < len(set(keys)):
+		legacy = {
+			_legacy_embedding_cache_key(model, scope, f"{id_prefix}{i}", t): k
+			for i, (t, k) in enumerate(zip(texts, keys))
+			if k not in found
+		}
+		found.update(_adopt_legacy_vectors(legacy, model, scope))
 	results: List[List[float]] = []
-	missing: List[tuple[int, str]] = []
-	# First pass: try cache
-	for i, t in enumerate(texts):
-		key = _embedding_cache_key(model, scope, f"{id_prefix}{i}", t)
-		cached = llm_cache.get(key)
+	# key -> first text with that key, in order
+	missing: Dict[str, str] = {}
+	for t, k in zip(texts, keys):
+		cached = found.get(k)
 		if cached is not None:
-			try:
-				vec = json.loads(cached)
-				if isinstance(vec, list):
-					results.append(vec)
-					tracemod.note_cache_hit()
-					continue
-			except Exception:
-				pass
-		# mark as missing
+			results.append(list(cached))
+			tracemod.note_cache_hit()
+			tracemod.note_embedding(scope, "hit")
+			continue
 		results.append([])
-		missing.append((i, t))
+		missing.setdefault(k, normalize_query_text(t))
 
 	if missing:
 		# Batch embed the missing items in manageable chunks
@@ -327,21 +369,23 @@ def embed_texts(client: Any, texts: List[str], model: Optional[str] = None, scop
 			max_batch_size = int(os.getenv("EMBED_BATCH", "128"))
 		except Exception:
 			max_batch_size = 128
+		pending = list(missing.items())
+		extra: Dict[str, Any] = {"dimensions": int(dimensions)} if dimensions else {}
 		start_index = 0
-		while start_index < len(missing):
-			chunk = missing[start_index : start_index + max_batch_size]
+		while start_index < len(pending):
+			chunk = pending[start_index : start_index + max_batch_size]
 			inputs = [t for _, t in chunk]
-			resp = client.embeddings.create(model=model, input=inputs)
+			resp = client.embeddings.create(model=model, input=inputs, **extra)
 			# OpenAI returns data in order
 			vecs = [d.embedding for d in resp.data]
-			for (idx, text), vec in zip(chunk, vecs):
-				results[idx] = list(vec)
-				key = _embedding_cache_key(model, scope, f"{id_prefix}{idx}", text)
-				try:
-					llm_cache.set(key, json.dumps(results[idx]))
-					tracemod.note_cache_store()
-				except Exception:
-					pass
+			stored = []
+			for (key, text), vec in zip(chunk, vecs):
+				# Rounded to float32 as stored, so hits and misses return the same values
+				found[key] = array.array("f", vec).tolist()
+				stored.append((key, model, found[key]))
+				tracemod.note_cache_store()
+				tracemod.note_embedding(scope, "miss")
+			llm_cache.set_vectors(stored, scope=scope)
 			# trace this batch
 			usage = getattr(resp, "usage", None)
 			meta = {
@@ -360,6 +404,9 @@ def embed_texts(client: Any, texts: List[str], model: Optional[str] = None, scop
 				extra_meta={"op": "embed_batch"},
 			)
 			start_index += max_batch_size
+		for i, k in enumerate(keys):
+			if not results[i] and k in found:
+				results[i] = list(found[k])
 
 	return results
 
@@ -369,6 +416,62 @@ def embed_text(client: Any, text: str, model: Optional[str] = None, scope: str =
 	return vecs[0] if vecs else []
 
 
+def normalize_query_text(text: str) -> str:
+	"""Collapse whitespace so trivially different spellings of a query share a cache entry."""
+	return re.sub(r"\s+", " ", text or "").strip()
+
+
+def query_embedding_key(model: str, text: str, dimensions: Optional[int] = None) -> str:
+	"""Queries share embedding_key with embed_texts, so a query seen as a text (or vice versa) is a hit."""
+	return embedding_key(model, text, dimensions)
+
+
+def clear_query_cache() -> None:
+	"""Drop in-process cached entries, query embeddings included (the llm_cache store is left alone)."""
+	llm_cache.drop_memory()
+
+
+def embed_query(text: str, model: Optional[str] = None, client: Any = None, dimensions: Optional[int] = None) -> List[float]:
+	"""Embedding for a search query, cached by model, dimensions and normalized text.
+
+	Looks in the llm_cache store through its in-process memory tier; only a miss
+	calls the API (client defaults to require_client(), created only then). Outcomes are
+	counted in trace.get_run_summary()["query_embeddings"].
+	"""
+	if model is None:
+		model = os.getenv("OPENAI_EMBED_MODEL", os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
+	key = query_embedding_key(model, text, dimensions)
+	sources: Dict[str, str] = {}
+	vec = llm_cache.get_vectors([key], model=model, sources=sources).get(key)
+	if vec:
+		tracemod.note_embedding("query", "hit")
+		tracemod.note_query_embedding(sources.get(key, "disk"))
+		return list(vec)
+	tracemod.note_query_embedding("miss")
+	if client is None:
+		client = require_client()
+	extra: Dict[str, Any] = {"dimensions": int(dimensions)} if dimensions else {}
+	res = client.embeddings.create(model=model, input=[normalize_query_text(text)], **extra)
+	vec = array.array("f", res.data[0].embedding).tolist()
+	llm_cache.set_vectors([(key, model, vec)], scope="query")
+	tracemod.note_cache_store()
+	tracemod.note_embedding("query", "miss")
+	usage = getattr(res, "usage", None)
+	tracemod.log_llm_event(
+		endpoint="embeddings.create",
+		model=model,
+		request_meta={"count": 1, "scope": "query"},
+		response_meta={
+			"prompt_tokens": getattr(usage, "prompt_tokens", None) if usage else None,
+			"total_tokens": getattr(usage, "total_tokens", None) if usage else None,
+		},
+		input_text=text[:200],
+		output_text=None,
+		extra_meta={"op": "embed_query"},
+	)
+	return list(vec)
+
+
 def meta_judge_llm(
 	client: Any,
 	judgments: List[Dict],
@@ -0,0 +1,51 @@
+import json
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import db as dbmod
+from agent_explorer import parser as parsermod
+
+
+def _make_db(path):
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE cursorDiskKV(key TEXT PRIMARY KEY, value BLOB)")
+    headers = [
+        {"bubbleId": "zz", "type": 1, "serverBubbleId": 0},
+        {"bubbleId": "aa", "type": 2, "serverBubbleId": 1},
+        {"bubbleId": "missing", "type": 2, "serverBubbleId": 2},
+        {"bubbleId": "mm", "type": 1, "serverBubbleId": 3},
+    ]
+    rows = [
+        ("composerData:cid", json.dumps({"fullConversationHeadersOnly": headers}).encode("utf-8")),
+        ("bubbleId:cid:zz", b'{"text":"first"}'),
+        ("bubbleId:cid:aa", b'{"content":"second"}'),
+        ("bubbleId:cid:mm", b'{"text":"third"}'),
+        # neighbouring composer whose id shares the prefix must not leak in
+        ("bubbleId:cid2:aa", b'{"text":"other"}'),
+    ]
+    conn.executemany("INSERT INTO cursorDiskKV(key, value) VALUES(?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_prefix_upper_bound():
+    assert dbmod._prefix_upper_bound("bubbleId:c:") == "bubbleId:c;"
+    assert dbmod._prefix_upper_bound("") is None
+
+
+def test_load_bubbles_and_reconstruct_in_header_order(tmp_path):
+    dbp = tmp_path / "state.sqlite"
+    _make_db(dbp)
+    conn = dbmod.connect_readonly(str(dbp))
+    bubbles = parsermod.load_bubbles(conn, "cid")
+    assert set(bubbles) == {"aa", "mm", "zz"}
+    msgs = parsermod.reconstruct_conversation(conn, "cid")
+    assert [m["text"] for m in msgs] == ["first", "second", "third"]
+    assert [m["role"] for m in msgs] == ["user", "assistant", "user"]
+
+
+def test_bench_bubble_loading_reports_identical_output():
+    res = benchmod.bench_bubble_loading(composers=3, turns=10, payload_bytes=16, repeat=1)
+    assert res["composers"] == 3 and res["bubbles"] == 30
+    assert res["identical"] is True
+    assert res["per_bubble_s"] >= 0 and res["bulk_s"] >= 0
@@ -0,0 +1,47 @@
+import sqlite3
+
+from agent_explorer import db as dbmod
+from agent_explorer import parser as parsermod
+
+
+def _make_db(path, n=25):
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE cursorDiskKV(key TEXT PRIMARY KEY, value BLOB)")
+    rows = [(f"composerData:c{i:03d}", b"{}") for i in range(n)]
+    rows += [
+        ("bubbleId:c000:b1", b"{}"),
+        ("composerDataX", b"{}"),  # shares the prefix text but not the ':' separator
+        ("composerData_:x", b"{}"),  # '_' is a LIKE wildcard; must not match the prefix
+        ("zzz", b"{}"),
+    ]
+    conn.executemany("INSERT INTO cursorDiskKV(key, value) VALUES(?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_iter_kv_keys_paginates_within_prefix(tmp_path):
+    dbp = tmp_path / "state.sqlite"
+    _make_db(dbp)
+    conn = dbmod.connect_readonly(str(dbp))
+    keys = list(dbmod.iter_kv_keys(conn, prefix="composerData:", page_size=4))
+    assert keys == [f"composerData:c{i:03d}" for i in range(25)]
+    # limit spanning several pages
+    assert list(dbmod.iter_kv_keys(conn, prefix="composerData:", limit=9, page_size=4)) == keys[:9]
+    # no prefix walks the whole table in key order
+    assert list(dbmod.iter_kv_keys(conn, page_size=3)) == sorted(keys + ["bubbleId:c000:b1", "composerDataX", "composerData_:x", "zzz"])
+    # kv_keys uses the same range semantics
+    assert dbmod.kv_keys(conn, prefix="composerData:", limit=3) == keys[:3]
+    # A limit of 0 (or less) means no limit, as kv_keys has always treated it
+    assert list(dbmod.iter_kv_keys(conn, prefix="composerData:", limit=0, page_size=4)) == keys
+    assert list(dbmod.iter_kv_keys(conn, prefix="composerData:", limit=-1)) == keys
+    assert dbmod.composer_data_keys(conn, limit=0) == keys
+    assert list(dbmod.iter_composer_data_keys(conn, limit=5)) == keys[:5]
+    assert dbmod.kv_keys(conn, prefix="composerData:", limit=0) == keys
+
+
+def test_list_composer_ids_is_not_capped(tmp_path):
+    dbp = tmp_path / "state.sqlite"
+    _make_db(dbp, n=1200)
+    conn = dbmod.connect_readonly(str(dbp))
+    ids = parsermod.list_composer_ids(conn)
+    assert len(ids) == 1200 and ids[0] == "c000"
@@ -0,0 +1,71 @@
+import random
+import time
+
+from agent_explorer import embed_pipeline as pipemod
+
+
+class _Resp:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _RateLimited(Exception):
+    def __init__(self, headers):
+        super().__init__("429")
+        self.response = _Resp(headers)
+
+
+def test_retry_after_parsing():
+    assert pipemod.retry_after_seconds(_RateLimited({"retry-after": "2"})) == 2.0
+    assert pipemod.retry_after_seconds(_RateLimited({"retry-after-ms": "250"})) == 0.25
+    assert pipemod.retry_after_seconds(ValueError("x")) is None
+
+
+def test_rate_limiter_waits_for_token_budget():
+    lim = pipemod.RateLimiter(tpm=6000)
+    lim.acquire(6000)  # drain the bucket
+    t0 = time.monotonic()
+    lim.acquire(10)  # 10 tokens at 100/s
+    assert time.monotonic() - t0 >= 0.08
+    unlimited = pipemod.RateLimiter()
+    t0 = time.monotonic()
+    for _ in range(1000):
+        unlimited.acquire(1000)
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_embed_with_retry_honors_retry_after():
+    calls = []
+
+    class _Emb:
+        def create(self, model, input):
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise _RateLimited({"retry-after-ms": "50"})
+            return "ok"
+
+    class _Client:
+        embeddings = _Emb()
+
+    lim = pipemod.RateLimiter()
+    assert pipemod.embed_with_retry(_Client(), "m", ["a"], lim) == "ok"
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.04
+
+
+def test_run_pipeline_writes_in_submission_order_and_commits():
+    def embed(texts):
+        time.sleep(random.random() / 200)
+        return [t.upper() for t in texts]
+
+    written = []
+    commits = []
+
+    def write(payload, res):
+        written.append((payload, res))
+        return len(res)
+
+    batches = (([f"t{i}a", f"t{i}b"], i) for i in range(25))
+    pipemod.run_pipeline(batches, embed, write, concurrency=4, commit=lambda: commits.append(len(written)), commit_every=10)
+    assert [p for p, _ in written] == list(range(25))
+    assert written[3][1] == ["T3A", "T3B"]
+    assert commits == [5, 10, 15, 20, 25]
@@ -0,0 +1,184 @@
+import json
+import sys
+
+import pytest
+
+from agent_explorer import cluster as clustermod
+from agent_explorer import embedders as embedmod
+from agent_explorer import flatvec as flatmod
+from agent_explorer import vector as vectmod
+import llm_utils as llmmod
+
+
+def _no_network():
+    raise AssertionError("network client requested by an offline backend")
+
+
+def test_hashing_embedder_is_deterministic_and_similarity_aware(monkeypatch):
+    monkeypatch.setattr(llmmod, "require_client", _no_network)
+    e = embedmod.get_embedder("tfidf", "hash:256")
+    assert e is embedmod.get_embedder("hash", "hash:256")
+    assert e.model == "hash:256" and not e.remote
+    a, b, c, empty = e.embed(["sqlite lock error", "sqlite lock timeout", "rust borrow checker", ""])
+    assert len(a) == 256 and a == e.embed(["sqlite lock error"])[0]
+    assert sum(x * x for x in a) == pytest.approx(1.0)
+    assert vectmod.cosine_similarity(a, b) > vectmod.cosine_similarity(a, c)
+    assert not any(empty)
+    # The OpenAI-shaped client lets embed_pipeline drive local backends
+    res = e.client().embeddings.create(model=e.model, input=["sqlite lock error"])
+    assert res.data[0].embedding == a and res.usage is None
+
+
+def test_hashing_fit_weights_rare_terms():
+    base = embedmod.get_embedder("hash", "hash:512")
+    texts = ["error in sqlite", "error in rust", "error in python"]
+    fitted = base.fit(texts)
+    assert fitted is not base and fitted.model.startswith("hash:512+idf:") and base.idf is None
+    # "error in" is shared by every text, so fitting lowers its weight relative to the topic word
+    assert vectmod.cosine_similarity(*fitted.embed(texts[:2])) < vectmod.cosine_similarity(*base.embed(texts[:2]))
+    # A fitted model is only reproducible from its saved state
+    state = json.loads(json.dumps(fitted.state()))
+    again = embedmod.embedder_for_model(fitted.model, state)
+    assert again.model == fitted.model and again.embed(texts) == fitted.embed(texts)
+    with pytest.raises(ValueError):
+        embedmod.embedder_for_model("hash:512+idf:000000000000")
+    with pytest.raises(ValueError):
+        embedmod.embedder_for_model("hash:512+idf:000000000000", state)
+    assert base.fit(texts).model == fitted.model and base.state() is None
+
+
+def test_registry_resolution(monkeypatch):
+    monkeypatch.setenv("AGENT_EMBED_BACKEND", "hash")
+    monkeypatch.setenv("AGENT_HASH_DIM", "64")
+    assert embedmod.get_embedder().model == "hash:64"
+    assert embedmod.embedder_for_model("hash:32").dim == 32
+    assert embedmod.embedder_for_model("st:tiny").model == "st:tiny"
+    assert embedmod.embedder_for_model("text-embedding-3-small").remote
+    with pytest.raises(ValueError):
+        embedmod.get_embedder("word2vec")
+
+    with pytest.raises(TypeError):
+        embedmod.Embedder("abstract")
+
+    class _Const(embedmod.Embedder):
+        name = "const"
+
+        def _embed_batch(self, texts):
+            return [[1.0, 0.0] for _ in texts]
+
+    embedmod.register_embedder("const", lambda model: _Const(model or "const"))
+    try:
+        calls = []
+        e = embedmod.get_embedder("const")
+        monkeypatch.setattr(e, "_embed_batch", lambda texts: calls.append(list(texts)) or [[1.0, 0.0] for _ in texts])
+        assert e.embed(["a", "b", "a"]) == [[1.0, 0.0]] * 3
+        assert e.embed(["b"]) == [[1.0, 0.0]]
+        # Duplicates are embedded once and memoized across calls
+        assert calls == [["a", "b"]]
+    finally:
+        embedmod._REGISTRY.pop("const", None)
+        embedmod._INSTANCES.pop(("const", ""), None)
+
+
+def test_offline_backends_need_no_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(llmmod, "require_client", _no_network)
+    monkeypatch.setenv("AGENT_EMBED_BACKEND", "hash")
+    monkeypatch.setenv("AGENT_HASH_DIM", "64")
+    monkeypatch.setattr(embedmod, "_INSTANCES", {})
+    index = tmp_path / "index.jsonl"
+    topics = ["sqlite lock", "rust borrow", "python import"]
+    index.write_text("".join(
+        json.dumps({"composer_id": f"c{i}", "turn_index": 0, "user": f"{topics[i % 3]} question {i}", "assistant": "answer"}) + "\n"
+        for i in range(30)
+    ), encoding="utf-8")
+
+    data = clustermod.build_cluster_tree(str(index), str(tmp_path / "tree.json"), depth=2, min_size=4)
+    assert data["meta"]["count"] == 30
+
+    db = str(tmp_path / "vec.db")
+    assert flatmod.build_flat_embeddings(db, str(index), "vec_index") == 30
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    # The index is TF-IDF: the idf is fitted on its texts and saved with the vectors
+    assert store.model.startswith("hash:64+idf:") and len(store.embedder_state["idf"]) == 64
+    rows = flatmod.flat_search(db, "vec_index", "rust borrow question 4", 1, nprobe=0)
+    assert rows[0]["composer_id"] == "c4"
+    # Rebuilds keep the saved idf, so unchanged items keep their vectors
+    monkeypatch.setattr(embedmod, "_INSTANCES", {})
+    stats = {}
+    flatmod.build_flat_embeddings(db, str(index), "vec_index", changed_only=True, stats=stats)
+    assert stats["skipped"] == 30 and flatmod.open_flat_vectors(db, "vec_index").model == store.model
+
+
+def test_vec_tables_record_fitted_model_and_follow_model_changes(tmp_path, monkeypatch):
+    import sqlite3
+
+    from agent_explorer import index as indexmod
+
+    monkeypatch.setattr(llmmod, "require_client", _no_network)
+    monkeypatch.setenv("AGENT_EMBED_BACKEND", "hash")
+    monkeypatch.setenv("AGENT_HASH_DIM", "64")
+    monkeypatch.setattr(embedmod, "_INSTANCES", {})
+    db = str(tmp_path / "items.sqlite")
+    conn = sqlite3.connect(db)
+    conn.execute(
+        "CREATE TABLE items (composer_id TEXT, turn_index INTEGER, user TEXT, assistant TEXT, user_head TEXT, assistant_head TEXT, annotations TEXT)"
+    )
+    conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, '', '', NULL)", [("c", i, f"rust borrow {i}", "answer") for i in range(5)])
+    conn.commit()
+    conn.close()
+
+    # vec-from-items fits the idf on the items table (stop before vec0, which needs the extension)
+    fitted = []
+    real = indexmod._vec_table_embedder
+
+    def capture(c, table, texts):
+        fitted.extend(texts())
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr(indexmod, "_load_sqlite_vec", lambda conn: None)
+
+    class _NoExtConnection(sqlite3.Connection):
+        def enable_load_extension(self, on):
+            pass
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda path: connect(path, factory=_NoExtConnection))
+    monkeypatch.setattr(indexmod, "_vec_table_embedder", capture)
+    with pytest.raises(RuntimeError):
+        indexmod.build_embeddings_sqlite_from_items(db)
+    assert fitted == [f"rust borrow {i}\nanswer" for i in range(5)]
+    monkeypatch.setattr(indexmod, "_vec_table_embedder", real)
+
+    conn = connect(db)
+    c = conn.cursor()
+    embedder, dim = indexmod._vec_table_embedder(c, "v", lambda: fitted)
+    assert dim == 64 and embedder.model.startswith("hash:64+idf:")
+    assert indexmod._vec_table_model(conn, "v") == (embedder.model, embedder.state())
+    # A different model is recorded, so queries are embedded like the re-embedded rows
+    monkeypatch.setenv("AGENT_HASH_DIM", "32")
+    monkeypatch.setattr(embedmod, "_INSTANCES", {})
+    embedder2, _ = indexmod._vec_table_embedder(c, "v", lambda: fitted)
+    assert embedder2.model.startswith("hash:32+idf:")
+    assert indexmod._vec_table_model(conn, "v")[0] == embedder2.model
+    conn.close()
+
+
+def test_streams_embeddings_need_sentence_transformers_or_an_opt_in(tmp_path, monkeypatch):
+    from agent_explorer import streams as streammod
+
+    monkeypatch.setattr(llmmod, "require_client", _no_network)
+    monkeypatch.setattr(embedmod, "_INSTANCES", {})
+    monkeypatch.setenv("AGENT_EMBED_BACKEND", "openai")
+    monkeypatch.setenv("AGENT_HASH_DIM", "64")
+    idx = tmp_path / "idx.jsonl"
+    with open(idx, "w", encoding="utf-8") as f:
+        for i, u in enumerate(["fix the parser", "fix the parser again", "write docs"]):
+            f.write(json.dumps({"composer_id": "c1", "turn_index": i, "user": u}) + "\n")
+    out = tmp_path / "streams.json"
+    monkeypatch.delenv("STREAMS_EMBED_BACKEND", raising=False)
+    monkeypatch.setitem(sys.modules, "sentence_transformers", None)
+    res = streammod.analyze_user_transitions(str(idx), str(out), use_embeddings=True)
+    assert res["meta"]["embeddings"] is False
+    monkeypatch.setenv("STREAMS_EMBED_BACKEND", "hash")
+    res = streammod.analyze_user_transitions(str(idx), str(out), use_embeddings=True)
+    assert res["meta"]["embeddings"] is True
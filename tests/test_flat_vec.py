@@ -0,0 +1,173 @@
+import hashlib
+import json
+
+import numpy as np
+import pytest
+
+from agent_explorer import cli as climod
+from agent_explorer import flatvec as flatmod
+from agent_explorer import index as indexmod
+import llm_utils as llmmod
+
+
+def _vec_for(text):
+    # Deterministic 8-d embedding; whitespace-insensitive like query normalization
+    seed = hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+    rng = np.random.default_rng(int.from_bytes(seed[:8], "little"))
+    return rng.standard_normal(8).tolist()
+
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.inputs = []
+
+    def create(self, model, input):
+        self.inputs.extend(input)
+
+        class _D:
+            def __init__(self, t):
+                self.embedding = _vec_for(t)
+
+        class _R:
+            data = [_D(t) for t in input]
+
+        return _R()
+
+
+class _FakeClient:
+    def __init__(self):
+        self.embeddings = _FakeEmbeddings()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    c = _FakeClient()
+    monkeypatch.setattr(llmmod, "require_client", lambda: c)
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setenv("LLM_LOG_PATH", str(tmp_path / "llm_usage.jsonl"))
+    monkeypatch.delenv("AGENT_VEC_BACKEND", raising=False)
+    llmmod.clear_query_cache()
+    yield c
+    llmmod.clear_query_cache()
+
+
+def _write_index(path, rows):
+    path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    return str(path)
+
+
+def _rows(n=6):
+    return [{"composer_id": "c", "turn_index": i, "user_head": f"question {i}", "assistant_head": f"answer {i}"} for i in range(n)]
+
+
+def test_build_and_search_match_exact_ranking(tmp_path, client):
+    idx = _write_index(tmp_path / "idx.jsonl", _rows() + [{"composer_id": "c", "turn_index": 9, "user": "", "assistant": ""}])
+    db = str(tmp_path / "vec.db")
+    stats = {}
+    assert indexmod.build_embeddings_sqlite(db, idx, backend="numpy", stats=stats) == 6
+    assert stats == {"inserted": 6, "updated": 0, "skipped": 0, "skipped_empty": 1, "deleted": 0}
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    assert store.matrix.shape == (6, 8) and store.matrix.dtype == np.float32
+    assert np.allclose(np.linalg.norm(store.matrix, axis=1), 1.0, atol=1e-5)
+
+    query = "question 3\nanswer 3"
+    res = indexmod.vec_search(db, "vec_index", query, top_k=3, backend="numpy")
+    q = np.asarray(_vec_for(query), dtype=np.float32)
+    q /= np.linalg.norm(q)
+    expected = [f"c:{i}" for i in np.argsort(-(store.matrix @ q))[:3]]
+    assert [r["id"] for r in res] == expected == ["c:3"] + expected[1:]
+    assert res[0]["distance"] == pytest.approx(0.0, abs=1e-3)
+    assert res[0]["user_head"] == "question 3" and res[0]["turn_index"] == 3
+    assert len(indexmod.vec_search(db, "vec_index", query, top_k=50, backend="numpy")) == 6
+
+    # No SQLite DB next to the store: auto-detected, also for the env default
+    assert indexmod.vec_backend(None, db, "vec_index") == "numpy"
+    assert indexmod.vec_search(db, "vec_index", query, top_k=3) == res
+    assert indexmod.vec_store_file(db) == flatmod.flat_paths(db, "vec_index")[0]
+
+
+def test_changed_only_reuses_vectors_and_drops_removed(tmp_path, client):
+    rows = _rows()
+    idx = _write_index(tmp_path / "idx.jsonl", rows)
+    db = str(tmp_path / "vec.db")
+    indexmod.build_embeddings_sqlite(db, idx, backend="numpy")
+    before = np.array(flatmod.open_flat_vectors(db, "vec_index").matrix)
+
+    client.embeddings.inputs.clear()
+    stats = {}
+    rows = [rows[0], {**rows[2], "assistant_head": "changed"}, rows[1], {"composer_id": "d", "turn_index": 0, "user_head": "new", "assistant_head": "row"}]
+    _write_index(tmp_path / "idx.jsonl", rows)
+    assert indexmod.build_embeddings_sqlite(db, idx, backend="numpy", changed_only=True, stats=stats) == 2
+    assert stats == {"inserted": 1, "updated": 1, "skipped": 2, "skipped_empty": 0, "deleted": 3}
+    assert client.embeddings.inputs == ["question 2\nchanged", "new\nrow"]
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    assert [r[0] for r in store.rows] == ["c:0", "c:2", "c:1", "d:0"]
+    assert np.array_equal(store.matrix[0], before[0]) and np.array_equal(store.matrix[2], before[1])
+    assert not np.array_equal(store.matrix[1], before[2])
+
+
+def test_duplicate_ids_keep_last_and_cli_flag(tmp_path, client, capsys):
+    rows = _rows(2) + [{**_rows(2)[0], "user_head": "later"}]
+    idx = _write_index(tmp_path / "idx.jsonl", rows)
+    db = str(tmp_path / "vec.db")
+    assert climod.main(["vec-index", db, idx, "--backend", "numpy"]) == 0
+    out = json.loads(capsys.readouterr().out.splitlines()[0])
+    assert out["backend"] == "numpy"
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    assert [r[0] for r in store.rows] == ["c:0", "c:1"] and store.rows[0][3] == "later"
+    assert climod.main(["vec-search", db, "--query", "later\nanswer 0", "--k", "1", "--backend", "numpy"]) == 0
+    assert json.loads(capsys.readouterr().out)[0]["id"] == "c:0"
+
+
+def test_backend_resolution(tmp_path, monkeypatch):
+    db = str(tmp_path / "vec.db")
+    monkeypatch.delenv("AGENT_VEC_BACKEND", raising=False)
+    assert indexmod.vec_backend(None, db) == "sqlite-vec"
+    monkeypatch.setenv("AGENT_VEC_BACKEND", "numpy")
+    assert indexmod.vec_backend(None, db) == "numpy"
+    assert indexmod.vec_backend("sqlite-vec", db) == "sqlite-vec"
+    with pytest.raises(ValueError):
+        indexmod.vec_backend("faiss", db)
+    with pytest.raises(FileNotFoundError):
+        indexmod.vec_search(db, "vec_index", "q")
+
+
+def test_batches_are_written_into_the_new_matrix_as_they_arrive(tmp_path, client, monkeypatch):
+    idx = _write_index(tmp_path / "idx.jsonl", _rows(6))
+    db = str(tmp_path / "vec.db")
+    monkeypatch.setenv("EMBED_BATCH", "2")
+    mats = []
+    new_matrix = flatmod._new_matrix
+
+    def capture(*args):
+        mats.append(new_matrix(*args))
+        return mats[-1]
+
+    written = []
+    create = client.embeddings.create
+
+    def create_and_count(model, input):
+        written.append(int(np.count_nonzero(np.any(mats[0] != 0, axis=1))) if mats else 0)
+        return create(model, input)
+
+    monkeypatch.setattr(flatmod, "_new_matrix", capture)
+    monkeypatch.setattr(client.embeddings, "create", create_and_count)
+    assert flatmod.build_flat_embeddings(db, idx, concurrency=1) == 6
+    # With two requests in flight, the first batch is in the matrix before the third is sent
+    assert len(written) == 3 and written[2] >= 2
+    assert not (tmp_path / "vec.db.vec_index.npy.tmp.npy").exists()
+
+
+def test_matrix_swapped_without_its_meta_is_not_opened(tmp_path, client):
+    idx = _write_index(tmp_path / "idx.jsonl", _rows())
+    db = str(tmp_path / "vec.db")
+    flatmod.build_flat_embeddings(db, idx)
+    npy, meta_path = flatmod.flat_paths(db, "vec_index")
+    old_meta = open(meta_path, encoding="utf-8").read()
+    _write_index(tmp_path / "idx.jsonl", [{**r, "assistant_head": "changed"} for r in _rows()])
+    flatmod.build_flat_embeddings(db, idx)
+    assert flatmod.open_flat_vectors(db, "vec_index") is not None
+    # Interrupted between the two renames: new matrix, old meta (same shape)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        f.write(old_meta)
+    assert flatmod.open_flat_vectors(db, "vec_index") is None
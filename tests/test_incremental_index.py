@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import index as indexmod
+
+
+def _set(dbp, key, obj):
+    conn = sqlite3.connect(dbp)
+    conn.execute("INSERT OR REPLACE INTO cursorDiskKV(key, value) VALUES(?, ?)", (key, json.dumps(obj).encode("utf-8")))
+    conn.commit()
+    conn.close()
+
+
+def test_incremental_build_matches_full_rebuild(tmp_path, monkeypatch):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=4, turns=4, payload_bytes=8)
+    inc = str(tmp_path / "inc.jsonl")
+    full = str(tmp_path / "full.jsonl")
+    assert indexmod.build_index(inc, db_path=dbp, incremental=True) == 8
+    manifest = json.load(open(indexmod.index_manifest_path(inc)))
+    assert len(manifest["composers"]) == 4 and all(e["turns"] == 2 for e in manifest["composers"].values())
+
+    # Edit one bubble, add a composer, drop another
+    cid1 = "c00001-0000-0000-0000-000000000000"
+    _set(dbp, f"bubbleId:{cid1}:b000001", {"text": "edited answer", "type": 2})
+    _set(dbp, "composerData:zz-new", {"fullConversationHeadersOnly": [{"bubbleId": "q", "type": 1}]})
+    _set(dbp, "bubbleId:zz-new:q", {"text": "new question", "type": 1})
+    conn = sqlite3.connect(dbp)
+    conn.execute("DELETE FROM cursorDiskKV WHERE key = 'composerData:c00002-0000-0000-0000-000000000000'")
+    conn.commit()
+    conn.close()
+
+    rebuilt = []
+    real = indexmod._composer_items
+    monkeypatch.setattr(indexmod, "_composer_items", lambda conn, cid, m=None: rebuilt.append(cid) or real(conn, cid, m))
+    n = indexmod.build_index(inc, db_path=dbp, incremental=True)
+    assert sorted(rebuilt) == [cid1, "zz-new"]
+    assert n == indexmod.build_index(full, db_path=dbp) == 7
+    with open(inc, "rb") as a, open(full, "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_incremental_noop_keeps_index_and_detects_tampering(tmp_path):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=2, turns=2, payload_bytes=8)
+    out = str(tmp_path / "idx.jsonl")
+    indexmod.build_index(out, db_path=dbp, incremental=True)
+    before = os.stat(out).st_mtime_ns
+    assert indexmod.build_index(out, db_path=dbp, incremental=True) == 2
+    assert os.stat(out).st_mtime_ns == before
+    # A hand-edited index no longer matches its manifest and is rebuilt in full
+    with open(out, "a", encoding="utf-8") as f:
+        f.write("{}\n")
+    assert indexmod._load_index_manifest(out, None) is None
+    assert indexmod.build_index(out, db_path=dbp, incremental=True) == 2
+    assert len(open(out, encoding="utf-8").read().splitlines()) == 2
+
+
+def test_fingerprints_are_sql_aggregates_plus_content_hash_and_skipped_by_full_builds(tmp_path, monkeypatch):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=2, turns=2, payload_bytes=8)
+    out = str(tmp_path / "idx.jsonl")
+    cid = "c00000-0000-0000-0000-000000000000"
+
+    def fingerprint():
+        conn = sqlite3.connect(dbp)
+        try:
+            return indexmod._composer_stats(conn, cid), indexmod._composer_hash(conn, cid)
+        finally:
+            conn.close()
+
+    composer = {"fullConversationHeadersOnly": [{"bubbleId": "b000000", "type": 1}], "lastUpdatedAt": 1000}
+    _set(dbp, f"composerData:{cid}", composer)
+    first = fingerprint()
+    # Same length: the aggregate is unchanged, the content hash is not
+    _set(dbp, f"composerData:{cid}", {**composer, "lastUpdatedAt": 2000})
+    second = fingerprint()
+    assert second[0] == first[0] and second[1] != first[1]
+    _set(dbp, f"bubbleId:{cid}:b000009", {"text": "appended", "type": 1})
+    assert fingerprint()[0] != second[0]
+
+    def no_fingerprint(conn, cid):
+        raise AssertionError("full builds do not fingerprint")
+
+    monkeypatch.setattr(indexmod, "_composer_stats", no_fingerprint)
+    monkeypatch.setattr(indexmod, "_composer_hash", no_fingerprint)
+    assert indexmod.build_index(out, db_path=dbp) == 2
+    monkeypatch.undo()
+    # The full build's manifest has no fingerprints, so the next incremental build redoes everything once
+    rebuilt = []
+    real = indexmod._composer_items
+    monkeypatch.setattr(indexmod, "_composer_items", lambda conn, cid, m=None: rebuilt.append(cid) or real(conn, cid, m))
+    indexmod.build_index(out, db_path=dbp, incremental=True)
+    indexmod.build_index(out, db_path=dbp, incremental=True)
+    assert len(rebuilt) == 2
+
+
+def test_same_length_bubble_edit_is_rebuilt(tmp_path):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=3, turns=2, payload_bytes=8)
+    inc = str(tmp_path / "inc.jsonl")
+    full = str(tmp_path / "full.jsonl")
+    cid = "c00001-0000-0000-0000-000000000000"
+    _set(dbp, f"bubbleId:{cid}:b000001", {"text": "message", "type": 2})
+    indexmod.build_index(inc, db_path=dbp, incremental=True)
+    _set(dbp, f"bubbleId:{cid}:b000001", {"text": "MESSAGE", "type": 2})
+    indexmod.build_index(inc, db_path=dbp, incremental=True)
+    indexmod.build_index(full, db_path=dbp)
+    with open(inc, "rb") as a, open(full, "rb") as b:
+        data = a.read()
+        assert data == b.read() and b"MESSAGE" in data
@@ -0,0 +1,107 @@
+import json
+import os
+
+from agent_explorer import bench as benchmod
+from agent_explorer import index as indexmod
+from agent_explorer import inverted as invmod
+from agent_explorer import memory as memmod
+
+
+_ITEMS = [
+    {"composer_id": "a", "turn_index": 0, "user": "How to fix SQLite locking?", "assistant": "Use WAL mode; sqlite3.connect(timeout=5)",
+     "annotations": {"tags": ["db", "sqlite"], "contains_learning": True}},
+    {"composer_id": "a", "turn_index": 1, "user": "thanks", "assistant": "Welcome! Locks are fine now.",
+     "annotations": {"tags": ["DB", "db"]}},
+    {"composer_id": "b", "turn_index": 0, "user": "plot résumé data", "assistant": "matplotlib and pandas",
+     "annotations": {"has_useful_output": True}},
+    {"composer_id": "c", "turn_index": 0, "user": "", "assistant": "", "annotations": {"tags": ["db"]}},
+]
+
+
+def _write_index(path, items=_ITEMS):
+    with open(path, "w", encoding="utf-8") as f:
+        for it in items:
+            f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        f.write("{not json\n\n")
+    return str(path)
+
+
+def _scan(path, query, k):
+    os.rename(invmod.inverted_index_path(path), str(path) + ".off")
+    try:
+        assert invmod.open_inverted_index(path) is None
+        return indexmod.search_index(path, query, k)
+    finally:
+        os.rename(str(path) + ".off", invmod.inverted_index_path(path))
+
+
+QUERIES = [
+    "sqlite", "lock", "SQLITE lock lock", "sqlite3.connect", "tag:db", "contains_learning", "résumé",
+    "db", "welcome!", "ite", "nothing-here", "x",
+]
+
+
+def test_sidecar_search_matches_scan(tmp_path):
+    path = _write_index(tmp_path / "index.jsonl")
+    assert invmod.build_inverted_index(path) == 4
+    inv = invmod.open_inverted_index(path)
+    assert inv is not None and inv.n_items == 4
+    assert inv.item(2)["composer_id"] == "b"
+    for q in QUERIES:
+        assert indexmod.search_index(path, q, k=3) == _scan(path, q, 3), q
+    # Tokens without word characters cannot use postings
+    assert inv.search("???", 3) is None
+
+
+def test_find_solution_fallback_matches_scan(tmp_path, monkeypatch):
+    monkeypatch.setenv("AGENT_ITEMS_DB", str(tmp_path / "missing.db"))
+    path = _write_index(tmp_path / "index.jsonl")
+    invmod.build_inverted_index(path)
+    for q in ["db sqlite", "lock", "DB", "sqlite3.connect"]:
+        with_inv = memmod.find_solution(q, index_jsonl=path, auto_index=False, use_cache=False)
+        os.rename(invmod.inverted_index_path(path), path + ".off")
+        scanned = memmod.find_solution(q, index_jsonl=path, auto_index=False, use_cache=False)
+        os.rename(path + ".off", invmod.inverted_index_path(path))
+        assert with_inv == scanned, q
+
+
+def test_stale_sidecar_is_ignored(tmp_path):
+    path = _write_index(tmp_path / "index.jsonl")
+    invmod.build_inverted_index(path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"composer_id": "d", "turn_index": 0, "user": "zebra", "assistant": ""}) + "\n")
+    assert invmod.open_inverted_index(path) is None
+    assert [r["composer_id"] for r in indexmod.search_index(path, "zebra")] == ["d"]
+
+
+def test_build_index_writes_and_reuses_sidecar(tmp_path, monkeypatch):
+    src = benchmod.make_synthetic_state_db(str(tmp_path / "state.sqlite"), composers=3, turns=4, payload_bytes=8)
+    out = str(tmp_path / "index.jsonl")
+    indexmod.build_index(out, db_path=src, incremental=True)
+    assert invmod.open_inverted_index(out).n_items == 6
+
+    # Change one composer: only its lines are tokenized again
+    import sqlite3
+    conn = sqlite3.connect(src)
+    key = conn.execute("SELECT key FROM cursorDiskKV WHERE key LIKE 'bubbleId:c00001%' ORDER BY key LIMIT 1").fetchone()[0]
+    conn.execute("UPDATE cursorDiskKV SET value=? WHERE key=?", (json.dumps({"text": "brand new words", "type": 1}), key))
+    conn.commit()
+    conn.close()
+    added = []
+    orig = invmod.InvertedIndexBuilder.add_item
+
+    def spy(self, obj, offset, length):
+        added.append(obj["composer_id"])
+        return orig(self, obj, offset, length)
+
+    monkeypatch.setattr(invmod.InvertedIndexBuilder, "add_item", spy)
+    indexmod.build_index(out, db_path=src, incremental=True)
+    assert set(added) == {"c00001-0000-0000-0000-000000000000"}
+    incremental = invmod.open_inverted_index(out)
+    for q in ["brand", "message", "c00002"]:
+        assert indexmod.search_index(out, q, k=10) == _scan(out, q, 10)
+    terms = [incremental.doc_terms(i) for i in range(incremental.n_items)]
+    invmod.build_inverted_index(out)
+    full = invmod.open_inverted_index(out)
+    assert terms == [full.doc_terms(i) for i in range(full.n_items)]
+    assert list(incremental.offsets) == list(full.offsets)
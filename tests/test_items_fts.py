@@ -0,0 +1,81 @@
+import json
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import index as indexmod
+
+
+_OLD_DDL = (
+    "CREATE TABLE items (composer_id TEXT NOT NULL, turn_index INTEGER NOT NULL, user TEXT, assistant TEXT, "
+    "user_head TEXT, assistant_head TEXT, annotations TEXT, PRIMARY KEY (composer_id, turn_index))"
+)
+
+
+def _insert(conn, cid, tix, user, assistant, ann=None):
+    conn.execute(
+        "INSERT INTO items (composer_id, turn_index, user, assistant, user_head, assistant_head, annotations) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (cid, tix, user, assistant, user[:10], assistant[:10], json.dumps(ann or {})),
+    )
+
+
+def _make_items(path, with_fts=True):
+    conn = sqlite3.connect(str(path))
+    conn.execute(_OLD_DDL)
+    _insert(conn, "c1", 0, "how do I fix the sqlite lock", "use WAL mode and retry on busy")
+    _insert(conn, "c1", 1, "thanks", "you are welcome")
+    _insert(conn, "c2", 0, "plot a chart", "matplotlib works; sqlite not needed")
+    if with_fts:
+        c = conn.cursor()
+        indexmod._ensure_items_columns(c, "items")
+        assert indexmod._ensure_items_fts(c, "items")
+        flags, tags = indexmod._ann_flags_and_tags({"contains_design": True, "tags": ["charts", ""]})
+        c.execute("UPDATE items SET ann_flags=?, tags=? WHERE composer_id='c2'", (flags, tags))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_fts_bm25_ranking_snippets_and_tags(tmp_path):
+    db = _make_items(tmp_path / "items.sqlite")
+    rows = indexmod.items_search(db, query="sqlite lock", k=5)
+    assert [(r["composer_id"], r["turn_index"]) for r in rows] == [("c1", 0), ("c2", 0)]
+    assert rows[0]["score"] > rows[1]["score"]
+    assert "[sqlite]" in rows[0]["snippet"]
+    # Tags and annotation flags are searchable through the trigger-synced columns
+    assert [r["composer_id"] for r in indexmod.items_search(db, query="charts")] == ["c2"]
+    assert [r["composer_id"] for r in indexmod.items_search(db, query="contains_design")] == ["c2"]
+    assert indexmod.items_search(db, query="nothingmatches") == []
+    hl = indexmod.items_search(db, query="welcome", highlight=True)
+    assert hl[0]["assistant_highlight"] == "you are [welcome]"
+
+
+def test_fts_follows_updates_and_deletes(tmp_path):
+    db = _make_items(tmp_path / "items.sqlite")
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE items SET assistant='try postgres instead' WHERE composer_id='c1' AND turn_index=0")
+    conn.execute("DELETE FROM items WHERE composer_id='c2'")
+    conn.commit()
+    conn.close()
+    assert [r["composer_id"] for r in indexmod.items_search(db, query="postgres")] == ["c1"]
+    assert [r["turn_index"] for r in indexmod.items_search(db, query="sqlite")] == [0]
+    assert indexmod.items_search(db, query="matplotlib") == []
+
+
+def test_scan_fallback_without_fts(tmp_path):
+    db = _make_items(tmp_path / "items.sqlite", with_fts=False)
+    rows = indexmod.items_search(db, query="sqlite lock", k=5)
+    assert rows[0]["composer_id"] == "c1" and isinstance(rows[0]["score"], int)
+    assert "snippet" not in rows[0]
+
+
+def test_build_index_sqlite_creates_fts(tmp_path):
+    src = benchmod.make_synthetic_state_db(str(tmp_path / "state.sqlite"), composers=2, turns=4, payload_bytes=8)
+    out = str(tmp_path / "items.sqlite")
+    assert indexmod.build_index_sqlite(out, db_path=src) == 4
+    # Re-running upserts through the update trigger without duplicating FTS rows
+    indexmod.build_index_sqlite(out, db_path=src)
+    conn = sqlite3.connect(out)
+    assert conn.execute("SELECT count(*) FROM items_fts WHERE items_fts MATCH 'message'").fetchone()[0] == 4
+    conn.close()
+    rows = indexmod.items_search(out, query="message 2", k=10)
+    assert rows and "[2]" in rows[0]["snippet"]
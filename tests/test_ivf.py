@@ -0,0 +1,108 @@
+import json
+
+import numpy as np
+
+from agent_explorer import bench as benchmod
+from agent_explorer import flatvec as flatmod
+from agent_explorer import index as indexmod
+from agent_explorer import ivf as ivfmod
+from agent_explorer import quant as quantmod
+import llm_utils as llmmod
+
+
+def _clustered(n, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((8, dim)).astype(np.float32)
+    pts = centers[rng.integers(0, 8, n)] + rng.standard_normal((n, dim), dtype=np.float32) * 0.3
+    return pts / np.linalg.norm(pts, axis=1, keepdims=True)
+
+
+def _store(tmp_path, vecs):
+    db = str(tmp_path / "vec.db")
+    rows = [[f"c:{i}", "c", i, f"u{i}", f"a{i}", ""] for i in range(len(vecs))]
+
+    def fill(mat):
+        mat[:] = vecs
+
+    flatmod._write_store(db, "vec_index", "m", vecs.shape[1], rows, fill)
+    return db, flatmod.open_flat_vectors(db, "vec_index")
+
+
+def test_ivf_recall_and_exhaustive_nprobe(tmp_path):
+    vecs = _clustered(2000)
+    db, store = _store(tmp_path, vecs)
+    idx = ivfmod.build_ivf(db, nlist=16)
+    assert idx.nlist == 16 and len(idx) == 2000
+    order, ptr = idx.lists()
+    assert sorted(order.tolist()) == list(range(2000)) and ptr[-1] == 2000
+    loaded = ivfmod.open_ivf(db, "vec_index", store)
+    assert np.array_equal(loaded.assign, idx.assign)
+
+    qs = _clustered(20, seed=1)
+    hits = 0
+    for q in qs:
+        exact = store.search_vector(q, 10)
+        assert store.search_vector(q, 10, ivf=loaded, nprobe=16) == exact
+        hits += len({r["id"] for r in exact} & {r["id"] for r in store.search_vector(q, 10, ivf=loaded, nprobe=4)})
+    assert hits / 200 > 0.9
+
+
+def test_stale_ivf_is_ignored_and_add(tmp_path):
+    vecs = _clustered(300)
+    db, store = _store(tmp_path, vecs)
+    idx = ivfmod.build_ivf(db, nlist=4)
+    db, store = _store(tmp_path, vecs[:200])
+    assert ivfmod.open_ivf(db, "vec_index", store) is None
+    idx.add(_clustered(5, seed=2))
+    assert len(idx) == 305 and idx.lists()[1][-1] == 305
+
+
+class _FakeClient:
+    def __init__(self):
+        class _E:
+            @staticmethod
+            def create(model, input):
+                class _D:
+                    def __init__(self, t):
+                        self.embedding = _clustered(1, seed=sum(t.encode()))[0].tolist()
+
+                class _R:
+                    data = [_D(t) for t in input]
+
+                return _R()
+
+        self.embeddings = _E()
+
+
+def test_incremental_build_keeps_ivf_current(tmp_path, monkeypatch):
+    monkeypatch.setattr(llmmod, "require_client", lambda: _FakeClient())
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setenv("LLM_LOG_PATH", str(tmp_path / "llm_usage.jsonl"))
+    llmmod.clear_query_cache()
+    idx_path = tmp_path / "idx.jsonl"
+    rows = [{"composer_id": "c", "turn_index": i, "user_head": f"q{i}", "assistant_head": f"a{i}"} for i in range(40)]
+    idx_path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    db = str(tmp_path / "vec.db")
+    indexmod.build_embeddings_sqlite(db, str(idx_path), backend="numpy")
+    before = ivfmod.build_ivf(db, nlist=4)
+    quantmod.build_quantized(db, "vec_index", ["binary"])
+
+    rows = rows[5:] + [{"composer_id": "d", "turn_index": 0, "user_head": "new", "assistant_head": "row"}]
+    idx_path.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    indexmod.build_embeddings_sqlite(db, str(idx_path), backend="numpy", changed_only=True)
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    after = ivfmod.open_ivf(db, "vec_index", store)
+    assert after is not None and len(after) == 36
+    assert len(quantmod.open_quantized(db, "vec_index", store, "binary")) == 36
+    assert np.array_equal(after.assign[:35], before.assign[5:])
+    assert after.assign[35] == ivfmod.nearest_centroid(store.matrix[35:36], after.centroids)[0]
+    # Every row is reachable when all lists are probed
+    exact = indexmod.vec_search(db, "vec_index", "new row", top_k=5, backend="numpy", nprobe=0)
+    assert indexmod.vec_search(db, "vec_index", "new row", top_k=5, backend="numpy", nprobe=4) == exact
+    llmmod.clear_query_cache()
+
+
+def test_bench_ann_reports_recall():
+    out = benchmod.bench_ann(rows=3000, dim=16, nlist=16, nprobes=[1, 16], k=5, queries=5)
+    assert out["ivf"][-1]["recall_at_k"] == 1.0
+    assert 0 < out["ivf"][0]["recall_at_k"] <= 1.0
@@ -0,0 +1,75 @@
+import json
+import sqlite3
+
+from agent_explorer import db as dbmod
+from agent_explorer import parser as parsermod
+
+
+def _make_db(path):
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE cursorDiskKV(key TEXT PRIMARY KEY, value BLOB)")
+    composer = {
+        "fullConversationHeadersOnly": [
+            {"bubbleId": "b1", "type": 1, "serverBubbleId": "s1"},
+            {"bubbleId": "b2", "type": 2},
+            {"bubbleId": "b3"},
+            {"bubbleId": "b4", "type": 2},
+        ],
+        "context": {"workspace": {"rootPath": "/home/me/code/proj"}},
+        "gitRemote": "https://github.com/me/proj.git",
+    }
+    rows = [
+        ("composerData:cid", json.dumps(composer).encode("utf-8")),
+        ("composerData:bad", b"not json"),
+        ("bubbleId:cid:b1", json.dumps({"text": "hi", "type": 1, "toolResults": [{"output": "x" * 1000}]}).encode("utf-8")),
+        ("bubbleId:cid:b2", b'{"text": "", "content": "from content", "type": 2}'),
+        ("bubbleId:cid:b3", b'{"text": "typed by bubble", "type": 1}'),
+        ("bubbleId:cid:b4", b"{broken"),
+    ]
+    conn.executemany("INSERT INTO cursorDiskKV(key, value) VALUES(?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return dbmod.connect_readonly(str(path))
+
+
+def test_kv_json_fields_projects_and_skips_bad_values(tmp_path):
+    conn = _make_db(tmp_path / "state.sqlite")
+    assert dbmod.kv_json_fields(conn, "bubbleId:cid:b1", ["$.text", "$.type", "$.nope"]) == ["hi", 1, None]
+    assert dbmod.kv_json_fields(conn, "composerData:cid", ["$.context"]) == [{"workspace": {"rootPath": "/home/me/code/proj"}}]
+    assert dbmod.kv_json_fields(conn, "composerData:bad", ["$.text"]) is None
+    assert dbmod.kv_json_fields(conn, "composerData:none", ["$.text"]) is None
+    keys = [k for k, _ in dbmod.iter_kv_json_fields(conn, "bubbleId:cid:", ["$.text"])]
+    assert keys == ["bubbleId:cid:b1", "bubbleId:cid:b2", "bubbleId:cid:b3"]
+
+
+def test_bubble_fields_and_headers(tmp_path):
+    conn = _make_db(tmp_path / "state.sqlite")
+    fields = parsermod.load_bubble_fields(conn, "cid")
+    assert fields["b1"] == {"text": "hi", "content": None}
+    assert "b4" not in fields
+    assert parsermod.load_bubble_headers(conn, "cid") == [("b1", 1, "s1"), ("b2", 2, None), ("b3", None, None), ("b4", 2, None)]
+    assert parsermod.load_bubble_headers(conn, "bad") is None
+    msgs = parsermod.reconstruct_conversation(conn, "cid")
+    assert [(m["role"], m["text"]) for m in msgs] == [("user", "hi"), ("assistant", "from content"), ("assistant", "typed by bubble")]
+
+
+def test_repo_hint_matches_python_walk(tmp_path):
+    conn = _make_db(tmp_path / "state.sqlite")
+    composer = parsermod.load_composer(conn, "cid")
+    assert parsermod.load_repo_hint(conn, "cid") == parsermod.extract_repo_hint(composer) == "proj"
+    assert parsermod.load_repo_hint(conn, "missing") is None
+
+
+def test_python_fallback_when_projection_fails(tmp_path, monkeypatch):
+    conn = _make_db(tmp_path / "state.sqlite")
+    expected = parsermod.reconstruct_conversation(conn, "cid")
+
+    def no_json1(*a, **k):
+        raise sqlite3.OperationalError("no such function: json_valid")
+
+    monkeypatch.setattr(dbmod, "kv_json_fields", no_json1)
+    monkeypatch.setattr(dbmod, "iter_kv_json_fields", no_json1)
+    monkeypatch.setattr(dbmod, "kv_json_string_fields", no_json1)
+    assert parsermod.reconstruct_conversation(conn, "cid") == expected
+    assert parsermod.load_bubble_headers(conn, "bad") is None
+    assert parsermod.load_repo_hint(conn, "cid") == "proj"
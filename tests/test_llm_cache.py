@@ -0,0 +1,290 @@
+import array
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+import llm_cache
+import llm_utils as llmmod
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "llm_cache.sqlite"
+    monkeypatch.setenv("LLM_CACHE_PATH", str(path))
+    yield path
+    llm_cache.close()
+
+
+def test_pooled_connection_and_bulk_api(cache_path, monkeypatch):
+    opened = []
+    real_connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *a, **k: opened.append(a) or real_connect(*a, **k))
+    llm_cache.set("a", "1", prompt_tokens=3, total_tokens=5)
+    llm_cache.set_many([("b", "2"), ("c", "3")])
+    assert llm_cache.get("a") == "1"
+    assert llm_cache.get_many(["a", "c", "missing", "a"]) == {"a": "1", "c": "3"}
+    assert llm_cache.get_many([]) == {}
+    assert llm_cache.get_with_meta("a") == ("1", {"prompt_tokens": 3, "completion_tokens": 0, "total_tokens": 5})
+    assert llm_cache.get_with_meta("missing") is None
+    assert llm_cache.count() == 3
+    assert len(opened) == 1
+    assert llm_cache._handle().conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def _rows_on_disk(path, table="cache"):
+    conn = sqlite3.connect(str(path))
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_writes_commit_and_reads_are_grouped(cache_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_COMMIT_EVERY", "3")
+    monkeypatch.setenv("LLM_CACHE_COMMIT_SECS", "3600")
+    llm_cache.set_many([("a", "1"), ("b", "2")])
+    llm_cache.set_vector("v", "m", [1.0])
+    # Writes are visible to other connections as soon as the call returns
+    assert _rows_on_disk(cache_path) == 2 and _rows_on_disk(cache_path, "embeddings") == 1
+    llm_cache.get("a")
+    llm_cache.get("b")
+    assert _rows_on_disk(cache_path, "cache_stats") == 0
+    llm_cache.get("c")
+    assert _rows_on_disk(cache_path, "cache_stats") == 1
+
+
+def test_idle_writer_does_not_block_other_processes(cache_path):
+    llm_cache.set("a", "1")
+    # This process stays idle with its connection open while another one writes
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([SRC, os.environ.get("PYTHONPATH", "")])}
+    code = "import llm_cache; llm_cache.set('b', '2'); llm_cache.close()"
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", code], env=env, check=True, timeout=60)
+    assert time.monotonic() - start < 5
+    assert _rows_on_disk(cache_path) == 2
+    assert llm_cache.get("b") == "2"
+
+
+def test_embed_texts_batches_cache_reads_and_writes(cache_path, monkeypatch):
+    calls = {"get_vectors": 0, "set_vectors": 0, "get": 0, "get_many": 0}
+    for name in calls:
+        real = getattr(llm_cache, name)
+        monkeypatch.setattr(llm_cache, name, lambda *a, _n=name, _r=real, **k: calls.__setitem__(_n, calls[_n] + 1) or _r(*a, **k))
+
+    class _Client:
+        class embeddings:
+            @staticmethod
+            def create(model, input):
+                class _D:
+                    def __init__(self, t):
+                        self.embedding = [float(len(t)), 1.0]
+
+                class _R:
+                    data = [_D(t) for t in input]
+                    usage = None
+
+                return _R()
+
+    texts = [f"text {i}" * (i + 1) for i in range(10)]
+    first = llmmod.embed_texts(_Client(), texts, model="m")
+    assert llmmod.embed_texts(_Client(), texts, model="m") == first
+    # The first call also checks the legacy position-based keys for its misses
+    assert calls == {"get_vectors": 3, "set_vectors": 1, "get": 0, "get_many": 0}
+
+
+def test_vectors_are_float32_blobs(cache_path):
+    llm_cache.set_vectors([("a", "m", [0.1, 0.2, 0.3]), ("b", "m", np.arange(4, dtype=np.float64))])
+    assert llm_cache.get_vector("a") == array.array("f", [0.1, 0.2, 0.3]).tolist()
+    found = llm_cache.get_vectors(["a", "b", "missing"], fmt="numpy")
+    assert set(found) == {"a", "b"} and found["b"].dtype == np.float32 and found["b"].tolist() == [0, 1, 2, 3]
+    assert llm_cache.get_vector("a", fmt="view").format == "f"
+    assert isinstance(llm_cache.get_vector("a", fmt="array"), array.array)
+    # Entries from another model are misses
+    assert llm_cache.get_vector("a", model="other") is None
+    conn = llm_cache._handle().conn
+    assert conn.execute("SELECT model, dim, length(vec) FROM embeddings WHERE key = 'a'").fetchone() == ("m", 3, 12)
+    assert llm_cache.count() == 0 and llm_cache.count_vectors() == 2
+    with pytest.raises(ValueError):
+        llm_cache.get_vectors(["a"], fmt="json")
+
+
+def test_json_embeddings_are_migrated_by_key(cache_path):
+    conn = sqlite3.connect(str(cache_path))
+    conn.execute("CREATE TABLE cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.execute("CREATE TABLE cache_meta (key TEXT PRIMARY KEY, prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    rows = [("e1", json.dumps([0.5, -1.0])), ("e2", json.dumps([1, 2, 3])), ("r1", json.dumps({"tags": []})), ("r2", json.dumps(["a", "b"])), ("r3", json.dumps([4, 5]))]
+    conn.executemany("INSERT INTO cache(key, value) VALUES(?, ?)", rows)
+    conn.execute("INSERT INTO cache_meta(key) VALUES('e1')")
+    conn.commit()
+    conn.close()
+    # Opening the file moves nothing: a numeric list is not necessarily an embedding
+    assert llm_cache.count() == 5 and llm_cache.count_vectors() == 0
+    assert llm_cache.migrate_embeddings(["e1", "e2", "r1", "r2", "missing"]) == 2
+    assert llm_cache.get_vector("e1") == [0.5, -1.0]
+    assert llm_cache.get_vector("e2", model="m") == [1.0, 2.0, 3.0]
+    assert llm_cache.get("e1") is None and llm_cache.get_meta("e1") is None
+    assert llm_cache.get("r1") == json.dumps({"tags": []}) and llm_cache.get("r2") == json.dumps(["a", "b"])
+    assert llm_cache.get("r3") == json.dumps([4, 5]) and llm_cache.get_vector("r3") is None
+
+
+class _CountingClient:
+    def __init__(self):
+        self.calls = []
+        self.embeddings = self
+
+    def create(self, model, input, **kw):
+        self.calls.append((list(input), kw))
+
+        class _D:
+            def __init__(self, t):
+                self.embedding = [float(len(t)), 0.5]
+
+        class _R:
+            data = [_D(t) for t in input]
+            usage = None
+
+        return _R()
+
+
+def test_embedding_keys_are_content_addressed(cache_path):
+    from agent_explorer import trace as tracemod
+
+    client = _CountingClient()
+    first = llmmod.embed_texts(client, ["alpha", "beta", "alpha"], model="m", scope="evoc", id_prefix="it:")
+    # Duplicates are sent once; order and position are not part of the key
+    assert client.calls == [(["alpha", "beta"], {})]
+    assert llmmod.embed_texts(client, ["beta", " alpha "], model="m", scope="vsearch:c1") == [first[1], first[0]]
+    assert llmmod.embed_query("alpha", model="m", client=client) == first[0]
+    assert len(client.calls) == 1
+    # Dimensions and model are part of the key
+    llmmod.embed_texts(client, ["alpha"], model="m", dimensions=64)
+    llmmod.embed_texts(client, ["alpha"], model="m2")
+    assert client.calls[1:] == [(["alpha"], {"dimensions": 64}), (["alpha"], {})]
+    # The text sent is the normalized text the key hashes
+    llmmod.embed_texts(client, ["  gamma\t delta\n"], model="m")
+    assert client.calls[-1] == (["gamma delta"], {})
+    by_scope = {(r["scope"], r["model"]): r["count"] for r in llm_cache.vector_stats()}
+    assert by_scope[("evoc", "m")] == 2
+    assert tracemod.get_run_summary()["embeddings"]["vsearch:c1"]["hits"] >= 2
+
+
+def test_legacy_position_keys_are_rekeyed(cache_path):
+    from agent_explorer import trace as tracemod
+
+    legacy = llmmod._legacy_embedding_cache_key("m", "evoc", "it:1", "beta")
+    llm_cache.set_vector(legacy, "m", [9.0, 9.0])
+    # Vectors from before the embeddings table are JSON in the cache table
+    jlegacy = llmmod._legacy_embedding_cache_key("m", "evoc", "it:0", "gamma")
+    llm_cache.set(jlegacy, json.dumps([7.0, 7.0]))
+    before = dict(tracemod.get_run_summary()["embeddings"].get("evoc", {"migrated": 0}))
+    client = _CountingClient()
+    assert llmmod.embed_texts(client, ["alpha", "beta"], model="m", scope="evoc", id_prefix="it:")[1] == [9.0, 9.0]
+    assert client.calls == [(["alpha"], {})]
+    assert llm_cache.get_vector(legacy) is None
+    assert llm_cache.get_vector(llmmod.embedding_key("m", "beta")) == [9.0, 9.0]
+    assert tracemod.get_run_summary()["embeddings"]["evoc"]["migrated"] == before["migrated"] + 1
+    # Another scope now finds it by content
+    assert llmmod.embed_texts(client, ["beta"], model="m", scope="other") == [[9.0, 9.0]]
+    assert llmmod.embed_texts(client, ["gamma"], model="m", scope="evoc", id_prefix="it:") == [[7.0, 7.0]]
+    assert llm_cache.get(jlegacy) is None
+    # Queries share the content key
+    llmmod.clear_query_cache()
+    assert llmmod.embed_query("gamma", model="m", client=client) == [7.0, 7.0]
+    assert len(client.calls) == 1
+
+
+def test_namespace_ttls(cache_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock[0])
+    monkeypatch.setenv("LLM_CACHE_TTL_SEARCH", "60")
+    llm_cache.set("s", "result", ns="search")
+    llm_cache.set("a", "annotation")
+    llm_cache.set_vector("e", "m", [1.0])
+    assert llm_cache.ttl_seconds("recall") == 7 * 24 * 3600 and llm_cache.ttl_seconds("llm") is None
+    clock[0] += 61
+    assert llm_cache.get("s", ns="search") is None
+    assert llm_cache.get("a") == "annotation" and llm_cache.get_vector("e") == [1.0]
+    assert llm_cache.evict() == {"expired": 1, "evicted": 0}
+    ns = llm_cache.stats()["namespaces"]
+    assert ns["search"]["expired"] == 1 and ns["search"]["misses"] == 1 and ns["search"]["entries"] == 0
+    assert ns["llm"]["hits"] == 1 and ns["embed"]["entries"] == 1
+
+
+def test_lru_eviction_by_entries_and_bytes(cache_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: clock[0])
+    for i in range(10):
+        clock[0] += 1
+        llm_cache.set(f"k{i}", "x" * 100)
+    clock[0] += 1
+    llm_cache.set_vector("v", "m", [0.0] * 8)
+    # Reading k0 makes it recent, so k1.. go first
+    clock[0] += 1
+    assert llm_cache.get("k0") == "x" * 100
+    monkeypatch.setenv("LLM_CACHE_MAX_ENTRIES", "5")
+    assert llm_cache.evict()["evicted"] == 11 - 4
+    assert sorted(llm_cache.get_many(["k0", "k8", "k9", "k1"])) == ["k0", "k8", "k9"]
+    assert llm_cache.count() + llm_cache.count_vectors() == 4
+    assert llm_cache.stats()["namespaces"]["llm"]["evictions"] == 7
+
+    monkeypatch.delenv("LLM_CACHE_MAX_ENTRIES")
+    llm_cache.set_many([(f"big{i}", "y" * 20000) for i in range(20)])
+    monkeypatch.setenv("LLM_CACHE_MAX_BYTES", "200K")
+    assert llm_cache._parse_bytes("200K") == 200 * 1024
+    llm_cache.evict()
+    assert llm_cache._used_bytes(llm_cache._handle().conn) <= 200 * 1024
+    assert llm_cache.count() < 23
+
+
+def test_stats_persist_and_cache_command(cache_path, capsys):
+    from agent_explorer import cli as climod
+
+    llm_cache.set("a", "1")
+    llm_cache.get("a")
+    llm_cache.get("b")
+    llm_cache.close()
+    assert climod.main(["cache", "stats"]) in (0, None)
+    out = capsys.readouterr().out
+    stats = json.loads(out[: out.index("\n}\n") + 2])
+    assert stats["namespaces"]["llm"]["hits"] == 1 and stats["namespaces"]["llm"]["hit_rate"] == 0.5
+    assert stats["namespaces"]["llm"]["bytes"] == 2
+    assert climod.main(["cache", "vacuum"]) in (0, None)
+
+
+def test_memory_tier_write_through_and_negative_entries(cache_path, monkeypatch):
+    from agent_explorer import trace as tracemod
+
+    monkeypatch.setenv("LLM_CACHE_MEMORY_BYTES", "4K")
+    monkeypatch.setenv("LLM_CACHE_NEGATIVE_SECS", "60")
+    selects = []
+    llm_cache._handle().conn.set_trace_callback(lambda sql: sql.startswith("SELECT c.key") and selects.append(sql))
+    before = dict(tracemod.get_run_summary()["memory_cache"])
+    llm_cache.set("a", "1", prompt_tokens=3)
+    for _ in range(3):
+        assert llm_cache.get_with_meta("a") == ("1", {"prompt_tokens": 3, "completion_tokens": 0, "total_tokens": 0})
+        assert llm_cache.get("missing") is None
+    # Written values are served from memory; the miss reaches SQLite once, then is remembered
+    assert len(selects) == 1
+    llm_cache.set("missing", "now")
+    assert llm_cache.get_many(["missing", "a"]) == {"missing": "now", "a": "1"} and len(selects) == 1
+    after = tracemod.get_run_summary()["memory_cache"]
+    assert after["hits"] - before["hits"] == 5 and after["negative_hits"] - before["negative_hits"] == 2
+    assert after["misses"] - before["misses"] == 1 and 0 < after["bytes"] <= 4096
+    assert llm_cache.stats()["namespaces"]["llm"]["hits"] == 5
+
+    # The tier is bounded in bytes: older entries fall back to SQLite
+    llm_cache.set_many([(f"big{i}", "x" * 1000) for i in range(8)])
+    mem = llm_cache._handle().memory
+    assert mem.bytes <= 4096 and "big0" not in mem.entries and "big7" in mem.entries
+    assert llm_cache.get("big0") == "x" * 1000 and len(selects) == 2
+
+    monkeypatch.setenv("LLM_CACHE_MEMORY_BYTES", "0")
+    assert llm_cache.get("a") == "1" and len(selects) == 3
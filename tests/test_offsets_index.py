@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import cli as climod
+from agent_explorer import index as indexmod
+from agent_explorer import offsets as offsetsmod
+from agent_explorer import toolchat as toolchatmod
+
+
+def _write_index(path):
+    rows = [
+        {"composer_id": "a", "turn_index": 1, "user": "second", "assistant": "x"},
+        {"composer_id": "a", "turn_index": 0, "user": "first", "assistant": "y"},
+        {"composer_id": "b", "turn_index": 0, "user": "über", "assistant": "z"},
+        {"composer_id": "a", "turn_index": 0, "user": "dup wins", "assistant": "w"},
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(rows[0]) + "\n{broken\n")
+        for r in rows[1:]:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    return str(path)
+
+
+def test_lookup_by_id_and_composer(tmp_path):
+    path = _write_index(tmp_path / "index.jsonl")
+    assert offsetsmod.build_offsets_index(path) == 4
+    offs = offsetsmod.open_offsets_index(path)
+    assert len(offs) == 4 and offs.composer_ids() == ["a", "b"]
+    assert offs.get("b:0")["user"] == "über"
+    assert offs.get("a:0")["user"] == "dup wins"
+    assert offs.get("a:7") is None and offs.get("zz:0") is None
+    off, length = offs.locate("a:1")
+    with open(path, "rb") as f:
+        f.seek(off)
+        assert json.loads(f.read(length))["user"] == "second"
+    assert [it["user"] for it in offs.composer_items("a")] == ["second", "first", "dup wins"]
+    assert offs.composer_range("b")[1] == offs.locate("b:0")[1]
+    assert offs.composer_items("missing") == [] and offs.composer_range("missing") is None
+    assert set(indexmod.get_index_items(path, ["a:1", "b:0", "nope:0"])) == {"a:1", "b:0"}
+
+
+def test_consumers_match_scan_fallback(tmp_path):
+    path = _write_index(tmp_path / "index.jsonl")
+    scanned = indexmod.get_index_items(path, ["a:0", "b:0"])
+    offsetsmod.build_offsets_index(path)
+    assert indexmod.get_index_items(path, ["a:0", "b:0"]) == scanned
+    sample = indexmod.sample_index(path, 10)
+    assert sorted(it["user"] for it in sample) == ["dup wins", "first", "second", "über"]
+    assert len(indexmod.sample_index(path, 2)) == 2
+
+    def titles(out):
+        args = argparse.Namespace(index_jsonl=path, use_llm=False, model=None, max_turns=1, out_json=str(out))
+        climod.cmd_auto_titles(args)
+        return json.load(open(out))["titles"]
+
+    with_offsets = titles(tmp_path / "t1.json")
+    (tmp_path / "index.jsonl.inv").unlink()
+    assert offsetsmod.open_offsets_index(path) is None
+    assert titles(tmp_path / "t2.json") == with_offsets == {"a": {"title": "second", "repo": None}, "b": {"title": "über", "repo": None}}
+
+
+def test_build_index_writes_offsets_incrementally(tmp_path):
+    src = benchmod.make_synthetic_state_db(str(tmp_path / "state.sqlite"), composers=3, turns=4, payload_bytes=8)
+    out = str(tmp_path / "index.jsonl")
+    indexmod.build_index(out, db_path=src, incremental=True)
+    cid = "c00001-0000-0000-0000-000000000000"
+    conn = sqlite3.connect(src)
+    conn.execute("UPDATE cursorDiskKV SET value=? WHERE key=?", (json.dumps({"text": "longer replacement text", "type": 1}), f"bubbleId:{cid}:b000000"))
+    conn.commit()
+    conn.close()
+    indexmod.build_index(out, db_path=src, incremental=True)
+    offs = offsetsmod.open_offsets_index(out)
+    assert offs is not None and len(offs) == 6
+    # Offsets come from the inverted-index sidecar; no separate file is written
+    assert not os.path.exists(out + ".offsets")
+    assert offs.get(f"{cid}:0")["user"] == "longer replacement text"
+    manifest = json.load(open(indexmod.index_manifest_path(out)))
+    for c, e in manifest["composers"].items():
+        assert offs.composer_range(c) == (e["offset"], e["length"] - 1)
+    assert [offs.ident(i) for i in range(len(offs))] == [offsetsmod.item_id(json.loads(line)) for line in open(out, encoding="utf-8")]
+
+    res = toolchatmod._tool_cat_chat({"index": out, "composer_id": cid, "offset": 0, "limit": 1, "db": src})
+    assert res == {"mode": "pairs", "items": [{"turn_index": 0, "user_head": "longer replacement text", "assistant_head": f"message 1 of {cid}"}]}
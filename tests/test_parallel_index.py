@@ -0,0 +1,32 @@
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import index as indexmod
+
+
+def test_parallel_build_index_is_byte_identical(tmp_path):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=7, turns=6, payload_bytes=32)
+    serial = tmp_path / "serial.jsonl"
+    parallel = tmp_path / "parallel.jsonl"
+    n1 = indexmod.build_index(str(serial), db_path=dbp)
+    n2 = indexmod.build_index(str(parallel), db_path=dbp, workers=3)
+    assert n1 == n2 == 7 * 3
+    assert serial.read_bytes() == parallel.read_bytes()
+    # limit applies before dispatch
+    assert indexmod.build_index(str(parallel), db_path=dbp, limit_composers=2, workers=2) == 6
+
+
+def test_parallel_build_index_sqlite_matches_serial(tmp_path):
+    dbp = benchmod.make_synthetic_state_db(str(tmp_path / "state.vscdb"), composers=5, turns=4, payload_bytes=32)
+    a = tmp_path / "a.sqlite"
+    b = tmp_path / "b.sqlite"
+    assert indexmod.build_index_sqlite(str(a), dbp) == indexmod.build_index_sqlite(str(b), dbp, workers=2) == 10
+
+    def rows(p):
+        conn = sqlite3.connect(str(p))
+        try:
+            return conn.execute("SELECT rowid, * FROM items ORDER BY rowid").fetchall()
+        finally:
+            conn.close()
+
+    assert rows(a) == rows(b)
@@ -0,0 +1,78 @@
+import numpy as np
+
+from agent_explorer import bench as benchmod
+from agent_explorer import flatvec as flatmod
+from agent_explorer import ivf as ivfmod
+from agent_explorer import quant as quantmod
+
+
+def _store(tmp_path, n=1500, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    db = str(tmp_path / "vec.db")
+    rows = [[f"c:{i}", "c", i, "", "", ""] for i in range(n)]
+
+    def fill(mat):
+        mat[:] = vecs
+
+    flatmod._write_store(db, "vec_index", "m", dim, rows, fill)
+    return db, flatmod.open_flat_vectors(db, "vec_index")
+
+
+def test_codes_sizes_and_values(tmp_path):
+    db, store = _store(tmp_path)
+    assert quantmod.build_quantized(db, "vec_index") == {"int8": 64, "binary": 8}
+    q8 = quantmod.open_quantized(db, "vec_index", store, "int8")
+    qb = quantmod.open_quantized(db, "vec_index", store, "binary")
+    assert q8.codes.dtype == np.int8 and qb.codes.shape == (1500, 8)
+    # int8 codes decode to within half a step of the float rows
+    decoded = q8.codes.astype(np.float32) * q8.scale / 127.0
+    assert np.abs(decoded - store.matrix).max() <= (q8.scale / 127.0).max() / 2 + 1e-6
+    assert np.array_equal(np.unpackbits(qb.codes, axis=1).astype(bool), store.matrix > 0)
+    # Rebuilding one kind keeps the other listed
+    quantmod.build_quantized(db, "vec_index", ["binary"])
+    assert quantmod.quantized_kinds(db, "vec_index") == ["int8", "binary"]
+
+
+def test_rerank_results_are_exact_scores_and_recall(tmp_path):
+    db, store = _store(tmp_path)
+    quantmod.build_quantized(db, "vec_index")
+    rng = np.random.default_rng(1)
+    for kind, floor in (("int8", 0.95), ("binary", 0.6)):
+        codes = quantmod.open_quantized(db, "vec_index", store, kind)
+        hits = 0
+        for _ in range(10):
+            q = rng.standard_normal(64).astype(np.float32)
+            q /= np.linalg.norm(q)
+            exact = store.search_vector(q, 10)
+            got = store.search_vector(q, 10, quant=codes, rerank=20)
+            # Distances come from the float rows, never the codes
+            by_id = {r["id"]: r["distance"] for r in exact}
+            assert all(abs(r["distance"] - by_id[r["id"]]) < 1e-6 for r in got if r["id"] in by_id)
+            assert [r["distance"] for r in got] == sorted(r["distance"] for r in got)
+            hits += len({r["id"] for r in got} & set(by_id))
+        assert hits / 100 >= floor, kind
+        # A shortlist covering every row is exhaustive
+        assert store.search_vector(q, 10, quant=codes, rerank=1000) == exact
+
+
+def test_quant_composes_with_ivf_and_goes_stale(tmp_path):
+    db, store = _store(tmp_path)
+    idx = ivfmod.build_ivf(db, nlist=8)
+    quantmod.build_quantized(db, "vec_index", ["int8"])
+    codes = quantmod.open_quantized(db, "vec_index", store, "int8")
+    q = store.matrix[7]
+    res = store.search_vector(q, 5, ivf=idx, nprobe=8, quant=codes, rerank=4)
+    assert res[0]["id"] == "c:7"
+    assert quantmod.open_quantized(db, "vec_index", store, "binary") is None
+    db, store = _store(tmp_path, seed=2)
+    assert quantmod.open_quantized(db, "vec_index", store, "int8") is None
+
+
+def test_bench_quant_reports_compression():
+    out = benchmod.bench_quant(rows=2000, dim=64, k=5, reranks=[2], queries=3)
+    assert out["kinds"]["int8"]["compression"] == 4.0
+    assert out["kinds"]["binary"]["compression"] == 32.0
+    run = out["kinds"]["int8"]["runs"][0]
+    assert 0 <= run["recall_loss"] <= 1 and abs(run["recall_at_k"] + run["recall_loss"] - 1.0) < 1e-9
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from agent_explorer import index as indexmod
+from agent_explorer import inverted as invmod
+from agent_explorer import offsets as offsetsmod
+
+
+def _write(path, items):
+    with open(path, "w", encoding="utf-8") as f:
+        for it in items:
+            f.write(json.dumps(it) + "\n")
+    return str(path)
+
+
+def _items(n_short=200, n_long=200):
+    items = [{"composer_id": f"s{i % 4}", "turn_index": i, "user": "q", "assistant": "a", "annotations": {"tags": ["short"]}} for i in range(n_short)]
+    items += [{"composer_id": "long", "turn_index": i, "user": "q", "assistant": "x" * 2000, "annotations": {}} for i in range(n_long)]
+    return items
+
+
+def _ids(items):
+    return [(it["composer_id"], it["turn_index"]) for it in items]
+
+
+def test_offset_sampling_is_seeded_distinct_and_sparse(tmp_path, monkeypatch):
+    path = _write(tmp_path / "index.jsonl", _items())
+    assert offsetsmod.open_offsets_index(path) is None
+    calls = []
+    real = json.loads
+    monkeypatch.setattr(json, "loads", lambda s, *a, **k: calls.append(1) or real(s, *a, **k))
+    first = indexmod.sample_index(path, 10, seed=7)
+    assert len(calls) < 100
+    monkeypatch.setattr(json, "loads", real)
+    assert len(set(_ids(first))) == 10
+    assert _ids(indexmod.sample_index(path, 10, seed=7)) == _ids(first)
+    assert _ids(indexmod.sample_index(path, 10, seed=8)) != _ids(first)
+
+
+def test_offset_sampling_corrects_length_bias(tmp_path):
+    path = _write(tmp_path / "index.jsonl", _items())
+    longs = sum(indexmod.sample_index(path, 1, seed=s)[0]["composer_id"] == "long" for s in range(1500))
+    # Long lines are ~200x longer; uncorrected offset sampling would pick them >99% of the time
+    assert 0.4 < longs / 1500 < 0.6
+
+
+def test_small_index_falls_back_to_reservoir(tmp_path):
+    path = _write(tmp_path / "index.jsonl", _items(3, 1))
+    assert sorted(_ids(indexmod.sample_index(path, 10, seed=1))) == sorted(_ids(_items(3, 1)))
+    assert _ids(indexmod.sample_index(path, 2, seed=3)) == _ids(indexmod.sample_index(path, 2, seed=3))
+
+
+def test_sidecar_sampling_is_seeded(tmp_path):
+    path = _write(tmp_path / "index.jsonl", _items())
+    offsetsmod.build_offsets_index(path)
+    a = indexmod.sample_index(path, 5, seed=11)
+    assert len(set(_ids(a))) == 5 and _ids(a) == _ids(indexmod.sample_index(path, 5, seed=11))
+
+
+@pytest.mark.parametrize("sidecars", [False, True])
+def test_stratified_sampling(tmp_path, sidecars):
+    path = _write(tmp_path / "index.jsonl", _items(8, 50))
+    if sidecars:
+        offsetsmod.build_offsets_index(path)
+        invmod.build_inverted_index(path)
+    by_composer = indexmod.sample_index(path, 5, seed=2, stratify="composer")
+    assert sorted(it["composer_id"] for it in by_composer) == ["long", "s0", "s1", "s2", "s3"]
+    by_tag = indexmod.sample_index(path, 4, seed=2, stratify="tag")
+    assert sorted(bool(it["annotations"].get("tags")) for it in by_tag) == [False, False, True, True]
+    assert _ids(indexmod.sample_index(path, 4, seed=2, stratify="tag")) == _ids(by_tag)
+    assert len(indexmod.sample_index(path, 100, seed=2, stratify="composer")) == 58
+    with pytest.raises(ValueError):
+        indexmod.sample_index(path, 1, stratify="repo")
+
+
+def test_tag_strata_match_with_and_without_sidecar(tmp_path):
+    items = [{"composer_id": "c", "turn_index": i, "user": "q", "assistant": "a", "annotations": {"tags": ["Fix"]}} for i in range(3)]
+    # Tagged but without text: no "#tag" term in the sidecar, so untagged on both paths
+    items += [{"composer_id": "c", "turn_index": 3 + i, "user": "", "assistant": "", "annotations": {"tags": ["docs"]}} for i in range(3)]
+    items += [{"composer_id": "c", "turn_index": 6 + i, "user": "q", "assistant": "a", "annotations": {}} for i in range(3)]
+    path = _write(tmp_path / "index.jsonl", items)
+    scans = [_ids(indexmod.sample_index(path, 4, seed=s, stratify="tag")) for s in range(10)]
+    invmod.build_inverted_index(path)
+    assert set(invmod.open_inverted_index(path).tag_postings()) == {"fix"}
+    assert [_ids(indexmod.sample_index(path, 4, seed=s, stratify="tag")) for s in range(10)] == scans
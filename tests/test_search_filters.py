@@ -0,0 +1,186 @@
+import array
+import json
+import math
+import sqlite3
+
+import numpy as np
+import pytest
+
+from agent_explorer import filters as filtersmod
+from agent_explorer import flatvec as flatmod
+from agent_explorer import index as indexmod
+from agent_explorer import inverted as invmod
+from agent_explorer import ivf as ivfmod
+
+
+def _items():
+    return [
+        {"composer_id": "a", "turn_index": 0, "user": "sqlite lock error", "assistant": "use WAL", "repo": "alpha",
+         "annotations": {"contains_design": True, "tags": ["DB"]}},
+        {"composer_id": "a", "turn_index": 1, "user": "sqlite vacuum", "assistant": "run VACUUM", "repo": "alpha", "annotations": {}},
+        {"composer_id": "b", "turn_index": 0, "user": "sqlite schema", "assistant": "see docs", "repo": "beta",
+         "annotations": {"tags": ["db", "schema"]}},
+        {"composer_id": "d", "turn_index": 0, "user": "sqlite notes", "assistant": "doc page", "annotations": {"kind": "doc", "tags": []}},
+    ]
+
+
+def _ids(rows):
+    return sorted(f"{r['composer_id']}:{r['turn_index']}" for r in rows)
+
+
+def test_parse_and_normalize():
+    f = filtersmod.parse_filter_args(["repo=alpha", "tag:DB", "contains_design", "kind=chat"])
+    assert f == {"repo": "alpha", "kind": "chat", "flags": ("contains_design",), "tags": ("db",)}
+    assert filtersmod.parse_filter_args([]) is None
+    assert filtersmod.normalize_filters({"tags": "db, schema"})["tags"] == ("db", "schema")
+    with pytest.raises(ValueError):
+        filtersmod.parse_filter_args(["colour=red"])
+    with pytest.raises(ValueError):
+        filtersmod.normalize_filters({"flags": ["x' OR 1"]})
+
+
+@pytest.mark.parametrize("sidecar", [False, True])
+def test_search_index_filters(tmp_path, sidecar):
+    path = tmp_path / "index.jsonl"
+    path.write_text("".join(json.dumps(it) + "\n" for it in _items()), encoding="utf-8")
+    if sidecar:
+        invmod.build_inverted_index(str(path))
+    assert _ids(indexmod.search_index(str(path), "sqlite", k=10)) == ["a:0", "a:1", "b:0", "d:0"]
+    assert _ids(indexmod.search_index(str(path), "sqlite", k=10, filters={"repo": "alpha"})) == ["a:0", "a:1"]
+    assert _ids(indexmod.search_index(str(path), "sqlite", k=10, filters={"tags": ["db"]})) == ["a:0", "b:0"]
+    assert _ids(indexmod.search_index(str(path), "sqlite", k=10, filters={"kind": "doc"})) == ["d:0"]
+    # Filtering happens before the top-k cut
+    assert _ids(indexmod.search_index(str(path), "sqlite", k=1, filters={"repo": "beta"})) == ["b:0"]
+
+
+@pytest.mark.parametrize("with_fts", [True, False])
+def test_items_search_filters(tmp_path, with_fts):
+    db = str(tmp_path / "items.sqlite")
+    conn = sqlite3.connect(db)
+    conn.execute(
+        "CREATE TABLE items (composer_id TEXT NOT NULL, turn_index INTEGER NOT NULL, user TEXT, assistant TEXT, "
+        "user_head TEXT, assistant_head TEXT, annotations TEXT, PRIMARY KEY (composer_id, turn_index))"
+    )
+    c = conn.cursor()
+    indexmod._ensure_items_columns(c, "items")
+    if with_fts:
+        assert indexmod._ensure_items_fts(c, "items")
+    for it in _items():
+        f = filtersmod.item_fields(it)
+        c.execute(
+            "INSERT INTO items (composer_id, turn_index, user, assistant, user_head, assistant_head, annotations, ann_flags, tags, repo, kind) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (it["composer_id"], it["turn_index"], it["user"], it["assistant"], "", "", json.dumps(it["annotations"]),
+             f["ann_flags"], f["tags"], f["repo"], f["kind"]),
+        )
+    conn.commit()
+    conn.close()
+    assert _ids(indexmod.items_search(db, query="sqlite", k=10, filters={"repo": "alpha", "flags": ["contains_design"]})) == ["a:0"]
+    assert _ids(indexmod.items_search(db, query="sqlite", k=1, filters={"tags": ["schema"]})) == ["b:0"]
+    assert _ids(indexmod.items_search(db, query="sqlite", k=10, filters={"kind": "chat"})) == ["a:0", "a:1", "b:0"]
+    # LIKE wildcards in a tag are literal
+    assert indexmod.items_search(db, query="sqlite", k=10, filters={"tags": ["d%"]}) == []
+
+
+def test_filters_on_legacy_tables_match_nothing(tmp_path):
+    # Tables built before filter columns existed: no repo/kind/ann_flags/tags
+    db = str(tmp_path / "items.sqlite")
+    conn = sqlite3.connect(db)
+    conn.execute(
+        "CREATE TABLE items (composer_id TEXT NOT NULL, turn_index INTEGER NOT NULL, user TEXT, assistant TEXT, "
+        "user_head TEXT, assistant_head TEXT, annotations TEXT, PRIMARY KEY (composer_id, turn_index))"
+    )
+    for it in _items():
+        conn.execute(
+            "INSERT INTO items (composer_id, turn_index, user, assistant, user_head, assistant_head, annotations) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (it["composer_id"], it["turn_index"], it["user"], it["assistant"], "", "", json.dumps(it["annotations"])),
+        )
+    conn.commit()
+    conn.close()
+    assert len(indexmod.items_search(db, query="sqlite", k=10)) == 4
+    for filters in ({"kind": "chat"}, {"repo": "alpha"}, {"flags": ["contains_design"]}, {"tags": ["schema"]}):
+        assert indexmod.items_search(db, query="sqlite", k=10, filters=filters) == []
+    cols = ["id", "composer_id", "kind"]
+    assert filtersmod.sql_where({"kind": "chat", "repo": "alpha"}, "m", cols) == ("0", [])
+    assert filtersmod.sql_where({"kind": "chat"}, "m", cols) == ("COALESCE(m.kind, 'chat') = ?", ["chat"])
+
+
+def _blob(vec):
+    return sqlite3.Binary(array.array("f", vec).tobytes())
+
+
+def _l2(a, b):
+    x, y = array.array("f"), array.array("f")
+    x.frombytes(a)
+    y.frombytes(b)
+    return math.sqrt(sum((p - q) ** 2 for p, q in zip(x, y)))
+
+
+@pytest.mark.parametrize("prefilter_max", ["2000", "0"])
+def test_vec_search_filtered_prefilter_and_overfetch(monkeypatch, prefilter_max):
+    # A plain table with a distance column stands in for vec0, as in test_vec_search_join
+    monkeypatch.setenv("AGENT_VEC_PREFILTER_MAX", prefilter_max)
+    rng = np.random.default_rng(0)
+    q = [1.0, 0.0, 0.0]
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("match", 2, lambda a, b: 1)
+    conn.create_function("vec_distance_l2", 2, _l2)
+    conn.execute("CREATE TABLE v(embedding BLOB, distance REAL)")
+    conn.execute("CREATE TABLE v_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT, text_hash TEXT)")
+    indexmod._ensure_vec_meta_columns(conn.cursor(), "v")
+    expected = []
+    for i in range(300):
+        vec = rng.standard_normal(3).astype(np.float32)
+        dist = float(np.linalg.norm(vec - np.asarray(q, dtype=np.float32)))
+        repo = "alpha" if i % 50 == 0 else "beta"
+        conn.execute("INSERT INTO v(rowid, embedding, distance) VALUES(?, ?, ?)", (i + 1, _blob(vec.tolist()), dist))
+        conn.execute(
+            "INSERT INTO v_meta(vec_rowid, id, composer_id, turn_index, repo, kind, ann_flags, tags) VALUES(?, ?, 'c', ?, ?, 'chat', '', '')",
+            (i + 1, f"c:{i}", i, repo),
+        )
+        if repo == "alpha":
+            expected.append((dist, f"c:{i}"))
+    rows = indexmod._vec_search_filtered(conn, "v", _blob(q), 3, filtersmod.normalize_filters({"repo": "alpha"}))
+    assert [r[0] for r in rows] == [ident for _, ident in sorted(expected)[:3]]
+    assert rows[0][-1] == pytest.approx(sorted(expected)[0][0], rel=1e-5)
+    assert indexmod._vec_search_filtered(conn, "v", _blob(q), 3, {"repo": "gamma"}) == []
+
+
+def test_upserter_writes_filter_columns():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE v(embedding BLOB)")
+    conn.execute("CREATE TABLE v_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT, text_hash TEXT)")
+    c = conn.cursor()
+    up = indexmod._VecMetaUpserter(c, "v", {})
+
+    class _D:
+        embedding = [1.0, 0.0]
+
+    class _R:
+        data = [_D()]
+
+    up.write([("a:0", {"composer_id": "a", "turn_index": 0, "text_hash": "h", **filtersmod.item_fields(_items()[0])})], _R())
+    assert c.execute("SELECT repo, kind, ann_flags, tags FROM v_meta").fetchall() == [("alpha", "chat", "contains_design", "DB")]
+    indexmod._refresh_vec_meta_filters(c, "v", [("beta", "chat", "", "DB", 1)])
+    assert c.execute("SELECT repo, ann_flags FROM v_meta").fetchall() == [("beta", "")]
+
+
+def test_flat_store_filtered_search(tmp_path):
+    db = str(tmp_path / "vec.db")
+    rng = np.random.default_rng(1)
+    mat = rng.standard_normal((400, 8)).astype(np.float32)
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True)
+    rows = [[f"c:{i}", "c", i, "u", "a", "h", "alpha" if i % 40 == 0 else "beta", "chat", "", "x" if i % 2 else ""] for i in range(400)]
+    rows[5] = rows[5][:6]  # a row written before filters existed
+    flatmod._write_store(db, "vec_index", "m", 8, rows, lambda m: m.__setitem__(slice(None), mat))
+    store = flatmod.open_flat_vectors(db, "vec_index")
+    f = filtersmod.normalize_filters({"repo": "alpha"})
+    allowed = store.allowed(f)
+    assert allowed.tolist() == list(range(0, 400, 40))
+    q = mat[7]
+    exact = sorted(allowed.tolist(), key=lambda i: -float(mat[i] @ q))[:3]
+    assert [r["turn_index"] for r in store.search_vector(q, 3, allowed=allowed)] == exact
+    # IVF lists hold too few allowed rows at nprobe=1, so every allowed row is scanned
+    ivf = ivfmod.build_ivf(db, "vec_index", nlist=40)
+    assert [r["turn_index"] for r in store.search_vector(q, 3, ivf=ivf, nprobe=1, allowed=allowed)] == exact
+    assert len(store.search_vector(q, 50, allowed=store.allowed(filtersmod.normalize_filters({"tags": ["x"]})))) == 50
@@ -0,0 +1,74 @@
+import json
+import sqlite3
+
+import pytest
+
+from agent_explorer import index as indexmod
+import llm_utils as llmmod
+
+
+def _vec_available():
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.enable_load_extension(True)
+        indexmod._load_sqlite_vec(conn)
+        conn.close()
+        return True
+    except Exception:
+        return False
+
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.inputs = []
+
+    def create(self, model, input):
+        self.inputs.extend(input)
+
+        class _D:
+            def __init__(self, i):
+                self.embedding = [float(i + 1), 1.0, 0.5]
+
+        class _R:
+            data = [_D(i) for i in range(len(input))]
+
+        return _R()
+
+
+class _FakeClient:
+    def __init__(self):
+        self.embeddings = _FakeEmbeddings()
+
+
+def test_annotation_meta_text_and_hash():
+    ann = {"contains_design": True, "has_useful_output": 1, "unfinished_thread": False, "tags": ["db", "", 3]}
+    assert indexmod._annotation_meta_text(ann) == "contains_design has_useful_output tag:db"
+    assert indexmod._annotation_meta_text(None) == ""
+    h = indexmod._embed_text_hash("m1", "hello")
+    assert h == indexmod._embed_text_hash("m1", "hello")
+    assert h != indexmod._embed_text_hash("m2", "hello")
+
+
+@pytest.mark.skipif(not _vec_available(), reason="sqlite-vec extension not loadable")
+def test_changed_only_skips_unchanged_and_deletes_orphans(tmp_path, monkeypatch):
+    client = _FakeClient()
+    monkeypatch.setattr(llmmod, "require_client", lambda: client)
+    idx = tmp_path / "idx.jsonl"
+    rows = [{"composer_id": "c", "turn_index": i, "user": f"q{i}", "assistant": f"a{i}"} for i in range(3)]
+    idx.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    db = str(tmp_path / "vec.sqlite")
+    stats = {}
+    assert indexmod.build_embeddings_sqlite(db, str(idx), changed_only=True, stats=stats) == 3
+    assert stats["inserted"] == 3
+
+    # No-op refresh: zero embedding calls
+    client.embeddings.inputs.clear()
+    indexmod.build_embeddings_sqlite(db, str(idx), changed_only=True, stats=stats)
+    assert client.embeddings.inputs == []
+    assert stats == {"inserted": 0, "updated": 0, "skipped": 3, "skipped_empty": 0, "deleted": 0}
+
+    # One changed, one removed
+    rows = [rows[0], {**rows[1], "assistant": "changed"}]
+    idx.write_text("".join(json.dumps(r) + "\n" for r in rows), encoding="utf-8")
+    indexmod.build_embeddings_sqlite(db, str(idx), changed_only=True, stats=stats)
+    assert stats["updated"] == 1 and stats["skipped"] == 1 and stats["deleted"] == 1
@@ -0,0 +1,151 @@
+import gc
+import os
+import sqlite3
+import threading
+import weakref
+
+import pytest
+
+from agent_explorer import index as indexmod
+from agent_explorer import trace as tracemod
+import llm_utils as llmmod
+
+
+class _Conn(sqlite3.Connection):
+    # Python builds without extension loading still exercise the query path
+    def enable_load_extension(self, on):
+        pass
+
+
+class _FakeClient:
+    calls = []
+
+    class embeddings:
+        @staticmethod
+        def create(model, input):
+            _FakeClient.calls.append((model, list(input)))
+            class _D:
+                embedding = [1.0, 0.0]
+
+            class _R:
+                data = [_D()]
+
+            return _R()
+
+
+@pytest.fixture
+def fake_vec(monkeypatch, tmp_path):
+    # A plain table with a distance column stands in for vec0; MATCH maps to match()
+    real_connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda *a, **k: real_connect(*a, factory=_Conn, **k))
+    monkeypatch.setattr(indexmod, "_load_sqlite_vec", lambda conn: conn.create_function("match", 2, lambda a, b: 1))
+    monkeypatch.setattr(llmmod, "require_client", lambda: _FakeClient())
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setenv("LLM_LOG_PATH", str(tmp_path / "llm_usage.jsonl"))
+    llmmod.clear_query_cache()
+    _FakeClient.calls = []
+    yield
+    indexmod.close_vec_connections()
+    llmmod.clear_query_cache()
+
+
+def _make_db(path, n=5):
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE v(embedding BLOB, distance REAL)")
+    conn.execute("CREATE TABLE v_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT)")
+    for i in range(n):
+        conn.execute("INSERT INTO v(rowid, embedding, distance) VALUES(?, x'00', ?)", (i + 1, 1.0 - i / 10))
+        if i != 3:
+            conn.execute("INSERT INTO v_meta VALUES(?, ?, 'c', ?, 'u', 'a')", (i + 1, f"c:{i}", i))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_vec_search_single_query_and_cached_connection(tmp_path, fake_vec):
+    db = _make_db(tmp_path / "vec.sqlite")
+    rows = indexmod.vec_search(db, "v", "q", top_k=3)
+    # Rowid 4 has no meta row and is dropped, like the per-row lookup did
+    assert [r["id"] for r in rows] == ["c:4", "c:2"]
+    assert rows[0]["distance"] == pytest.approx(0.6)
+    conn = next(iter(indexmod._vec_conns().values()))[0]
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert indexmod.vec_search(db, "v", "q", top_k=5)[-1]["id"] == "c:0"
+    assert len([s for s in statements if s.lstrip().upper().startswith(("SELECT", "WITH"))]) == 1
+    assert len(indexmod._vec_conns()) == 1
+
+    # A rebuilt DB file gets a fresh connection
+    os.remove(db)
+    _make_db(db, n=2)
+    assert [r["id"] for r in indexmod.vec_search(db, "v", "q", top_k=5)] == ["c:1", "c:0"]
+    assert next(iter(indexmod._vec_conns().values()))[0] is not conn
+
+    # k beyond the sqlite-vec KNN limit is clamped
+    statements.clear()
+    conn = next(iter(indexmod._vec_conns().values()))[0]
+    conn.set_trace_callback(statements.append)
+    assert len(indexmod.vec_search(db, "v", "q", top_k=100000)) == 2
+    assert any("LIMIT 4096" in s for s in statements)
+    assert indexmod.vec_search(db, "v", "q", top_k=0) == []
+
+
+def test_vec_connections_are_per_thread_and_closed_with_it(tmp_path, fake_vec):
+    db = _make_db(tmp_path / "vec.sqlite")
+    refs = []
+
+    def search():
+        indexmod.vec_search(db, "v", "q", top_k=3)
+        refs.append(weakref.ref(next(iter(indexmod._vec_conns().values()))[0]))
+
+    for _ in range(3):
+        t = threading.Thread(target=search)
+        t.start()
+        t.join()
+    gc.collect()
+    assert len(refs) == 3 and all(r() is None for r in refs)
+    assert indexmod._vec_conns() == {}
+
+
+def test_query_embeddings_are_cached(tmp_path, fake_vec, monkeypatch):
+    db = _make_db(tmp_path / "vec.sqlite")
+    monkeypatch.setenv("OPENAI_EMBED_MODEL", "m1")
+    before = dict(tracemod.get_run_summary()["query_embeddings"])
+    first = indexmod.vec_search(db, "v", "how  to fix\tlocking", top_k=3)
+    # Whitespace variants share the entry; the llm_cache memory tier answers without the API
+    assert indexmod.vec_search(db, "v", " how to fix locking ", top_k=3) == first
+    assert _FakeClient.calls == [("m1", ["how to fix locking"])]
+
+    # A new process (empty memory tier) reads the persistent store
+    llmmod.clear_query_cache()
+    monkeypatch.setattr(llmmod, "require_client", lambda: pytest.fail("network call on a cache hit"))
+    indexmod.vec_search(db, "v", "how to fix locking", top_k=3)
+    after = tracemod.get_run_summary()["query_embeddings"]
+    assert after["misses"] - before["misses"] == 1
+    assert after["memory_hits"] - before["memory_hits"] == 1
+    assert after["disk_hits"] - before["disk_hits"] == 1
+    assert 0 < after["hit_rate"] <= 1
+
+    # Keys include the model
+    monkeypatch.setattr(llmmod, "require_client", lambda: _FakeClient())
+    monkeypatch.setenv("OPENAI_EMBED_MODEL", "m2")
+    indexmod.vec_search(db, "v", "how to fix locking", top_k=3)
+    assert _FakeClient.calls[-1] == ("m2", ["how to fix locking"])
+
+
+def test_query_vectors_share_the_byte_bounded_memory_tier(tmp_path, fake_vec, monkeypatch):
+    import llm_cache
+
+    monkeypatch.setenv("LLM_CACHE_MEMORY_BYTES", "700")
+    for q in ["a", "b", "a", "c"]:
+        llmmod.embed_query(q, model="m")
+    mem = llm_cache._handle().memory
+    assert 0 < mem.bytes <= 700
+    keys = [llm_cache._VEC_PREFIX + llmmod.query_embedding_key("m", q) for q in "abc"]
+    assert keys[2] in mem.entries and keys[1] not in mem.entries
+    # Evicted from memory, still on disk
+    sources = {}
+    assert llm_cache.get_vectors([llmmod.query_embedding_key("m", "b")], sources=sources)
+    assert list(sources.values()) == ["disk"]
+    llm_cache.delete_vectors([llmmod.query_embedding_key("m", "c")])
+    assert keys[2] not in mem.entries
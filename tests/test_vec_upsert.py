@@ -0,0 +1,36 @@
+import sqlite3
+
+from agent_explorer import bench as benchmod
+from agent_explorer import index as indexmod
+
+
+def _db():
+    conn = sqlite3.connect(":memory:")
+    # Plain table with the vec0 column layout; the upserter only needs rowid + embedding
+    conn.execute("CREATE TABLE v(embedding BLOB)")
+    conn.execute("CREATE TABLE v_meta(vec_rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, composer_id TEXT, turn_index INTEGER, user_head TEXT, assistant_head TEXT, text_hash TEXT)")
+    return conn
+
+
+def _batch(ids, h="h1"):
+    meta = [(i, {"composer_id": i.split(":")[0], "turn_index": int(i.split(":")[1]), "text_hash": h}) for i in ids]
+    return meta, benchmod._FakeResponse([[3.0, 4.0]] * len(ids))
+
+
+def test_upserter_inserts_then_updates_in_place():
+    conn = _db()
+    c = conn.cursor()
+    up = indexmod._VecMetaUpserter(c, "v", indexmod._load_vec_meta_state(c, "v"))
+    assert up.write(*_batch(["a:0", "a:1", "a:0"])) == (2, 1)
+    conn.commit()
+    # A new upserter picks up existing rowids from the meta table
+    up2 = indexmod._VecMetaUpserter(c, "v", indexmod._load_vec_meta_state(c, "v"))
+    assert up2.write(*_batch(["a:1", "b:0"], h="h2")) == (1, 1)
+    rows = c.execute("SELECT vec_rowid, id, text_hash FROM v_meta ORDER BY vec_rowid").fetchall()
+    assert rows == [(1, "a:0", "h1"), (2, "a:1", "h2"), (3, "b:0", "h2")]
+    assert [r[0] for r in c.execute("SELECT rowid FROM v ORDER BY rowid")] == [1, 2, 3]
+
+
+def test_bench_vec_upsert_smoke():
+    res = benchmod.bench_vec_upsert(rows=200, dim=4, batch=16)
+    assert res["rows"] == 200 and res["batched_insert_s"] >= 0 and res["per_row_update_s"] >= 0
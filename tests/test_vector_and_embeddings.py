@@ -19,3 +19,52 @@ def test_cosine_and_topk_and_l2():
     assert v0 == [0.0, 0.0]
 
 
+
+
+def _ranked_ids(rows):
+    return [[i for i, _ in r] for r in rows]
+
+
+def test_topk_batch_matches_pure_python(monkeypatch):
+    import numpy as np
+    from agent_explorer import bench as benchmod
+
+    rng = np.random.default_rng(3)
+    corpus = rng.standard_normal((300, 16)).tolist()
+    corpus[7] = [0.0] * 16  # zero vectors score 0.0
+    queries = rng.standard_normal((5, 16)).tolist() + [[0.0] * 16]
+    for k in (0, 1, 10, 300, 500):
+        fast = vectmod.topk_batch(queries, corpus, k)
+        pure = vectmod._topk_pure(queries, corpus, k, False)
+        assert _ranked_ids(fast[:5]) == _ranked_ids(pure[:5])
+        for f, p in zip(fast, pure):
+            assert np.allclose([s for _, s in f], [s for _, s in p], atol=1e-5)
+    # Pre-normalized float32 matrices are used as-is; single-query topk agrees
+    normed = vectmod.normalize_rows(corpus)
+    assert _ranked_ids(vectmod.topk_batch(vectmod.normalize_rows(queries), normed, 5, normalized=True)) == _ranked_ids(vectmod.topk_batch(queries, corpus, 5))
+    assert [i for i, _ in vectmod.topk(queries[0], corpus, 5)] == _ranked_ids(pure)[0][:5]
+    # Without NumPy the pure path is used
+    monkeypatch.setattr(vectmod, "_HAS_NUMPY", False)
+    assert _ranked_ids(vectmod.topk_batch(queries[:5], corpus, 10)) == _ranked_ids(vectmod._topk_pure(queries[:5], corpus, 10, False))
+    assert vectmod.normalize_rows([[3.0, 4.0], [0.0, 0.0]]) == [[0.6, 0.8], [0.0, 0.0]]
+    monkeypatch.undo()
+    res = benchmod.bench_topk(rows=200, dim=8, queries=3, k=5)
+    assert res["same_top_k"] and res["numpy_batched_query_s"] >= 0
+
+
+def test_topk_batch_ties_across_the_k_boundary_keep_corpus_order():
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    # Row 0 is best; half the other rows tie for second, scattered among lower-scoring rows
+    corpus = -np.abs(rng.standard_normal((100, 4)))
+    tied = np.sort(rng.choice(np.arange(1, 100), 50, replace=False))
+    corpus[tied] = [1.0, 1.0, 0.0, 0.0]
+    corpus[0] = [1.0, 0.0, 0.0, 0.0]
+    queries = [[1.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0]]
+    for k in (3, 10, 50):
+        fast = vectmod.topk_batch(queries, corpus.tolist(), k)
+        assert _ranked_ids(fast) == _ranked_ids(vectmod._topk_pure(queries, corpus.tolist(), k, False))
+        assert _ranked_ids(fast)[0] == [0] + tied[:k - 1].tolist()
+        # A zero query ties every row
+        assert _ranked_ids(fast)[1] == list(range(k))